@@ -0,0 +1,229 @@
+"""Benchmarks of the histogram tree pipeline.
+
+Times every stage of fitting and using the trees: binning, histogram
+build, split search, tree fit, forest fit, batch predict and the
+reductions, over a grid of rows, features, depths and backends. Results
+are written as JSON so runs of different releases can be compared.
+
+Examples
+--------
+Small grid on the CPU backend::
+
+    python benchmarks/bench_trees.py --rows 10000 100000 --features 10 50 \\
+        --depth 6 12 --backend cpu --output bench.json
+
+Only some benchmarks, against the GPU as well::
+
+    python benchmarks/bench_trees.py --bench histogram tree_fit \\
+        --backend cpu cuda
+
+Each benchmark runs ``--warmup`` untimed rounds, then ``--repeat`` timed
+ones; the JSON holds the raw times, their min/mean/std, the requested
+percentiles and the median throughput in rows per second.
+"""
+import argparse
+import datetime
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+import sklgpu
+from sklgpu.ensemble import RandomForestRegressor
+from sklgpu.tree import BinMapper, DecisionTreeRegressor
+from sklgpu.tree._binning import get_bin_cache
+from sklgpu.tree._histogram import (cuda_available, get_histogram_builder,
+                                    resolve_backend)
+from sklgpu.tree._reduction import reduce
+from sklgpu.tree._splitting import MSE, find_best_split
+
+BENCHMARKS = ('binning', 'histogram', 'split', 'tree_fit', 'forest_fit',
+              'predict', 'reduce')
+# benchmarks whose cost depends on the tree depth
+DEPTH_BENCHMARKS = ('tree_fit', 'forest_fit', 'predict')
+
+
+def make_data(n_samples, n_features, seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.randn(n_samples, n_features)
+    coef = rng.randn(n_features)
+    y = X.dot(coef) + np.sin(3 * X[:, 0]) + 0.1 * rng.randn(n_samples)
+    return X, y
+
+
+def time_function(func, warmup, repeat):
+    """Wall clock seconds of ``repeat`` calls of ``func`` after warmup."""
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return np.array(times)
+
+
+def summarize(times, n_samples, percentiles):
+    summary = {'times': times.tolist(),
+               'min': float(times.min()),
+               'mean': float(times.mean()),
+               'std': float(times.std())}
+    for q in percentiles:
+        summary['p%g' % q] = float(np.percentile(times, q))
+    median = np.median(times)
+    summary['rows_per_second'] = (float(n_samples / median) if median > 0
+                                  else None)
+    return summary
+
+
+def clear_cache_and_fit(estimator, X, y):
+    # the estimators cache the binned data, without this every timed round
+    # but the warmup would skip the binning
+    get_bin_cache().clear()
+    estimator.fit(X, y)
+
+
+def setup_benchmark(name, X, y, backend, max_depth, args):
+    """Return the function to time; the setup itself is not timed."""
+    order = get_histogram_builder(backend).preferred_order
+    if name == 'binning':
+        return lambda: BinMapper(max_bins=args.max_bins,
+                                 order=order).fit_transform(X)
+
+    if name in ('histogram', 'split'):
+        mapper = BinMapper(max_bins=args.max_bins, order=order)
+        X_binned = mapper.fit_transform(X)
+        criterion = MSE()
+        builder = get_histogram_builder(backend)(X_binned, mapper.n_bins_)
+        builder.set_stats(criterion.sample_stats(y, np.ones_like(y)))
+        indices = np.arange(X.shape[0], dtype=np.uint32)
+        if name == 'histogram':
+            def run():
+                builder.free(builder.build(indices))
+            return run
+        hist = builder.build(indices)
+        parent_stats = hist[0].sum(axis=0)
+        return lambda: find_best_split(hist, criterion, parent_stats)
+
+    if name == 'tree_fit':
+        tree = DecisionTreeRegressor(max_depth=max_depth,
+                                     max_bins=args.max_bins,
+                                     random_state=0, backend=backend)
+        return lambda: clear_cache_and_fit(tree, X, y)
+
+    if name == 'forest_fit':
+        forest = RandomForestRegressor(n_estimators=args.n_estimators,
+                                       max_depth=max_depth,
+                                       max_bins=args.max_bins,
+                                       n_jobs=args.n_jobs, random_state=0,
+                                       backend=backend)
+        return lambda: clear_cache_and_fit(forest, X, y)
+
+    if name == 'predict':
+        tree = DecisionTreeRegressor(max_depth=max_depth,
+                                     max_bins=args.max_bins,
+                                     random_state=0,
+                                     backend=backend).fit(X, y)
+        return lambda: tree.predict(X)
+
+    if name == 'reduce':
+        x = np.ravel(X).astype(np.float32)
+        return lambda: reduce(x, 'sum', backend=backend)
+
+    raise ValueError("unknown benchmark %r" % name)
+
+
+def run(args):
+    backends = []
+    for backend in args.backend:
+        if backend == 'cuda' and not cuda_available():
+            print("skipping the cuda backend: no device or extension",
+                  file=sys.stderr)
+            continue
+        backend = resolve_backend(backend)
+        if backend not in backends:
+            backends.append(backend)
+
+    results = []
+    for n_samples in args.rows:
+        for n_features in args.features:
+            X, y = make_data(n_samples, n_features, args.seed)
+            for backend in backends:
+                for name in args.bench:
+                    depths = (args.depth if name in DEPTH_BENCHMARKS
+                              else [None])
+                    for max_depth in depths:
+                        func = setup_benchmark(name, X, y, backend,
+                                               max_depth, args)
+                        times = time_function(func, args.warmup,
+                                              args.repeat)
+                        result = {'benchmark': name,
+                                  'backend': backend,
+                                  'n_samples': n_samples,
+                                  'n_features': n_features,
+                                  'max_depth': max_depth,
+                                  'warmup': args.warmup,
+                                  'repeat': args.repeat}
+                        result.update(summarize(times, n_samples,
+                                                args.percentiles))
+                        results.append(result)
+                        if args.verbose:
+                            print("%-10s %-4s rows=%-8d features=%-4d "
+                                  "depth=%-4s median=%.4fs"
+                                  % (name, backend, n_samples, n_features,
+                                     max_depth, np.median(times)),
+                                  file=sys.stderr)
+    return results
+
+
+def environment():
+    return {'timestamp': datetime.datetime.now(
+                datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'numpy': np.__version__,
+            'sklgpu': sklgpu.__version__,
+            'cuda_available': cuda_available()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--bench', nargs='+', choices=BENCHMARKS,
+                        default=list(BENCHMARKS))
+    parser.add_argument('--rows', nargs='+', type=int, default=[10000, 100000])
+    parser.add_argument('--features', nargs='+', type=int, default=[20])
+    parser.add_argument('--depth', nargs='+', type=int, default=[8])
+    parser.add_argument('--backend', nargs='+', default=['cpu'],
+                        help="'cpu', 'cuda' or 'auto'")
+    parser.add_argument('--max-bins', type=int, default=256)
+    parser.add_argument('--n-estimators', type=int, default=10)
+    parser.add_argument('--n-jobs', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--percentiles', nargs='+', type=float,
+                        default=[50, 90, 99])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', '-o', default=None,
+                        help="JSON file, stdout when omitted")
+    parser.add_argument('--verbose', '-v', action='store_true')
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat should be at least 1")
+
+    report = {'environment': environment(),
+              'parameters': {key: value for key, value in vars(args).items()
+                             if key not in ('output', 'verbose')},
+              'results': run(args)}
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
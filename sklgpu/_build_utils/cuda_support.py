@@ -29,7 +29,7 @@ def get_cuda_support():
 
 		cudaconfig = {'home':home, 'nvcc':nvcc,
 					  'include': pjoin(home, 'include'),
-					  'lib64': pjoin(home, 'lib', 'x64')}
+					  'lib64': pjoin(home, 'lib', 'x64') if os.name == 'nt' else pjoin(home, 'lib64')}
 		for k, v in cudaconfig.items():
 			if not os.path.exists(v) and not os.path.exists(v + ".exe"):
 				raise EnvironmentError('The CUDA %s path could not be located in %s' % (k, v))
@@ -267,10 +267,22 @@ def get_cuda_support():
 	# run the customize_compiler
 	class custom_build_ext(build_ext):
 		def build_extensions(self):
-			customize_compiler_for_nvcc_win(self.compiler)
-			customize_linker_for_nvcc_win(self.compiler)
+			if os.name == 'nt':
+				customize_compiler_for_nvcc_win(self.compiler)
+				customize_linker_for_nvcc_win(self.compiler)
+			else:
+				customize_compiler_for_nvcc_unix(self.compiler)
 			build_ext.build_extensions(self)
 
-	CUDA = locate_cuda()
+	# CPU only build: asked for, or no CUDA toolkit around. The CUDA
+	# extensions are skipped and sklgpu runs on the 'cpu' backend.
+	if os.environ.get('SKLGPU_NO_CUDA', '0') not in ('', '0'):
+		log.info("SKLGPU_NO_CUDA is set, building without CUDA support")
+		return None, build_ext
+	try:
+		CUDA = locate_cuda()
+	except EnvironmentError as e:
+		log.warn("%s\nBuilding without CUDA support." % e)
+		return None, build_ext
 
 	return CUDA, custom_build_ext
\ No newline at end of file
@@ -0,0 +1,12 @@
+"""
+The :mod:`sklgpu.ensemble` module includes ensemble-based methods built on
+the histogram trees of :mod:`sklgpu.tree`.
+"""
+
+from .forest import RandomForestClassifier
+from .forest import RandomForestRegressor
+from .gradient_boosting import HistGradientBoostingClassifier
+from .gradient_boosting import HistGradientBoostingRegressor
+
+__all__ = ["RandomForestClassifier", "RandomForestRegressor",
+           "HistGradientBoostingClassifier", "HistGradientBoostingRegressor"]
@@ -0,0 +1,527 @@
+"""Collectives of the distributed gradient boosting fit.
+
+Every process of a group (a *rank*) holds a row shard of the training set.
+The only data exchanged while growing trees are the node histograms,
+summed over the ranks with an allreduce so that every rank finds the same
+splits and grows the same tree; a rank never sees the rows of another.
+
+Communication goes through a ``Transport``, a point to point byte channel
+between ranks. Two are provided:
+
+- ``SocketTransport``: a full mesh of TCP or Unix domain sockets, for
+  processes on one or several hosts;
+- ``SharedMemoryTransport``: mailboxes in one shared memory block guarded
+  by semaphores, for processes started from a common parent on one host
+  (see ``SharedMemoryGroup``).
+
+Any object with the same ``rank``, ``world_size``, ``send``,
+``recv_into`` and ``close`` can be plugged in instead (MPI, a cluster
+scheduler's channels...). The ``Communicator`` implements the collectives
+on top: a ring allreduce (reduce-scatter then allgather, bandwidth
+optimal) for large buffers and a binomial tree (reduce to rank 0, then
+broadcast) for small ones, where latency dominates. Both hand every rank
+bitwise identical sums: each element is added up once, on one rank, and
+copied to the others.
+"""
+import multiprocessing
+import os
+import pickle
+import socket
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.utils import check_random_state
+
+from ..tree._binning import _category_thresholds
+from ..tree._profiling import record
+from ..tree._streaming import read_rows
+
+__all__ = ["Transport", "SocketTransport", "SharedMemoryTransport",
+           "SharedMemoryGroup", "Communicator"]
+
+MAX_INT = np.iinfo(np.int32).max
+
+_LENGTH = struct.Struct('<q')
+
+
+class Transport(object):
+    """Point to point byte channels between the ranks of a group.
+
+    Messages carry no header: both ends know how many bytes are
+    exchanged. Subclasses implement ``send`` and ``recv_into``.
+
+    Attributes
+    ----------
+    rank : int
+        Index of this process in the group.
+
+    world_size : int
+        Number of processes in the group.
+    """
+
+    rank = 0
+    world_size = 1
+    _sender = None
+
+    def send(self, peer, data):
+        """Send the bytes of ``data`` (any buffer) to rank ``peer``."""
+        raise NotImplementedError
+
+    def recv_into(self, peer, buffer):
+        """Fill the writable ``buffer`` with bytes sent by rank ``peer``."""
+        raise NotImplementedError
+
+    def sendrecv(self, dest, data, source, buffer):
+        """Send ``data`` to ``dest`` while receiving ``buffer`` from
+        ``source``.
+
+        The ring steps have every rank send and receive at once, blocking
+        sends larger than the channel buffers would deadlock; the send runs
+        on a helper thread.
+        """
+        if self._sender is None:
+            self._sender = ThreadPoolExecutor(1)
+        future = self._sender.submit(self.send, dest, data)
+        self.recv_into(source, buffer)
+        future.result()
+
+    def close(self):
+        if self._sender is not None:
+            self._sender.shutdown(wait=False)
+            self._sender = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _as_bytes(buffer):
+    return memoryview(buffer).cast('B')
+
+
+class SocketTransport(Transport):
+    """A socket per pair of ranks.
+
+    Every rank listens on its own address, connects to the lower ranks and
+    accepts the higher ones. Addresses are ``(host, port)`` tuples for TCP
+    or strings, paths of Unix domain sockets; the paths are removed once
+    the group is connected.
+
+    Parameters
+    ----------
+    rank : int
+
+    addresses : list, one per rank
+
+    timeout : float, optional (default=60)
+        Seconds to wait for the other ranks to come up.
+    """
+
+    def __init__(self, rank, addresses, timeout=60.):
+        self.rank = rank
+        self.world_size = len(addresses)
+        if not 0 <= rank < self.world_size:
+            raise ValueError("rank=%r should be in [0, %d)"
+                             % (rank, self.world_size))
+        self._sockets = {}
+        listener = self._socket(addresses[rank])
+        try:
+            listener.bind(addresses[rank])
+            listener.listen(self.world_size)
+            deadline = time.monotonic() + timeout
+            for peer in range(rank):
+                sock = self._connect(addresses[peer], deadline)
+                sock.sendall(_LENGTH.pack(rank))
+                self._sockets[peer] = sock
+            listener.settimeout(timeout)
+            for _ in range(rank + 1, self.world_size):
+                sock, _ = listener.accept()
+                sock.settimeout(None)
+                header = bytearray(_LENGTH.size)
+                self._recv_exactly(sock, memoryview(header))
+                self._sockets[_LENGTH.unpack(header)[0]] = sock
+        except Exception:
+            self.close()
+            raise
+        finally:
+            listener.close()
+            if isinstance(addresses[rank], str):
+                try:
+                    os.unlink(addresses[rank])
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _socket(address):
+        if isinstance(address, str):
+            return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        return sock
+
+    def _connect(self, address, deadline):
+        # the peer may not be listening yet
+        while True:
+            sock = self._socket(address)
+            try:
+                sock.connect(address)
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                if time.monotonic() > deadline:
+                    raise TimeoutError("rank %d could not connect to %r"
+                                       % (self.rank, address))
+                time.sleep(0.01)
+                continue
+            if sock.family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+
+    @staticmethod
+    def _recv_exactly(sock, view):
+        while len(view):
+            n = sock.recv_into(view)
+            if n == 0:
+                raise ConnectionError("peer closed the connection")
+            view = view[n:]
+
+    def send(self, peer, data):
+        view = _as_bytes(data)
+        # the peer may be done and gone when it expects nothing more
+        if len(view):
+            self._sockets[peer].sendall(view)
+
+    def recv_into(self, peer, buffer):
+        self._recv_exactly(self._sockets[peer], _as_bytes(buffer))
+
+    def close(self):
+        for sock in self._sockets.values():
+            sock.close()
+        self._sockets = {}
+        super(SocketTransport, self).close()
+
+
+class SharedMemoryTransport(Transport):
+    """Mailboxes in a shared memory block, one per ordered pair of ranks.
+
+    A mailbox holds ``slot_bytes``; larger messages go through it one
+    piece at a time, the ``empty`` and ``full`` semaphores of the mailbox
+    handing it over between the sender and the receiver. Instances are
+    made by ``SharedMemoryGroup`` in a parent process and passed to the
+    worker processes as ``Process`` arguments: the semaphores can only be
+    shared by inheritance.
+    """
+
+    def __init__(self, rank, world_size, name, slot_bytes, empty, full):
+        self.rank = rank
+        self.world_size = world_size
+        self.name = name
+        self.slot_bytes = slot_bytes
+        self._empty = empty
+        self._full = full
+        self._block = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_block'] = None
+        state['_sender'] = None
+        return state
+
+    def _attach(self):
+        if self._block is None:
+            self._block = shared_memory.SharedMemory(name=self.name)
+
+    def _mailbox(self, source, dest):
+        self._attach()
+        start = (source * self.world_size + dest) * self.slot_bytes
+        index = source * self.world_size + dest
+        return (self._block.buf[start:start + self.slot_bytes],
+                self._empty[index], self._full[index])
+
+    def send(self, peer, data):
+        view = _as_bytes(data)
+        mailbox, empty, full = self._mailbox(self.rank, peer)
+        for start in range(0, len(view), self.slot_bytes):
+            piece = view[start:start + self.slot_bytes]
+            empty.acquire()
+            mailbox[:len(piece)] = piece
+            full.release()
+        mailbox.release()
+
+    def recv_into(self, peer, buffer):
+        view = _as_bytes(buffer)
+        mailbox, empty, full = self._mailbox(peer, self.rank)
+        for start in range(0, len(view), self.slot_bytes):
+            piece = view[start:start + self.slot_bytes]
+            full.acquire()
+            piece[:] = mailbox[:len(piece)]
+            empty.release()
+        mailbox.release()
+
+    def sendrecv(self, dest, data, source, buffer):
+        # attached once, before the send thread would race to it
+        self._attach()
+        super(SharedMemoryTransport, self).sendrecv(dest, data, source,
+                                                    buffer)
+
+    def close(self):
+        if self._block is not None:
+            self._block.close()
+            self._block = None
+        super(SharedMemoryTransport, self).close()
+
+
+class SharedMemoryGroup(object):
+    """The shared memory block and semaphores of ``world_size`` ranks.
+
+    Use as a context manager in the parent process, the block is unlinked
+    on exit; ``transports[rank]`` goes to the worker of each rank.
+
+    Parameters
+    ----------
+    world_size : int
+
+    slot_bytes : int, optional (default=1 MiB)
+        Size of every mailbox, ``world_size ** 2`` of them.
+
+    context : multiprocessing context or None
+        The one the workers are started with.
+    """
+
+    def __init__(self, world_size, slot_bytes=1 << 20, context=None):
+        if context is None:
+            context = multiprocessing.get_context()
+        n_mailboxes = world_size * world_size
+        self._block = shared_memory.SharedMemory(
+            create=True, size=n_mailboxes * slot_bytes)
+        empty = [context.Semaphore(1) for _ in range(n_mailboxes)]
+        full = [context.Semaphore(0) for _ in range(n_mailboxes)]
+        self.transports = [
+            SharedMemoryTransport(rank, world_size, self._block.name,
+                                  slot_bytes, empty, full)
+            for rank in range(world_size)]
+
+    def close(self):
+        if self._block is not None:
+            self._block.close()
+            self._block.unlink()
+            self._block = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Communicator(object):
+    """Collective operations over a ``Transport``.
+
+    Parameters
+    ----------
+    transport : Transport
+
+    algorithm : {'auto', 'ring', 'tree'}, optional (default='auto')
+        Allreduce algorithm; 'auto' uses the ring from ``ring_min_bytes``
+        on, with more than two ranks.
+    """
+
+    # below this, the 2 * (world_size - 1) ring steps cost more latency
+    # than the tree's 2 * log2(world_size) full size messages
+    ring_min_bytes = 1 << 16
+
+    def __init__(self, transport, algorithm='auto'):
+        if algorithm not in ('auto', 'ring', 'tree'):
+            raise ValueError("algorithm should be 'auto', 'ring' or 'tree', "
+                             "got %r" % algorithm)
+        self.transport = transport
+        self.algorithm = algorithm
+
+    @property
+    def rank(self):
+        return self.transport.rank
+
+    @property
+    def world_size(self):
+        return self.transport.world_size
+
+    def allreduce(self, array):
+        """Sum the contiguous ``array`` over the ranks, in place."""
+        if self.world_size == 1:
+            return array
+        if not array.flags.c_contiguous:
+            raise ValueError("allreduce needs a C contiguous array")
+        flat = array.reshape(-1)
+        algorithm = self.algorithm
+        if algorithm == 'auto':
+            algorithm = ('ring' if self.world_size > 2
+                         and array.nbytes >= self.ring_min_bytes else 'tree')
+        if algorithm == 'ring':
+            self._ring_allreduce(flat)
+        else:
+            self._tree_reduce(flat)
+            self.broadcast(flat)
+        return array
+
+    def _ring_allreduce(self, flat):
+        rank, size = self.rank, self.world_size
+        right, left = (rank + 1) % size, (rank - 1) % size
+        bounds = np.linspace(0, flat.shape[0], size + 1).astype(np.intp)
+        segments = [flat[bounds[i]:bounds[i + 1]] for i in range(size)]
+        incoming = np.empty(int(np.diff(bounds).max()), dtype=flat.dtype)
+        # reduce-scatter: after size - 1 steps this rank holds the full sum
+        # of segment rank + 1
+        for step in range(size - 1):
+            send = segments[(rank - step) % size]
+            receive = segments[(rank - step - 1) % size]
+            buffer = incoming[:receive.shape[0]]
+            self.transport.sendrecv(right, send, left, buffer)
+            receive += buffer
+        # allgather: the summed segments go round the ring
+        for step in range(size - 1):
+            self.transport.sendrecv(right, segments[(rank + 1 - step) % size],
+                                    left, segments[(rank - step) % size])
+
+    def _tree_reduce(self, flat):
+        # binomial tree towards rank 0
+        rank, size = self.rank, self.world_size
+        incoming = np.empty_like(flat)
+        mask = 1
+        while mask < size:
+            if rank & mask:
+                self.transport.send(rank - mask, flat)
+                return
+            if rank + mask < size:
+                self.transport.recv_into(rank + mask, incoming)
+                flat += incoming
+            mask <<= 1
+
+    def broadcast(self, array, root=0):
+        """Overwrite ``array`` with the one of ``root``, in place."""
+        rank, size = (self.rank - root) % self.world_size, self.world_size
+        mask = 1
+        while mask < size:
+            mask <<= 1
+        mask >>= 1
+        while mask > 0:
+            if rank % (2 * mask) == 0 and rank + mask < size:
+                self.transport.send((rank + mask + root) % size, array)
+            elif rank % (2 * mask) == mask:
+                self.transport.recv_into((rank - mask + root) % size, array)
+            mask >>= 1
+        return array
+
+    def allgather_object(self, obj):
+        """The picklable ``obj`` of every rank, in rank order."""
+        rank, size = self.rank, self.world_size
+        blobs = [None] * size
+        blobs[rank] = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        right, left = (rank + 1) % size, (rank - 1) % size
+        for step in range(size - 1):
+            send = blobs[(rank - step) % size]
+            length = bytearray(_LENGTH.size)
+            self.transport.sendrecv(right, _LENGTH.pack(len(send)), left,
+                                    length)
+            receive = bytearray(_LENGTH.unpack(length)[0])
+            self.transport.sendrecv(right, send, left, receive)
+            blobs[(rank - step - 1) % size] = receive
+        return [pickle.loads(blob) for blob in blobs]
+
+    def barrier(self):
+        self.allreduce(np.zeros(1))
+
+    def close(self):
+        self.transport.close()
+
+
+class AllreduceHistogramBuilder(object):
+    """Sums the histograms of a local builder over the ranks.
+
+    Every rank builds the histogram of its own rows of the node; after the
+    allreduce each one holds the histogram of the whole node. ``build`` is
+    a collective call: all ranks must build the same nodes in the same
+    order, which the identical trees they grow guarantee.
+    """
+
+    def __init__(self, builder, communicator):
+        self.builder = builder
+        self.communicator = communicator
+        self.preferred_order = builder.preferred_order
+        self.accepts_sparse = builder.accepts_sparse
+
+    def set_stats(self, stats):
+        self.builder.set_stats(stats)
+
+    def build(self, sample_indices):
+        hist = self.builder.build(sample_indices)
+        with record('allreduce'):
+            return self.communicator.allreduce(hist)
+
+    def free(self, hist):
+        self.builder.free(hist)
+
+
+def fit_bin_mapper(communicator, X, bin_mapper):
+    """Fit ``bin_mapper`` on a subsample drawn from all the shards.
+
+    Every rank contributes rows in proportion to its shard and fits the
+    thresholds on the same gathered sample, so the bins agree everywhere.
+    The subsample is drawn with ``bin_mapper.random_state``, which then
+    needs to be the same on all ranks. The categories of the categorical
+    features are those of all the rows of all the shards.
+    """
+    shapes = communicator.allgather_object(X.shape)
+    if len(set(shape[1] for shape in shapes)) != 1:
+        raise ValueError("the shards have different numbers of features: %s"
+                         % [shape[1] for shape in shapes])
+    categories = _union_categories(
+        communicator.allgather_object(bin_mapper._find_categories(X)),
+        bin_mapper.max_bins)
+    n_rows = np.array([shape[0] for shape in shapes])
+    n_samples = n_rows.sum()
+    subsample = bin_mapper.subsample
+    if subsample is not None and n_samples > subsample:
+        # each rank draws from its own stream of the common seed
+        seeds = check_random_state(bin_mapper.random_state).randint(
+            MAX_INT, size=communicator.world_size)
+        rng = np.random.RandomState(seeds[communicator.rank])
+        n_local = int(round(subsample * X.shape[0] / n_samples))
+        rows = np.sort(rng.choice(X.shape[0], min(n_local, X.shape[0]),
+                                  replace=False))
+        sample = X.tocsr()[rows] if sp.issparse(X) else read_rows(X, rows)
+    else:
+        sample = X
+    samples = communicator.allgather_object(sample)
+    if any(sp.issparse(s) for s in samples):
+        sample = sp.vstack(samples, format='csr')
+    else:
+        sample = np.concatenate([np.asarray(s, dtype=np.float64)
+                                 for s in samples])
+    bin_mapper.set_params(subsample=None)
+    bin_mapper.fit(sample)
+    bin_mapper._set_thresholds(
+        [thresholds if codes is None else _category_thresholds(codes)
+         for thresholds, codes in zip(bin_mapper.bin_thresholds_,
+                                      categories)], categories)
+    return bin_mapper
+
+
+def _union_categories(rank_categories, max_bins):
+    """Categories of every feature over all the ranks, None for the
+    numerical features."""
+    categories = []
+    for f, codes in enumerate(rank_categories[0]):
+        if codes is not None:
+            codes = np.unique(np.concatenate([local[f]
+                                              for local in rank_categories]))
+            if len(codes) > max_bins:
+                raise ValueError("a categorical feature has %d categories, "
+                                 "more than max_bins=%d"
+                                 % (len(codes), max_bins))
+        categories.append(codes)
+    return categories
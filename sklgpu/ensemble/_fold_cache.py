@@ -0,0 +1,159 @@
+"""Work shared by the gradient boosting fits of one training fold.
+
+A parameter search fits every candidate on the same folds, and what a fit
+does before its hyperparameters come into play is the same for all of
+them: binning the fold, uploading the binned matrix for the CUDA backend,
+the gradients of the baseline prediction and the root histograms of the
+first iteration. A ``FoldCache`` keeps those for one fold, keyed by the
+parameters they depend on, and the fits of the fold take them from it;
+the first candidate pays for them, the others only for their own trees.
+"""
+import numbers
+
+import numpy as np
+
+from ..tree._binning import _categorical_mask
+from ..tree._histogram import get_histogram_builder
+
+__all__ = ["FoldCache"]
+
+
+class FirstIteration(object):
+    """Per-sample statistics and root histograms of the trees of the first
+    iteration, the same for all the fits of a fold with the same bins and
+    loss.
+
+    Parameters
+    ----------
+    n_trees : int
+        Trees per iteration.
+    """
+
+    def __init__(self, n_trees):
+        self.stats = [None] * n_trees
+        self.histograms = [None] * n_trees
+
+    @property
+    def complete(self):
+        """Whether every tree has its statistics, the gradients of the
+        iteration then need not be computed."""
+        return all(stats is not None for stats in self.stats)
+
+    def tree_inputs(self, k, builder, sample_indices, make_stats):
+        """Set the statistics of tree ``k`` on ``builder`` and return its
+        root histogram, from the pool of ``builder``. ``make_stats()``
+        computes the statistics the first time."""
+        if self.stats[k] is None:
+            self.stats[k] = make_stats()
+        builder.set_stats(self.stats[k])
+        cached = self.histograms[k]
+        if cached is None:
+            hist = builder.build(sample_indices)
+            # the grower subtracts the sibling histograms in place
+            self.histograms[k] = hist.copy()
+            return hist
+        hist = builder.pool.empty(cached.shape, dtype=cached.dtype)
+        hist[...] = cached
+        return hist
+
+
+class BinnedFold(object):
+    """A fold binned with one set of binning parameters.
+
+    Attributes
+    ----------
+    bin_thresholds : list of arrays
+
+    categories : list of arrays or None
+        The ``categories_`` of the bin mapper.
+
+    X_binned : ndarray or SparseBinnedMatrix
+
+    builder : histogram builder
+        On ``X_binned``, which the CUDA backend uploads once.
+    """
+
+    def __init__(self, bin_thresholds, X_binned, builder, categories=None):
+        self.bin_thresholds = bin_thresholds
+        self.categories = categories
+        self.X_binned = X_binned
+        self.builder = builder
+        self._first_iterations = {}
+
+    def first_iteration(self, loss, n_trees):
+        """The ``FirstIteration`` of the fits with ``loss``, the name of
+        the loss class."""
+        key = (loss, n_trees)
+        if key not in self._first_iterations:
+            self._first_iterations[key] = FirstIteration(n_trees)
+        return self._first_iterations[key]
+
+
+class FoldCache(object):
+    """Binned matrices, histogram builders and first iterations of the
+    gradient boosting fits on one training fold.
+
+    Fits on other data, e.g. the training part of a
+    ``validation_fraction`` split, do not use it.
+
+    Parameters
+    ----------
+    X : array-like or sparse matrix, shape (n_samples, n_features)
+        The training fold, the very object the fits are given, always
+        with the same targets and sample weights.
+
+    Attributes
+    ----------
+    hits : int
+        Fits that found their binned fold in the cache.
+
+    misses : int
+        Fits that binned it.
+    """
+
+    def __init__(self, X):
+        self.X = X
+        self._folds = {}
+        self.hits = 0
+        self.misses = 0
+
+    def holds(self, X):
+        return X is self.X
+
+    def binned(self, bin_mapper, backend):
+        """The ``BinnedFold`` of ``bin_mapper``'s parameters on the
+        ``backend``: ``bin_mapper`` is fitted on the fold the first time,
+        given the cached thresholds afterwards."""
+        subsampled = (bin_mapper.subsample is not None
+                      and self.X.shape[0] > bin_mapper.subsample)
+        seed = bin_mapper.random_state
+        key = (bin_mapper.max_bins, bin_mapper.order, backend,
+               bin_mapper.subsample if subsampled else None,
+               seed if subsampled and isinstance(seed, numbers.Integral)
+               else None,
+               tuple(np.flatnonzero(_categorical_mask(
+                   bin_mapper.categorical_features, self.X.shape[1]))))
+        fold = self._folds.get(key)
+        if fold is not None:
+            self.hits += 1
+            bin_mapper._set_thresholds(fold.bin_thresholds, fold.categories)
+            return fold
+        self.misses += 1
+        X_binned = bin_mapper.fit_transform(self.X)
+        builder = get_histogram_builder(backend)(X_binned,
+                                                 bin_mapper.n_bins_)
+        fold = self._folds[key] = BinnedFold(bin_mapper.bin_thresholds_,
+                                             X_binned, builder,
+                                             bin_mapper.categories_)
+        return fold
+
+    @property
+    def nbytes(self):
+        """Bytes of the binned matrices and cached histograms."""
+        total = 0
+        for fold in self._folds.values():
+            total += fold.X_binned.nbytes
+            for first in fold._first_iterations.values():
+                total += sum(a.nbytes for a in first.stats + first.histograms
+                             if a is not None)
+        return total
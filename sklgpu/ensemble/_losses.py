@@ -0,0 +1,116 @@
+"""Loss functions of the histogram gradient boosting estimators.
+
+Raw predictions, gradients and hessians have shape
+``(n_trees_per_iteration, n_samples)``.
+"""
+import numpy as np
+from scipy.special import expit, logsumexp
+
+
+class BaseLoss(object):
+    """Base class for the boosting losses."""
+
+    hessians_are_constant = False
+
+    def __call__(self, y_true, raw_predictions, sample_weight=None):
+        """Average loss of the raw predictions."""
+        return np.average(self.pointwise_loss(y_true, raw_predictions),
+                          weights=sample_weight)
+
+    def init_gradients_and_hessians(self, n_samples, n_trees_per_iteration):
+        shape = (n_trees_per_iteration, n_samples)
+        gradients = np.empty(shape, dtype=np.float64)
+        hessians = np.ones(shape, dtype=np.float64)
+        return gradients, hessians
+
+    def get_baseline_prediction(self, y_train, sample_weight,
+                                n_trees_per_iteration):
+        raise NotImplementedError
+
+    def update_gradients_and_hessians(self, gradients, hessians, y_true,
+                                      raw_predictions):
+        raise NotImplementedError
+
+
+class LeastSquares(BaseLoss):
+    """Half squared error, the hessians are constant."""
+
+    hessians_are_constant = True
+
+    def pointwise_loss(self, y_true, raw_predictions):
+        return 0.5 * np.square(y_true - raw_predictions[0])
+
+    def get_baseline_prediction(self, y_train, sample_weight,
+                                n_trees_per_iteration):
+        return np.average(y_train, weights=sample_weight)
+
+    def update_gradients_and_hessians(self, gradients, hessians, y_true,
+                                      raw_predictions):
+        np.subtract(raw_predictions[0], y_true, out=gradients[0])
+
+    def inverse_link_function(self, raw_predictions):
+        return raw_predictions
+
+
+class BinaryCrossEntropy(BaseLoss):
+    """Logistic loss, ``y_true`` holds 0 and 1."""
+
+    def pointwise_loss(self, y_true, raw_predictions):
+        raw = raw_predictions[0]
+        return np.logaddexp(0, raw) - y_true * raw
+
+    def get_baseline_prediction(self, y_train, sample_weight,
+                                n_trees_per_iteration):
+        eps = np.finfo(np.float64).eps
+        proba = np.clip(np.average(y_train, weights=sample_weight),
+                        eps, 1 - eps)
+        return np.log(proba / (1 - proba))
+
+    def update_gradients_and_hessians(self, gradients, hessians, y_true,
+                                      raw_predictions):
+        proba = expit(raw_predictions[0])
+        np.subtract(proba, y_true, out=gradients[0])
+        np.multiply(proba, 1 - proba, out=hessians[0])
+
+    def predict_proba(self, raw_predictions):
+        proba = np.empty((raw_predictions.shape[1], 2))
+        proba[:, 1] = expit(raw_predictions[0])
+        proba[:, 0] = 1 - proba[:, 1]
+        return proba
+
+
+class CategoricalCrossEntropy(BaseLoss):
+    """Multinomial loss, one tree per class and iteration."""
+
+    def pointwise_loss(self, y_true, raw_predictions):
+        one_hot = (y_true[np.newaxis, :]
+                   == np.arange(raw_predictions.shape[0])[:, np.newaxis])
+        return (logsumexp(raw_predictions, axis=0)
+                - (one_hot * raw_predictions).sum(axis=0))
+
+    def get_baseline_prediction(self, y_train, sample_weight,
+                                n_trees_per_iteration):
+        eps = np.finfo(np.float64).eps
+        baseline = np.zeros((n_trees_per_iteration, 1))
+        for k in range(n_trees_per_iteration):
+            proba = np.clip(np.average(y_train == k, weights=sample_weight),
+                            eps, 1 - eps)
+            baseline[k] = np.log(proba)
+        return baseline
+
+    def update_gradients_and_hessians(self, gradients, hessians, y_true,
+                                      raw_predictions):
+        proba = np.exp(raw_predictions
+                       - logsumexp(raw_predictions, axis=0)[np.newaxis, :])
+        for k in range(raw_predictions.shape[0]):
+            np.subtract(proba[k], y_true == k, out=gradients[k])
+            np.multiply(proba[k], 1 - proba[k], out=hessians[k])
+
+    def predict_proba(self, raw_predictions):
+        return np.exp(raw_predictions
+                      - logsumexp(raw_predictions, axis=0)[np.newaxis, :]).T
+
+
+_LOSSES = {'least_squares': LeastSquares,
+           'binary_crossentropy': BinaryCrossEntropy,
+           'categorical_crossentropy': CategoricalCrossEntropy}
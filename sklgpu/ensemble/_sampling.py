@@ -0,0 +1,91 @@
+"""Row and feature sampling of the gradient boosting iterations.
+
+The rows of an iteration are an index array into the binned training set,
+which the histogram builders and the grower take as they are: sampling
+never copies the data, it only shortens the index arrays the histograms
+are built over.
+
+``subsample`` draws a uniform fraction of the rows. Gradient-based one
+side sampling (GOSS, Ke et al., LightGBM) keeps the ``top_rate`` rows of
+largest ``|gradient * hessian|``, which drive the gains, and a random
+``other_rate`` of the others, their statistics scaled up so that their
+sums stay unbiased.
+
+The features of a tree are drawn once per tree (``colsample_bytree``) and
+a fraction of them at every node (``colsample_bynode``), the grower's
+``features`` and ``max_features``.
+"""
+import numpy as np
+
+__all__ = ["uniform_rows", "goss_rows", "tree_features"]
+
+
+def uniform_rows(sample_indices, subsample, rng):
+    """Sorted ``subsample`` fraction of ``sample_indices``."""
+    n_rows = max(int(round(subsample * len(sample_indices))), 1)
+    if n_rows >= len(sample_indices):
+        return sample_indices
+    return np.sort(rng.choice(sample_indices, n_rows, replace=False))
+
+
+def goss_rows(sample_indices, gradients, hessians, sample_weight, top_rate,
+              other_rate, rng):
+    """GOSS sample of ``sample_indices``.
+
+    Parameters
+    ----------
+    sample_indices : ndarray
+        The rows of nonzero weight.
+
+    gradients, hessians : ndarray, shape (n_trees_per_iteration, n_samples)
+
+    sample_weight : ndarray or None
+
+    top_rate, other_rate : float
+        Fractions of ``sample_indices`` kept for their gradients and drawn
+        among the others.
+
+    rng : RandomState
+
+    Returns
+    -------
+    rows : ndarray
+        The sorted sample.
+
+    sample_weight : ndarray or None
+        The weights of all the samples, the drawn rows scaled by the
+        inverse of their drawing rate; ``sample_weight`` itself when every
+        row is kept.
+    """
+    n_rows = len(sample_indices)
+    n_top = int(top_rate * n_rows)
+    n_other = max(int(other_rate * n_rows), 1)
+    if n_top + n_other >= n_rows:
+        return sample_indices, sample_weight
+    score = np.abs(gradients[:, sample_indices]
+                   * hessians[:, sample_indices]).sum(axis=0)
+    if sample_weight is not None:
+        score *= sample_weight[sample_indices]
+    order = np.argpartition(-score, n_top)
+    top = sample_indices[order[:n_top]]
+    other = rng.choice(sample_indices[order[n_top:]], n_other, replace=False)
+    weights = (np.ones(gradients.shape[1]) if sample_weight is None
+               else sample_weight.copy())
+    weights[other] *= (n_rows - n_top) / n_other
+    return np.sort(np.concatenate([top, other])), weights
+
+
+def tree_features(n_features, colsample_bytree, colsample_bynode, rng):
+    """``(features, max_features)`` of a tree: its sorted candidate
+    features, None for all of them, and the number drawn at every node,
+    None for all of the tree's."""
+    features = None
+    n_tree_features = n_features
+    if colsample_bytree < 1:
+        n_tree_features = max(int(round(colsample_bytree * n_features)), 1)
+        features = np.sort(rng.choice(n_features, n_tree_features,
+                                      replace=False))
+    max_features = None
+    if colsample_bynode < 1:
+        max_features = max(int(round(colsample_bynode * n_tree_features)), 1)
+    return features, max_features
@@ -0,0 +1,66 @@
+"""Training data shared between worker processes without copies.
+
+The parent process copies each array once into a named shared memory
+block; workers attach to the blocks by name in their initializer and wrap
+them in NumPy arrays, so tasks only carry a few bytes of arguments.
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedArrays(object):
+    """Named shared memory copies of a dict of arrays.
+
+    Use as a context manager in the parent process; the blocks are
+    unlinked on exit. ``spec`` is the picklable description workers pass
+    to :func:`attach_arrays`.
+    """
+
+    def __init__(self, arrays):
+        self._blocks = []
+        self.spec = {}
+        try:
+            for key, array in arrays.items():
+                order = 'F' if (array.flags.f_contiguous
+                                and not array.flags.c_contiguous) else 'C'
+                block = shared_memory.SharedMemory(
+                    create=True, size=max(array.nbytes, 1))
+                self._blocks.append(block)
+                view = np.ndarray(array.shape, dtype=array.dtype,
+                                  buffer=block.buf, order=order)
+                view[...] = array
+                del view
+                self.spec[key] = (block.name, array.shape, array.dtype.str,
+                                  order)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def attach_arrays(spec):
+    """Read only arrays backed by the blocks described in ``spec``.
+
+    Returns the arrays and the block handles, which must outlive them.
+    """
+    arrays, blocks = {}, []
+    for key, (name, shape, dtype, order) in spec.items():
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf,
+                           order=order)
+        array.flags.writeable = False
+        arrays[key] = array
+    return arrays, blocks
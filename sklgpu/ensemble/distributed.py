@@ -0,0 +1,177 @@
+"""Data parallel histogram gradient boosting over several processes.
+
+Each process holds a row shard of the training set, bins it with
+thresholds fitted on a subsample gathered from all the shards and builds
+the histograms of its own rows; the histograms are summed with an
+allreduce, so every process finds the same splits and ends up with the
+same model. Only histograms (and a few scalars) go over the wire, the
+largest training set is bounded by the sum of the memories of the
+processes rather than by one of them.
+
+:func:`fit_distributed` is the entry point of one process in a group
+connected by a :class:`Communicator`, e.g. over TCP between hosts::
+
+    addresses = [('node0', 29500), ('node1', 29500)]
+    communicator = Communicator(SocketTransport(rank, addresses))
+    model = fit_distributed(HistGradientBoostingRegressor(), X_shard,
+                            y_shard, communicator=communicator)
+
+:func:`run_local` starts the group as local processes, over Unix domain
+sockets or shared memory.
+"""
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import traceback
+
+from ._allreduce import (Communicator, SharedMemoryGroup,
+                         SharedMemoryTransport, SocketTransport, Transport)
+from .gradient_boosting import BaseHistGradientBoosting
+
+__all__ = ["fit_distributed", "run_local", "Communicator", "Transport",
+           "SocketTransport", "SharedMemoryTransport", "SharedMemoryGroup"]
+
+
+def fit_distributed(estimator, X, y, sample_weight=None, communicator=None):
+    """Fit a histogram gradient boosting estimator on one shard of rows.
+
+    Every process of the group calls it, with its own shard and the same
+    estimator parameters.
+
+    Parameters
+    ----------
+    estimator : HistGradientBoostingClassifier or \
+            HistGradientBoostingRegressor
+
+    X, y, sample_weight :
+        The shard, anything ``fit`` accepts. Shards need at least one row.
+
+    communicator : Communicator or None
+        Connects the processes; None fits on ``X`` alone.
+
+    Returns
+    -------
+    estimator : the fitted estimator, the same model on every process
+    """
+    if not isinstance(estimator, BaseHistGradientBoosting):
+        raise TypeError("distributed fits are implemented for the histogram "
+                        "gradient boosting estimators, got %s"
+                        % type(estimator).__name__)
+    if communicator is None or communicator.world_size == 1:
+        return estimator.fit(X, y, sample_weight)
+    return estimator._fit(X, y, sample_weight, communicator)
+
+
+def _run_worker(rank, estimator, shard, transport, algorithm, results):
+    try:
+        if isinstance(transport, list):
+            transport = SocketTransport(rank, transport)
+        with transport:
+            if callable(shard):
+                shard = shard()
+            communicator = Communicator(transport, algorithm)
+            estimator = fit_distributed(estimator, *shard,
+                                        communicator=communicator)
+        results.put((rank, estimator if rank == 0 else None, None))
+    except BaseException:
+        results.put((rank, None, traceback.format_exc()))
+
+
+def run_local(estimator, shards, transport='socket', algorithm='auto',
+              start_method=None, timeout=None):
+    """Fit ``estimator`` with one local process per shard.
+
+    Parameters
+    ----------
+    estimator : HistGradientBoostingClassifier or \
+            HistGradientBoostingRegressor
+
+    shards : list
+        ``(X, y)`` or ``(X, y, sample_weight)`` tuples, or callables
+        returning one, called in the worker (e.g. to open a memory mapped
+        shard there rather than pickling it).
+
+    transport : {'socket', 'shm'}, optional (default='socket')
+        Unix domain sockets or shared memory mailboxes.
+
+    algorithm : {'auto', 'ring', 'tree'}, optional (default='auto')
+        Allreduce algorithm, see ``Communicator``.
+
+    start_method : str or None
+        ``multiprocessing`` start method of the workers; 'spawn' is needed
+        with the CUDA backend, a forked process cannot use the parent's
+        device context.
+
+    timeout : float or None
+        Seconds to wait for the fit.
+
+    Returns
+    -------
+    estimator : the model fitted by the worker of rank 0
+    """
+    if transport not in ('socket', 'shm'):
+        raise ValueError("transport should be 'socket' or 'shm', got %r"
+                         % transport)
+    world_size = len(shards)
+    if world_size < 1:
+        raise ValueError("at least one shard is required")
+    context = multiprocessing.get_context(start_method)
+    results = context.Queue()
+    directory = tempfile.mkdtemp(prefix='sklgpu_')
+    group = None
+    processes = []
+    try:
+        if transport == 'socket':
+            addresses = [os.path.join(directory, 'rank%d.sock' % rank)
+                         for rank in range(world_size)]
+            transports = [addresses] * world_size
+        else:
+            group = SharedMemoryGroup(world_size, context=context)
+            transports = group.transports
+        for rank, shard in enumerate(shards):
+            process = context.Process(
+                target=_run_worker, args=(rank, estimator, shard,
+                                          transports[rank], algorithm,
+                                          results),
+                daemon=True)
+            process.start()
+            processes.append(process)
+        fitted = None
+        for _ in range(world_size):
+            rank, model, error = _get_result(results, processes, timeout)
+            if error is not None:
+                raise RuntimeError("worker %d failed:\n%s" % (rank, error))
+            if rank == 0:
+                fitted = model
+        for process in processes:
+            process.join()
+        return fitted
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        if group is not None:
+            group.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _get_result(results, processes, timeout):
+    # a worker killed before reporting would leave the others blocked in a
+    # collective, poll for it
+    waited = 0.
+    while True:
+        try:
+            return results.get(timeout=1.)
+        except queue.Empty:
+            waited += 1.
+        dead = [rank for rank, process in enumerate(processes)
+                if process.exitcode not in (None, 0)]
+        if dead:
+            raise RuntimeError("worker %d exited with code %d"
+                               % (dead[0], processes[dead[0]].exitcode))
+        if timeout is not None and waited >= timeout:
+            raise TimeoutError("the distributed fit did not finish in %r "
+                               "seconds" % timeout)
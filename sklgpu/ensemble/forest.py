@@ -0,0 +1,589 @@
+"""Forests of histogram decision trees.
+
+The training set is binned once for the whole forest, or presorted once
+with ``splitter='exact'``. With ``n_jobs > 1`` the binned matrix (or the
+sorted columns), the encoded targets and the sample weights are placed in
+shared memory and the trees are grown by a process pool whose workers
+attach to those blocks, so no worker receives a pickled copy of the data.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.base import BaseEstimator, ClassifierMixin, RegressorMixin
+from sklearn.utils import check_random_state
+from sklearn.utils.validation import check_is_fitted
+
+from ..tree import DecisionTreeClassifier, DecisionTreeRegressor
+from ..tree._binning import MAX_BINS, BinMapper, SparseBinnedMatrix
+from ..tree._histogram import get_histogram_builder, resolve_backend
+from ..tree._presort import PresortedIndex
+from ..tree._shap import TreePaths, shap_values
+from ..tree._streaming import check_training_data
+from ..tree._tree import TreeEnsemble, _memory_usage
+from ._shared import SharedArrays, attach_arrays
+
+__all__ = ["RandomForestClassifier", "RandomForestRegressor"]
+
+MAX_INT = np.iinfo(np.int32).max
+
+# set in every pool worker by _init_worker
+_worker_state = {}
+
+
+# training data made of several arrays, by key in the shared arrays
+_COMPOSITE = {'X_binned': SparseBinnedMatrix, 'presorted': PresortedIndex}
+
+
+def _flatten_arrays(arrays):
+    """Put the components of a sparse ``X_binned`` or of a presorted index
+    in shared memory."""
+    flat = {}
+    for key, value in arrays.items():
+        if isinstance(value, tuple(_COMPOSITE.values())):
+            for name, component in value.components().items():
+                flat[key + '_' + name] = component
+        else:
+            flat[key] = value
+    return flat
+
+
+def _unflatten_arrays(arrays):
+    for key, cls in _COMPOSITE.items():
+        prefix = key + '_'
+        names = [name for name in arrays if name.startswith(prefix)]
+        if key in arrays or not names:
+            continue
+        arrays[key] = cls.from_components(
+            {name[len(prefix):]: arrays.pop(name) for name in names})
+    return arrays
+
+
+def _init_worker(spec, bin_mapper):
+    arrays, blocks = attach_arrays(spec)
+    _worker_state.update(arrays=_unflatten_arrays(arrays), blocks=blocks,
+                         bin_mapper=bin_mapper)
+
+
+def _fit_tree(tree, seed, bootstrap, arrays=None, bin_mapper=None):
+    """Fit one tree of the forest, on the worker's shared arrays unless
+    ``arrays`` is given."""
+    if arrays is None:
+        arrays = _worker_state['arrays']
+        bin_mapper = _worker_state['bin_mapper']
+    sample_weight = arrays['sample_weight']
+    if bootstrap:
+        n_samples = sample_weight.shape[0]
+        rng = np.random.RandomState(seed)
+        counts = np.bincount(rng.randint(0, n_samples, n_samples),
+                             minlength=n_samples)
+        sample_weight = sample_weight * counts
+    tree.set_params(random_state=seed)
+    if 'presorted' in arrays:
+        return tree._fit_presorted(arrays['presorted'], arrays['y'],
+                                   sample_weight)
+    return tree._fit_binned(arrays['X_binned'], bin_mapper, arrays['y'],
+                            sample_weight)
+
+
+def _effective_n_jobs(n_jobs, n_tasks):
+    if n_jobs is None:
+        n_jobs = 1
+    elif n_jobs < 0:
+        n_jobs = max(os.cpu_count() + 1 + n_jobs, 1)
+    elif n_jobs == 0:
+        raise ValueError("n_jobs == 0 has no meaning")
+    return min(n_jobs, n_tasks)
+
+
+class BaseForest(BaseEstimator):
+    """Base class for forests of histogram trees.
+
+    Warning: This class should not be used directly. Use derived classes
+    instead.
+    """
+
+    def __init__(self, n_estimators, criterion, max_depth, min_samples_split,
+                 min_samples_leaf, max_features, max_leaf_nodes,
+                 min_impurity_decrease, bootstrap, max_bins, n_jobs,
+                 random_state, backend, splitter, categorical_features):
+        self.n_estimators = n_estimators
+        self.criterion = criterion
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.min_samples_leaf = min_samples_leaf
+        self.max_features = max_features
+        self.max_leaf_nodes = max_leaf_nodes
+        self.min_impurity_decrease = min_impurity_decrease
+        self.bootstrap = bootstrap
+        self.max_bins = max_bins
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.backend = backend
+        self.splitter = splitter
+        self.categorical_features = categorical_features
+
+    def _make_estimator(self):
+        tree = self._tree_class(
+            criterion=self.criterion, max_depth=self.max_depth,
+            min_samples_split=self.min_samples_split,
+            min_samples_leaf=self.min_samples_leaf,
+            max_features=self.max_features,
+            max_leaf_nodes=self.max_leaf_nodes,
+            min_impurity_decrease=self.min_impurity_decrease,
+            max_bins=self.max_bins, backend=self.backend_,
+            splitter=self.splitter,
+            categorical_features=self.categorical_features)
+        tree._check_params()
+        return tree
+
+    def fit(self, X, y, sample_weight=None):
+        """Build a forest of trees from the training set (X, y).
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+            The training input samples.
+            Also an ``np.memmap``, read by chunks of rows, or an iterator
+            of row chunks, arrays or ``(X, y[, sample_weight])`` tuples,
+            for training sets that do not fit in memory.
+            CSR and CSC matrices are binned without being densified.
+
+        y : array-like, shape (n_samples,)
+            The target values.
+
+        sample_weight : array-like, shape (n_samples,) or None
+            Sample weights.
+
+        Returns
+        -------
+        self : object
+        """
+        if self.n_estimators < 1:
+            raise ValueError("n_estimators must be greater than zero, "
+                             "got %r." % self.n_estimators)
+        X, y, sample_weight = check_training_data(X, y, sample_weight)
+        y = self._encode_y(np.ravel(y))
+        if X.shape[0] != y.shape[0]:
+            raise ValueError("Number of labels=%d does not match number of "
+                             "samples=%d" % (y.shape[0], X.shape[0]))
+        if sample_weight is None:
+            sample_weight = np.ones(X.shape[0], dtype=np.float64)
+        else:
+            sample_weight = np.ascontiguousarray(sample_weight,
+                                                 dtype=np.float64)
+        self.n_features_ = X.shape[1]
+
+        random_state = check_random_state(self.random_state)
+        exact = self.splitter == 'exact'
+        self.backend_ = ('cpu' if exact
+                         else resolve_backend(self.backend, sp.issparse(X)))
+        # the trees check the parameters before the data is processed
+        trees = [self._make_estimator() for _ in range(self.n_estimators)]
+        for tree in trees:
+            self._init_tree(tree)
+        arrays = {'y': y, 'sample_weight': sample_weight}
+        if exact:
+            # sorted once, every tree starts from this order
+            arrays['presorted'] = PresortedIndex(X)
+            bin_mapper = None
+        else:
+            bin_mapper = BinMapper(
+                self.max_bins,
+                order=get_histogram_builder(self.backend_).preferred_order,
+                cache=True, random_state=self.random_state,
+                categorical_features=self.categorical_features)
+            arrays['X_binned'] = bin_mapper.fit_transform(X)
+        del X
+
+        seeds = random_state.randint(MAX_INT, size=self.n_estimators)
+
+        self._ensemble = None
+        n_jobs = _effective_n_jobs(self.n_jobs, self.n_estimators)
+        if n_jobs == 1:
+            self.estimators_ = [
+                _fit_tree(tree, seed, self.bootstrap, arrays, bin_mapper)
+                for tree, seed in zip(trees, seeds)]
+        else:
+            with SharedArrays(_flatten_arrays(arrays)) as shared:
+                with ProcessPoolExecutor(
+                        n_jobs, initializer=_init_worker,
+                        initargs=(shared.spec, bin_mapper)) as executor:
+                    self.estimators_ = list(executor.map(
+                        _fit_tree, trees, seeds,
+                        [self.bootstrap] * self.n_estimators))
+        self._set_importances()
+        return self
+
+    def _set_importances(self):
+        # the sum of the normalized importances of the trees with a split,
+        # scikit-learn's mean once normalized
+        self._split_gains = np.zeros(self.n_features_)
+        self._split_counts = np.zeros(self.n_features_, dtype=np.intp)
+        for tree in self.estimators_:
+            features, gains, counts = tree._split_importances
+            self._split_counts[features] += counts
+            if gains.sum() > 0:
+                self._split_gains[features] += gains / gains.sum()
+
+    @property
+    def feature_importances_(self):
+        """Mean impurity decrease of the splits on every feature over the
+        trees, normalized to sum to 1.
+
+        Returns
+        -------
+        feature_importances_ : array, shape (n_features,)
+        """
+        check_is_fitted(self, 'estimators_')
+        total = self._split_gains.sum()
+        if total > 0:
+            return self._split_gains / total
+        return self._split_gains.copy()
+
+    @property
+    def feature_split_counts_(self):
+        """Number of splits on every feature in all the trees, shape
+        (n_features,)."""
+        check_is_fitted(self, 'estimators_')
+        return self._split_counts.copy()
+
+    def _init_tree(self, tree):
+        pass
+
+    def _validate_X_predict(self, X):
+        check_is_fitted(self, 'estimators_')
+        return self.estimators_[0]._validate_X_predict(X)
+
+    def _tree_ensemble(self):
+        """The fitted trees as one ``TreeEnsemble``, built on first use."""
+        if getattr(self, '_ensemble', None) is None:
+            self._ensemble = TreeEnsemble(
+                [tree.tree_ for tree in self.estimators_])
+        return self._ensemble
+
+    def memory_usage(self):
+        """Bytes held by the fitted forest.
+
+        Returns
+        -------
+        usage : dict
+            ``'nodes'``: the node arrays of the trees, ``'binning'``: the
+            bin thresholds, ``'device'``: the node arrays uploaded for GPU
+            prediction, ``'total'``: the host bytes, and ``'n_nodes'``.
+        """
+        check_is_fitted(self, 'estimators_')
+        return _memory_usage(
+            [tree.tree_ for tree in self.estimators_],
+            getattr(self, '_ensemble', None),
+            [t for tree in self.estimators_ for t in tree._bin_thresholds])
+
+    def __getstate__(self):
+        # the concatenated arrays are rebuilt after unpickling
+        state = super().__getstate__()
+        state.pop('_ensemble', None)
+        return state
+
+    def _mean_value(self, X):
+        X = self._validate_X_predict(X)
+        # the traversal releases the GIL, chunks of rows run on threads
+        n_threads = _effective_n_jobs(self.n_jobs, X.shape[0])
+        value = self._tree_ensemble().predict(X, n_threads=n_threads,
+                                              backend=self.backend_)
+        value /= len(self.estimators_)
+        return value
+
+    def _shap_values(self, X, background, n_jobs):
+        X = self._validate_X_predict(X)
+        if background is not None:
+            background = self._validate_X_predict(background)
+        values = shap_values(
+            TreePaths.from_ensemble(self._tree_ensemble()), X,
+            self.n_features_, background,
+            n_jobs=self.n_jobs if n_jobs is None else n_jobs,
+            backend=self.backend_)
+        values /= len(self.estimators_)
+        return values
+
+
+class RandomForestClassifier(ClassifierMixin, BaseForest):
+    """A random forest of histogram decision tree classifiers.
+
+    Parameters
+    ----------
+    n_estimators : int, optional (default=100)
+        The number of trees in the forest.
+
+    criterion : string, optional (default="gini")
+        "gini" or "entropy".
+
+    max_depth : int or None, optional (default=None)
+        The maximum depth of the trees.
+
+    min_samples_split : int, optional (default=2)
+        The minimum number of samples required to split an internal node.
+
+    min_samples_leaf : int, optional (default=1)
+        The minimum number of samples required to be at a leaf node.
+
+    max_features : int, float, string or None, optional (default="sqrt")
+        The number of features to consider at each split.
+
+    max_leaf_nodes : int or None, optional (default=None)
+        Grow trees best first with at most ``max_leaf_nodes`` leaves.
+
+    min_impurity_decrease : float, optional (default=0.)
+        A node is split only if the weighted impurity decrease is at least
+        this value.
+
+    bootstrap : boolean, optional (default=True)
+        Whether bootstrap samples are used when building trees.
+
+    max_bins : int, optional (default=256)
+        Maximum number of histogram bins per feature, up to 65536.
+
+    n_jobs : int or None, optional (default=None)
+        Number of worker processes growing trees, -1 for all cores.
+
+    random_state : int, RandomState instance or None, optional
+        Controls the binning, the bootstrap and the feature sampling.
+
+    backend : string, optional (default="auto")
+        "cpu", "cuda", or "auto" to use the GPU when one is available.
+        "cuda" falls back to "cpu" with a warning when no device is
+        usable.
+
+    splitter : string, optional (default="hist")
+        "hist" splits at bin boundaries; "exact" between any two
+        consecutive feature values, with the feature columns sorted once
+        for all the trees. "exact" runs on the CPU and needs dense ``X``.
+
+    categorical_features : array-like of int or bool, or None, optional \
+            (default=None)
+        Indices or boolean mask of the categorical features, which hold
+        integer codes in [0, 65535], at most ``max_bins`` different ones
+        per feature. Their splits send a subset of the categories left,
+        without one-hot encoding; codes unseen during the fit, or of
+        fewer than 10 samples in the node, go right. Missing codes are
+        not supported: like every feature they must not be NaN, in fit
+        and predict.
+        Only with ``splitter="hist"``.
+
+    Attributes
+    ----------
+    estimators_ : list of DecisionTreeClassifier
+        The fitted trees.
+
+    classes_ : array of shape (n_classes,)
+        The classes labels.
+
+    n_classes_ : int
+        The number of classes.
+
+    n_features_ : int
+        The number of features when ``fit`` is performed.
+
+    backend_ : string
+        The backend the trees were built with.
+
+    feature_importances_ : array of shape (n_features,)
+        The impurity decrease of the splits on every feature, normalized
+        per tree and averaged over the trees.
+
+    feature_split_counts_ : array of shape (n_features,)
+        The number of splits on every feature.
+    """
+
+    _tree_class = DecisionTreeClassifier
+
+    def __init__(self, n_estimators=100, criterion="gini", max_depth=None,
+                 min_samples_split=2, min_samples_leaf=1, max_features="sqrt",
+                 max_leaf_nodes=None, min_impurity_decrease=0.,
+                 bootstrap=True, max_bins=MAX_BINS, n_jobs=None,
+                 random_state=None, backend="auto", splitter="hist",
+                 categorical_features=None):
+        super(RandomForestClassifier, self).__init__(
+            n_estimators=n_estimators, criterion=criterion,
+            max_depth=max_depth, min_samples_split=min_samples_split,
+            min_samples_leaf=min_samples_leaf, max_features=max_features,
+            max_leaf_nodes=max_leaf_nodes,
+            min_impurity_decrease=min_impurity_decrease, bootstrap=bootstrap,
+            max_bins=max_bins, n_jobs=n_jobs, random_state=random_state,
+            backend=backend, splitter=splitter,
+            categorical_features=categorical_features)
+
+    def _encode_y(self, y):
+        self.classes_, y = np.unique(y, return_inverse=True)
+        self.n_classes_ = len(self.classes_)
+        return y
+
+    def _init_tree(self, tree):
+        tree.classes_ = self.classes_
+        tree.n_classes_ = self.n_classes_
+
+    def predict_proba(self, X):
+        """Mean predicted class probabilities of the trees."""
+        return self._mean_value(X)
+
+    def predict_log_proba(self, X):
+        with np.errstate(divide='ignore'):
+            return np.log(self.predict_proba(X))
+
+    def predict(self, X):
+        """Predict class for X."""
+        proba = self.predict_proba(X)
+        return self.classes_.take(np.argmax(proba, axis=1), axis=0)
+
+    def shap_values(self, X, background=None, n_jobs=None):
+        """SHAP values of the mean class probabilities of X.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+
+        background : array-like, shape (n_background, n_features) or None
+            Interventional SHAP values over these rows; None for the tree
+            path dependent values over the training samples of the nodes.
+
+        n_jobs : int or None, optional (default=None)
+            Threads over chunks of rows, ``self.n_jobs`` when None.
+
+        Returns
+        -------
+        values : array, shape (n_samples, n_features + 1, n_classes)
+            Contribution of every feature to the probability of every
+            class, then the expected probabilities: a row sums to
+            ``predict_proba``.
+        """
+        return self._shap_values(X, background, n_jobs)
+
+
+class RandomForestRegressor(RegressorMixin, BaseForest):
+    """A random forest of histogram decision tree regressors.
+
+    Parameters
+    ----------
+    n_estimators : int, optional (default=100)
+        The number of trees in the forest.
+
+    criterion : string, optional (default="mse")
+        Only "mse" is supported.
+
+    max_depth : int or None, optional (default=None)
+        The maximum depth of the trees.
+
+    min_samples_split : int, optional (default=2)
+        The minimum number of samples required to split an internal node.
+
+    min_samples_leaf : int, optional (default=1)
+        The minimum number of samples required to be at a leaf node.
+
+    max_features : int, float, string or None, optional (default=None)
+        The number of features to consider at each split.
+
+    max_leaf_nodes : int or None, optional (default=None)
+        Grow trees best first with at most ``max_leaf_nodes`` leaves.
+
+    min_impurity_decrease : float, optional (default=0.)
+        A node is split only if the weighted impurity decrease is at least
+        this value.
+
+    bootstrap : boolean, optional (default=True)
+        Whether bootstrap samples are used when building trees.
+
+    max_bins : int, optional (default=256)
+        Maximum number of histogram bins per feature, up to 65536.
+
+    n_jobs : int or None, optional (default=None)
+        Number of worker processes growing trees, -1 for all cores.
+
+    random_state : int, RandomState instance or None, optional
+        Controls the binning, the bootstrap and the feature sampling.
+
+    backend : string, optional (default="auto")
+        "cpu", "cuda", or "auto" to use the GPU when one is available.
+        "cuda" falls back to "cpu" with a warning when no device is
+        usable.
+
+    splitter : string, optional (default="hist")
+        "hist" splits at bin boundaries; "exact" between any two
+        consecutive feature values, with the feature columns sorted once
+        for all the trees. "exact" runs on the CPU and needs dense ``X``.
+
+    categorical_features : array-like of int or bool, or None, optional \
+            (default=None)
+        Indices or boolean mask of the categorical features, which hold
+        integer codes in [0, 65535], at most ``max_bins`` different ones
+        per feature. Their splits send a subset of the categories left,
+        without one-hot encoding; codes unseen during the fit, or of
+        fewer than 10 samples in the node, go right. Missing codes are
+        not supported: like every feature they must not be NaN, in fit
+        and predict.
+        Only with ``splitter="hist"``.
+
+    Attributes
+    ----------
+    estimators_ : list of DecisionTreeRegressor
+        The fitted trees.
+
+    n_features_ : int
+        The number of features when ``fit`` is performed.
+
+    backend_ : string
+        The backend the trees were built with.
+
+    feature_importances_ : array of shape (n_features,)
+        The impurity decrease of the splits on every feature, normalized
+        per tree and averaged over the trees.
+
+    feature_split_counts_ : array of shape (n_features,)
+        The number of splits on every feature.
+    """
+
+    _tree_class = DecisionTreeRegressor
+
+    def __init__(self, n_estimators=100, criterion="mse", max_depth=None,
+                 min_samples_split=2, min_samples_leaf=1, max_features=None,
+                 max_leaf_nodes=None, min_impurity_decrease=0.,
+                 bootstrap=True, max_bins=MAX_BINS, n_jobs=None,
+                 random_state=None, backend="auto", splitter="hist",
+                 categorical_features=None):
+        super(RandomForestRegressor, self).__init__(
+            n_estimators=n_estimators, criterion=criterion,
+            max_depth=max_depth, min_samples_split=min_samples_split,
+            min_samples_leaf=min_samples_leaf, max_features=max_features,
+            max_leaf_nodes=max_leaf_nodes,
+            min_impurity_decrease=min_impurity_decrease, bootstrap=bootstrap,
+            max_bins=max_bins, n_jobs=n_jobs, random_state=random_state,
+            backend=backend, splitter=splitter,
+            categorical_features=categorical_features)
+
+    def _encode_y(self, y):
+        return np.asarray(y, dtype=np.float64)
+
+    def predict(self, X):
+        """Mean predicted regression target of the trees."""
+        return self._mean_value(X)[:, 0]
+
+    def shap_values(self, X, background=None, n_jobs=None):
+        """SHAP values of the predictions of X.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+
+        background : array-like, shape (n_background, n_features) or None
+            Interventional SHAP values over these rows; None for the tree
+            path dependent values over the training samples of the nodes.
+
+        n_jobs : int or None, optional (default=None)
+            Threads over chunks of rows, ``self.n_jobs`` when None.
+
+        Returns
+        -------
+        values : array, shape (n_samples, n_features + 1)
+            Contribution of every feature, then the expected value: a row
+            sums to the prediction.
+        """
+        return self._shap_values(X, background, n_jobs)[:, :, 0]
@@ -0,0 +1,1154 @@
+"""Histogram gradient boosting.
+
+Every iteration fits one tree per output on the gradients and hessians of
+the loss, with the second order gain of
+:class:`sklgpu.tree._splitting.GradientCriterion`. The training set is
+binned and, for the CUDA backend, uploaded once per fit; each tree only
+refreshes the per-sample statistics. Trees are grown best first and use
+histogram subtraction, so only the smaller child of every split has its
+histogram built from the data.
+
+With ``warm_start`` or ``partial_fit`` the binned training set and its raw
+predictions are kept by the estimator, so adding iterations on the same
+data costs only the new iterations.
+
+With ``n_iter_no_change`` the fit stops once the score on a validation set,
+``eval_set`` or a ``validation_fraction`` of the training set, has not
+improved for that many iterations. Like those of the training set, the raw
+predictions of the validation set are kept and only the new trees predict
+it, scoring every iteration costs one tree rather than the whole ensemble.
+
+The fit also runs data parallel over a group of processes each holding a
+row shard, the histograms being summed with an allreduce, see
+:mod:`sklgpu.ensemble.distributed`.
+
+The fits of a parameter search on one fold share its binned matrix and
+the gradients and root histograms of their first iteration through a
+``FoldCache``, and the staged predictions score every ``max_iter`` of a
+fit, see :mod:`sklgpu.model_selection`.
+
+The split gains of every feature are summed as the trees grow, and SHAP
+values, in the raw (log odds for classifiers) space, come from the root to
+leaf paths of all the trees, see :mod:`sklgpu.tree._shap`.
+
+``subsample`` and GOSS grow the trees of an iteration on a sample of the
+rows and ``colsample_bytree`` and ``colsample_bynode`` on a sample of the
+features, see :mod:`sklgpu.ensemble._sampling`. The rows left out are
+routed through the binned splits afterwards, so the raw predictions of the
+training set stay those of the whole ensemble.
+"""
+from abc import ABCMeta, abstractmethod
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.base import (BaseEstimator, ClassifierMixin, RegressorMixin,
+                          is_classifier)
+from sklearn.metrics import check_scoring
+from sklearn.model_selection import train_test_split
+from sklearn.utils import check_array, check_random_state
+from sklearn.utils.validation import check_is_fitted
+
+from ..tree._binning import (MAX_BINS, BinMapper, dataset_fingerprint,
+                             take_rows)
+from ..tree._grower import TreeGrower
+from ..tree._histogram import get_histogram_builder, resolve_backend
+from ..tree._shap import TreePaths, shap_values
+from ..tree._splitting import GradientCriterion
+from ..tree._streaming import check_training_data, read_rows, row_chunks
+from ..tree._tree import VALUE_DTYPE, Tree, TreeEnsemble, _memory_usage
+from ._allreduce import AllreduceHistogramBuilder, fit_bin_mapper
+from ._losses import _LOSSES
+from ._sampling import goss_rows, tree_features, uniform_rows
+
+__all__ = ["HistGradientBoostingClassifier", "HistGradientBoostingRegressor"]
+
+# leaves need at least this much hessian to be split
+MIN_HESSIAN_TO_SPLIT = 1e-3
+
+MAX_INT = np.iinfo(np.int32).max
+
+
+def _training_set_key(X):
+    """Fingerprint telling a warm start whether it resumes on the data of
+    the previous fit."""
+    if sp.issparse(X):
+        return tuple(dataset_fingerprint(a) for a in (
+            X.data, X.indices, X.indptr)) + (X.format, X.shape)
+    return dataset_fingerprint(X)
+
+
+def _resume_random_state(state):
+    """RandomState continuing from ``state``, a ``get_state()`` kept
+    with the model (a RandomState itself does not go in model files),
+    None for None."""
+    if state is None:
+        return None
+    rng = np.random.RandomState()
+    rng.set_state(state)
+    return rng
+
+
+class BaseHistGradientBoosting(BaseEstimator, metaclass=ABCMeta):
+    """Base class for histogram gradient boosting estimators.
+
+    Warning: This class should not be used directly. Use derived classes
+    instead.
+    """
+
+    @abstractmethod
+    def __init__(self, loss, learning_rate, max_iter, max_leaf_nodes,
+                 max_depth, min_samples_leaf, l2_regularization, max_bins,
+                 random_state, backend, warm_start, scoring,
+                 validation_fraction, n_iter_no_change, tol,
+                 categorical_features, subsample, goss_top_rate,
+                 goss_other_rate, colsample_bytree, colsample_bynode):
+        self.loss = loss
+        self.learning_rate = learning_rate
+        self.max_iter = max_iter
+        self.max_leaf_nodes = max_leaf_nodes
+        self.max_depth = max_depth
+        self.min_samples_leaf = min_samples_leaf
+        self.l2_regularization = l2_regularization
+        self.max_bins = max_bins
+        self.random_state = random_state
+        self.backend = backend
+        self.warm_start = warm_start
+        self.scoring = scoring
+        self.validation_fraction = validation_fraction
+        self.n_iter_no_change = n_iter_no_change
+        self.tol = tol
+        self.categorical_features = categorical_features
+        self.subsample = subsample
+        self.goss_top_rate = goss_top_rate
+        self.goss_other_rate = goss_other_rate
+        self.colsample_bytree = colsample_bytree
+        self.colsample_bynode = colsample_bynode
+
+    def _validate_parameters(self):
+        if self.loss not in self._VALID_LOSSES:
+            raise ValueError("Loss %r is not supported for %s. Accepted "
+                             "losses: %s." % (self.loss,
+                                              self.__class__.__name__,
+                                              ', '.join(self._VALID_LOSSES)))
+        if self.learning_rate <= 0:
+            raise ValueError("learning_rate=%r must be strictly positive"
+                             % self.learning_rate)
+        if self.max_iter < 1:
+            raise ValueError("max_iter=%r must not be smaller than 1."
+                             % self.max_iter)
+        if self.max_leaf_nodes is not None and self.max_leaf_nodes <= 1:
+            raise ValueError("max_leaf_nodes=%r should not be smaller than 2"
+                             % self.max_leaf_nodes)
+        if self.max_depth is not None and self.max_depth < 1:
+            raise ValueError("max_depth=%r should not be smaller than 1."
+                             % self.max_depth)
+        if self.min_samples_leaf < 1:
+            raise ValueError("min_samples_leaf=%r should not be smaller "
+                             "than 1." % self.min_samples_leaf)
+        if self.l2_regularization < 0:
+            raise ValueError("l2_regularization=%r must be positive."
+                             % self.l2_regularization)
+        if self.n_iter_no_change is not None and self.n_iter_no_change < 1:
+            raise ValueError("n_iter_no_change=%r must be positive or None."
+                             % self.n_iter_no_change)
+        if self.validation_fraction is not None and (
+                self.validation_fraction <= 0 or
+                (isinstance(self.validation_fraction, float)
+                 and self.validation_fraction >= 1)):
+            raise ValueError("validation_fraction=%r must be a float in (0, "
+                             "1), a positive int or None."
+                             % self.validation_fraction)
+        if self.tol < 0:
+            raise ValueError("tol=%r must not be negative." % self.tol)
+        for name in ('subsample', 'colsample_bytree', 'colsample_bynode'):
+            if not 0 < getattr(self, name) <= 1:
+                raise ValueError("%s=%r must be in (0, 1]."
+                                 % (name, getattr(self, name)))
+        if self.goss_top_rate is not None:
+            if not (0 <= self.goss_top_rate < 1
+                    and 0 < self.goss_other_rate <= 1
+                    and self.goss_top_rate + self.goss_other_rate <= 1):
+                raise ValueError("goss_top_rate=%r and goss_other_rate=%r "
+                                 "must be in [0, 1) and (0, 1] with a sum "
+                                 "of at most 1."
+                                 % (self.goss_top_rate, self.goss_other_rate))
+            if self.subsample < 1:
+                raise ValueError("subsample=%r and GOSS cannot be combined, "
+                                 "set goss_top_rate=None."
+                                 % self.subsample)
+
+    def fit(self, X, y, sample_weight=None, eval_set=None):
+        """Fit the gradient boosting model.
+
+        With ``warm_start``, a fitted model is grown up to ``max_iter``
+        iterations instead of being replaced.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+            The input samples.
+            Also an ``np.memmap``, read by chunks of rows, or an iterator
+            of row chunks, arrays or ``(X, y[, sample_weight])`` tuples,
+            for training sets that do not fit in memory.
+            CSR and CSC matrices are binned without being densified.
+
+        y : array-like, shape (n_samples,)
+            Target values.
+
+        sample_weight : array-like, shape (n_samples,) or None
+            Sample weights.
+
+        eval_set : tuple or None, optional (default=None)
+            ``(X_val, y_val)`` or ``(X_val, y_val, sample_weight_val)``,
+            scored after every iteration into ``validation_score_`` and
+            watched by ``n_iter_no_change`` instead of a
+            ``validation_fraction`` of ``X``.
+
+        Returns
+        -------
+        self : object
+        """
+        return self._fit(X, y, sample_weight, eval_set=eval_set)
+
+    def partial_fit(self, X, y, sample_weight=None, n_iter=None,
+                    eval_set=None):
+        """Add boosting iterations to the model fitted so far.
+
+        The new trees fit the residuals of the current model on ``X``,
+        the first call fits a new model. The bin thresholds, the baseline
+        and the classes stay those of the first fit. When ``X`` is the
+        training set of the previous call its bins and raw predictions
+        come from the estimator's cache, only the new iterations are paid
+        for; on other data the current trees predict it first.
+
+        Parameters
+        ----------
+        X, y, sample_weight, eval_set :
+            As in ``fit``.
+
+        n_iter : int or None, optional (default=None)
+            Number of iterations to add, ``max_iter`` when None; fewer
+            when ``n_iter_no_change`` stops the fit.
+
+        Returns
+        -------
+        self : object
+        """
+        if n_iter is None:
+            n_iter = self.max_iter
+        if n_iter < 1:
+            raise ValueError("n_iter=%r must not be smaller than 1."
+                             % n_iter)
+        return self._fit(X, y, sample_weight, n_iter=n_iter,
+                         eval_set=eval_set)
+
+    def _fit(self, X, y, sample_weight=None, communicator=None, n_iter=None,
+             eval_set=None, fold=None):
+        """``fit``, on one row shard of the training set when a
+        ``Communicator`` is given: the bins, the baseline, the histograms
+        and the training scores are then computed over all the shards.
+
+        ``n_iter`` iterations are added to the fitted model when given,
+        as ``partial_fit`` does. Each shard holds its own part of the
+        validation set, the validation loss is computed over all of them.
+
+        A new fit on the training fold of a ``FoldCache`` ``fold`` takes
+        its binned matrix, histogram builder and first iteration gradients
+        and root histograms from there.
+        """
+        self._validate_parameters()
+        X, y, sample_weight = check_training_data(X, y, sample_weight)
+        keep_cache = self.warm_start or n_iter is not None
+        resume = keep_cache and self._is_fitted()
+        n_fitted = len(self._predictors) if resume else 0
+        max_iter = self.max_iter if n_iter is None else n_fitted + n_iter
+        if max_iter < n_fitted:
+            raise ValueError("max_iter=%d must be larger than or equal to "
+                             "n_iter_=%d when warm_start==True"
+                             % (max_iter, n_fitted))
+        if resume and max_iter == n_fitted:
+            return self
+        y = self._encode_y(np.ravel(y), communicator, resume)
+        if X.shape[0] != y.shape[0]:
+            raise ValueError("Number of labels=%d does not match number of "
+                             "samples=%d" % (y.shape[0], X.shape[0]))
+        if sample_weight is not None:
+            sample_weight = np.ascontiguousarray(sample_weight,
+                                                 dtype=np.float64)
+        y, sample_weight, validation, train = self._validation_set(
+            X, y, sample_weight, eval_set, communicator, resume)
+        rng = check_random_state(self.random_state)
+        row_rng = None
+        if resume and getattr(self, '_rng_states', None) is not None:
+            # the draws go on where the previous fit stopped, the added
+            # iterations sample what those of one longer fit would
+            rng, row_rng = (_resume_random_state(state)
+                            for state in self._rng_states)
+        key = _training_set_key(X) if keep_cache else None
+        n_samples = y.shape[0]
+        binned = None
+
+        if resume:
+            if X.shape[1] != self.n_features_:
+                raise ValueError("X has %d features but this estimator was "
+                                 "trained with %d features."
+                                 % (X.shape[1], self.n_features_))
+            X_binned, raw_predictions = self._resume_state(X, key, train)
+            if validation is not None:
+                validation_raw_predictions = self._raw_predict(validation[0])
+        else:
+            self.n_features_ = X.shape[1]
+            self.backend_ = resolve_backend(self.backend, sp.issparse(X))
+            self.bin_mapper_ = BinMapper(
+                self.max_bins,
+                order=get_histogram_builder(self.backend_).preferred_order,
+                cache=True, random_state=self.random_state,
+                categorical_features=self.categorical_features)
+            if (fold is not None and communicator is None and train is None
+                    and fold.holds(X)):
+                binned = fold.binned(self.bin_mapper_, self.backend_)
+                X_binned = binned.X_binned
+            elif communicator is None:
+                X_binned = self.bin_mapper_.fit_transform(X)
+            else:
+                X_binned = fit_bin_mapper(communicator, X,
+                                          self.bin_mapper_).transform(X)
+            if train is not None:
+                X_binned = take_rows(X_binned, train)
+
+            self.loss_ = self._get_loss()
+            self._baseline_prediction = self._get_baseline_prediction(
+                y, sample_weight, communicator)
+            raw_predictions = np.zeros((self.n_trees_per_iteration_,
+                                        n_samples))
+            raw_predictions += self._baseline_prediction
+            if validation is not None:
+                validation_raw_predictions = np.zeros(
+                    (self.n_trees_per_iteration_, validation[0].shape[0]))
+                validation_raw_predictions += self._baseline_prediction
+            self._predictors = []
+            self.train_score_ = []
+            self.validation_score_ = []
+            self._split_gains = np.zeros(self.n_features_)
+            self._split_counts = np.zeros(self.n_features_, dtype=np.intp)
+        del X
+        # dropped during the fit, an error leaves a consistent model
+        self._train_cache = None
+        gradients, hessians = self.loss_.init_gradients_and_hessians(
+            n_samples, self.n_trees_per_iteration_)
+
+        criterion = GradientCriterion(self.l2_regularization)
+        first = None
+        if binned is not None:
+            builder = binned.builder
+            first = binned.first_iteration(type(self.loss_).__name__,
+                                           self.n_trees_per_iteration_)
+        else:
+            builder = get_histogram_builder(self.backend_)(
+                X_binned, self.bin_mapper_.n_bins_)
+        if communicator is not None:
+            builder = AllreduceHistogramBuilder(builder, communicator)
+        if sample_weight is None:
+            sample_indices = np.arange(n_samples, dtype=np.uint32)
+        else:
+            sample_indices = np.flatnonzero(sample_weight > 0)
+        if self.subsample < 1 or self.goss_top_rate is not None:
+            if row_rng is None:
+                # the rows of the shards of a distributed fit are drawn
+                # apart from the features, which have to be the same
+                # everywhere
+                row_rng = np.random.RandomState(rng.randint(MAX_INT))
+            # a fit on its own samples shares no first iteration
+            first = None
+
+        self._ensemble = None
+        self.train_score_ = list(self.train_score_)
+        if validation is None:
+            self.validation_score_ = []
+        self.validation_score_ = list(self.validation_score_)
+        for iteration in range(n_fitted, max_iter):
+            # the first iteration of a fit sharing a fold starts from the
+            # statistics of the fits before it
+            shared = first if iteration == 0 else None
+            if shared is None or not shared.complete:
+                self.loss_.update_gradients_and_hessians(
+                    gradients, hessians, y, raw_predictions)
+            rows, weights = sample_indices, sample_weight
+            if self.goss_top_rate is not None:
+                rows, weights = goss_rows(
+                    sample_indices, gradients, hessians, sample_weight,
+                    self.goss_top_rate, self.goss_other_rate, row_rng)
+            elif self.subsample < 1:
+                rows = uniform_rows(sample_indices, self.subsample, row_rng)
+            left_out = None
+            if rows is not sample_indices:
+                in_rows = np.zeros(n_samples, dtype=bool)
+                in_rows[rows] = True
+                left_out = sample_indices[~in_rows[sample_indices]]
+            predictors = []
+            for k in range(self.n_trees_per_iteration_):
+                features, max_features = tree_features(
+                    self.n_features_, self.colsample_bytree,
+                    self.colsample_bynode, rng)
+                root_histogram = None
+                if shared is None:
+                    builder.set_stats(criterion.sample_stats(
+                        gradients[k], hessians[k], weights))
+                else:
+                    root_histogram = shared.tree_inputs(
+                        k, builder, sample_indices,
+                        lambda: criterion.sample_stats(
+                            gradients[k], hessians[k], sample_weight))
+                grower = TreeGrower(
+                    X_binned, self.bin_mapper_.bin_thresholds_, builder,
+                    criterion, max_depth=self.max_depth,
+                    min_samples_leaf=self.min_samples_leaf,
+                    min_weight_leaf=MIN_HESSIAN_TO_SPLIT,
+                    max_features=max_features,
+                    max_leaf_nodes=self.max_leaf_nodes, random_state=rng,
+                    categories=self.bin_mapper_.categories_,
+                    features=features)
+                root = grower.grow(rows, root_histogram)
+                self._split_gains += grower.split_gains
+                self._split_counts += grower.split_counts
+                # shrink the leaves and update the training raw predictions
+                # from the leaf memberships found while growing, with the
+                # float32 values the tree stores
+                for leaf in grower.leaves:
+                    leaf.value = (leaf.value * self.learning_rate).astype(
+                        VALUE_DTYPE).astype(np.float64)
+                    raw_predictions[k, leaf.sample_indices] += leaf.value[0]
+                    leaf.sample_indices = None
+                if left_out is not None:
+                    for leaf, indices in grower.partition(root, left_out):
+                        raw_predictions[k, indices] += leaf.value[0]
+                predictors.append(Tree.from_root(root))
+            self._predictors.append(predictors)
+            # an ensemble a scorer built from the previous trees is stale
+            self._ensemble = None
+            self.train_score_.append(-self._train_loss(
+                y, raw_predictions, sample_weight, communicator))
+            if validation is not None:
+                # only the new trees predict the validation set
+                for k, tree in enumerate(predictors):
+                    validation_raw_predictions[k] += tree.predict(
+                        validation[0])[:, 0]
+                self.validation_score_.append(self._validation_score(
+                    validation, validation_raw_predictions, communicator))
+            if self._should_stop(self.validation_score_ if validation
+                                 is not None else self.train_score_):
+                break
+        self._ensemble = None
+        self._rng_states = (rng.get_state(), None if row_rng is None
+                            else row_rng.get_state())
+        self.n_iter_ = len(self._predictors)
+        self.train_score_ = np.asarray(self.train_score_)
+        self.validation_score_ = np.asarray(self.validation_score_)
+        if keep_cache:
+            # what the next warm start on the same data resumes from
+            self._train_cache = (key, X_binned, raw_predictions)
+        return self
+
+    def _is_fitted(self):
+        return bool(getattr(self, '_predictors', None))
+
+    def _validation_set(self, X, y, sample_weight, eval_set, communicator,
+                        resume):
+        """``y, sample_weight`` left for training, the validation set
+        ``(X_val, y_val, sample_weight_val)`` and the training rows of
+        ``X``.
+
+        The validation set is ``eval_set``, or a ``validation_fraction``
+        held out of ``X`` (stratified for classifiers) when
+        ``n_iter_no_change`` stops on it, or None. Only the held out rows
+        are read, the training rows are taken from the binned ``X``; the
+        training rows are None when all of ``X`` is used.
+        """
+        if (communicator is not None and self.scoring not in (None, 'loss')
+                and (eval_set is not None
+                     or self.n_iter_no_change is not None)):
+            raise ValueError("distributed fits can only score the "
+                             "validation set with scoring='loss', got %r"
+                             % self.scoring)
+        if eval_set is not None:
+            if len(eval_set) not in (2, 3):
+                raise ValueError("eval_set should be (X_val, y_val) or "
+                                 "(X_val, y_val, sample_weight_val)")
+            X_val = check_array(eval_set[0], accept_sparse='csr',
+                                dtype=np.float64)
+            if X_val.shape[1] != X.shape[1]:
+                raise ValueError("eval_set has %d features, X has %d."
+                                 % (X_val.shape[1], X.shape[1]))
+            y_val = self._encode_y(np.ravel(eval_set[1]), communicator,
+                                   fitted=True)
+            if X_val.shape[0] != y_val.shape[0]:
+                raise ValueError("eval_set has %d samples but %d labels."
+                                 % (X_val.shape[0], y_val.shape[0]))
+            sample_weight_val = None
+            if len(eval_set) == 3 and eval_set[2] is not None:
+                sample_weight_val = np.ascontiguousarray(eval_set[2],
+                                                         dtype=np.float64)
+            return y, sample_weight, (X_val, y_val, sample_weight_val), None
+        if self.n_iter_no_change is None or self.validation_fraction is None:
+            return y, sample_weight, None, None
+
+        # the same split when a warm start resumes, its training part is
+        # what the cache holds
+        if not resume:
+            self._validation_seed = check_random_state(
+                self.random_state).randint(MAX_INT)
+        train, validation = train_test_split(
+            np.arange(y.shape[0]), test_size=self.validation_fraction,
+            stratify=y if is_classifier(self) else None,
+            random_state=self._validation_seed)
+        # in row order, memory mapped X is read forwards
+        train.sort()
+        validation.sort()
+        X_val = (X[validation] if sp.issparse(X)
+                 else read_rows(X, validation))
+        if sample_weight is None:
+            weights = None, None
+        else:
+            weights = sample_weight[train], sample_weight[validation]
+        return (y[train], weights[0], (X_val, y[validation], weights[1]),
+                train)
+
+    def _validation_score(self, validation, raw_predictions, communicator):
+        X_val, y_val, sample_weight_val = validation
+        if self.scoring in (None, 'loss'):
+            return -self._train_loss(y_val, raw_predictions,
+                                     sample_weight_val, communicator)
+        scorer = check_scoring(self, self.scoring)
+        if is_classifier(self):
+            y_val = self.classes_.take(y_val.astype(np.intp))
+        kwargs = {}
+        if sample_weight_val is not None:
+            kwargs['sample_weight'] = sample_weight_val
+        # the scorer's predictions of X_val come from the running raw
+        # predictions rather than from the ensemble, see _raw_predict
+        self._scored_raw_predictions = (X_val, raw_predictions)
+        try:
+            return scorer(self, X_val, y_val, **kwargs)
+        finally:
+            del self._scored_raw_predictions
+
+    def _should_stop(self, scores):
+        """Whether none of the last ``n_iter_no_change`` scores improved on
+        the one before them by more than ``tol``."""
+        if self.n_iter_no_change is None:
+            return False
+        reference = len(scores) - self.n_iter_no_change - 1
+        if reference < 0:
+            return False
+        return not any(score > scores[reference] + self.tol
+                       for score in scores[reference + 1:])
+
+    def _resume_state(self, X, key, train=None):
+        """Binned ``X`` and the raw predictions of the current model on
+        it, restricted to the ``train`` rows when given, cached by the
+        previous fit when it was on the same data."""
+        cache = getattr(self, '_train_cache', None)
+        if cache is not None and cache[0] == key:
+            return cache[1], cache[2]
+        X_binned = self.bin_mapper_.transform(X)
+        ensemble = self._tree_ensemble()
+        raw_predictions = np.empty((self.n_trees_per_iteration_,
+                                    X.shape[0]))
+        if sp.issparse(X):
+            raw_predictions[:] = ensemble.predict(X.tocsr()).T
+        else:
+            for rows in row_chunks(X.shape[0]):
+                raw_predictions[:, rows] = ensemble.predict(
+                    read_rows(X, rows)).T
+        raw_predictions += self._baseline_prediction
+        if train is not None:
+            X_binned = take_rows(X_binned, train)
+            raw_predictions = raw_predictions[:, train]
+        return X_binned, raw_predictions
+
+    def _get_baseline_prediction(self, y, sample_weight, communicator):
+        if communicator is None:
+            return self.loss_.get_baseline_prediction(
+                y, sample_weight, self.n_trees_per_iteration_)
+        # the baselines only depend on the weighted mean of y, or on the
+        # weighted class counts: a baseline of those sums is the baseline
+        # of all the shards
+        if is_classifier(self):
+            n_classes = len(self.classes_)
+            counts = communicator.allreduce(np.bincount(
+                y.astype(np.intp), weights=sample_weight,
+                minlength=n_classes).astype(np.float64))
+            return self.loss_.get_baseline_prediction(
+                np.arange(n_classes, dtype=np.float64), counts,
+                self.n_trees_per_iteration_)
+        weights = np.ones_like(y) if sample_weight is None else sample_weight
+        sums = communicator.allreduce(np.array([np.dot(weights, y),
+                                                weights.sum()]))
+        return self.loss_.get_baseline_prediction(
+            np.array([sums[0] / sums[1]]), None, self.n_trees_per_iteration_)
+
+    def _train_loss(self, y, raw_predictions, sample_weight, communicator):
+        if communicator is None:
+            return self.loss_(y, raw_predictions, sample_weight)
+        losses = self.loss_.pointwise_loss(y, raw_predictions)
+        weights = np.ones_like(y) if sample_weight is None else sample_weight
+        sums = communicator.allreduce(np.array([np.dot(weights, losses),
+                                                weights.sum()]))
+        return sums[0] / sums[1]
+
+    def _validate_X_predict(self, X):
+        check_is_fitted(self, '_predictors')
+        X = check_array(X, accept_sparse='csr', dtype=np.float64)
+        if X.shape[1] != self.n_features_:
+            raise ValueError("X has %d features but this estimator was "
+                             "trained with %d features."
+                             % (X.shape[1], self.n_features_))
+        return X
+
+    def _raw_predict(self, X):
+        scored = getattr(self, '_scored_raw_predictions', None)
+        if scored is not None and X is scored[0]:
+            return scored[1].copy()
+        X = self._validate_X_predict(X)
+        raw_predictions = self._tree_ensemble().predict(
+            X, backend=self.backend_).T
+        raw_predictions += self._baseline_prediction
+        return raw_predictions
+
+    def _staged_raw_predict(self, X):
+        """Raw predictions of ``X`` after every iteration, each tree only
+        adding its own predictions to those of the iterations before.
+
+        Yields
+        ------
+        raw_predictions : array, shape (n_trees_per_iteration_, n_samples)
+            A view updated in place by the next iteration.
+        """
+        X = self._validate_X_predict(X)
+        raw_predictions = np.zeros((self.n_trees_per_iteration_,
+                                    X.shape[0]))
+        raw_predictions += self._baseline_prediction
+        for predictors in self._predictors:
+            for k, tree in enumerate(predictors):
+                raw_predictions[k] += tree.predict(X)[:, 0]
+            yield raw_predictions
+
+    def _shap_values(self, X, background, n_jobs):
+        """SHAP values of the raw predictions, shape (n_samples,
+        n_features + 1, n_trees_per_iteration_)."""
+        X = self._validate_X_predict(X)
+        if background is not None:
+            background = self._validate_X_predict(background)
+        values = shap_values(
+            TreePaths.from_ensemble(self._tree_ensemble()), X,
+            self.n_features_, background, n_jobs=n_jobs,
+            backend=self.backend_)
+        values[:, -1] += self._baseline_prediction.ravel()
+        return values
+
+    @property
+    def feature_importances_(self):
+        """Total gain of the splits on every feature over all the trees,
+        normalized to sum to 1.
+
+        Returns
+        -------
+        feature_importances_ : array, shape (n_features,)
+        """
+        check_is_fitted(self, '_predictors')
+        total = self._split_gains.sum()
+        if total > 0:
+            return self._split_gains / total
+        return self._split_gains.copy()
+
+    @property
+    def feature_split_counts_(self):
+        """Number of splits on every feature in all the trees, shape
+        (n_features,)."""
+        check_is_fitted(self, '_predictors')
+        return self._split_counts.copy()
+
+    def _tree_ensemble(self):
+        """All the trees as one ``TreeEnsemble``, built on first use."""
+        if getattr(self, '_ensemble', None) is None:
+            trees = [tree for predictors in self._predictors
+                     for tree in predictors]
+            offsets = [k for predictors in self._predictors
+                       for k in range(len(predictors))]
+            self._ensemble = TreeEnsemble(trees, offsets,
+                                          self.n_trees_per_iteration_)
+        return self._ensemble
+
+    def memory_usage(self):
+        """Bytes held by the fitted model.
+
+        Returns
+        -------
+        usage : dict
+            ``'nodes'``: the node arrays of the trees, ``'binning'``: the
+            bin thresholds, ``'cache'``: the binned training set and raw
+            predictions kept with ``warm_start``, ``'device'``: the node
+            arrays uploaded for GPU prediction, ``'total'``: the host
+            bytes, and ``'n_nodes'``.
+        """
+        check_is_fitted(self, '_predictors')
+        usage = _memory_usage(
+            [tree for predictors in self._predictors for tree in predictors],
+            getattr(self, '_ensemble', None), self.bin_mapper_.bin_thresholds_)
+        cache = getattr(self, '_train_cache', None)
+        usage['cache'] = 0
+        if cache is not None:
+            usage['cache'] = cache[1].nbytes + cache[2].nbytes
+        usage['total'] += usage['cache']
+        return usage
+
+    def __getstate__(self):
+        # the concatenated arrays are rebuilt after unpickling
+        state = super().__getstate__()
+        state.pop('_ensemble', None)
+        # the binned training set is not part of the model
+        state.pop('_train_cache', None)
+        return state
+
+    @abstractmethod
+    def _get_loss(self):
+        pass
+
+    @abstractmethod
+    def _encode_y(self, y, communicator=None, fitted=False):
+        pass
+
+
+class HistGradientBoostingRegressor(RegressorMixin, BaseHistGradientBoosting):
+    """Histogram based gradient boosting regression tree.
+
+    Parameters
+    ----------
+    loss : {'least_squares'}, optional (default='least_squares')
+        The loss function to use in the boosting process.
+
+    learning_rate : float, optional (default=0.1)
+        The multiplicative factor of the leaf values.
+
+    max_iter : int, optional (default=100)
+        The number of boosting iterations.
+
+    max_leaf_nodes : int or None, optional (default=31)
+        The maximum number of leaves of each tree.
+
+    max_depth : int or None, optional (default=None)
+        The maximum depth of each tree.
+
+    min_samples_leaf : int, optional (default=20)
+        The minimum number of samples per leaf.
+
+    l2_regularization : float, optional (default=0)
+        The L2 regularization of the leaf values.
+
+    max_bins : int, optional (default=256)
+        Maximum number of histogram bins per feature, up to 65536.
+
+    random_state : int, RandomState instance or None, optional
+        Controls the binning subsample and the row and feature sampling.
+
+    backend : string, optional (default="auto")
+        "cpu", "cuda", or "auto" to use the GPU when one is available.
+        "cuda" falls back to "cpu" with a warning when no device is
+        usable.
+
+    warm_start : bool, optional (default=False)
+        When set, ``fit`` adds iterations to the fitted model up to
+        ``max_iter`` rather than starting over. The binned training set
+        and its raw predictions are kept between the calls (but not
+        pickled), so on the same data the added iterations are all the
+        work done. See also ``partial_fit``.
+
+    scoring : str, callable or None, optional (default='loss')
+        Score of the validation set: 'loss' (or None) for the negative
+        loss, else a scikit-learn scorer or its name, which sees the
+        predictions of the running raw scores.
+
+    validation_fraction : float, int or None, optional (default=0.1)
+        Proportion (or number) of the training samples held out as the
+        validation set of ``n_iter_no_change`` when ``fit`` is given no
+        ``eval_set``; None watches the training loss instead.
+
+    n_iter_no_change : int or None, optional (default=None)
+        Stop when the validation score has not improved by more than
+        ``tol`` for that many iterations; None never stops early.
+
+    tol : float, optional (default=1e-7)
+        Improvement of the score ``n_iter_no_change`` waits for.
+
+    categorical_features : array-like of int or bool, or None, optional \
+            (default=None)
+        Indices or boolean mask of the categorical features, which hold
+        integer codes in [0, 65535], at most ``max_bins`` different ones
+        per feature. Their splits send a subset of the categories left,
+        ordered by gradient over hessian, without one-hot encoding; codes
+        unseen during the fit, or of fewer than 10 samples in the node, go
+        right. Missing codes are not supported: like every feature they
+        must not be NaN, in fit and predict.
+
+    subsample : float, optional (default=1.)
+        Fraction of the rows, drawn at every iteration, the trees of the
+        iteration are grown on.
+
+    goss_top_rate : float or None, optional (default=None)
+        Gradient-based one side sampling instead: the trees of an
+        iteration are grown on this fraction of the rows of largest
+        gradients and a random ``goss_other_rate`` of the others, whose
+        weights are scaled up accordingly. None for no GOSS.
+
+    goss_other_rate : float, optional (default=0.1)
+        Fraction of the rows drawn among those of small gradients by GOSS.
+
+    colsample_bytree : float, optional (default=1.)
+        Fraction of the features, drawn for every tree, a tree may split
+        on.
+
+    colsample_bynode : float, optional (default=1.)
+        Fraction of the features of the tree, drawn at every node, the
+        split of the node is searched on.
+
+    Attributes
+    ----------
+    n_iter_ : int
+        The number of boosting iterations, fewer than ``max_iter`` when
+        stopped early.
+
+    n_trees_per_iteration_ : int
+        Always 1 for regressors.
+
+    train_score_ : ndarray, shape (n_iter_,)
+        The negative loss on the training data after each iteration.
+
+    validation_score_ : ndarray, shape (n_iter_,)
+        The score of the validation set after each iteration, empty
+        without one.
+
+    feature_importances_ : ndarray, shape (n_features,)
+        The normalized total gain of the splits on every feature, summed
+        during the fit.
+
+    feature_split_counts_ : ndarray, shape (n_features,)
+        The number of splits on every feature.
+    """
+
+    _VALID_LOSSES = ('least_squares',)
+
+    def __init__(self, loss='least_squares', learning_rate=0.1, max_iter=100,
+                 max_leaf_nodes=31, max_depth=None, min_samples_leaf=20,
+                 l2_regularization=0., max_bins=MAX_BINS, random_state=None,
+                 backend="auto", warm_start=False, scoring='loss',
+                 validation_fraction=0.1, n_iter_no_change=None, tol=1e-7,
+                 categorical_features=None, subsample=1.,
+                 goss_top_rate=None, goss_other_rate=0.1,
+                 colsample_bytree=1., colsample_bynode=1.):
+        super(HistGradientBoostingRegressor, self).__init__(
+            loss=loss, learning_rate=learning_rate, max_iter=max_iter,
+            max_leaf_nodes=max_leaf_nodes, max_depth=max_depth,
+            min_samples_leaf=min_samples_leaf,
+            l2_regularization=l2_regularization, max_bins=max_bins,
+            random_state=random_state, backend=backend,
+            warm_start=warm_start, scoring=scoring,
+            validation_fraction=validation_fraction,
+            n_iter_no_change=n_iter_no_change, tol=tol,
+            categorical_features=categorical_features,
+            subsample=subsample, goss_top_rate=goss_top_rate,
+            goss_other_rate=goss_other_rate,
+            colsample_bytree=colsample_bytree,
+            colsample_bynode=colsample_bynode)
+
+    def _encode_y(self, y, communicator=None, fitted=False):
+        self.n_trees_per_iteration_ = 1
+        return np.asarray(y, dtype=np.float64)
+
+    def _get_loss(self):
+        return _LOSSES[self.loss]()
+
+    def predict(self, X):
+        """Predict values for X."""
+        return self._raw_predict(X)[0]
+
+    def staged_predict(self, X):
+        """Predictions of X after every iteration, computed with one tree
+        per iteration rather than the whole ensemble each time.
+
+        Yields
+        ------
+        y : array, shape (n_samples,)
+        """
+        for raw_predictions in self._staged_raw_predict(X):
+            yield raw_predictions[0].copy()
+
+    def shap_values(self, X, background=None, n_jobs=None):
+        """SHAP values of the predictions of X.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+
+        background : array-like, shape (n_background, n_features) or None
+            Interventional SHAP values over these rows; None for the tree
+            path dependent values over the hessians of the nodes.
+
+        n_jobs : int or None, optional (default=None)
+            Threads over chunks of rows, all the cores with -1.
+
+        Returns
+        -------
+        values : array, shape (n_samples, n_features + 1)
+            Contribution of every feature, then the expected value: a row
+            sums to the prediction.
+        """
+        return self._shap_values(X, background, n_jobs)[:, :, 0]
+
+
+class HistGradientBoostingClassifier(ClassifierMixin,
+                                     BaseHistGradientBoosting):
+    """Histogram based gradient boosting classification tree.
+
+    Parameters
+    ----------
+    loss : {'auto', 'binary_crossentropy', 'categorical_crossentropy'}, \
+            optional (default='auto')
+        The loss function, 'auto' picks the binary or categorical cross
+        entropy from the number of classes.
+
+    learning_rate : float, optional (default=0.1)
+        The multiplicative factor of the leaf values.
+
+    max_iter : int, optional (default=100)
+        The number of boosting iterations; multiclass problems build one
+        tree per class and iteration.
+
+    max_leaf_nodes : int or None, optional (default=31)
+        The maximum number of leaves of each tree.
+
+    max_depth : int or None, optional (default=None)
+        The maximum depth of each tree.
+
+    min_samples_leaf : int, optional (default=20)
+        The minimum number of samples per leaf.
+
+    l2_regularization : float, optional (default=0)
+        The L2 regularization of the leaf values.
+
+    max_bins : int, optional (default=256)
+        Maximum number of histogram bins per feature, up to 65536.
+
+    random_state : int, RandomState instance or None, optional
+        Controls the binning subsample and the row and feature sampling.
+
+    backend : string, optional (default="auto")
+        "cpu", "cuda", or "auto" to use the GPU when one is available.
+        "cuda" falls back to "cpu" with a warning when no device is
+        usable.
+
+    warm_start : bool, optional (default=False)
+        When set, ``fit`` adds iterations to the fitted model up to
+        ``max_iter`` rather than starting over. The binned training set
+        and its raw predictions are kept between the calls (but not
+        pickled), so on the same data the added iterations are all the
+        work done. See also ``partial_fit``.
+
+    scoring : str, callable or None, optional (default='loss')
+        Score of the validation set: 'loss' (or None) for the negative
+        loss, else a scikit-learn scorer or its name, which sees the
+        predictions of the running raw scores.
+
+    validation_fraction : float, int or None, optional (default=0.1)
+        Proportion (or number) of the training samples held out as the
+        validation set of ``n_iter_no_change`` when ``fit`` is given no
+        ``eval_set``; None watches the training loss instead.
+
+    n_iter_no_change : int or None, optional (default=None)
+        Stop when the validation score has not improved by more than
+        ``tol`` for that many iterations; None never stops early.
+
+    tol : float, optional (default=1e-7)
+        Improvement of the score ``n_iter_no_change`` waits for.
+
+    categorical_features : array-like of int or bool, or None, optional \
+            (default=None)
+        Indices or boolean mask of the categorical features, which hold
+        integer codes in [0, 65535], at most ``max_bins`` different ones
+        per feature. Their splits send a subset of the categories left,
+        ordered by gradient over hessian, without one-hot encoding; codes
+        unseen during the fit, or of fewer than 10 samples in the node, go
+        right. Missing codes are not supported: like every feature they
+        must not be NaN, in fit and predict.
+
+    subsample : float, optional (default=1.)
+        Fraction of the rows, drawn at every iteration, the trees of the
+        iteration are grown on.
+
+    goss_top_rate : float or None, optional (default=None)
+        Gradient-based one side sampling instead: the trees of an
+        iteration are grown on this fraction of the rows of largest
+        gradients and a random ``goss_other_rate`` of the others, whose
+        weights are scaled up accordingly. None for no GOSS.
+
+    goss_other_rate : float, optional (default=0.1)
+        Fraction of the rows drawn among those of small gradients by GOSS.
+
+    colsample_bytree : float, optional (default=1.)
+        Fraction of the features, drawn for every tree, a tree may split
+        on.
+
+    colsample_bynode : float, optional (default=1.)
+        Fraction of the features of the tree, drawn at every node, the
+        split of the node is searched on.
+
+    Attributes
+    ----------
+    classes_ : array, shape (n_classes,)
+        Class labels.
+
+    n_iter_ : int
+        The number of boosting iterations, fewer than ``max_iter`` when
+        stopped early.
+
+    n_trees_per_iteration_ : int
+        1 for binary problems, ``n_classes`` otherwise.
+
+    train_score_ : ndarray, shape (n_iter_,)
+        The negative loss on the training data after each iteration.
+
+    validation_score_ : ndarray, shape (n_iter_,)
+        The score of the validation set after each iteration, empty
+        without one.
+
+    feature_importances_ : ndarray, shape (n_features,)
+        The normalized total gain of the splits on every feature, summed
+        during the fit.
+
+    feature_split_counts_ : ndarray, shape (n_features,)
+        The number of splits on every feature.
+    """
+
+    _VALID_LOSSES = ('binary_crossentropy', 'categorical_crossentropy',
+                     'auto')
+
+    def __init__(self, loss='auto', learning_rate=0.1, max_iter=100,
+                 max_leaf_nodes=31, max_depth=None, min_samples_leaf=20,
+                 l2_regularization=0., max_bins=MAX_BINS, random_state=None,
+                 backend="auto", warm_start=False, scoring='loss',
+                 validation_fraction=0.1, n_iter_no_change=None, tol=1e-7,
+                 categorical_features=None, subsample=1.,
+                 goss_top_rate=None, goss_other_rate=0.1,
+                 colsample_bytree=1., colsample_bynode=1.):
+        super(HistGradientBoostingClassifier, self).__init__(
+            loss=loss, learning_rate=learning_rate, max_iter=max_iter,
+            max_leaf_nodes=max_leaf_nodes, max_depth=max_depth,
+            min_samples_leaf=min_samples_leaf,
+            l2_regularization=l2_regularization, max_bins=max_bins,
+            random_state=random_state, backend=backend,
+            warm_start=warm_start, scoring=scoring,
+            validation_fraction=validation_fraction,
+            n_iter_no_change=n_iter_no_change, tol=tol,
+            categorical_features=categorical_features,
+            subsample=subsample, goss_top_rate=goss_top_rate,
+            goss_other_rate=goss_other_rate,
+            colsample_bytree=colsample_bytree,
+            colsample_bynode=colsample_bynode)
+
+    def _encode_y(self, y, communicator=None, fitted=False):
+        if fitted:
+            # the classes of the first fit, a batch may miss some of them
+            encoded_y = np.searchsorted(self.classes_, y)
+            unseen = self.classes_.take(encoded_y, mode='clip') != y
+            if np.any(unseen):
+                raise ValueError("y contains classes not seen in the first "
+                                 "fit: %s" % np.unique(y[unseen]))
+            return encoded_y.astype(np.float64)
+        self.classes_, encoded_y = np.unique(y, return_inverse=True)
+        if communicator is not None:
+            # the classes of all the shards, some may miss a few
+            self.classes_ = np.unique(np.concatenate(
+                communicator.allgather_object(self.classes_)))
+            encoded_y = np.searchsorted(self.classes_, y)
+        n_classes = self.classes_.shape[0]
+        # only 1 tree for binary classification
+        self.n_trees_per_iteration_ = 1 if n_classes <= 2 else n_classes
+        return encoded_y.astype(np.float64)
+
+    def _get_loss(self):
+        if self.loss == 'auto':
+            if self.n_trees_per_iteration_ == 1:
+                return _LOSSES['binary_crossentropy']()
+            return _LOSSES['categorical_crossentropy']()
+        if (self.loss == 'binary_crossentropy'
+                and self.n_trees_per_iteration_ > 1):
+            raise ValueError("'binary_crossentropy' is not suitable for a "
+                             "dataset with %d classes"
+                             % self.n_trees_per_iteration_)
+        if (self.loss == 'categorical_crossentropy'
+                and self.n_trees_per_iteration_ == 1):
+            raise ValueError("'categorical_crossentropy' is not suitable for "
+                             "a binary classification problem. Please use "
+                             "'auto' or 'binary_crossentropy' instead.")
+        return _LOSSES[self.loss]()
+
+    def predict_proba(self, X):
+        """Predict class probabilities for X."""
+        return self.loss_.predict_proba(self._raw_predict(X))
+
+    def decision_function(self, X):
+        """Raw values predicted by the model, shape (n_samples,) for binary
+        problems and (n_samples, n_classes) otherwise."""
+        decision = self._raw_predict(X)
+        if decision.shape[0] == 1:
+            return decision.ravel()
+        return decision.T
+
+    def predict(self, X):
+        """Predict classes for X."""
+        encoded_classes = np.argmax(self.predict_proba(X), axis=1)
+        return self.classes_[encoded_classes]
+
+    def staged_decision_function(self, X):
+        """``decision_function`` of X after every iteration, computed with
+        one tree per iteration rather than the whole ensemble each time."""
+        for raw_predictions in self._staged_raw_predict(X):
+            if raw_predictions.shape[0] == 1:
+                yield raw_predictions.ravel().copy()
+            else:
+                yield raw_predictions.T.copy()
+
+    def staged_predict_proba(self, X):
+        """``predict_proba`` of X after every iteration."""
+        for raw_predictions in self._staged_raw_predict(X):
+            yield self.loss_.predict_proba(raw_predictions)
+
+    def staged_predict(self, X):
+        """``predict`` of X after every iteration."""
+        for proba in self.staged_predict_proba(X):
+            yield self.classes_[np.argmax(proba, axis=1)]
+
+    def shap_values(self, X, background=None, n_jobs=None):
+        """SHAP values of the decision function of X.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+
+        background : array-like, shape (n_background, n_features) or None
+            Interventional SHAP values over these rows; None for the tree
+            path dependent values over the hessians of the nodes.
+
+        n_jobs : int or None, optional (default=None)
+            Threads over chunks of rows, all the cores with -1.
+
+        Returns
+        -------
+        values : array, shape (n_samples, n_features + 1) for binary \
+                problems, (n_samples, n_features + 1, n_classes) otherwise
+            Contribution of every feature to the raw predictions, then
+            their expected value: a row sums to ``decision_function``.
+        """
+        values = self._shap_values(X, background, n_jobs)
+        if values.shape[2] == 1:
+            return values[:, :, 0]
+        return values
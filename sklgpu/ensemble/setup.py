@@ -1,8 +1,4 @@
-import os
-
-import numpy
 from numpy.distutils.misc_util import Configuration
-from _build_utils import CUDA
 
 def configuration(parent_package="", top_path=None):
     config = Configuration("ensemble", parent_package, top_path)
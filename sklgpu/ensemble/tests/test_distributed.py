@@ -0,0 +1,144 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from sklgpu.ensemble import (HistGradientBoostingClassifier,
+                             HistGradientBoostingRegressor,
+                             RandomForestRegressor)
+from sklgpu.ensemble.distributed import (Communicator, SocketTransport,
+                                         fit_distributed, run_local)
+
+
+def _data(n_samples=900, seed=2):
+    rng = np.random.RandomState(seed)
+    X = rng.normal(size=(n_samples, 5))
+    y = X[:, 0] - X[:, 1] ** 2 + rng.normal(scale=0.1, size=n_samples)
+    return X, y
+
+
+def _shards(X, y, n_shards=3):
+    bounds = np.linspace(0, X.shape[0], n_shards + 1).astype(int)
+    return [(X[start:end], y[start:end])
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def _assert_same_model(model, single):
+    # the histograms summed over the shards differ from the single process
+    # ones by rounding errors only: the trees are the same, their values
+    # close
+    assert model.n_iter_ == single.n_iter_
+    for predictors, expected in zip(model._predictors, single._predictors):
+        for tree, tree_expected in zip(predictors, expected):
+            np.testing.assert_array_equal(tree.feature,
+                                          tree_expected.feature)
+            np.testing.assert_array_equal(tree.threshold,
+                                          tree_expected.threshold)
+            np.testing.assert_allclose(tree.value, tree_expected.value,
+                                       rtol=1e-6, atol=1e-7)
+
+
+@pytest.mark.parametrize('transport', ['socket', 'shm'])
+@pytest.mark.parametrize('algorithm', ['ring', 'tree'])
+def test_distributed_matches_single_fit(transport, algorithm):
+    X, y = _data()
+    y = np.digitize(y, [-1, 0])
+    estimator = HistGradientBoostingClassifier(max_iter=5, backend='cpu')
+    single = estimator.fit(X, y)
+    model = run_local(estimator, _shards(X, y), transport=transport,
+                      algorithm=algorithm, timeout=120)
+    _assert_same_model(model, single)
+    np.testing.assert_array_equal(model.classes_, single.classes_)
+    np.testing.assert_allclose(model.predict_proba(X),
+                               single.predict_proba(X), rtol=1e-10)
+    np.testing.assert_allclose(model.train_score_, single.train_score_,
+                               rtol=1e-10)
+
+
+def test_distributed_regressor_with_column_sampling():
+    X, y = _data()
+    estimator = HistGradientBoostingRegressor(
+        max_iter=5, colsample_bytree=0.6, colsample_bynode=0.8,
+        random_state=0, backend='cpu')
+    single = estimator.fit(X, y)
+    model = run_local(estimator, _shards(X, y, 2), timeout=120)
+    _assert_same_model(model, single)
+    np.testing.assert_allclose(model.predict(X), single.predict(X),
+                               rtol=1e-10, atol=1e-12)
+
+
+def test_worker_errors_are_raised():
+    X, y = _data(100)
+    shards = [(X[:50], y[:50]), (X[50:, :3], y[50:])]
+    with pytest.raises(RuntimeError, match="different numbers of features"):
+        run_local(HistGradientBoostingRegressor(max_iter=2, backend='cpu'),
+                  shards, timeout=120)
+
+
+def test_invalid_arguments():
+    X, y = _data(100)
+    with pytest.raises(TypeError, match="histogram gradient boosting"):
+        fit_distributed(RandomForestRegressor(), X, y)
+    with pytest.raises(ValueError, match="transport"):
+        run_local(HistGradientBoostingRegressor(), [(X, y)], transport='mpi')
+    with pytest.raises(ValueError, match="at least one shard"):
+        run_local(HistGradientBoostingRegressor(), [])
+
+
+def _run_ranks(tmp_path, world_size, function):
+    """``function(communicator)`` on ``world_size`` threads connected over
+    Unix domain sockets, the results in rank order."""
+    addresses = [os.path.join(str(tmp_path), 'rank%d.sock' % rank)
+                 for rank in range(world_size)]
+    results = [None] * world_size
+    errors = []
+
+    def run(rank):
+        try:
+            with SocketTransport(rank, addresses, timeout=30) as transport:
+                results[rank] = function(Communicator(transport,
+                                                      algorithm))
+        except Exception as e:
+            errors.append(e)
+
+    for algorithm in ('ring', 'tree'):
+        threads = [threading.Thread(target=run, args=(rank,))
+                   for rank in range(world_size)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        yield algorithm, list(results)
+
+
+@pytest.mark.parametrize('world_size', [2, 3, 5])
+def test_allreduce(tmp_path, world_size):
+    arrays = [np.random.RandomState(rank).normal(size=(101, 3))
+              for rank in range(world_size)]
+
+    def allreduce(communicator):
+        return communicator.allreduce(arrays[communicator.rank].copy())
+
+    for algorithm, sums in _run_ranks(tmp_path, world_size, allreduce):
+        # every rank gets the same bits
+        for result in sums[1:]:
+            np.testing.assert_array_equal(result, sums[0])
+        np.testing.assert_allclose(sums[0], np.sum(arrays, axis=0),
+                                   rtol=1e-12)
+
+
+def test_broadcast_and_allgather(tmp_path):
+    def collectives(communicator):
+        array = np.full(4, communicator.rank, dtype=np.float64)
+        communicator.broadcast(array, root=2)
+        gathered = communicator.allgather_object({'rank': communicator.rank})
+        communicator.barrier()
+        return array, gathered
+
+    for _, results in _run_ranks(tmp_path, 4, collectives):
+        for array, gathered in results:
+            np.testing.assert_array_equal(array, 2)
+            assert gathered == [{'rank': rank} for rank in range(4)]
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from sklearn import ensemble as sklearn_ensemble
+
+from sklgpu.ensemble import RandomForestClassifier, RandomForestRegressor
+
+
+def _data(n_samples=400, seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.normal(size=(n_samples, 6))
+    y = X[:, 0] + X[:, 1] ** 2 + rng.normal(scale=.3, size=n_samples)
+    return X, y
+
+
+@pytest.mark.parametrize('splitter', ['hist', 'exact'])
+def test_process_pool_matches_sequential_fit(splitter):
+    # the workers grow the same trees from the shared memory blocks, which
+    # also hold the presorted index of the exact splitter
+    X, y = _data()
+    params = dict(n_estimators=8, max_depth=6, random_state=0,
+                  backend='cpu', splitter=splitter)
+    pooled = RandomForestRegressor(n_jobs=2, **params).fit(X, y)
+    sequential = RandomForestRegressor(n_jobs=1, **params).fit(X, y)
+    np.testing.assert_array_equal(pooled.predict(X), sequential.predict(X))
+
+    y = y > np.median(y)
+    pooled = RandomForestClassifier(n_jobs=2, **params).fit(X, y)
+    sequential = RandomForestClassifier(n_jobs=1, **params).fit(X, y)
+    np.testing.assert_array_equal(pooled.predict_proba(X),
+                                  sequential.predict_proba(X))
+
+
+def test_accuracy_close_to_sklearn():
+    X, y = _data(1000)
+    X_test, y_test = _data(500, seed=1)
+    params = dict(n_estimators=30, random_state=0)
+    est = RandomForestRegressor(backend='cpu', **params).fit(X, y)
+    ref = sklearn_ensemble.RandomForestRegressor(**params).fit(X, y)
+    assert est.score(X_test, y_test) > ref.score(X_test, y_test) - .05
+
+
+def test_exact_forest_matches_sklearn():
+    # without sampling, every tree grown on the index the forest sorted
+    # once is the exact tree of scikit-learn
+    X, y = _data()
+    forest = RandomForestRegressor(n_estimators=3, max_depth=5,
+                                   max_features=None, bootstrap=False,
+                                   splitter='exact', random_state=0)
+    forest.fit(X, y)
+    ref = sklearn_ensemble.RandomForestRegressor(
+        n_estimators=3, max_depth=5, max_features=None, bootstrap=False,
+        random_state=0).fit(X, y)
+    np.testing.assert_allclose(forest.predict(X), ref.predict(X),
+                               rtol=1e-6)
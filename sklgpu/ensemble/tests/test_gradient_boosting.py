@@ -0,0 +1,214 @@
+import pickle
+
+import numpy as np
+import pytest
+from sklearn import ensemble as sklearn_ensemble
+from sklearn.metrics import log_loss, r2_score, roc_auc_score
+
+from sklgpu.ensemble import (HistGradientBoostingClassifier,
+                             HistGradientBoostingRegressor)
+
+
+def _data(n_samples=2000, seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.normal(size=(n_samples, 6))
+    y = X[:, 0] + X[:, 1] ** 2 + rng.normal(scale=.3, size=n_samples)
+    return X, y
+
+
+def test_accuracy_close_to_sklearn():
+    X, y = _data()
+    X_test, y_test = _data(1000, seed=1)
+    params = dict(max_iter=50, random_state=0)
+    est = HistGradientBoostingRegressor(**params).fit(X, y)
+    ref = sklearn_ensemble.HistGradientBoostingRegressor(
+        early_stopping=False, **params).fit(X, y)
+    assert est.score(X_test, y_test) > ref.score(X_test, y_test) - .02
+
+    y, y_test = y > 1, y_test > 1
+    est = HistGradientBoostingClassifier(**params).fit(X, y)
+    ref = sklearn_ensemble.HistGradientBoostingClassifier(
+        early_stopping=False, **params).fit(X, y)
+    assert est.score(X_test, y_test) > ref.score(X_test, y_test) - .02
+    # the training scores are the losses of the fitted raw predictions
+    proba = est.predict_proba(X)[:, 1]
+    loss = -np.mean(np.log(np.where(y, proba, 1 - proba)))
+    np.testing.assert_allclose(-est.train_score_[-1], loss, rtol=1e-5)
+
+
+@pytest.mark.parametrize('n_classes', [2, 3])
+def test_warm_start_matches_one_fit(n_classes):
+    X, y = _data()
+    y = np.digitize(y, np.percentile(y, np.linspace(0, 100, n_classes + 1)
+                                     [1:-1]))
+    ref = HistGradientBoostingClassifier(max_iter=20).fit(X, y)
+    est = HistGradientBoostingClassifier(max_iter=8, warm_start=True)
+    est.fit(X, y)
+    first_trees = [tree.node_count for trees in est._predictors
+                   for tree in trees]
+    # unpickled without the cache, the training set is binned again and
+    # predicted by the current trees
+    unpickled = pickle.loads(pickle.dumps(est))
+    est.set_params(max_iter=20).fit(X, y)
+    unpickled.set_params(max_iter=20).fit(X, y)
+    for model in (est, unpickled):
+        assert model.n_iter_ == 20
+        assert [tree.node_count for trees in model._predictors[:8]
+                for tree in trees] == first_trees
+        np.testing.assert_allclose(model.predict_proba(X),
+                                   ref.predict_proba(X), rtol=1e-12)
+        np.testing.assert_allclose(model.train_score_, ref.train_score_,
+                                   rtol=1e-12)
+
+    # the same max_iter leaves the model alone, a smaller one is an error
+    est.fit(X, y)
+    assert est.n_iter_ == 20
+    with pytest.raises(ValueError, match="max_iter=10 must be larger"):
+        est.set_params(max_iter=10).fit(X, y)
+    # without warm_start, fit starts over
+    est.set_params(warm_start=False).fit(X, y)
+    assert est.n_iter_ == 10
+
+
+def test_partial_fit_on_new_batches():
+    X, y = _data()
+    est = HistGradientBoostingRegressor()
+    est.partial_fit(X[:1000], y[:1000], n_iter=10)
+    thresholds = est.bin_mapper_.bin_thresholds_
+    baseline = est._baseline_prediction
+    est.partial_fit(X[1000:], y[1000:], n_iter=5)
+    assert est.n_iter_ == 15
+    # the bins and the baseline stay those of the first batch
+    assert est.bin_mapper_.bin_thresholds_ is thresholds
+    assert est._baseline_prediction == baseline
+    # the added trees fit the residuals of the current model on the batch
+    ref = HistGradientBoostingRegressor().partial_fit(X[:1000], y[:1000],
+                                                      n_iter=10)
+    assert (np.mean((est.predict(X[1000:]) - y[1000:]) ** 2)
+            < np.mean((ref.predict(X[1000:]) - y[1000:]) ** 2))
+    with pytest.raises(ValueError, match="n_iter=0"):
+        est.partial_fit(X, y, n_iter=0)
+    with pytest.raises(ValueError, match="X has 5 features"):
+        est.partial_fit(X[:, :5], y, n_iter=1)
+
+    y = (y > 1).astype(np.int64)
+    est = HistGradientBoostingClassifier().partial_fit(X, y, n_iter=2)
+    with pytest.raises(ValueError, match="classes not seen"):
+        est.partial_fit(X, y + 1, n_iter=1)
+
+
+def test_float32_thresholds_predict_as_fitted():
+    # epoch seconds: distinct values closer than float32 resolves
+    rng = np.random.RandomState(0)
+    X = 1.7e9 + rng.randint(0, 100000, size=(2000, 1)).astype(np.float64)
+    y = np.sin(X[:, 0] / 997.) + rng.normal(0, .1, 2000)
+    est = HistGradientBoostingRegressor(max_iter=50, random_state=0)
+    est.fit(X, y)
+    loss = np.mean((est.predict(X) - y) ** 2) / 2
+    np.testing.assert_allclose(-est.train_score_[-1], loss, rtol=1e-6)
+
+
+def test_eval_set_scores_every_iteration():
+    X, y = _data()
+    X_val, y_val = _data(500, seed=1)
+    y, y_val = y > 1, y_val > 1
+    weights = np.random.RandomState(0).uniform(.5, 2, 500)
+    est = HistGradientBoostingClassifier(max_iter=15).fit(
+        X, y, eval_set=(X_val, y_val, weights))
+    # the running raw predictions score as the models of fewer trees
+    for n_iter in (1, 7, 15):
+        ref = HistGradientBoostingClassifier(max_iter=n_iter).fit(X, y)
+        loss = log_loss(y_val, ref.predict_proba(X_val),
+                        sample_weight=weights)
+        np.testing.assert_allclose(-est.validation_score_[n_iter - 1],
+                                   loss, rtol=1e-6)
+
+    est = HistGradientBoostingClassifier(max_iter=15, scoring='roc_auc')
+    est.fit(X, y, eval_set=(X_val, y_val))
+    ref = HistGradientBoostingClassifier(max_iter=15).fit(X, y)
+    np.testing.assert_allclose(
+        est.validation_score_[-1],
+        roc_auc_score(y_val, ref.predict_proba(X_val)[:, 1]))
+    with pytest.raises(ValueError, match="eval_set has 5 features"):
+        est.fit(X, y, eval_set=(X_val[:, :5], y_val))
+
+
+def test_early_stopping():
+    # noise: the validation loss stops improving early
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(1000, 5))
+    y = rng.normal(size=1000)
+    est = HistGradientBoostingRegressor(max_iter=100, n_iter_no_change=5,
+                                        random_state=0).fit(X, y)
+    assert est.n_iter_ < 100
+    scores = est.validation_score_
+    assert len(scores) == len(est.train_score_) == est.n_iter_
+    best = scores[-6]
+    assert np.all(scores[-5:] <= best + est.tol)
+    # without n_iter_no_change every iteration runs, unscored
+    est = HistGradientBoostingRegressor(max_iter=20).fit(X, y)
+    assert est.n_iter_ == 20
+    assert est.validation_score_.shape == (0,)
+
+
+def test_scorer_predictions_do_not_truncate_the_model():
+    # a scorer predicting a copy of X_val goes through the ensemble
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(1000, 5))
+    y = X[:, 0] * 100 + rng.normal(size=1000)
+
+    def scorer(est, X, y):
+        return r2_score(y, est.predict(np.array(X, copy=True)))
+
+    params = dict(max_iter=30, n_iter_no_change=100, random_state=0)
+    est = HistGradientBoostingRegressor(scoring=scorer, **params).fit(X, y)
+    ref = HistGradientBoostingRegressor(scoring='loss', **params).fit(X, y)
+    assert est.n_iter_ == ref.n_iter_ == 30
+    np.testing.assert_array_equal(est.predict(X), ref.predict(X))
+
+
+def test_validation_fraction_on_memmap(tmp_path):
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(2000, 5))
+    y = X[:, 0] + rng.normal(size=2000)
+    X_mm = np.memmap(tmp_path / 'X.dat', dtype=np.float64, mode='w+',
+                     shape=X.shape)
+    X_mm[:] = X
+    params = dict(max_iter=20, n_iter_no_change=5, validation_fraction=.1,
+                  random_state=0)
+    est = HistGradientBoostingRegressor(**params).fit(X_mm, y)
+    ref = HistGradientBoostingRegressor(**params).fit(X, y)
+    np.testing.assert_array_equal(est.predict(X), ref.predict(X))
+    np.testing.assert_array_equal(est.validation_score_,
+                                  ref.validation_score_)
+
+    # a warm start resumes on the same held out rows, from its cache or,
+    # unpickled without it, from the binned X
+    est = HistGradientBoostingRegressor(warm_start=True,
+                                        **dict(params, max_iter=10))
+    est.fit(X_mm, y)
+    unpickled = pickle.loads(pickle.dumps(est))
+    est.set_params(max_iter=20).fit(X_mm, y)
+    np.testing.assert_array_equal(est.predict(X), ref.predict(X))
+    unpickled.set_params(max_iter=20).fit(X_mm, y)
+    np.testing.assert_array_equal(unpickled.predict(X), ref.predict(X))
+
+
+@pytest.mark.parametrize('params', [
+    dict(subsample=.5, colsample_bytree=.5, colsample_bynode=.7),
+    dict(goss_top_rate=.2, goss_other_rate=.2, colsample_bynode=.5)])
+def test_sampling_warm_start_matches_one_fit(params):
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(1000, 6))
+    y = X[:, 0] + X[:, 1] ** 2 + rng.normal(size=1000)
+    ref = HistGradientBoostingRegressor(max_iter=20, random_state=0,
+                                        **params).fit(X, y)
+    est = HistGradientBoostingRegressor(max_iter=10, warm_start=True,
+                                        random_state=0, **params)
+    est.fit(X, y).set_params(max_iter=20).fit(X, y)
+    np.testing.assert_array_equal(est.predict(X), ref.predict(X))
+
+    est = HistGradientBoostingRegressor(random_state=0, **params)
+    for _ in range(4):
+        est.partial_fit(X, y, n_iter=5)
+    np.testing.assert_array_equal(est.predict(X), ref.predict(X))
@@ -0,0 +1,70 @@
+import numpy as np
+
+from sklgpu.ensemble._sampling import goss_rows, tree_features, uniform_rows
+
+
+def test_uniform_rows():
+    rng = np.random.RandomState(0)
+    sample_indices = np.arange(0, 200, 2)
+    rows = uniform_rows(sample_indices, .3, rng)
+    assert rows.shape == (30,)
+    assert np.all(np.diff(rows) > 0)
+    assert np.all(np.isin(rows, sample_indices))
+    # all the rows, unchanged
+    assert uniform_rows(sample_indices, 1., rng) is sample_indices
+    assert uniform_rows(sample_indices, 1e-6, rng).shape == (1,)
+
+
+def test_goss_rows_keep_the_largest_gradients():
+    rng = np.random.RandomState(0)
+    n_samples = 1000
+    gradients = rng.normal(size=(1, n_samples))
+    hessians = np.ones((1, n_samples))
+    sample_indices = np.arange(n_samples)
+    rows, weights = goss_rows(sample_indices, gradients, hessians, None,
+                              .1, .2, rng)
+    assert rows.shape == (100 + 200,)
+    assert np.all(np.diff(rows) > 0)
+    top = np.argsort(-np.abs(gradients[0]))[:100]
+    assert np.all(np.isin(top, rows))
+    # the drawn rows stand for all the others
+    others = np.setdiff1d(rows, top)
+    np.testing.assert_allclose(weights[others], 900 / 200)
+    np.testing.assert_array_equal(weights[top], 1)
+    np.testing.assert_allclose(weights[rows].sum(), n_samples)
+
+
+def test_goss_rows_scale_the_sample_weights():
+    rng = np.random.RandomState(0)
+    gradients = rng.normal(size=(2, 100))
+    hessians = rng.uniform(.5, 1, size=(2, 100))
+    sample_weight = rng.uniform(.5, 2, size=100)
+    sample_indices = np.flatnonzero(rng.rand(100) > .2)
+    rows, weights = goss_rows(sample_indices, gradients, hessians,
+                              sample_weight, .2, .3, rng)
+    assert np.all(np.isin(rows, sample_indices))
+    n_rows = len(sample_indices)
+    n_top, n_other = int(.2 * n_rows), int(.3 * n_rows)
+    scaled = np.flatnonzero(weights != sample_weight)
+    assert scaled.shape == (n_other,)
+    assert np.all(np.isin(scaled, rows))
+    np.testing.assert_allclose(weights[scaled] / sample_weight[scaled],
+                               (n_rows - n_top) / n_other)
+    # the input weights are left alone
+    assert weights is not sample_weight
+    # every row kept: nothing drawn
+    kept, kept_weights = goss_rows(sample_indices, gradients, hessians,
+                                   sample_weight, .5, .5, rng)
+    assert kept is sample_indices and kept_weights is sample_weight
+
+
+def test_tree_features():
+    rng = np.random.RandomState(0)
+    assert tree_features(10, 1., 1., rng) == (None, None)
+    features, max_features = tree_features(10, .5, 1., rng)
+    assert features.shape == (5,) and max_features is None
+    assert np.all(np.diff(features) > 0)
+    features, max_features = tree_features(10, .5, .5, rng)
+    assert max_features == 2
+    features, max_features = tree_features(10, 1., .01, rng)
+    assert features is None and max_features == 1
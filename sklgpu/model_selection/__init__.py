@@ -0,0 +1,8 @@
+"""
+The :mod:`sklgpu.model_selection` module includes parameter searches that
+share the binned folds between the candidates of :mod:`sklgpu.ensemble`.
+"""
+
+from ._search import GridSearchCV
+
+__all__ = ["GridSearchCV"]
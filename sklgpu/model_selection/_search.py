@@ -0,0 +1,281 @@
+"""Exhaustive parameter search sharing work between the candidates.
+
+``GridSearchCV`` fits the candidates fold by fold. For histogram gradient
+boosting the candidates of a fold share a
+:class:`sklgpu.ensemble._fold_cache.FoldCache`: the fold is binned, and
+uploaded for the CUDA backend, once per set of binning parameters, and the
+gradients and root histograms of the first iteration are computed once
+per loss. Candidates that only differ in ``max_iter`` are a single fit of
+the largest one, scored after each of their iterations from the staged
+raw predictions of the test fold, at the cost of one tree per iteration.
+
+Other estimators are fitted and scored one candidate at a time; the
+process wide binning cache still bins each fold once.
+"""
+import time
+from collections import defaultdict
+
+import numpy as np
+from scipy.stats import rankdata
+from sklearn.base import (BaseEstimator, MetaEstimatorMixin, clone,
+                          is_classifier)
+from sklearn.metrics import check_scoring
+from sklearn.model_selection import ParameterGrid, check_cv
+from sklearn.utils import check_array
+from sklearn.utils.validation import check_is_fitted
+
+from ..ensemble._fold_cache import FoldCache
+from ..ensemble.gradient_boosting import BaseHistGradientBoosting
+
+__all__ = ["GridSearchCV"]
+
+
+def _staged_groups(estimator, candidates):
+    """Candidates as ``(params, [(index, max_iter), ...])`` groups: the
+    gradient boosting candidates differing only in ``max_iter`` go
+    together, with ``max_iter`` left out of ``params``; every other
+    candidate is a group of its own, with ``max_iter`` None."""
+    groups = []
+    staged = isinstance(estimator, BaseHistGradientBoosting)
+    for index, params in enumerate(candidates):
+        if not staged:
+            groups.append((params, [(index, None)]))
+            continue
+        params = dict(params)
+        max_iter = params.pop('max_iter', estimator.max_iter)
+        for group_params, members in groups:
+            if group_params == params:
+                members.append((index, max_iter))
+                break
+        else:
+            groups.append((params, [(index, max_iter)]))
+    return groups
+
+
+def _index(X, rows):
+    return X[rows] if X is not None else None
+
+
+def _fit_params(sample_weight, rows=slice(None)):
+    """``sample_weight`` of ``rows`` as keyword arguments of ``fit``, none
+    without weights for the estimators that take none."""
+    if sample_weight is None:
+        return {}
+    return {'sample_weight': sample_weight[rows]}
+
+
+class GridSearchCV(MetaEstimatorMixin, BaseEstimator):
+    """Exhaustive search over a parameter grid with cross validation,
+    sharing the binned folds and first iterations of the gradient boosting
+    candidates.
+
+    Parameters
+    ----------
+    estimator : estimator object
+        A :mod:`sklgpu.ensemble` gradient boosting estimator gets the
+        shared folds and the staged ``max_iter`` candidates, any other
+        estimator is fitted once per candidate and fold.
+
+    param_grid : dict or list of dicts
+        As in ``sklearn.model_selection.ParameterGrid``.
+
+    scoring : string, callable or None, optional (default=None)
+        Scorer of the test folds, the ``score`` method of the estimator
+        when None.
+
+    cv : int, cross-validation generator or iterable, optional
+        Folds, as in ``sklearn.model_selection.check_cv``: 5 (stratified
+        for classifiers) when None.
+
+    refit : boolean, optional (default=True)
+        Fit the best candidate on the whole training set.
+
+    Attributes
+    ----------
+    cv_results_ : dict of arrays
+        ``params``, ``param_<name>`` (masked where a candidate does not
+        set it), ``split<i>_test_score``, ``mean_test_score``,
+        ``std_test_score``, ``rank_test_score``, ``mean_fit_time``,
+        ``std_fit_time``, ``mean_score_time`` and ``std_score_time``.
+        Candidates scored from one staged fit all get its fit time.
+
+    best_index_ : int
+
+    best_score_ : float
+
+    best_params_ : dict
+
+    best_estimator_ : estimator
+        With ``refit``.
+
+    refit_time_ : float
+        Seconds of the refit.
+
+    scorer_ : callable
+
+    n_splits_ : int
+
+    n_fits_ : int
+        Estimators fitted on the folds, fewer than candidates times
+        folds when ``max_iter`` candidates share a fit.
+    """
+
+    def __init__(self, estimator, param_grid, scoring=None, cv=None,
+                 refit=True):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.scoring = scoring
+        self.cv = cv
+        self.refit = refit
+
+    def fit(self, X, y, sample_weight=None):
+        """Score every candidate on every fold, then refit the best one.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+
+        y : array-like, shape (n_samples,)
+
+        sample_weight : array-like, shape (n_samples,) or None
+            Weights of the fits, the scores are not weighted.
+
+        Returns
+        -------
+        self : object
+        """
+        X = check_array(X, accept_sparse='csr', dtype=np.float64)
+        y = np.ravel(y)
+        if X.shape[0] != y.shape[0]:
+            raise ValueError("Number of labels=%d does not match number of "
+                             "samples=%d" % (y.shape[0], X.shape[0]))
+        if sample_weight is not None:
+            sample_weight = np.ascontiguousarray(sample_weight,
+                                                 dtype=np.float64)
+        cv = check_cv(self.cv, y, classifier=is_classifier(self.estimator))
+        self.scorer_ = check_scoring(self.estimator, self.scoring)
+        candidates = list(ParameterGrid(self.param_grid))
+        if not candidates:
+            raise ValueError("param_grid has no candidate")
+        groups = _staged_groups(self.estimator, candidates)
+        splits = list(cv.split(X, y))
+        self.n_splits_ = len(splits)
+
+        scores = np.empty((len(candidates), len(splits)))
+        fit_times = np.empty_like(scores)
+        score_times = np.empty_like(scores)
+        self.n_fits_ = 0
+        for split, (train, test) in enumerate(splits):
+            X_train, X_test = X[train], X[test]
+            y_train, y_test = y[train], y[test]
+            fold = FoldCache(X_train)
+            for params, members in groups:
+                estimator = clone(self.estimator).set_params(**params)
+                staged = members[0][1] is not None
+                if staged:
+                    estimator.set_params(
+                        max_iter=max(max_iter for _, max_iter in members))
+                start = time.perf_counter()
+                if staged:
+                    estimator._fit(X_train, y_train,
+                                   _index(sample_weight, train), fold=fold)
+                else:
+                    estimator.fit(X_train, y_train,
+                                  **_fit_params(sample_weight, train))
+                fit_time = time.perf_counter() - start
+                self.n_fits_ += 1
+                start = time.perf_counter()
+                if staged:
+                    group_scores = self._staged_scores(
+                        estimator, X_test, y_test,
+                        [max_iter for _, max_iter in members])
+                else:
+                    group_scores = [self.scorer_(estimator, X_test, y_test)]
+                score_time = (time.perf_counter() - start) / len(members)
+                for (index, _), score in zip(members, group_scores):
+                    scores[index, split] = score
+                    fit_times[index, split] = fit_time
+                    score_times[index, split] = score_time
+
+        self.cv_results_ = self._format_results(candidates, scores, fit_times,
+                                                score_times)
+        self.best_index_ = int(np.argmin(self.cv_results_['rank_test_score']))
+        self.best_score_ = self.cv_results_['mean_test_score'][
+            self.best_index_]
+        self.best_params_ = candidates[self.best_index_]
+        if self.refit:
+            start = time.perf_counter()
+            self.best_estimator_ = clone(self.estimator).set_params(
+                **self.best_params_)
+            self.best_estimator_.fit(X, y, **_fit_params(sample_weight))
+            self.refit_time_ = time.perf_counter() - start
+        return self
+
+    def _staged_scores(self, estimator, X_test, y_test, max_iters):
+        """Scores of ``estimator`` truncated to each of ``max_iters``
+        iterations, or to all of them when it stopped early."""
+        wanted = defaultdict(list)
+        for position, max_iter in enumerate(max_iters):
+            wanted[min(max_iter, estimator.n_iter_)].append(position)
+        scores = [None] * len(max_iters)
+        for n_iter, raw_predictions in enumerate(
+                estimator._staged_raw_predict(X_test), 1):
+            if n_iter not in wanted:
+                continue
+            # the scorer's predictions come from the staged raw
+            # predictions, see BaseHistGradientBoosting._raw_predict
+            estimator._scored_raw_predictions = (X_test, raw_predictions)
+            try:
+                score = self.scorer_(estimator, X_test, y_test)
+            finally:
+                del estimator._scored_raw_predictions
+            for position in wanted[n_iter]:
+                scores[position] = score
+        return scores
+
+    @staticmethod
+    def _format_results(candidates, scores, fit_times, score_times):
+        results = {'params': candidates}
+        names = sorted(set(name for params in candidates for name in params))
+        for name in names:
+            column = np.ma.MaskedArray(np.empty(len(candidates), dtype=object),
+                                       mask=True)
+            for index, params in enumerate(candidates):
+                if name in params:
+                    column[index] = params[name]
+            results['param_%s' % name] = column
+        for split in range(scores.shape[1]):
+            results['split%d_test_score' % split] = scores[:, split]
+        results['mean_test_score'] = scores.mean(axis=1)
+        results['std_test_score'] = scores.std(axis=1)
+        results['rank_test_score'] = rankdata(
+            -results['mean_test_score'], method='min').astype(np.int32)
+        results['mean_fit_time'] = fit_times.mean(axis=1)
+        results['std_fit_time'] = fit_times.std(axis=1)
+        results['mean_score_time'] = score_times.mean(axis=1)
+        results['std_score_time'] = score_times.std(axis=1)
+        return results
+
+    def _check_refit(self):
+        check_is_fitted(self, 'best_estimator_')
+        return self.best_estimator_
+
+    def predict(self, X):
+        """``predict`` of the best estimator."""
+        return self._check_refit().predict(X)
+
+    def predict_proba(self, X):
+        """``predict_proba`` of the best estimator."""
+        return self._check_refit().predict_proba(X)
+
+    def decision_function(self, X):
+        """``decision_function`` of the best estimator."""
+        return self._check_refit().decision_function(X)
+
+    def score(self, X, y):
+        """Score of the best estimator with ``scoring``."""
+        return self.scorer_(self._check_refit(), X, y)
+
+    @property
+    def classes_(self):
+        return self._check_refit().classes_
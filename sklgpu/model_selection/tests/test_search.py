@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from sklearn import model_selection as sklearn_model_selection
+from sklearn.metrics import log_loss
+from sklearn.model_selection import KFold, StratifiedKFold
+
+from sklgpu.ensemble import (HistGradientBoostingClassifier,
+                             HistGradientBoostingRegressor,
+                             RandomForestRegressor)
+from sklgpu.model_selection import GridSearchCV
+
+
+def _data(n_samples=600, seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.normal(size=(n_samples, 5))
+    y = X[:, 0] + X[:, 1] ** 2 + rng.normal(scale=.3, size=n_samples)
+    return X, y
+
+
+def _compare(estimator, param_grid, X, y, cv, scoring=None):
+    search = GridSearchCV(estimator, param_grid, scoring=scoring, cv=cv)
+    search.fit(X, y)
+    ref = sklearn_model_selection.GridSearchCV(estimator, param_grid,
+                                               scoring=scoring, cv=cv)
+    ref.fit(X, y)
+    assert search.cv_results_['params'] == ref.cv_results_['params']
+    for key in ['split%d_test_score' % i for i in range(cv.n_splits)] + [
+            'mean_test_score', 'std_test_score', 'rank_test_score']:
+        np.testing.assert_allclose(search.cv_results_[key],
+                                   ref.cv_results_[key], rtol=1e-12)
+    assert search.best_params_ == ref.best_params_
+    assert search.best_score_ == pytest.approx(ref.best_score_, rel=1e-12)
+    np.testing.assert_array_equal(search.predict(X), ref.predict(X))
+    return search
+
+
+def test_boosting_matches_sklearn():
+    X, y = _data()
+    # the max_iter candidates are scored from one fit per fold
+    param_grid = {'max_iter': [5, 10, 20], 'learning_rate': [.1, .3],
+                  'max_leaf_nodes': [7, 15]}
+    search = _compare(HistGradientBoostingRegressor(backend='cpu'),
+                      param_grid, X, y, KFold(3, shuffle=True,
+                                              random_state=0))
+    assert search.n_fits_ == 3 * 4
+
+
+def test_classifier_matches_sklearn():
+    X, y = _data()
+    y = np.digitize(y, [0, 1.5])
+    param_grid = [{'max_iter': [3, 8], 'l2_regularization': [0, 1.]},
+                  {'max_bins': [16], 'max_iter': [8]}]
+    _compare(HistGradientBoostingClassifier(backend='cpu'), param_grid, X, y,
+             StratifiedKFold(3), scoring='neg_log_loss')
+
+
+def test_sample_weight_weights_the_fits_only():
+    X, y = _data()
+    y = np.digitize(y, [0, 1.5])
+    sample_weight = np.random.RandomState(1).uniform(.5, 2, size=y.shape)
+    cv = StratifiedKFold(3)
+    search = GridSearchCV(HistGradientBoostingClassifier(backend='cpu'),
+                          {'max_iter': [3, 8]}, scoring='neg_log_loss',
+                          cv=cv)
+    search.fit(X, y, sample_weight=sample_weight)
+    for index, max_iter in enumerate([3, 8]):
+        for split, (train, test) in enumerate(cv.split(X, y)):
+            est = HistGradientBoostingClassifier(max_iter=max_iter,
+                                                 backend='cpu')
+            est.fit(X[train], y[train], sample_weight[train])
+            expected = -log_loss(y[test], est.predict_proba(X[test]))
+            assert search.cv_results_['split%d_test_score' % split][
+                index] == pytest.approx(expected, rel=1e-12)
+
+
+def test_other_estimators_match_sklearn():
+    X, y = _data(300)
+    search = _compare(
+        RandomForestRegressor(n_estimators=5, random_state=0,
+                              backend='cpu'),
+        {'max_depth': [3, 6]}, X, y, KFold(3))
+    assert search.n_fits_ == 6
+    assert 'param_max_depth' in search.cv_results_
+
+
+def test_early_stopped_candidates_share_their_last_score():
+    X, y = _data()
+    estimator = HistGradientBoostingRegressor(
+        n_iter_no_change=2, tol=1., random_state=0, backend='cpu')
+    search = GridSearchCV(estimator, {'max_iter': [50, 100]}, cv=KFold(3))
+    search.fit(X, y)
+    scores = search.cv_results_['mean_test_score']
+    assert scores[0] == scores[1]
+    assert search.n_fits_ == 3
+
+
+def test_refit():
+    X, y = _data()
+    search = GridSearchCV(HistGradientBoostingRegressor(backend='cpu'),
+                          {'max_iter': [2, 5]}, cv=KFold(2), refit=False)
+    search.fit(X, y)
+    assert not hasattr(search, 'best_estimator_')
+    with pytest.raises(Exception, match="not fitted"):
+        search.predict(X)
+    with pytest.raises(ValueError, match="no candidate"):
+        GridSearchCV(HistGradientBoostingRegressor(), []).fit(X, y)
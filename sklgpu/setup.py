@@ -6,6 +6,7 @@ def configuration(parent_package='', top_path=None):
 
     config.add_subpackage('tree')
     config.add_subpackage('ensemble')
+    config.add_subpackage('model_selection')
 
     return config
 
@@ -0,0 +1,16 @@
+"""
+The :mod:`sklgpu.tree` module includes histogram based decision tree
+classification and regression models.
+"""
+
+from ._binning import BinMapper
+from ._codegen import compile_model, export_c
+from ._model_file import load_model, save_model
+from ._profiling import device_properties, profile
+from ._serving import Predictor
+from .tree import DecisionTreeClassifier
+from .tree import DecisionTreeRegressor
+
+__all__ = ["BinMapper", "DecisionTreeClassifier", "DecisionTreeRegressor",
+           "Predictor", "compile_model", "device_properties", "export_c",
+           "load_model", "profile", "save_model"]
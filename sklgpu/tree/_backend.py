@@ -0,0 +1,149 @@
+"""Registry of the compute backends.
+
+A backend is a name (the ``backend`` parameter of the estimators) bound to
+a histogram builder class. ``'auto'`` resolves to the available backend
+with the highest priority, so 'cuda' when the extension is built and sees
+a device, 'cpu' otherwise.
+
+``_tree_gpu`` links against the CUDA runtime; nothing imports it at module
+level. ``load_extension`` imports it on first use and remembers the
+outcome, so importing sklgpu or unpickling a fitted model never touches
+CUDA. Setting ``SKLGPU_DISABLE_CUDA=1`` keeps the extension from being
+loaded at all.
+"""
+import os
+import warnings
+from collections import OrderedDict
+
+__all__ = ["load_extension", "cuda_available", "register_backend",
+           "available_backends", "resolve_backend", "get_histogram_builder"]
+
+_extension = None
+_extension_error = None
+_extension_loaded = False
+_n_devices = None
+
+
+def load_extension():
+    """The ``_tree_gpu`` module, None when it is not built or not loadable."""
+    global _extension, _extension_error, _extension_loaded
+    if not _extension_loaded:
+        _extension_loaded = True
+        if os.environ.get('SKLGPU_DISABLE_CUDA', '0') not in ('', '0'):
+            _extension_error = "disabled by SKLGPU_DISABLE_CUDA"
+        else:
+            try:
+                from . import _tree_gpu
+                _extension = _tree_gpu
+            except ImportError as e:
+                # also raised when libcudart is missing
+                _extension_error = str(e)
+    return _extension
+
+
+def require_extension(feature):
+    """``load_extension()`` or a RuntimeError naming the missing ``feature``."""
+    extension = load_extension()
+    if extension is None:
+        raise RuntimeError("sklgpu.tree._tree_gpu could not be loaded (%s), "
+                           "%s is unavailable" % (_extension_error, feature))
+    return extension
+
+
+def cuda_available():
+    """Whether the CUDA extension loads and sees at least one device."""
+    global _n_devices
+    if _n_devices is None:
+        extension = load_extension()
+        _n_devices = 0
+        if extension is not None:
+            try:
+                _n_devices = extension.device_count()
+            except RuntimeError:
+                pass
+    return _n_devices > 0
+
+
+class Backend(object):
+
+    def __init__(self, name, histogram_builder, is_available, priority):
+        self.name = name
+        self.histogram_builder = histogram_builder
+        self.is_available = is_available
+        self.priority = priority
+
+
+_backends = OrderedDict()
+
+
+def register_backend(name, histogram_builder, is_available=None, priority=0):
+    """Make ``name`` a valid ``backend`` parameter.
+
+    Parameters
+    ----------
+    name : str
+
+    histogram_builder : class
+        Built as ``histogram_builder(X_binned, n_bins)``, with a
+        ``preferred_order`` class attribute ('C' or 'F') and the
+        ``set_stats``, ``build`` and ``free`` methods. An
+        ``accepts_sparse`` class attribute set to True declares that it
+        takes a ``SparseBinnedMatrix``.
+
+    is_available : callable or None
+        Returns whether the backend can run here, always when None.
+
+    priority : int
+        'auto' picks the available backend with the highest priority.
+    """
+    if is_available is None:
+        def is_available():
+            return True
+    _backends[name] = Backend(name, histogram_builder, is_available,
+                              priority)
+
+
+def _accepts_sparse(backend):
+    return getattr(backend.histogram_builder, 'accepts_sparse', False)
+
+
+def available_backends(sparse=False):
+    """Names of the backends that can run here, by decreasing priority,
+    only those taking sparse data when ``sparse`` is set."""
+    backends = sorted(_backends.values(), key=lambda b: -b.priority)
+    return [b.name for b in backends
+            if b.is_available() and (not sparse or _accepts_sparse(b))]
+
+
+def resolve_backend(backend, sparse=False):
+    """Turn ``'auto'`` into a registered backend and validate names.
+
+    A known backend that cannot run here (``'cuda'`` without a device), or
+    that does not take the sparse training data, falls back to ``'auto'``
+    with a warning.
+    """
+    if backend == 'auto':
+        available = available_backends(sparse)
+        if not available:
+            raise RuntimeError("no backend is available")
+        return available[0]
+    if backend not in _backends:
+        raise ValueError("backend should be one of 'auto', %s, got %r"
+                         % (", ".join(repr(b) for b in sorted(_backends)),
+                            backend))
+    if not _backends[backend].is_available():
+        fallback = resolve_backend('auto', sparse)
+        warnings.warn("the %r backend is unavailable here, using %r instead"
+                      % (backend, fallback), RuntimeWarning)
+        return fallback
+    if sparse and not _accepts_sparse(_backends[backend]):
+        fallback = resolve_backend('auto', sparse)
+        warnings.warn("the %r backend does not take sparse data, using %r "
+                      "instead" % (backend, fallback), RuntimeWarning)
+        return fallback
+    return backend
+
+
+def get_histogram_builder(backend):
+    """Histogram builder class of a resolved backend."""
+    return _backends[backend].histogram_builder
@@ -0,0 +1,514 @@
+"""Quantile binning of continuous features.
+
+The histogram based builders never look at the raw float values during
+fit: every feature is mapped once to a small integer bin index and all
+split candidates are bin boundaries. The binned matrix is uint8 (uint16
+above 256 bins), 8 times smaller than the float64 input.
+
+Sparse input (CSR or CSC) stays sparse: only the stored values are binned
+and the implicit zeros of a feature all fall in the bin of 0, see
+``SparseBinnedMatrix``.
+
+Binned matrices are cached by dataset fingerprint, so fitting several
+estimators on the same data (parameter searches, repeated experiments)
+bins it only once.
+
+The float input is read one chunk of rows at a time; a memory mapped
+input is never loaded or converted as a whole (see ``_streaming``).
+
+Categorical features hold integer category codes and are not quantile
+binned: every category seen in the whole column (not a subsample, a rare
+category keeps its bin) gets a bin of its own, in the order of the codes.
+The splits on them send a subset of the categories left, see
+``_splitting.find_best_split``.
+"""
+import hashlib
+import numbers
+from collections import OrderedDict
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils import check_random_state
+from sklearn.utils.validation import check_is_fitted
+
+from ._profiling import record
+from ._streaming import (DEFAULT_CHUNK_ROWS, check_large_array, read_column,
+                         read_rows, row_chunks)
+from ._tree import _round_down, _round_up
+
+__all__ = ["BinMapper", "SparseBinnedMatrix", "dataset_fingerprint",
+           "get_bin_cache", "take_bins", "take_rows"]
+
+MAX_BINS = 256
+MAX_BINS_UINT16 = 1 << 16
+# category codes are in [0, MAX_CATEGORY_CODE], the bitsets of the splits
+# on them are at most (MAX_CATEGORY_CODE + 1) / 32 words
+MAX_CATEGORY_CODE = MAX_BINS_UINT16 - 1
+
+DEFAULT_CACHE_BYTES = 1 << 30
+
+
+def _find_thresholds(col, max_bins):
+    """Upper bin edges for one feature column.
+
+    Bin ``b`` holds the values ``thresholds[b - 1] < x <= thresholds[b]``,
+    so a split ``bin <= b`` is the same as ``x <= thresholds[b]``.
+    """
+    distinct = np.unique(col)
+    if len(distinct) <= max_bins:
+        # one bin per distinct value, edges half way between values
+        return _float32_edges((distinct[:-1] + distinct[1:]) * 0.5,
+                              distinct)
+    percentiles = np.linspace(0, 100, num=max_bins + 1)[1:-1]
+    thresholds = np.unique(np.percentile(col, percentiles))
+    # make sure the largest value never ends up alone past the last edge
+    return _float32_edges(thresholds[thresholds < distinct[-1]], distinct)
+
+
+def _float32_edges(thresholds, distinct):
+    """``thresholds`` moved to float32 values splitting the sorted
+    ``distinct`` values of the column the same way.
+
+    The trees store their thresholds as float32 and predict compares the
+    float64 input against them, so an edge has to be a float32 for the
+    bins to route the training samples as predict does. Edges between
+    values no float32 separates (closer than float32 resolves) are dropped
+    and these values share a bin.
+    """
+    if not len(thresholds):
+        return thresholds
+    position = np.searchsorted(distinct, thresholds, side='right')
+    low, high = distinct[position - 1], distinct[position]
+    up = _round_up(low)
+    separable = up < high
+    low, high, up = low[separable], high[separable], up[separable]
+    with np.errstate(over='ignore'):
+        middle = low + (high - low) / 2.
+    # overflow or no double between them
+    middle = np.where((low <= middle) & (middle < high), middle, low)
+    down = _round_down(middle)
+    return np.unique(np.where(down >= low, down, up).astype(np.float64))
+
+
+def _find_categories(col, max_bins):
+    """Sorted distinct category codes of a categorical column."""
+    categories = np.unique(col)
+    # NaN fails the comparisons
+    invalid = ~((categories >= 0) & (categories <= MAX_CATEGORY_CODE)
+                & (categories == np.floor(categories)))
+    if np.any(invalid):
+        raise ValueError("categorical features should hold integer codes in "
+                         "[0, %d], got %g"
+                         % (MAX_CATEGORY_CODE, categories[invalid][0]))
+    if len(categories) > max_bins:
+        raise ValueError("a categorical feature has %d categories, more than "
+                         "max_bins=%d" % (len(categories), max_bins))
+    return categories
+
+
+def _category_thresholds(categories):
+    """Bin edges giving every category a bin of its own."""
+    return (categories[:-1] + categories[1:]) * 0.5
+
+
+def _categorical_mask(categorical_features, n_features):
+    """Boolean mask of the categorical features, from indices or a mask."""
+    mask = np.zeros(n_features, dtype=bool)
+    if categorical_features is None:
+        return mask
+    categorical_features = np.asarray(categorical_features)
+    if categorical_features.dtype == bool:
+        if categorical_features.shape != (n_features,):
+            raise ValueError("categorical_features mask has shape %r, "
+                             "expected (%d,)" % (categorical_features.shape,
+                                                 n_features))
+        return categorical_features.copy()
+    if categorical_features.size and (
+            categorical_features.dtype.kind not in 'iu'
+            or categorical_features.min() < -n_features
+            or categorical_features.max() >= n_features):
+        raise ValueError("categorical_features should be a boolean mask or "
+                         "indices of the %d features, got %r"
+                         % (n_features, categorical_features))
+    mask[categorical_features.astype(np.intp)] = True
+    return mask
+
+
+def _find_thresholds_sparse(values, n_zeros, max_bins):
+    """``_find_thresholds`` of a column made of ``values`` and ``n_zeros``
+    zeros, which are only materialized for the quantiles."""
+    distinct = np.unique(values)
+    if n_zeros and not np.any(distinct == 0):
+        distinct = np.insert(distinct, np.searchsorted(distinct, 0.), 0.)
+    if len(distinct) <= max_bins:
+        return _float32_edges((distinct[:-1] + distinct[1:]) * 0.5,
+                              distinct)
+    return _find_thresholds(np.concatenate([values, np.zeros(n_zeros)]),
+                            max_bins)
+
+
+class SparseBinnedMatrix(object):
+    """Binned sparse matrix.
+
+    Holds the bins of the stored values in CSR layout (rows of the node
+    samples for the histograms) and CSC layout (feature columns for the
+    partitions). The implicit zeros of feature ``f`` are in bin
+    ``zero_bins[f]``.
+
+    Parameters
+    ----------
+    csr : csr_matrix of uint8 or uint16
+
+    zero_bins : ndarray of uint8 or uint16, shape (n_features,)
+    """
+
+    def __init__(self, csr, zero_bins):
+        csr.sort_indices()
+        self.csr = csr
+        self.csc = csr.tocsc()
+        self.csc.sort_indices()
+        self.zero_bins = zero_bins
+        self.shape = csr.shape
+        self.dtype = csr.dtype
+
+    @property
+    def nbytes(self):
+        return sum(m.data.nbytes + m.indices.nbytes + m.indptr.nbytes
+                   for m in (self.csr, self.csc)) + self.zero_bins.nbytes
+
+    def column_bins(self, feature, rows):
+        """Bins of ``feature`` for ``rows``, binary searched in the stored
+        rows of the column."""
+        start, end = self.csc.indptr[feature], self.csc.indptr[feature + 1]
+        stored_rows = self.csc.indices[start:end]
+        bins = np.full(len(rows), self.zero_bins[feature], dtype=self.dtype)
+        if end > start:
+            pos = np.minimum(np.searchsorted(stored_rows, rows),
+                             end - start - 1)
+            found = stored_rows[pos] == rows
+            bins[found] = self.csc.data[start:end][pos[found]]
+        return bins
+
+    def components(self):
+        """The arrays behind the matrix, see ``from_components``."""
+        return {'data': self.csr.data, 'indices': self.csr.indices,
+                'indptr': self.csr.indptr, 'zero_bins': self.zero_bins,
+                'shape': np.array(self.shape, dtype=np.intp)}
+
+    @classmethod
+    def from_components(cls, components):
+        csr = sp.csr_matrix((components['data'], components['indices'],
+                             components['indptr']),
+                            shape=tuple(components['shape']))
+        return cls(csr, components['zero_bins'])
+
+
+def take_bins(X_binned, feature, rows):
+    """``X_binned[rows, feature]`` of a dense or sparse binned matrix."""
+    if isinstance(X_binned, SparseBinnedMatrix):
+        return X_binned.column_bins(feature, rows)
+    return X_binned[:, feature].take(rows)
+
+
+def take_rows(X_binned, rows):
+    """``X_binned[rows]`` of a dense or sparse binned matrix, in the same
+    layout."""
+    if isinstance(X_binned, SparseBinnedMatrix):
+        return SparseBinnedMatrix(X_binned.csr[rows], X_binned.zero_bins)
+    if X_binned.flags.f_contiguous:
+        return X_binned.T.take(rows, axis=1).T
+    return X_binned.take(rows, axis=0)
+
+
+def dataset_fingerprint(X):
+    """Digest of the shape, dtype, layout and content of an array."""
+    X = np.asarray(X)
+    if X.flags.c_contiguous:
+        layout, data = 'C', X
+    elif X.flags.f_contiguous:
+        layout, data = 'F', X.T
+    else:
+        layout, data = 'C', np.ascontiguousarray(X)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((X.shape, X.dtype.str, layout)).encode('ascii'))
+    digest.update(data.reshape(-1).view(np.uint8))
+    return digest.hexdigest()
+
+
+class BinnedDataCache(object):
+    """LRU cache of fitted bin edges and binned matrices.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Total size of the cached binned matrices, the least recently used
+        entries are evicted beyond it. 0 disables the cache.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, bin_thresholds, X_binned, categories=None):
+        if key in self._entries or X_binned.nbytes > self.max_bytes:
+            return
+        X_binned.flags.writeable = False
+        self._entries[key] = (bin_thresholds, X_binned, categories)
+        self.nbytes += X_binned.nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted, _) = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_bin_cache = BinnedDataCache()
+
+
+def get_bin_cache():
+    """The process wide cache used by ``BinMapper(cache=True)``."""
+    return _bin_cache
+
+
+class BinMapper(TransformerMixin, BaseEstimator):
+    """Map float features to quantile bin indices.
+
+    ``X`` can be an ``np.memmap`` of any numeric dtype, read by chunks of
+    ``chunk_rows`` rows, or a CSR / CSC matrix, binned into a
+    ``SparseBinnedMatrix`` without being densified (``order`` does not
+    apply and the cache is not used).
+
+    Parameters
+    ----------
+    max_bins : int, optional (default=256)
+        Maximum number of bins per feature. Up to 256 bins the binned
+        matrix is uint8, up to 65536 it is uint16.
+
+    subsample : int or None, optional (default=200000)
+        Number of rows used to compute the quantiles.
+
+    order : {'C', 'F'}, optional (default='C')
+        Memory layout of the binned matrix: row major suits the NumPy
+        histogram builder, column major the CUDA kernels.
+
+    cache : boolean, optional (default=False)
+        Look ``fit_transform`` up in the process wide cache keyed by the
+        dataset fingerprint, and store its result there. Only used when
+        the binning is deterministic, i.e. when no subsampling happens or
+        ``random_state`` is an int.
+
+    random_state : int, RandomState instance or None, optional
+        Seed of the row subsample.
+
+    categorical_features : array-like of int or bool, or None, optional
+        Indices or boolean mask of the categorical features, which hold
+        integer codes in [0, 65535]; at most ``max_bins`` categories per
+        feature.
+
+    Attributes
+    ----------
+    bin_thresholds_ : list of arrays
+        Upper edge of every bin but the last, per feature.
+
+    n_bins_per_feature_ : array of int, shape (n_features,)
+
+    n_bins_ : int
+        Number of bins of the widest feature.
+
+    X_binned_dtype_ : dtype
+        uint8 or uint16.
+
+    is_categorical_ : array of bool, shape (n_features,)
+
+    categories_ : list of arrays or None
+        Sorted category codes of every categorical feature, bin ``b``
+        holding ``categories_[f][b]``; None for the other features.
+    """
+
+    # rows of float input binned at a time
+    chunk_rows = DEFAULT_CHUNK_ROWS
+
+    def __init__(self, max_bins=MAX_BINS, subsample=int(2e5), order='C',
+                 cache=False, random_state=None, categorical_features=None):
+        self.max_bins = max_bins
+        self.subsample = subsample
+        self.order = order
+        self.cache = cache
+        self.random_state = random_state
+        self.categorical_features = categorical_features
+
+    def _check_params(self):
+        if not 2 <= self.max_bins <= MAX_BINS_UINT16:
+            raise ValueError("max_bins=%r should be in [2, %d]"
+                             % (self.max_bins, MAX_BINS_UINT16))
+        if self.order not in ('C', 'F'):
+            raise ValueError("order should be 'C' or 'F', got %r"
+                             % self.order)
+
+    def fit(self, X, y=None):
+        """Compute the quantile bin edges of every feature."""
+        self._check_params()
+        X = check_large_array(X)
+        categories = self._find_categories(X)
+        if self.subsample is not None and X.shape[0] > self.subsample:
+            rng = check_random_state(self.random_state)
+            rows = rng.choice(X.shape[0], self.subsample, replace=False)
+            # in file order, a memmap is read front to back; the order of
+            # the rows does not change the quantiles
+            if sp.issparse(X):
+                X = X.tocsr()[np.sort(rows)]
+            else:
+                X = read_rows(X, np.sort(rows))
+        if sp.issparse(X):
+            X = X.tocsc()
+            with record('binning'):
+                self._set_thresholds([
+                    _find_thresholds_sparse(
+                        X.data[X.indptr[f]:X.indptr[f + 1]],
+                        X.shape[0] - (X.indptr[f + 1] - X.indptr[f]),
+                        self.max_bins)
+                    if categories[f] is None
+                    else _category_thresholds(categories[f])
+                    for f in range(X.shape[1])], categories)
+            return self
+        with record('binning'):
+            self._set_thresholds([_find_thresholds(read_column(X, f),
+                                                   self.max_bins)
+                                  if categories[f] is None
+                                  else _category_thresholds(categories[f])
+                                  for f in range(X.shape[1])], categories)
+        return self
+
+    def _find_categories(self, X):
+        """``categories_`` of ``X``, from all its rows."""
+        mask = _categorical_mask(self.categorical_features, X.shape[1])
+        categories = [None] * X.shape[1]
+        if not mask.any():
+            return categories
+        if sp.issparse(X):
+            X = X.tocsc()
+        with record('binning'):
+            for f in np.flatnonzero(mask):
+                if sp.issparse(X):
+                    values = X.data[X.indptr[f]:X.indptr[f + 1]]
+                    if X.indptr[f + 1] - X.indptr[f] < X.shape[0]:
+                        values = np.append(values, 0.)
+                else:
+                    values = read_column(X, f)
+                categories[f] = _find_categories(values, self.max_bins)
+        return categories
+
+    def _set_thresholds(self, bin_thresholds, categories=None):
+        if categories is None:
+            categories = [None] * len(bin_thresholds)
+        self.categories_ = categories
+        self.is_categorical_ = np.array([c is not None for c in categories],
+                                        dtype=bool)
+        self.bin_thresholds_ = bin_thresholds
+        self.n_bins_per_feature_ = np.array(
+            [len(t) + 1 for t in bin_thresholds], dtype=np.intp)
+        self.n_bins_ = int(self.n_bins_per_feature_.max()) if len(
+            bin_thresholds) else 1
+        self.X_binned_dtype_ = np.dtype(
+            np.uint8 if self.max_bins <= MAX_BINS else np.uint16)
+
+    def transform(self, X):
+        """Bin ``X`` into a uint8 or uint16 matrix in ``order`` layout."""
+        check_is_fitted(self, 'bin_thresholds_')
+        X = check_large_array(X)
+        if X.shape[1] != len(self.bin_thresholds_):
+            raise ValueError("X has %d features, the mapper was fitted with "
+                             "%d" % (X.shape[1], len(self.bin_thresholds_)))
+        if sp.issparse(X):
+            return self._transform_sparse(X)
+        binned = np.empty(X.shape, dtype=self.X_binned_dtype_,
+                          order=self.order)
+        with record('binning'):
+            for rows in row_chunks(X.shape[0], self.chunk_rows):
+                chunk = read_rows(X, rows)
+                for f, thresholds in enumerate(self.bin_thresholds_):
+                    binned[rows, f] = np.searchsorted(thresholds,
+                                                      chunk[:, f],
+                                                      side='left')
+                    if self.categories_[f] is not None:
+                        self._check_known(f, chunk[:, f], binned[rows, f])
+        return binned
+
+    def _check_known(self, f, values, bins):
+        """Raise on the codes of categorical feature ``f`` that ``fit``
+        did not see, which have no bin."""
+        unknown = self.categories_[f].take(bins) != values
+        if np.any(unknown):
+            raise ValueError("feature %d has categories unknown to the "
+                             "fitted bins, e.g. %g"
+                             % (f, values[np.flatnonzero(unknown)[0]]))
+
+    def _transform_sparse(self, X):
+        X = X.tocsc()
+        binned = np.empty(X.nnz, dtype=self.X_binned_dtype_)
+        with record('binning'):
+            for f, thresholds in enumerate(self.bin_thresholds_):
+                stored = slice(X.indptr[f], X.indptr[f + 1])
+                binned[stored] = np.searchsorted(thresholds, X.data[stored],
+                                                 side='left')
+                if self.categories_[f] is not None:
+                    self._check_known(f, X.data[stored], binned[stored])
+                    if X.indptr[f + 1] - X.indptr[f] < X.shape[0]:
+                        self._check_known(f, np.zeros(1), np.searchsorted(
+                            thresholds, np.zeros(1), side='left'))
+            zero_bins = np.array([np.searchsorted(t, 0., side='left')
+                                  for t in self.bin_thresholds_],
+                                 dtype=self.X_binned_dtype_)
+            csc = sp.csc_matrix((binned, X.indices, X.indptr),
+                                shape=X.shape)
+            return SparseBinnedMatrix(csc.tocsr(), zero_bins)
+
+    def _cache_key(self, X):
+        if sp.issparse(X):
+            return None
+        subsampled = self.subsample is not None and X.shape[0] > self.subsample
+        if not self.cache or (subsampled and not isinstance(
+                self.random_state, numbers.Integral)):
+            return None
+        return (dataset_fingerprint(X), self.max_bins, self.order,
+                self.subsample if subsampled else None,
+                self.random_state if subsampled else None,
+                tuple(np.flatnonzero(_categorical_mask(
+                    self.categorical_features, X.shape[1]))))
+
+    def fit_transform(self, X, y=None):
+        """Fit and bin ``X``, going through the cache when enabled.
+
+        Cached matrices are shared and therefore read only.
+        """
+        self._check_params()
+        X = check_large_array(X)
+        key = self._cache_key(X)
+        if key is not None:
+            entry = _bin_cache.get(key)
+            if entry is not None:
+                self._set_thresholds(entry[0], entry[2])
+                return entry[1]
+        X_binned = self.fit(X).transform(X)
+        if key is not None:
+            _bin_cache.put(key, self.bin_thresholds_, X_binned,
+                           self.categories_)
+        return X_binned
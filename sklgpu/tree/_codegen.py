@@ -0,0 +1,567 @@
+"""Fitted trees compiled to native code.
+
+``export_c`` writes the trees of a fitted estimator as a C source file
+with a batch entry point; ``compile_model`` builds it into a shared
+library and loads it as a ``CompiledModel``. The trees become either
+nested ``if``/``else`` blocks (``style='branches'``, every threshold an
+immediate of the generated code) or static node arrays walked without
+branches (``style='arrays'``, a child is picked by indexing with the
+comparison result), the better choice depending on the size of the trees.
+The splits on categorical features test the code of the row in a static
+bitset of the category codes going left.
+
+The library is compiled with nvcc when a CUDA toolkit is found, like the
+extensions of the package, and with the C compiler Python was built with
+otherwise. The generated code is plain C and only needs a host compiler.
+
+The exported functions, ``<name>`` being the ``name`` parameter::
+
+    void <name>_predict(const double *X, ptrdiff_t n_rows, double *out);
+    int <name>_n_features(void);
+    int <name>_n_outputs(void);
+
+``X`` is C contiguous with ``n_features`` columns and ``out`` receives
+``n_outputs`` values per row: the class probabilities or the target of
+trees and forests, the raw predictions of gradient boosting.
+"""
+import ctypes
+import hashlib
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import sysconfig
+import tempfile
+
+import numpy as np
+import scipy.sparse as sp
+
+from ._profiling import record
+from ._tree import TREE_LEAF, TreeEnsemble, _as_predict_input, _map_chunks
+
+__all__ = ["export_c", "compile_model", "CompiledModel"]
+
+STYLES = ('branches', 'arrays')
+COMPILERS = ('auto', 'nvcc', 'cc')
+# rows per call of the compiled predict when running on several threads
+CHUNK_SIZE = 1 << 14
+
+_HEADER = """\
+/* Generated by sklgpu.tree.export_c, do not edit. */
+#include <stddef.h>
+
+#if defined(_WIN32)
+#define SKLGPU_EXPORT __declspec(dllexport)
+#else
+#define SKLGPU_EXPORT __attribute__((visibility("default")))
+#endif
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+#define N_FEATURES %(n_features)d
+#define N_OUTPUTS %(n_outputs)d
+#define N_TREES %(n_trees)d
+#define VALUE_WIDTH %(width)d
+#define DIVISOR %(divisor)s
+
+static const double baseline[N_OUTPUTS] = {%(baseline)s};
+"""
+
+_FOOTER = """
+SKLGPU_EXPORT void %(name)s_predict(const double *X, ptrdiff_t n_rows,
+	double *out)
+{
+	ptrdiff_t i;
+	int k;
+	for (i = 0; i < n_rows; i++) {
+		const double *x = X + i * N_FEATURES;
+		double *row_out = out + i * N_OUTPUTS;
+		for (k = 0; k < N_OUTPUTS; k++)
+			row_out[k] = 0.;
+		predict_row(x, row_out);
+		for (k = 0; k < N_OUTPUTS; k++)
+			row_out[k] = row_out[k] / DIVISOR + baseline[k];
+	}
+}
+
+SKLGPU_EXPORT int %(name)s_n_features(void)
+{
+	return N_FEATURES;
+}
+
+SKLGPU_EXPORT int %(name)s_n_outputs(void)
+{
+	return N_OUTPUTS;
+}
+
+#ifdef __cplusplus
+}
+#endif
+"""
+
+_ARRAYS_PREDICT = """
+static void predict_row(const double *x, double *out)
+{
+	int t, k;
+	for (t = 0; t < N_TREES; t++) {
+		int node = roots[t];
+		const float *leaf_value;
+		while (children[2 * node] >= 0) {
+			/* NaN goes right, as in the interpreted traversal */
+			int go_right = %(go_right)s;
+			node = children[2 * node + go_right];
+		}
+		leaf_value = value + (ptrdiff_t)node * VALUE_WIDTH;
+		for (k = 0; k < VALUE_WIDTH; k++)
+			out[output_offsets[t] + k] += leaf_value[k];
+	}
+}
+"""
+
+_NUMERIC_TEST = "!(x[feature[node]] <= threshold[node])"
+
+_CATEGORICAL_TEST = """category_split[node] >= 0
+				? !in_categories(x[feature[node]],
+					categories[category_split[node]])
+				: !(x[feature[node]] <= threshold[node])"""
+
+_IN_CATEGORIES = """
+/* Whether category code x is in the bitset, codes out of its range (and
+ * NaN) never are. */
+static int in_categories(double x, const unsigned int *bitset)
+{
+	int code;
+	if (!(x >= 0 && x < 32. * N_WORDS))
+		return 0;
+	code = (int)x;
+	return (bitset[code >> 5] >> (code & 31)) & 1;
+}
+"""
+
+
+def _literal(x):
+    """C literal of a double, exact on the round trip."""
+    x = float(x)
+    if np.isnan(x):
+        return "(0.0 / 0.0)"
+    if np.isinf(x):
+        return "(1.0 / 0.0)" if x > 0 else "(-1.0 / 0.0)"
+    text = repr(x)
+    if '.' not in text and 'e' not in text:
+        text += '.'
+    return text
+
+
+def _array(ctype, name, values, per_line=8):
+    values = list(values)
+    lines = ["static const %s %s[%d] = {" % (ctype, name, max(len(values), 1))]
+    for start in range(0, len(values), per_line):
+        lines.append("\t" + ", ".join(values[start:start + per_line]) + ",")
+    lines.append("};")
+    return "\n".join(lines)
+
+
+def _model_ensemble(model):
+    """``(ensemble, n_features, divisor, baseline)`` of a fitted estimator:
+    its predictions are ``ensemble.predict(X) / divisor + baseline``."""
+    if getattr(model, 'tree_', None) is not None:
+        ensemble = TreeEnsemble([model.tree_])
+        divisor = 1
+        baseline = np.zeros(ensemble.n_outputs)
+    elif getattr(model, 'estimators_', None) is not None:
+        ensemble = model._tree_ensemble()
+        divisor = len(model.estimators_)
+        baseline = np.zeros(ensemble.n_outputs)
+    elif getattr(model, '_predictors', None) is not None:
+        ensemble = model._tree_ensemble()
+        divisor = 1
+        baseline = np.broadcast_to(np.ravel(model._baseline_prediction),
+                                   (ensemble.n_outputs,))
+    else:
+        raise TypeError("expected a fitted tree, forest or gradient boosting "
+                        "estimator of sklgpu, got %r" % model)
+    return ensemble, model.n_features_, divisor, baseline
+
+
+def _categories(ensemble, lines):
+    """The category bitsets of ``ensemble`` as the static ``categories``
+    array and the ``in_categories`` test, when it has categorical splits.
+
+    Returns
+    -------
+    category_split : ndarray or None
+        Row of ``categories`` of every node of the ensemble, -1 for the
+        numerical splits and the leaves.
+    """
+    if ensemble.category_split is None:
+        return None
+    tree_of_node = np.repeat(np.arange(ensemble.n_trees), np.diff(
+        np.append(ensemble.roots, ensemble.node_count)))
+    category_split = np.where(
+        ensemble.category_split >= 0,
+        ensemble.category_roots[tree_of_node] + ensemble.category_split, -1)
+    n_words = ensemble.categories.shape[1]
+    lines.append("#define N_WORDS %d" % n_words)
+    lines.append("")
+    lines.append("static const unsigned int categories[%d][N_WORDS] = {"
+                 % ensemble.categories.shape[0])
+    for bitset in ensemble.categories:
+        lines.append("	{%s}," % ", ".join("%du" % word for word in bitset))
+    lines.append("};")
+    lines.append(_IN_CATEGORIES)
+    return category_split
+
+
+def _branches(ensemble, t, lines, category_split=None):
+    """Nested ``if``/``else`` blocks of tree ``t`` as ``tree_<t>``."""
+    left = ensemble.children_left
+    right = ensemble.children_right
+    width = ensemble.value.shape[1]
+    offset = ensemble.output_offsets[t]
+    root = ensemble.roots[t]
+    lines.append("static void tree_%d(const double *x, double *out)" % t)
+    lines.append("{")
+    # explicit stack, deep trees would hit the recursion limit
+    stack = [(root, 1)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            lines.append(item)
+            continue
+        node, depth = item
+        indent = "\t" * depth
+        if left[node] == TREE_LEAF:
+            for k in range(width):
+                lines.append("%sout[%d] += %s;"
+                             % (indent, offset + k,
+                                _literal(ensemble.value[node, k])))
+            continue
+        if category_split is not None and category_split[node] >= 0:
+            lines.append("%sif (in_categories(x[%d], categories[%d])) {"
+                         % (indent, ensemble.feature[node],
+                            category_split[node]))
+        else:
+            lines.append("%sif (x[%d] <= %s) {"
+                         % (indent, ensemble.feature[node],
+                            _literal(ensemble.threshold[node])))
+        stack.append(indent + "}")
+        stack.append((root + right[node], depth + 1))
+        stack.append(indent + "} else {")
+        stack.append((root + left[node], depth + 1))
+    lines.append("}")
+    lines.append("")
+
+
+def export_c(model, style='branches', name='sklgpu_model'):
+    """C source of the trees of a fitted estimator.
+
+    Parameters
+    ----------
+    model : fitted estimator
+        A decision tree, random forest or histogram gradient boosting model
+        of sklgpu.
+
+    style : 'branches' or 'arrays', optional (default='branches')
+        Nested ``if``/``else`` code or static node arrays walked by a loop.
+
+    name : str, optional (default='sklgpu_model')
+        Prefix of the exported functions.
+
+    Returns
+    -------
+    source : str
+    """
+    return _export_c(_model_ensemble(model), style, name)
+
+
+def _export_c(model_ensemble, style, name):
+    """``export_c`` of the ``_model_ensemble`` of a model."""
+    if style not in STYLES:
+        raise ValueError("style should be one of %s, got %r"
+                         % (", ".join(repr(s) for s in STYLES), style))
+    ensemble, n_features, divisor, baseline = model_ensemble
+    lines = [_HEADER % {'n_features': n_features,
+                        'n_outputs': ensemble.n_outputs,
+                        'n_trees': ensemble.n_trees,
+                        'width': ensemble.value.shape[1],
+                        'divisor': _literal(divisor),
+                        'baseline': ", ".join(_literal(b)
+                                              for b in baseline)}]
+    category_split = _categories(ensemble, lines)
+    if style == 'branches':
+        for t in range(ensemble.n_trees):
+            _branches(ensemble, t, lines, category_split)
+        lines.append("static void predict_row(const double *x, double *out)")
+        lines.append("{")
+        lines.extend("\ttree_%d(x, out);" % t
+                     for t in range(ensemble.n_trees))
+        lines.append("}")
+    else:
+        # node ids of the whole ensemble, the loop does not track the root
+        sizes = np.diff(np.append(ensemble.roots, ensemble.node_count))
+        shift = np.repeat(ensemble.roots, sizes)
+        children = np.column_stack([ensemble.children_left,
+                                    ensemble.children_right])
+        children = np.where(children == TREE_LEAF, TREE_LEAF,
+                            children + shift[:, None]).ravel()
+        feature_type = ("unsigned short" if ensemble.feature.dtype == np.uint16
+                        else "int")
+        lines.append(_array("int", "roots", map(str, ensemble.roots)))
+        lines.append(_array("int", "output_offsets",
+                            map(str, ensemble.output_offsets)))
+        lines.append(_array("int", "children", map(str, children), 16))
+        lines.append(_array(feature_type, "feature",
+                            map(str, ensemble.feature), 16))
+        # the float32 values are exact as double literals
+        lines.append(_array("float", "threshold",
+                            map(_literal, ensemble.threshold), 4))
+        lines.append(_array("float", "value",
+                            map(_literal, ensemble.value.ravel()), 4))
+        go_right = _NUMERIC_TEST
+        if category_split is not None:
+            lines.append(_array("int", "category_split",
+                                map(str, category_split), 16))
+            go_right = _CATEGORICAL_TEST
+        lines.append(_ARRAYS_PREDICT % {'go_right': go_right})
+    lines.append(_FOOTER % {'name': name})
+    return "\n".join(lines)
+
+
+def _find_nvcc():
+    home = os.environ.get('CUDA_PATH')
+    if home:
+        nvcc = os.path.join(home, 'bin', 'nvcc')
+        if os.path.exists(nvcc) or os.path.exists(nvcc + '.exe'):
+            return nvcc
+    return shutil.which('nvcc')
+
+
+def _library_suffix():
+    if os.name == 'nt':
+        return '.dll'
+    if sys.platform == 'darwin':
+        return '.dylib'
+    return '.so'
+
+
+def _compile_nvcc(nvcc, source_path, library_path):
+    args = [nvcc, '-O3', '-shared', '-o', library_path, source_path]
+    if os.name != 'nt':
+        args[1:1] = ['-Xcompiler', '-fPIC']
+    process = subprocess.run(args, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+    if process.returncode != 0:
+        raise RuntimeError("nvcc failed to compile %s:\n%s"
+                           % (source_path,
+                              process.stdout.decode(errors='replace')))
+
+
+def _compile_cc(source_path, library_path):
+    if os.name == 'nt':
+        args = ['cl', '/nologo', '/O2', '/LD', source_path,
+                '/Fe' + library_path]
+    else:
+        cc = os.environ.get('CC') or sysconfig.get_config_var('CC') or 'cc'
+        args = shlex.split(cc) + ['-O3', '-fPIC', '-shared', '-o',
+                                  library_path, source_path]
+    try:
+        # the objects of cl land in the working directory
+        process = subprocess.run(args, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT,
+                                 cwd=os.path.dirname(library_path))
+    except OSError as e:
+        raise RuntimeError("the C compiler %s could not be run: %s"
+                           % (args[0], e))
+    if process.returncode != 0:
+        raise RuntimeError("the C compiler failed to build %s:\n%s"
+                           % (source_path,
+                              process.stdout.decode(errors='replace')))
+
+
+def _build_library(source, name, compiler, build_dir):
+    """Path of the library built from ``source``, reused when a library
+    of the same source already sits in ``build_dir``."""
+    if compiler not in COMPILERS:
+        raise ValueError("compiler should be one of %s, got %r"
+                         % (", ".join(repr(c) for c in COMPILERS), compiler))
+    nvcc = None
+    if compiler != 'cc':
+        nvcc = _find_nvcc()
+        if nvcc is None and compiler == 'nvcc':
+            raise RuntimeError("nvcc could not be located, add it to your "
+                               "PATH or set CUDA_PATH")
+    if build_dir is None:
+        build_dir = os.path.join(tempfile.gettempdir(), 'sklgpu_compiled')
+    if not os.path.isdir(build_dir):
+        os.makedirs(build_dir)
+
+    digest = hashlib.sha1(source.encode()).hexdigest()[:16]
+    basename = os.path.join(build_dir, "%s_%s" % (name, digest))
+    library_path = basename + _library_suffix()
+    if not os.path.exists(library_path):
+        source_path = basename + '.c'
+        with open(source_path, 'w') as f:
+            f.write(source)
+        if nvcc is not None:
+            _compile_nvcc(nvcc, source_path, library_path)
+        else:
+            _compile_cc(source_path, library_path)
+    return library_path, ('nvcc' if nvcc is not None else 'cc')
+
+
+class CompiledModel(object):
+    """A fitted estimator compiled to a shared library.
+
+    Built by ``compile_model``. ``predict`` and, for classifiers,
+    ``predict_proba`` match the estimator; ``predict_raw`` is the output of
+    the library. Pickling keeps the source only, the library is rebuilt
+    when missing on first use.
+
+    Attributes
+    ----------
+    source : str
+        The generated C code.
+
+    library_path : str
+
+    compiler : str
+        'nvcc' or 'cc', the compiler that built the library.
+
+    n_features : int
+
+    n_outputs : int
+
+    classes_ : array or None
+        Classes of a classifier, None for a regressor.
+    """
+
+    def __init__(self, source, name, library_path, compiler, n_features,
+                 n_outputs, classes=None, loss=None, build_dir=None):
+        self.source = source
+        self.name = name
+        self.library_path = library_path
+        self.compiler = compiler
+        self.n_features = n_features
+        self.n_outputs = n_outputs
+        self.classes_ = classes
+        self._loss = loss
+        self._build_dir = build_dir
+        self._library = None
+
+    def _predict_function(self):
+        if self._library is None:
+            if not os.path.exists(self.library_path):
+                self.library_path, self.compiler = _build_library(
+                    self.source, self.name, 'auto', self._build_dir)
+            library = ctypes.CDLL(self.library_path)
+            function = getattr(library, self.name + '_predict')
+            function.restype = None
+            function.argtypes = [ctypes.c_void_p, ctypes.c_ssize_t,
+                                 ctypes.c_void_p]
+            if getattr(library, self.name + '_n_features')() != \
+                    self.n_features:
+                raise RuntimeError("%s was built for another model"
+                                   % self.library_path)
+            self._library = library
+            self._predict = function
+        return self._predict
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_library'] = None
+        state.pop('_predict', None)
+        return state
+
+    def predict_raw(self, X, n_threads=1):
+        """Output of the library, shape (n_samples, n_outputs). Sparse
+        input is densified one chunk at a time."""
+        if sp.issparse(X):
+            X = sp.csr_matrix(X, dtype=np.float64)
+        else:
+            X = _as_predict_input(X)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError("X should have %d features, got shape %r"
+                             % (self.n_features, X.shape))
+        out = np.empty((X.shape[0], self.n_outputs))
+        function = self._predict_function()
+
+        def predict_chunk(chunk):
+            rows = X[chunk]
+            if sp.issparse(rows):
+                rows = rows.toarray()
+            # ctypes releases the GIL for the duration of the call
+            function(rows.ctypes.data, chunk.stop - chunk.start,
+                     out[chunk].ctypes.data)
+
+        with record('predict'):
+            _map_chunks(predict_chunk, X.shape[0], CHUNK_SIZE, n_threads)
+        return out
+
+    def predict_proba(self, X, n_threads=1):
+        """Class probabilities, for classifiers only."""
+        if self.classes_ is None:
+            raise AttributeError("predict_proba is only available for "
+                                 "classifiers")
+        raw = self.predict_raw(X, n_threads)
+        if self._loss is not None:
+            return self._loss.predict_proba(raw.T)
+        return raw
+
+    def predict(self, X, n_threads=1):
+        """Predicted class or target, as the estimator's ``predict``."""
+        if self.classes_ is None:
+            return self.predict_raw(X, n_threads)[:, 0]
+        proba = self.predict_proba(X, n_threads)
+        return self.classes_.take(np.argmax(proba, axis=1), axis=0)
+
+
+def compile_model(model, style='branches', compiler='auto', build_dir=None,
+                  name='sklgpu_model'):
+    """Compile the trees of a fitted estimator to native code.
+
+    Parameters
+    ----------
+    model : fitted estimator
+        A decision tree, random forest or histogram gradient boosting model
+        of sklgpu.
+
+    style : 'branches' or 'arrays', optional (default='branches')
+        Code generated for the trees, see ``export_c``.
+
+    compiler : 'auto', 'nvcc' or 'cc', optional (default='auto')
+        'auto' uses nvcc when it is found and the C compiler of Python
+        otherwise.
+
+    build_dir : str or None, optional (default=None)
+        Where the source and the library are written, a ``sklgpu_compiled``
+        directory of the temporary directory when None. A library built
+        from the same code is reused.
+
+    name : str, optional (default='sklgpu_model')
+        Prefix of the exported functions.
+
+    Returns
+    -------
+    compiled : CompiledModel
+
+    Examples
+    --------
+    >>> from sklgpu.ensemble import RandomForestClassifier
+    >>> from sklgpu.tree import compile_model
+    >>> forest = RandomForestClassifier(n_estimators=10).fit(X, y)
+    >>> compiled = compile_model(forest)
+    >>> compiled.predict(X)
+    """
+    model_ensemble = _model_ensemble(model)
+    source = _export_c(model_ensemble, style, name)
+    library_path, compiler = _build_library(source, name, compiler, build_dir)
+    ensemble, n_features, _, _ = model_ensemble
+    return CompiledModel(source, name, library_path, compiler, n_features,
+                         ensemble.n_outputs,
+                         classes=getattr(model, 'classes_', None),
+                         loss=(getattr(model, 'loss_', None)
+                               if hasattr(model, 'classes_') else None),
+                         build_dir=build_dir)
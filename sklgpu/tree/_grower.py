@@ -0,0 +1,312 @@
+"""Growing a single tree from binned data and feature histograms.
+
+Only the smaller child of a split gets its histogram built from the data,
+the histogram of its sibling is the parent histogram minus that one.
+"""
+import heapq
+
+import numpy as np
+from sklearn.utils import check_random_state
+
+from ._binning import take_bins
+from ._profiling import record
+from ._splitting import COUNT, WEIGHT, find_best_split
+
+
+class TreeNode(object):
+    """A node of a tree being grown.
+
+    Internal nodes send samples with ``X[:, feature] <= threshold`` (or
+    equivalently ``X_binned[:, feature] <= bin_threshold``) to ``left``;
+    splits on a categorical feature send the samples whose code is in
+    ``categories``, their threshold is NaN.
+    """
+
+    def __init__(self, depth, sample_indices, stats, value, impurity):
+        self.depth = depth
+        self.sample_indices = sample_indices
+        self.stats = stats
+        self.value = value
+        self.impurity = impurity
+        self.n_samples = int(stats[COUNT])
+        self.weighted_n_samples = stats[WEIGHT]
+        self.split_info = None
+        self.histogram = None
+        # (samples, values) sorted along every feature, for the exact grower
+        self.presorted = None
+        self.feature = -1
+        self.bin_threshold = -1
+        self.threshold = np.nan
+        self.categories = None
+        self.gain = 0.
+        self.left = None
+        self.right = None
+
+    @property
+    def is_leaf(self):
+        return self.left is None
+
+    def __lt__(self, other):
+        # heapq ordering for best first growth: larger gain first
+        return self.split_info.gain > other.split_info.gain
+
+
+class TreeGrower(object):
+    """Grow a tree depth first, or best first when ``max_leaf_nodes`` is set.
+
+    Parameters
+    ----------
+    X_binned : ndarray of uint8, shape (n_samples, n_features)
+        Or a ``SparseBinnedMatrix``.
+
+    bin_thresholds : list of arrays
+        Per feature bin edges, used to turn bin splits into thresholds on
+        the raw feature values.
+
+    histogram_builder : object
+        Histogram builder of the chosen backend, with its per-sample
+        statistics already set. Histograms that are no longer needed go
+        back through its ``free`` method.
+
+    criterion : Criterion
+
+    max_depth, min_samples_split, min_samples_leaf, min_weight_leaf,
+    min_impurity_decrease, max_features, max_leaf_nodes :
+        Usual stopping and feature sampling parameters.
+
+    features : array of int or None
+        Sorted candidate features of the whole tree, all of them when
+        None; ``max_features`` are drawn among them at every node.
+
+    random_state : int, RandomState instance or None
+        Used to draw the per node candidate features.
+
+    categories : list or None
+        ``BinMapper.categories_``: the category code of every bin of the
+        categorical features, None for the others. No feature is
+        categorical when None.
+
+    Attributes
+    ----------
+    split_gains : ndarray of float64, shape (n_features,)
+        Total gain (impurity decrease) of the splits on every feature,
+        summed as the tree grows.
+
+    split_counts : ndarray of intp, shape (n_features,)
+        Number of splits on every feature.
+    """
+
+    def __init__(self, X_binned, bin_thresholds, histogram_builder,
+                 criterion, max_depth=None, min_samples_split=2,
+                 min_samples_leaf=1, min_weight_leaf=0.,
+                 min_impurity_decrease=0., max_features=None,
+                 max_leaf_nodes=None, random_state=None, categories=None,
+                 features=None):
+        self.X_binned = X_binned
+        self.bin_thresholds = bin_thresholds
+        self.histogram_builder = histogram_builder
+        self.criterion = criterion
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.min_samples_leaf = min_samples_leaf
+        self.min_weight_leaf = min_weight_leaf
+        self.min_impurity_decrease = min_impurity_decrease
+        self.max_features = max_features
+        self.max_leaf_nodes = max_leaf_nodes
+        self.random_state = random_state
+        self.categories = categories
+        self.features = features
+        self._categorical = None
+        if categories is not None and any(c is not None for c in categories):
+            self._categorical = np.array([c is not None for c in categories])
+
+    def grow(self, sample_indices, root_histogram=None):
+        """Grow the tree on ``sample_indices`` and return its root.
+
+        ``root_histogram``, the histogram of ``sample_indices`` from the
+        pool of the builder when it was already built (the fits of a
+        parameter search share it), spares the root build; the grower
+        frees it like its own.
+        """
+        self._rng = check_random_state(self.random_state)
+        self._n_features = self.X_binned.shape[1]
+        self.n_nodes = 0
+        self.leaves = []
+        self.split_gains = np.zeros(self._n_features)
+        self.split_counts = np.zeros(self._n_features, dtype=np.intp)
+        self._root_histogram = root_histogram
+
+        root = self._make_root(np.asarray(sample_indices, dtype=np.uint32))
+        if self.max_leaf_nodes is None:
+            self._grow_depth_first(root)
+        else:
+            self._grow_best_first(root)
+        return root
+
+    def _grow_depth_first(self, root):
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node.split_info is None:
+                self.leaves.append(node)
+                continue
+            left, right = self._split(node)
+            stack.append(right)
+            stack.append(left)
+
+    def _grow_best_first(self, root):
+        heap = []
+        n_leaves = 1
+        if root.split_info is not None:
+            heapq.heappush(heap, root)
+        else:
+            self.leaves.append(root)
+        while heap:
+            node = heapq.heappop(heap)
+            if n_leaves >= self.max_leaf_nodes:
+                self._make_leaf(node)
+                continue
+            left, right = self._split(node)
+            n_leaves += 1
+            for child in (left, right):
+                if child.split_info is not None:
+                    heapq.heappush(heap, child)
+                else:
+                    self.leaves.append(child)
+
+    def _make_root(self, sample_indices):
+        hist, self._root_histogram = self._root_histogram, None
+        if hist is None:
+            hist = self.histogram_builder.build(sample_indices)
+        root = self._make_node(0, sample_indices, hist[0].sum(axis=0))
+        self._total_weight = max(root.weighted_n_samples, 1e-300)
+        self._find_split(root, hist)
+        return root
+
+    def _make_node(self, depth, sample_indices, stats):
+        node = TreeNode(depth, sample_indices, stats,
+                        self.criterion.node_value(stats),
+                        float(self.criterion.impurity(stats)))
+        self.n_nodes += 1
+        return node
+
+    def _make_leaf(self, node):
+        node.split_info = None
+        if node.histogram is not None:
+            self.histogram_builder.free(node.histogram)
+            node.histogram = None
+        node.presorted = None
+        self.leaves.append(node)
+
+    def _can_split(self, node):
+        return not (self.max_depth is not None and node.depth >= self.max_depth
+                    or node.n_samples < self.min_samples_split
+                    or node.n_samples < 2 * self.min_samples_leaf)
+
+    def _record_split(self, node):
+        self.split_gains[node.feature] += node.gain
+        self.split_counts[node.feature] += 1
+
+    def _draw_features(self):
+        """Sorted candidate features of a node, None for all of them."""
+        if self.features is None:
+            if (self.max_features is not None
+                    and self.max_features < self._n_features):
+                return np.sort(self._rng.choice(
+                    self._n_features, self.max_features, replace=False))
+            return None
+        if (self.max_features is not None
+                and self.max_features < len(self.features)):
+            return np.sort(self._rng.choice(
+                self.features, self.max_features, replace=False))
+        return self.features
+
+    def _find_split(self, node, hist):
+        if not self._can_split(node):
+            self.histogram_builder.free(hist)
+            return
+        features = self._draw_features()
+        with record('split'):
+            split_info = find_best_split(hist, self.criterion, node.stats,
+                                         self.min_samples_leaf,
+                                         self.min_weight_leaf, features,
+                                         self._categorical)
+        if (split_info is None or split_info.gain / self._total_weight
+                < self.min_impurity_decrease):
+            self.histogram_builder.free(hist)
+            return
+        node.split_info = split_info
+        # kept until the split for the sibling subtraction
+        node.histogram = hist
+
+    def _split(self, node):
+        split_info = node.split_info
+        node.feature = split_info.feature
+        node.bin_threshold = split_info.bin
+        node.gain = split_info.gain
+        self._record_split(node)
+        left_bins = split_info.left_bins
+        if left_bins is None:
+            node.threshold = self.bin_thresholds[split_info.feature][
+                split_info.bin]
+        else:
+            node.categories = self.categories[node.feature][left_bins]
+
+        with record('partition'):
+            goes_left = self._goes_left(node, node.sample_indices)
+            left_indices = node.sample_indices[goes_left]
+            right_indices = node.sample_indices[~goes_left]
+        node.sample_indices = None
+        node.split_info = None
+
+        # the sibling histogram is subtracted in place, it takes over the
+        # parent buffer. The sizes come from the histogram counts rather
+        # than the local indices, so that the processes of a distributed
+        # fit, each with a shard of the node, build the same child
+        if split_info.left_stats[COUNT] <= split_info.right_stats[COUNT]:
+            left_hist = self.histogram_builder.build(left_indices)
+            right_hist = np.subtract(node.histogram, left_hist,
+                                     out=node.histogram)
+        else:
+            right_hist = self.histogram_builder.build(right_indices)
+            left_hist = np.subtract(node.histogram, right_hist,
+                                    out=node.histogram)
+        node.histogram = None
+
+        children = []
+        for indices, hist in ((left_indices, left_hist),
+                              (right_indices, right_hist)):
+            child = self._make_node(node.depth + 1, indices,
+                                    hist[0].sum(axis=0))
+            self._find_split(child, hist)
+            children.append(child)
+        node.left, node.right = children
+        return children
+
+    def _goes_left(self, node, sample_indices):
+        """Whether each of ``sample_indices`` goes to the left child of the
+        split ``node``."""
+        bins = take_bins(self.X_binned, node.feature, sample_indices)
+        if node.categories is None:
+            return bins <= node.bin_threshold
+        codes = self.categories[node.feature]
+        in_left = np.zeros(len(codes), dtype=bool)
+        in_left[np.searchsorted(codes, node.categories)] = True
+        return in_left[bins]
+
+    def partition(self, root, sample_indices):
+        """``(leaf, indices)`` of the leaves of the grown tree ``root``
+        reached by ``sample_indices``, e.g. the rows of the training set
+        it was not grown on."""
+        leaves = []
+        stack = [(root, np.asarray(sample_indices))]
+        while stack:
+            node, indices = stack.pop()
+            if node.is_leaf:
+                leaves.append((node, indices))
+                continue
+            with record('partition'):
+                goes_left = self._goes_left(node, indices)
+            stack.append((node.right, indices[~goes_left]))
+            stack.append((node.left, indices[goes_left]))
+        return leaves
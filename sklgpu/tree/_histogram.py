@@ -0,0 +1,202 @@
+"""Per node feature histograms.
+
+A histogram has shape ``(n_features, n_bins, n_stats)``: for every feature
+and every bin it holds the sum of the per-sample statistics (sample count,
+weight, class weights, targets or gradients, see ``_splitting``) of the
+node samples falling in that bin.
+"""
+import time
+
+import numpy as np
+
+from ._backend import (cuda_available, get_histogram_builder,
+                       register_backend, require_extension, resolve_backend)
+from ._binning import SparseBinnedMatrix
+from ._memory import get_memory_pool
+from ._profiling import is_active, record, record_kernel, record_time
+
+HISTOGRAM_DTYPE = np.float64
+
+
+class CPUHistogramBuilder(object):
+    """Vectorized NumPy histogram builder.
+
+    Bins are offset by ``feature * n_bins`` so that the histogram of all
+    features is a single ``bincount`` per statistic; rows are processed in
+    chunks to bound the size of the temporaries.
+
+    On a ``SparseBinnedMatrix`` only the stored values of the node rows are
+    visited. The implicit zeros of a feature get the node totals minus the
+    stored values, in the bin of 0.
+
+    Parameters
+    ----------
+    X_binned : ndarray of uint8 or uint16, shape (n_samples, n_features)
+        Binned training data, or a ``SparseBinnedMatrix``.
+
+    n_bins : int
+        Number of bins of the widest feature.
+
+    pool : HostMemoryPool or None
+        Where histograms and scratch buffers come from, the process wide
+        host pool by default. Histograms go back with ``free``.
+    """
+
+    # row gathers are the hot loop, they want a row major matrix
+    preferred_order = 'C'
+    accepts_sparse = True
+    # cells (rows * features) per bincount call
+    chunk_cells = 1 << 20
+
+    def __init__(self, X_binned, n_bins, pool=None):
+        self.X_binned = X_binned
+        self.n_bins = n_bins
+        self.pool = get_memory_pool() if pool is None else pool
+        self.stats = None
+        self._offsets = np.arange(X_binned.shape[1], dtype=np.intp) * n_bins
+
+    def set_stats(self, stats):
+        """Set the ``(n_samples, n_stats)`` per-sample statistics."""
+        self.stats = np.ascontiguousarray(stats, dtype=HISTOGRAM_DTYPE)
+
+    def build(self, sample_indices):
+        with record('histogram'):
+            return self._build(sample_indices)
+
+    def _build(self, sample_indices):
+        if isinstance(self.X_binned, SparseBinnedMatrix):
+            return self._build_sparse(sample_indices)
+        n_features = self.X_binned.shape[1]
+        n_stats = self.stats.shape[1]
+        size = n_features * self.n_bins
+        hist = self.pool.zeros((n_features, self.n_bins, n_stats),
+                               dtype=HISTOGRAM_DTYPE)
+        flat_hist = hist.reshape(size, n_stats)
+        chunk = min(max(1, self.chunk_cells // max(n_features, 1)),
+                    max(len(sample_indices), 1))
+        scratch = self.pool.empty((chunk, n_features), dtype=np.intp)
+        for start in range(0, len(sample_indices), chunk):
+            rows = sample_indices[start:start + chunk]
+            flat = scratch[:len(rows)]
+            np.add(self.X_binned.take(rows, axis=0), self._offsets, out=flat)
+            flat = flat.ravel()
+            stats = self.stats.take(rows, axis=0)
+            for k in range(n_stats):
+                flat_hist[:, k] += np.bincount(
+                    flat, weights=np.repeat(stats[:, k], n_features),
+                    minlength=size)
+        self.pool.free(scratch)
+        return hist
+
+    def _build_sparse(self, sample_indices):
+        csr = self.X_binned.csr
+        n_features = csr.shape[1]
+        n_stats = self.stats.shape[1]
+        size = n_features * self.n_bins
+        hist = self.pool.zeros((n_features, self.n_bins, n_stats),
+                               dtype=HISTOGRAM_DTYPE)
+        flat_hist = hist.reshape(size, n_stats)
+        starts = csr.indptr[:-1]
+        counts = np.diff(csr.indptr)
+        totals = np.zeros(n_stats, dtype=HISTOGRAM_DTYPE)
+        # chunks of rows holding about chunk_cells stored values
+        chunk = max(1, self.chunk_cells * len(sample_indices)
+                    // max(int(counts.take(sample_indices).sum()), 1))
+        for start in range(0, len(sample_indices), chunk):
+            rows = sample_indices[start:start + chunk]
+            row_counts = counts.take(rows)
+            n_stored = int(row_counts.sum())
+            stats = self.stats.take(rows, axis=0)
+            totals += stats.sum(axis=0)
+            if n_stored == 0:
+                continue
+            # positions of the stored values of the rows in the CSR arrays
+            shifts = starts.take(rows) - (np.cumsum(row_counts) - row_counts)
+            positions = np.repeat(shifts, row_counts) + np.arange(n_stored)
+            flat = (csr.indices.take(positions).astype(np.intp) * self.n_bins
+                    + csr.data.take(positions))
+            owners = np.repeat(np.arange(len(rows)), row_counts)
+            for k in range(n_stats):
+                flat_hist[:, k] += np.bincount(
+                    flat, weights=stats[owners, k], minlength=size)
+        # implicit zeros: whatever the stored values of a feature miss
+        zeros = totals - hist.sum(axis=1)
+        hist[np.arange(n_features), self.X_binned.zero_bins] += zeros
+        return hist
+
+    def free(self, hist):
+        """Hand a histogram returned by ``build`` back to the pool."""
+        self.pool.free(hist)
+
+
+class CUDAHistogramBuilder(object):
+    """Histogram builder running the ``_tree_gpu`` kernels.
+
+    The binned matrix is uploaded once, per node only the sample indices
+    travel to the device. When the matrix and the statistics do not fit in
+    half of the free device memory they stay on the host and every build
+    streams the row chunks holding node samples through the device.
+
+    Uploads go through pinned staging buffers on ``n_streams`` streams:
+    the copy of a chunk, or of a batch of sample indices, overlaps the
+    kernel of the previous one.
+    """
+
+    # one feature column per grid row, coalesced column reads
+    preferred_order = 'F'
+    accepts_sparse = False
+    # rows per streamed chunk, -1 streams only when the data does not fit
+    chunk_rows = -1
+    # streams (and chunk buffers) of the upload pipeline, 2 double buffers
+    n_streams = 2
+
+    def __init__(self, X_binned, n_bins, pool=None):
+        _tree_gpu = require_extension("the 'cuda' backend")
+        self.n_bins = n_bins
+        # device buffers come from the extension pool, the host copies of
+        # the histograms from this one
+        self.pool = get_memory_pool() if pool is None else pool
+        self._builder = _tree_gpu.HistogramBuilder(
+            np.asfortranarray(X_binned), n_bins, self.chunk_rows,
+            self.n_streams)
+
+    def set_stats(self, stats):
+        stats = np.ascontiguousarray(stats, dtype=HISTOGRAM_DTYPE)
+        self._builder.profile = is_active()
+        # the first call also uploads the binned matrix
+        with record('transfer'):
+            self._builder.set_stats(stats)
+        if self._builder.profile:
+            record_kernel('stats_upload',
+                          self._builder.timings['upload_ms'] * 1e-3)
+
+    def build(self, sample_indices):
+        builder = self._builder
+        builder.profile = is_active()
+        hist = self.pool.empty((builder.n_features, builder.n_bins,
+                                builder.n_stats), dtype=HISTOGRAM_DTYPE)
+        sample_indices = np.ascontiguousarray(sample_indices, dtype=np.uint32)
+        if not builder.profile:
+            return builder.build(sample_indices, hist)
+        # split the wall time of the call between the copies and the kernel
+        start = time.perf_counter()
+        builder.build(sample_indices, hist)
+        elapsed = time.perf_counter() - start
+        timings = builder.timings
+        transfer = (timings['upload_ms'] + timings['download_ms']) * 1e-3
+        record_kernel('indices_upload', timings['upload_ms'] * 1e-3)
+        record_kernel('histogram', timings['kernel_ms'] * 1e-3)
+        record_kernel('histogram_download', timings['download_ms'] * 1e-3)
+        record_time('transfer', transfer)
+        record_time('histogram', max(elapsed - transfer, 0.))
+        return hist
+
+    def free(self, hist):
+        self.pool.free(hist)
+
+
+register_backend('cpu', CPUHistogramBuilder, priority=0)
+register_backend('cuda', CUDAHistogramBuilder, cuda_available, priority=10)
+
+__all__ = ["CPUHistogramBuilder", "CUDAHistogramBuilder", "cuda_available",
+           "get_histogram_builder", "resolve_backend"]
@@ -0,0 +1,183 @@
+"""Caching memory pools.
+
+Growing a tree allocates a histogram per node and a few scratch arrays per
+histogram, and a forest or a boosting run grows hundreds of trees of the
+same shape. Instead of going to the allocator every time, freed buffers are
+kept in per size class free lists and handed out again.
+
+Requests are rounded up to a size class (powers of 2 from 512 bytes, then
+multiples of 1 MiB) and at most ``max_cached_bytes`` stay cached. The CUDA
+extension has the same allocator over ``cudaMalloc`` and pinned host
+memory (``src/memory_pool.cu``); ``HostMemoryPool`` is its NumPy twin used
+by the CPU builders, and the reference the device pool is checked against.
+"""
+import numbers
+import threading
+import weakref
+
+import numpy as np
+
+from ._backend import require_extension
+
+__all__ = ["HostMemoryPool", "CUDAMemoryPool", "get_memory_pool"]
+
+MIN_BLOCK = 512
+LARGE_BLOCK = 1 << 20
+DEFAULT_MAX_CACHED_BYTES = 1 << 30
+
+
+def size_class(nbytes):
+    """Bytes actually reserved for a request of ``nbytes``."""
+    nbytes = max(int(nbytes), 1)
+    if nbytes >= LARGE_BLOCK:
+        return -(-nbytes // LARGE_BLOCK) * LARGE_BLOCK
+    return max(MIN_BLOCK, 1 << (nbytes - 1).bit_length())
+
+
+class HostMemoryPool(object):
+    """Caching allocator of NumPy arrays.
+
+    Arrays come from ``empty`` or ``zeros`` and go back with ``free``; after
+    ``free`` the caller must not touch the array (nor views of it) again.
+    Arrays that are garbage collected without ``free`` are simply not
+    reused.
+
+    Parameters
+    ----------
+    max_cached_bytes : int
+        Bytes of freed blocks kept for reuse, beyond that they are dropped.
+    """
+
+    def __init__(self, max_cached_bytes=DEFAULT_MAX_CACHED_BYTES):
+        self.max_cached_bytes = max_cached_bytes
+        self._lock = threading.Lock()
+        self._free_blocks = {}
+        self._in_use = {}
+        self.bytes_in_use = 0
+        self.bytes_cached = 0
+        self.peak_bytes_in_use = 0
+        self.hits = 0
+        self.misses = 0
+
+    def empty(self, shape, dtype=np.float64):
+        """Uninitialized C contiguous array of the given shape and dtype."""
+        dtype = np.dtype(dtype)
+        if isinstance(shape, numbers.Integral):
+            shape = (shape,)
+        shape = tuple(int(n) for n in shape)
+        nbytes = int(np.prod(shape, dtype=np.intp)) * dtype.itemsize
+        size = size_class(nbytes)
+        with self._lock:
+            bucket = self._free_blocks.get(size)
+            if bucket:
+                block = bucket.pop()
+                self.bytes_cached -= size
+                self.hits += 1
+            else:
+                block = np.empty(size, dtype=np.uint8)
+                self.misses += 1
+            array = block[:nbytes].view(dtype).reshape(shape)
+            key = id(array)
+            # forget the block, not reuse it, when the array is dropped
+            finalizer = weakref.finalize(array, self._forget, key)
+            finalizer.atexit = False
+            self._in_use[key] = (block, finalizer)
+            self.bytes_in_use += size
+            self.peak_bytes_in_use = max(self.peak_bytes_in_use,
+                                         self.bytes_in_use)
+        return array
+
+    def zeros(self, shape, dtype=np.float64):
+        array = self.empty(shape, dtype)
+        array.fill(0)
+        return array
+
+    def free(self, array):
+        """Give an array obtained from this pool back for reuse."""
+        with self._lock:
+            entry = self._in_use.pop(id(array), None)
+            if entry is None:
+                raise ValueError("array was not allocated by this pool or "
+                                 "was already freed")
+            block, finalizer = entry
+            finalizer.detach()
+            size = block.shape[0]
+            self.bytes_in_use -= size
+            if self.bytes_cached + size > self.max_cached_bytes:
+                return
+            self._free_blocks.setdefault(size, []).append(block)
+            self.bytes_cached += size
+
+    def _forget(self, key):
+        with self._lock:
+            entry = self._in_use.pop(key, None)
+            if entry is not None:
+                self.bytes_in_use -= entry[0].shape[0]
+
+    def stats(self):
+        """Dict of counters, the keys of the device pool statistics."""
+        with self._lock:
+            return {'bytes_in_use': self.bytes_in_use,
+                    'bytes_cached': self.bytes_cached,
+                    'peak_bytes_in_use': self.peak_bytes_in_use,
+                    'max_cached_bytes': self.max_cached_bytes,
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+    def set_limit(self, max_cached_bytes):
+        """Change ``max_cached_bytes``, dropping the cache if it is over."""
+        self.max_cached_bytes = max_cached_bytes
+        if self.bytes_cached > max_cached_bytes:
+            self.release()
+
+    def release(self):
+        """Drop every cached block."""
+        with self._lock:
+            self._free_blocks.clear()
+            self.bytes_cached = 0
+
+
+class CUDAMemoryPool(object):
+    """Handle on one of the ``_tree_gpu`` caching allocators.
+
+    Allocation happens inside the extension, this only exposes the
+    statistics and the cache controls of ``HostMemoryPool``.
+
+    Parameters
+    ----------
+    kind : {'device', 'pinned'}
+    """
+
+    def __init__(self, kind='device'):
+        self._extension = require_extension("the CUDA memory pools")
+        self.kind = kind
+        self._kind = self._extension.POOL_KINDS[kind]
+
+    def stats(self):
+        return self._extension.pool_stats(self._kind)
+
+    def set_limit(self, max_cached_bytes):
+        self._extension.pool_set_limit(self._kind, max_cached_bytes)
+
+    def release(self):
+        self._extension.pool_release(self._kind)
+
+
+_host_pool = HostMemoryPool()
+
+
+def get_memory_pool(kind='host'):
+    """The process wide pool of the given kind.
+
+    Parameters
+    ----------
+    kind : {'host', 'device', 'pinned'}
+        'host' is the NumPy pool of the CPU builders, 'device' and 'pinned'
+        the CUDA pools (they need the extension).
+    """
+    if kind == 'host':
+        return _host_pool
+    if kind in ('device', 'pinned'):
+        return CUDAMemoryPool(kind)
+    raise ValueError("kind should be one of 'host', 'device', 'pinned', "
+                     "got %r" % (kind,))
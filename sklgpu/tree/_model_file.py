@@ -0,0 +1,347 @@
+"""Fitted estimators in a memory mappable binary file.
+
+``save_model`` writes a fitted tree, forest or gradient boosting model as
+a fixed header, a JSON description of the estimator and its arrays at 64
+byte aligned offsets::
+
+    offset 0   magic b'SKLGPUMF'
+           8   format version, uint32 little endian
+          12   reserved, uint32
+          16   length of the JSON description in bytes, uint64
+          24   the JSON description (utf-8), zero padded
+           *   the arrays, little endian, C order, each at a multiple of
+               ALIGNMENT from the start of the array section
+
+The nodes of all the trees are stored once, as the concatenated arrays of
+their ``TreeEnsemble``, with its category bitsets when it has categorical
+splits. ``load_model`` maps the file with ``np.memmap``
+(or wraps a buffer with ``np.frombuffer``) and builds the estimator around
+views of it: nothing is unpickled or copied, so loading costs the parsing
+of the description whatever the size of the trees, and the processes
+serving one file share its pages through the page cache.
+
+The description holds the estimator state as tagged JSON: plain values as
+they are, arrays as references to the array section, trees as indices in
+the ensemble, ``RandomState`` instances as their ``get_state()`` and
+objects of sklgpu classes as their class and state. Only classes of the
+``sklgpu`` package are instantiated when loading. Callables, e.g. a
+``scoring`` function, cannot be written as data: the description keeps
+their name and they load as None, to be set again with ``set_params``
+before the loaded model is fitted further.
+"""
+import importlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from ._tree import _CATEGORY_ARRAYS, _NODE_ARRAYS, Tree, TreeEnsemble
+
+__all__ = ["save_model", "load_model"]
+
+MAGIC = b'SKLGPUMF'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+# magic, version, reserved, description length
+_HEADER = struct.Struct('<8sIIQ')
+
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+def _model_trees(model):
+    """``(trees, ensemble)`` of a fitted estimator, the trees in the order
+    of the ensemble."""
+    if getattr(model, 'tree_', None) is not None:
+        trees = [model.tree_]
+        return trees, TreeEnsemble(trees)
+    if getattr(model, 'estimators_', None) is not None:
+        return ([estimator.tree_ for estimator in model.estimators_],
+                model._tree_ensemble())
+    if getattr(model, '_predictors', None) is not None:
+        return ([tree for predictors in model._predictors
+                 for tree in predictors], model._tree_ensemble())
+    raise TypeError("expected a fitted tree, forest or gradient boosting "
+                    "estimator of sklgpu, got %r" % model)
+
+
+class _Encoder(object):
+    """Estimator state to tagged JSON, collecting the arrays."""
+
+    def __init__(self, trees):
+        self.arrays = []
+        # arrays and lists shared between estimators, e.g. the bin
+        # thresholds of a forest, are written once; the memo holds them so
+        # that their ids are not reused by temporary states
+        self._memo = {}
+        self._tree_index = {id(tree): i for i, tree in enumerate(trees)}
+
+    def array(self, array):
+        array = np.ascontiguousarray(array)
+        if array.dtype.byteorder == '>':
+            array = array.astype(array.dtype.newbyteorder('<'))
+        self.arrays.append(array)
+        return len(self.arrays) - 1
+
+    def encode(self, value):
+        if value is None or isinstance(value, (bool, str)):
+            return value
+        if isinstance(value, (int, float)) and type(value) in (int, float):
+            return value
+        if isinstance(value, np.generic):
+            return {'__scalar__': [value.dtype.str, value.item()]}
+        if isinstance(value, np.dtype):
+            return {'__dtype__': value.str}
+        if isinstance(value, np.ndarray):
+            if value.dtype.hasobject:
+                return {'__object_array__': [
+                    value.dtype.str, list(value.shape),
+                    [self.encode(v) for v in value.ravel()]]}
+            if id(value) not in self._memo:
+                self._memo[id(value)] = (value,
+                                         {'__array__': self.array(value)})
+            return self._memo[id(value)][1]
+        if isinstance(value, Tree):
+            if id(value) not in self._tree_index:
+                raise TypeError("tree %r is not part of the model" % value)
+            return {'__tree__': self._tree_index[id(value)]}
+        if isinstance(value, (list, tuple)):
+            if (len(value) > 1 and all(isinstance(v, np.ndarray)
+                                       and v.ndim == 1 for v in value)
+                    and len(set(v.dtype for v in value)) == 1
+                    and not value[0].dtype.hasobject):
+                # many small arrays, e.g. the bin thresholds of every
+                # feature, as one array and offsets
+                if id(value) not in self._memo:
+                    offsets = np.cumsum([0] + [len(v) for v in value])
+                    self._memo[id(value)] = (value, {'__ragged__': [
+                        self.array(np.concatenate(value)),
+                        self.array(offsets), isinstance(value, tuple)]})
+                return self._memo[id(value)][1]
+            items = [self.encode(v) for v in value]
+            return {'__tuple__': items} if isinstance(value, tuple) else items
+        if isinstance(value, dict):
+            if not all(isinstance(key, str) for key in value):
+                raise TypeError("cannot save a dict with non string keys")
+            return {'__dict__': {key: self.encode(v)
+                                 for key, v in value.items()}}
+        if isinstance(value, np.random.RandomState):
+            return {'__random_state__': self.encode(value.get_state())}
+        cls = type(value)
+        if cls.__module__.split('.')[0] == 'sklgpu' and hasattr(value,
+                                                                '__dict__'):
+            state = (value.__getstate__() if hasattr(value, '__getstate__')
+                     else value.__dict__)
+            if state is None:
+                # object.__getstate__ of an empty instance dict
+                state = {}
+            if not isinstance(state, dict):
+                raise TypeError("cannot save the state of %r" % value)
+            return {'__object__': ['%s:%s' % (cls.__module__,
+                                              cls.__qualname__),
+                                   self.encode(state)]}
+        if callable(value):
+            return {'__callable__': '%s:%s' % (
+                getattr(value, '__module__', None) or cls.__module__,
+                getattr(value, '__qualname__', cls.__qualname__))}
+        raise TypeError("cannot save %r of type %s in a model file"
+                        % (value, cls.__name__))
+
+
+class _Decoder(object):
+    """Tagged JSON back to the estimator state, arrays as views."""
+
+    def __init__(self, arrays, trees):
+        self.arrays = arrays
+        self.trees = trees
+
+    def decode(self, value):
+        if isinstance(value, list):
+            return [self.decode(v) for v in value]
+        if not isinstance(value, dict):
+            return value
+        (tag, content), = value.items()
+        if tag == '__array__':
+            return self.arrays[content]
+        if tag == '__tree__':
+            return self.trees[content]
+        if tag == '__tuple__':
+            return tuple(self.decode(v) for v in content)
+        if tag == '__dict__':
+            return {key: self.decode(v) for key, v in content.items()}
+        if tag == '__scalar__':
+            return np.dtype(content[0]).type(content[1])
+        if tag == '__dtype__':
+            return np.dtype(content)
+        if tag == '__object_array__':
+            array = np.empty(len(content[2]), dtype=np.dtype(content[0]))
+            array[:] = [self.decode(v) for v in content[2]]
+            return array.reshape(content[1])
+        if tag == '__ragged__':
+            data, offsets = self.arrays[content[0]], self.arrays[content[1]]
+            views = [data[start:end]
+                     for start, end in zip(offsets[:-1], offsets[1:])]
+            return tuple(views) if content[2] else views
+        if tag == '__random_state__':
+            random_state = np.random.RandomState()
+            random_state.set_state(self.decode(content))
+            return random_state
+        if tag == '__callable__':
+            # not saved, see the module docstring
+            return None
+        if tag == '__object__':
+            return self.instance(content[0], self.decode(content[1]))
+        raise ValueError("unknown entry %r in the model description" % tag)
+
+    @staticmethod
+    def instance(path, state):
+        module, _, qualname = path.partition(':')
+        if module.split('.')[0] != 'sklgpu':
+            raise ValueError("model files only hold sklgpu classes, got %s"
+                             % path)
+        cls = importlib.import_module(module)
+        for name in qualname.split('.'):
+            cls = getattr(cls, name)
+        obj = cls.__new__(cls)
+        if hasattr(obj, '__setstate__'):
+            obj.__setstate__(state)
+        else:
+            obj.__dict__.update(state)
+        return obj
+
+
+def save_model(model, file):
+    """Write a fitted estimator to a model file.
+
+    Parameters
+    ----------
+    model : fitted estimator
+        A decision tree, random forest or histogram gradient boosting model
+        of sklgpu.
+
+    file : str or file object
+        A path, written to a temporary file first and renamed, so readers
+        never map a partial file; or a binary file object.
+
+    Notes
+    -----
+    Callable parameters, e.g. a ``scoring`` function, are not saved: the
+    loaded model has None in their place.
+    """
+    trees, ensemble = _model_trees(model)
+    encoder = _Encoder(trees)
+    description = {
+        'model': encoder.encode(model),
+        'ensemble': {
+            'arrays': {name: encoder.array(getattr(ensemble, name))
+                       for name in _NODE_ARRAYS},
+            'roots': encoder.array(ensemble.roots.astype(np.int64)),
+            'output_offsets': encoder.array(
+                ensemble.output_offsets.astype(np.int64)),
+            'n_outputs': int(ensemble.n_outputs),
+            'max_depths': [int(tree.max_depth) for tree in trees]},
+    }
+    if ensemble.category_split is not None:
+        layout = description['ensemble']
+        layout['arrays'].update(
+            (name, encoder.array(getattr(ensemble, name)))
+            for name in _CATEGORY_ARRAYS)
+        layout['category_roots'] = encoder.array(
+            ensemble.category_roots.astype(np.int64))
+    layout = []
+    offset = 0
+    for array in encoder.arrays:
+        layout.append([offset, array.dtype.str, list(array.shape)])
+        offset += array.nbytes + _padding(array.nbytes)
+    description['arrays'] = layout
+    text = json.dumps(description, separators=(',', ':')).encode('utf-8')
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(text))
+
+    def write(f):
+        f.write(header)
+        f.write(text)
+        f.write(b'\0' * _padding(len(header) + len(text)))
+        for array in encoder.arrays:
+            f.write(array.tobytes())
+            f.write(b'\0' * _padding(array.nbytes))
+
+    if hasattr(file, 'write'):
+        write(file)
+        return
+    temporary = '%s.%d.tmp' % (file, os.getpid())
+    try:
+        with open(temporary, 'wb') as f:
+            write(f)
+        os.replace(temporary, file)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def load_model(file, mmap_mode='r'):
+    """Load an estimator written by ``save_model``.
+
+    Parameters
+    ----------
+    file : str or bytes-like
+        A path, or the content of a model file.
+
+    mmap_mode : {'r', 'c', None}, optional (default='r')
+        How a path is mapped: 'r' shares the read only pages of the file
+        between processes, 'c' maps them copy on write (for models that
+        are fitted further, e.g. with ``warm_start``), None reads the file
+        into memory.
+
+    Returns
+    -------
+    model : estimator
+        Its node arrays, bin thresholds and other arrays are views of the
+        file.
+    """
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        buffer = np.frombuffer(file, dtype=np.uint8)
+    elif mmap_mode is None:
+        buffer = np.fromfile(file, dtype=np.uint8)
+    elif mmap_mode in ('r', 'c'):
+        buffer = np.memmap(file, dtype=np.uint8, mode=mmap_mode)
+    else:
+        raise ValueError("mmap_mode should be 'r', 'c' or None, got %r"
+                         % (mmap_mode,))
+    if buffer.shape[0] < _HEADER.size:
+        raise ValueError("not a sklgpu model file: too short")
+    magic, version, _, length = _HEADER.unpack(
+        bytes(buffer[:_HEADER.size]))
+    if magic != MAGIC:
+        raise ValueError("not a sklgpu model file")
+    if version > FORMAT_VERSION:
+        raise ValueError("model file format %d is newer than the %d this "
+                         "version of sklgpu reads" % (version, FORMAT_VERSION))
+    end = _HEADER.size + length
+    description = json.loads(bytes(buffer[_HEADER.size:end]).decode('utf-8'))
+    start = end + _padding(end)
+
+    arrays = []
+    for offset, dtype, shape in description['arrays']:
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        first = start + offset
+        if first + size > buffer.shape[0]:
+            raise ValueError("truncated model file")
+        arrays.append(buffer[first:first + size].view(dtype).reshape(shape))
+
+    layout = description['ensemble']
+    category_roots = layout.get('category_roots')
+    ensemble = TreeEnsemble.from_arrays(
+        {name: arrays[index] for name, index in layout['arrays'].items()},
+        arrays[layout['roots']], arrays[layout['output_offsets']],
+        layout['n_outputs'],
+        None if category_roots is None else arrays[category_roots])
+    trees = ensemble.trees(layout['max_depths'])
+    model = _Decoder(arrays, trees).decode(description['model'])
+    if hasattr(type(model), '_tree_ensemble'):
+        # prediction goes through the mapped arrays rather than a copy
+        model._ensemble = ensemble
+    return model
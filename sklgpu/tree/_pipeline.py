@@ -0,0 +1,386 @@
+"""CPU emulation of the CUDA transfer pipeline.
+
+``src/pipeline.h`` feeds the histogram, reduction and prediction kernels
+through a few slots, each with its own stream and pinned staging buffers:
+the host packs item ``i + 1`` into one slot and queues its upload while
+the kernel of item ``i`` runs on another stream, and a slot is only
+reused once its previous item completed and was retired. This module runs
+the same loop with threads standing in for the streams, so the ordering
+and buffer reuse logic can be exercised, and its overlap measured,
+without a GPU:
+
+- a ``HostStream`` is a single worker thread, work queued on one stream
+  runs in order and work on different streams concurrently, like CUDA
+  streams; ``record`` returns a future playing the CUDA event;
+- a ``HostPipeline`` owns the slots and runs ``upload / launch /
+  download`` for every item and ``retire`` once it is done, in the order
+  of ``runPipeline``;
+- ``PredictStage`` and ``ReduceStage`` are the stages of the prediction
+  and reduction pipelines, with NumPy kernels, so their results can be
+  checked against ``TreeEnsemble.predict`` and ``reduce``.
+
+Every queued operation is logged in ``HostPipeline.timeline`` as
+``(kind, item, stream, start, end)``.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ._reduction import DEFAULT_BLOCK_SIZE, _UFUNCS, _block_partials
+
+__all__ = ["HostStream", "HostPipeline", "PredictStage", "ReduceStage",
+           "emulate_predict", "emulate_reduce"]
+
+# mirrors of src/pipeline.h and src/reduction.cu
+MAX_STREAMS = 8
+DEFAULT_STREAMS = 2
+REDUCE_CHUNK = 1 << 20
+
+
+class HostStream(object):
+    """In order work queue on a thread, the CPU twin of a CUDA stream.
+
+    The calls return at once. As with CUDA, an error is sticky: the work
+    queued after a failed operation is skipped and ``record`` futures
+    raise the error.
+    """
+
+    def __init__(self, name, timeline=None):
+        self.name = name
+        self.error = None
+        self._timeline = timeline
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix=name)
+
+    def _submit(self, kind, item, func, *args):
+        def run():
+            if self.error is not None:
+                raise self.error
+            start = time.perf_counter()
+            try:
+                func(*args)
+            except Exception as e:
+                self.error = e
+                raise
+            if self._timeline is not None and kind is not None:
+                # list.append is atomic, the streams share the timeline
+                self._timeline.append((kind, item, self.name, start,
+                                       time.perf_counter()))
+        return self._executor.submit(run)
+
+    def upload(self, dst, src, item=None):
+        """Queue a host to device copy, ``cudaMemcpyAsync``."""
+        return self._submit('upload', item, np.copyto, dst, src)
+
+    def download(self, dst, src, item=None):
+        """Queue a device to host copy."""
+        return self._submit('download', item, np.copyto, dst, src)
+
+    def launch(self, kernel, *args, item=None):
+        """Queue ``kernel(*args)``."""
+        return self._submit('kernel', item, kernel, *args)
+
+    def record(self):
+        """Future completing when the work queued so far has, the CUDA
+        event."""
+        return self._submit(None, None, _no_op)
+
+    def synchronize(self):
+        self.record().result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def _no_op():
+    pass
+
+
+class HostSlot(object):
+    """Stream, staging ("pinned") and device buffers of one slot, as raw
+    bytes the stages view with the dtype and shape they need."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.done = None
+        self.h_in = self.d_in = self.h_out = self.d_out = _buffer(0)
+        # free for the stage, e.g. the chunk the slot buffers hold
+        self.tag = -1
+
+    def reserve(self, in_bytes, out_bytes):
+        if self.h_in.nbytes < in_bytes:
+            self.h_in, self.d_in = _buffer(in_bytes), _buffer(in_bytes)
+        if self.h_out.nbytes < out_bytes:
+            self.h_out, self.d_out = _buffer(out_bytes), _buffer(out_bytes)
+
+
+def _buffer(nbytes):
+    return np.empty(nbytes, dtype=np.uint8)
+
+
+def _view(buffer, dtype, shape):
+    """First elements of a raw buffer as an array of the given shape."""
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape, dtype=np.intp))
+    return buffer[:count * dtype.itemsize].view(dtype).reshape(shape)
+
+
+class HostPipeline(object):
+    """Slots of the emulated pipeline and the loop driving them.
+
+    Parameters
+    ----------
+    n_streams : int
+        Slots, 1 to 8; 2 is double buffering.
+
+    Attributes
+    ----------
+    timeline : list of tuple
+        ``(kind, item, stream, start, end)`` of every upload, kernel and
+        download, ``kind`` one of 'upload', 'kernel', 'download'.
+    """
+
+    def __init__(self, n_streams=DEFAULT_STREAMS):
+        if not 1 <= n_streams <= MAX_STREAMS:
+            raise ValueError("n_streams should be between 1 and %d, got %r"
+                             % (MAX_STREAMS, n_streams))
+        self.n_streams = n_streams
+        self.timeline = []
+        self.slots = [HostSlot(HostStream('stream%d' % s, self.timeline))
+                      for s in range(n_streams)]
+
+    def run(self, n_items, stage):
+        """Run ``n_items`` items of ``stage`` through the slots, item ``i``
+        on slot ``i % n_streams``, and retire them in order.
+
+        The stage has ``in_bytes`` and ``out_bytes`` attributes (buffer
+        sizes per slot) and the methods ``upload(item, slot)``,
+        ``launch(item, slot)``, ``download(item, slot)`` that queue work on
+        ``slot.stream`` and ``retire(item, slot)`` called once the item is
+        done. The first error is raised after the items in flight were
+        waited for.
+        """
+        for slot in self.slots:
+            slot.reserve(stage.in_bytes, stage.out_bytes)
+        error = None
+        issued = retired = 0
+        while retired < issued or (error is None and issued < n_items):
+            issue = error is None and issued < n_items
+            # retire the oldest item when its slot is needed or at the end
+            if retired < issued and (not issue
+                                     or issued - retired == self.n_streams):
+                slot = self.slots[retired % self.n_streams]
+                try:
+                    slot.done.result()
+                    if error is None:
+                        stage.retire(retired, slot)
+                except Exception as e:
+                    error = error or e
+                retired += 1
+                continue
+            slot = self.slots[issued % self.n_streams]
+            try:
+                stage.upload(issued, slot)
+                stage.launch(issued, slot)
+                stage.download(issued, slot)
+            except Exception as e:
+                error = e
+            # recorded even after an error, the retire loop waits on it
+            slot.done = slot.stream.record()
+            issued += 1
+        if error is not None:
+            for slot in self.slots:
+                # errors do not outlive the run here
+                slot.stream.error = None
+            raise error
+
+    def overlap(self):
+        """Seconds during which a copy of one item ran while a kernel of
+        another item did, from the timeline."""
+        copies = [(start, end, item)
+                  for kind, item, _, start, end in self.timeline
+                  if kind != 'kernel']
+        kernels = [(start, end, item)
+                   for kind, item, _, start, end in self.timeline
+                   if kind == 'kernel']
+        total = 0.
+        for c_start, c_end, c_item in copies:
+            for k_start, k_end, k_item in kernels:
+                if c_item != k_item:
+                    total += max(0., min(c_end, k_end)
+                                 - max(c_start, k_start))
+        return total
+
+    def close(self):
+        for slot in self.slots:
+            slot.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+class PredictStage(object):
+    """Stage of ``src/predict.cu``: row chunks of ``X`` in, the sums of the
+    ensemble leaf values out."""
+
+    def __init__(self, ensemble, X, out, chunk_rows):
+        self.ensemble = ensemble
+        self.X = X
+        self.out = out
+        self.chunk_rows = chunk_rows
+        self.in_bytes = chunk_rows * X.shape[1] * X.itemsize
+        self.out_bytes = chunk_rows * out.shape[1] * out.itemsize
+
+    @property
+    def n_items(self):
+        return -(-self.X.shape[0] // self.chunk_rows)
+
+    def _rows(self, item):
+        start = item * self.chunk_rows
+        return slice(start, min(start + self.chunk_rows, self.X.shape[0]))
+
+    def _shape(self, item, width):
+        rows = self._rows(item)
+        return (rows.stop - rows.start, width)
+
+    def upload(self, item, slot):
+        shape = self._shape(item, self.X.shape[1])
+        staging = _view(slot.h_in, np.float64, shape)
+        # packed by the host while the other slots run
+        np.copyto(staging, self.X[self._rows(item)])
+        slot.stream.upload(_view(slot.d_in, np.float64, shape), staging,
+                           item=item)
+
+    def launch(self, item, slot):
+        rows = _view(slot.d_in, np.float64,
+                     self._shape(item, self.X.shape[1]))
+        out = _view(slot.d_out, np.float64,
+                    self._shape(item, self.out.shape[1]))
+        slot.stream.launch(self._kernel, rows, out, item=item)
+
+    def _kernel(self, rows, out):
+        np.copyto(out, self.ensemble.predict(rows))
+
+    def download(self, item, slot):
+        shape = self._shape(item, self.out.shape[1])
+        slot.stream.download(_view(slot.h_out, np.float64, shape),
+                             _view(slot.d_out, np.float64, shape), item=item)
+
+    def retire(self, item, slot):
+        self.out[self._rows(item)] = _view(
+            slot.h_out, np.float64, self._shape(item, self.out.shape[1]))
+
+
+class ReduceStage(object):
+    """Stage of the ``src/reduction.cu`` reductions: chunks of ``x`` in,
+    block partials out, folded in block order when retired."""
+
+    def __init__(self, x, op='sum', variant='unrolled',
+                 block_size=DEFAULT_BLOCK_SIZE, chunk=REDUCE_CHUNK):
+        self.x = x
+        self.op = op
+        self.variant = variant
+        self.block_size = block_size
+        per_block = 2 * block_size if variant == 'unrolled' else block_size
+        if chunk % per_block:
+            raise ValueError("chunk should be a multiple of the %d elements "
+                             "of a block" % per_block)
+        self.chunk = min(chunk, max(x.shape[0], 1))
+        self.per_block = per_block
+        self.in_bytes = self.chunk * x.itemsize
+        self.out_bytes = self._blocks(self.chunk) * x.itemsize
+        self.result = None
+
+    @property
+    def n_items(self):
+        return max(1, -(-self.x.shape[0] // self.chunk))
+
+    def _count(self, item):
+        return max(0, min(self.chunk, self.x.shape[0] - item * self.chunk))
+
+    def _blocks(self, count):
+        return max(1, -(-count // self.per_block))
+
+    def upload(self, item, slot):
+        count = self._count(item)
+        staging = _view(slot.h_in, self.x.dtype, (count,))
+        np.copyto(staging, self.x[item * self.chunk:item * self.chunk + count])
+        slot.stream.upload(_view(slot.d_in, self.x.dtype, (count,)),
+                           staging, item=item)
+
+    def launch(self, item, slot):
+        count = self._count(item)
+        slot.stream.launch(
+            self._kernel, _view(slot.d_in, self.x.dtype, (count,)),
+            _view(slot.d_out, self.x.dtype, (self._blocks(count),)),
+            item=item)
+
+    def _kernel(self, values, partials):
+        partials[:] = _block_partials(values, self.op, self.variant,
+                                      self.block_size)
+
+    def download(self, item, slot):
+        n_blocks = self._blocks(self._count(item))
+        slot.stream.download(_view(slot.h_out, self.x.dtype, (n_blocks,)),
+                             _view(slot.d_out, self.x.dtype, (n_blocks,)),
+                             item=item)
+
+    def retire(self, item, slot):
+        partials = _view(slot.h_out, self.x.dtype,
+                         (self._blocks(self._count(item)),))
+        if item > 0:
+            partials = np.concatenate([[self.result], partials])
+        if self.op == 'sum':
+            # the host folds the partials one after the other
+            self.result = np.cumsum(partials, dtype=self.x.dtype)[-1]
+        else:
+            self.result = _UFUNCS[self.op].reduce(partials)
+
+
+def emulate_predict(ensemble, X, chunk_rows=1 << 16, n_streams=DEFAULT_STREAMS,
+                    pipeline=None):
+    """``ensemble.predict(X)`` computed through the emulated pipeline.
+
+    Parameters
+    ----------
+    ensemble : TreeEnsemble
+
+    X : ndarray of float64, shape (n_samples, n_features)
+
+    chunk_rows : int
+        Rows per pipeline item.
+
+    n_streams : int
+        Slots of the pipeline, when ``pipeline`` is None.
+
+    pipeline : HostPipeline or None
+        Pipeline to run on, to inspect its timeline afterwards.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    out = np.zeros((X.shape[0], ensemble.n_outputs))
+    stage = PredictStage(ensemble, X, out, chunk_rows)
+    if pipeline is not None:
+        pipeline.run(stage.n_items, stage)
+        return out
+    with HostPipeline(n_streams) as pipeline:
+        pipeline.run(stage.n_items, stage)
+    return out
+
+
+def emulate_reduce(x, op='sum', variant='unrolled',
+                   block_size=DEFAULT_BLOCK_SIZE, chunk=REDUCE_CHUNK,
+                   n_streams=DEFAULT_STREAMS, pipeline=None):
+    """``reduce(x, op, variant, block_size)`` computed through the emulated
+    pipeline, ``chunk`` elements per item."""
+    x = np.ascontiguousarray(x).ravel()
+    stage = ReduceStage(x, op, variant, block_size, chunk)
+    if pipeline is not None:
+        pipeline.run(stage.n_items, stage)
+        return stage.result
+    with HostPipeline(n_streams) as pipeline:
+        pipeline.run(stage.n_items, stage)
+    return stage.result
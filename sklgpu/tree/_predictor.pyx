@@ -0,0 +1,389 @@
+# coding: utf-8
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""Row by row tree traversal over the flat node arrays of ``_tree``,
+without the GIL so that chunks of rows can be predicted on threads.
+Dense rows are read directly, CSR rows by binary search of the feature
+among the stored columns.
+
+The node arrays have the compact types of ``_tree``: int32 child ids
+relative to the root of their tree, uint16 or int32 feature ids, float32
+thresholds compared in double and float32 values summed in double. The
+splits on categorical features test the code of the row in a uint32 bitset
+of ``categories`` instead, through the optional ``category_split``,
+``categories`` and ``category_roots`` arguments.
+
+The SHAP kernels of ``_shap`` run over the root to leaf paths of the trees
+instead, one row at a time, the elements on categorical features testing
+the code of the row in their set through the optional ``category_set`` and
+``categories`` arguments."""
+from libc.stdlib cimport free, malloc
+
+cimport numpy as np
+
+np.import_array()
+
+ctypedef np.intp_t intp_t
+ctypedef np.int32_t node_t
+ctypedef np.uint32_t word_t
+
+ctypedef fused feature_t:
+	np.uint16_t
+	np.int32_t
+
+cdef node_t TREE_LEAF = -1
+
+
+cdef inline intp_t _leaf(const double[:, ::1] X, Py_ssize_t row,
+		const node_t[::1] children_left, const node_t[::1] children_right,
+		const feature_t[::1] feature, const float[::1] threshold, intp_t root) nogil:
+	cdef intp_t node = root
+	while children_left[node] != TREE_LEAF:
+		if X[row, feature[node]] <= threshold[node]:
+			node = root + children_left[node]
+		else:
+			node = root + children_right[node]
+	return node
+
+
+cdef inline bint _in_categories(double x, const word_t[:, ::1] categories,
+		intp_t row) nogil:
+	"""Whether the category code ``x`` is in the bitset ``categories[row]``,
+	codes out of its range never are."""
+	cdef intp_t code
+	if not (x >= 0 and x < categories.shape[1] * 32):
+		return False
+	code = <intp_t>x
+	return (categories[row, code >> 5] >> (code & 31)) & 1
+
+
+cdef inline bint _goes_left(double x, intp_t node,
+		const float[::1] threshold, const node_t[::1] category_split,
+		const word_t[:, ::1] categories, intp_t category_root) nogil:
+	if category_split[node] >= 0:
+		return _in_categories(x, categories, category_root + category_split[node])
+	return x <= threshold[node]
+
+
+cdef inline intp_t _leaf_categorical(const double[:, ::1] X, Py_ssize_t row,
+		const node_t[::1] children_left, const node_t[::1] children_right,
+		const feature_t[::1] feature, const float[::1] threshold,
+		const node_t[::1] category_split, const word_t[:, ::1] categories,
+		intp_t root, intp_t category_root) nogil:
+	cdef intp_t node = root
+	while children_left[node] != TREE_LEAF:
+		if _goes_left(X[row, feature[node]], node, threshold, category_split,
+				categories, category_root):
+			node = root + children_left[node]
+		else:
+			node = root + children_right[node]
+	return node
+
+
+def apply_dense(const double[:, ::1] X, const node_t[::1] children_left,
+		const node_t[::1] children_right, const feature_t[::1] feature,
+		const float[::1] threshold, const intp_t[::1] roots, intp_t[:, ::1] out,
+		const node_t[::1] category_split=None,
+		const word_t[:, ::1] categories=None,
+		const intp_t[::1] category_roots=None):
+	"""Write the node reached from ``roots[t]`` by row ``i`` to ``out[i, t]``."""
+	cdef Py_ssize_t i, t
+	cdef bint categorical = category_split is not None
+	with nogil:
+		for i in range(X.shape[0]):
+			for t in range(roots.shape[0]):
+				if categorical:
+					out[i, t] = _leaf_categorical(X, i, children_left,
+						children_right, feature, threshold, category_split,
+						categories, roots[t], category_roots[t])
+				else:
+					out[i, t] = _leaf(X, i, children_left, children_right,
+						feature, threshold, roots[t])
+
+
+def predict_sum_dense(const double[:, ::1] X, const node_t[::1] children_left,
+		const node_t[::1] children_right, const feature_t[::1] feature,
+		const float[::1] threshold, const float[:, ::1] value,
+		const intp_t[::1] roots, const intp_t[::1] output_offsets, double[:, ::1] out,
+		const node_t[::1] category_split=None,
+		const word_t[:, ::1] categories=None,
+		const intp_t[::1] category_roots=None):
+	"""Add the leaf value of every tree to ``out[i, output_offsets[t]:]``."""
+	cdef Py_ssize_t i, t, k
+	cdef Py_ssize_t width = value.shape[1]
+	cdef intp_t node, offset
+	cdef bint categorical = category_split is not None
+	with nogil:
+		for i in range(X.shape[0]):
+			for t in range(roots.shape[0]):
+				if categorical:
+					node = _leaf_categorical(X, i, children_left,
+						children_right, feature, threshold, category_split,
+						categories, roots[t], category_roots[t])
+				else:
+					node = _leaf(X, i, children_left, children_right, feature,
+						threshold, roots[t])
+				offset = output_offsets[t]
+				for k in range(width):
+					out[i, offset + k] += value[node, k]
+
+
+cdef inline double _csr_value(const double[::1] data, const intp_t[::1] indices,
+		intp_t start, intp_t end, intp_t column) nogil:
+	"""``X[row, column]`` of a CSR row with sorted indices, 0 if not stored."""
+	cdef intp_t low = start, high = end, middle
+	while low < high:
+		middle = (low + high) // 2
+		if indices[middle] < column:
+			low = middle + 1
+		else:
+			high = middle
+	if low < end and indices[low] == column:
+		return data[low]
+	return 0.
+
+
+cdef inline intp_t _leaf_csr(const double[::1] data, const intp_t[::1] indices,
+		intp_t start, intp_t end,
+		const node_t[::1] children_left, const node_t[::1] children_right,
+		const feature_t[::1] feature, const float[::1] threshold, intp_t root) nogil:
+	cdef intp_t node = root
+	while children_left[node] != TREE_LEAF:
+		if _csr_value(data, indices, start, end, feature[node]) <= threshold[node]:
+			node = root + children_left[node]
+		else:
+			node = root + children_right[node]
+	return node
+
+
+cdef inline intp_t _leaf_csr_categorical(const double[::1] data,
+		const intp_t[::1] indices, intp_t start, intp_t end,
+		const node_t[::1] children_left, const node_t[::1] children_right,
+		const feature_t[::1] feature, const float[::1] threshold,
+		const node_t[::1] category_split, const word_t[:, ::1] categories,
+		intp_t root, intp_t category_root) nogil:
+	cdef intp_t node = root
+	while children_left[node] != TREE_LEAF:
+		if _goes_left(_csr_value(data, indices, start, end, feature[node]), node,
+				threshold, category_split, categories, category_root):
+			node = root + children_left[node]
+		else:
+			node = root + children_right[node]
+	return node
+
+
+def apply_csr(const double[::1] data, const intp_t[::1] indices,
+		const intp_t[::1] indptr, const node_t[::1] children_left,
+		const node_t[::1] children_right, const feature_t[::1] feature,
+		const float[::1] threshold, const intp_t[::1] roots, intp_t[:, ::1] out,
+		const node_t[::1] category_split=None,
+		const word_t[:, ::1] categories=None,
+		const intp_t[::1] category_roots=None):
+	"""``apply_dense`` on the rows of a CSR matrix with sorted indices."""
+	cdef Py_ssize_t i, t
+	cdef bint categorical = category_split is not None
+	with nogil:
+		for i in range(indptr.shape[0] - 1):
+			for t in range(roots.shape[0]):
+				if categorical:
+					out[i, t] = _leaf_csr_categorical(data, indices, indptr[i],
+						indptr[i + 1], children_left, children_right, feature,
+						threshold, category_split, categories, roots[t],
+						category_roots[t])
+				else:
+					out[i, t] = _leaf_csr(data, indices, indptr[i], indptr[i + 1],
+						children_left, children_right, feature, threshold, roots[t])
+
+
+def predict_sum_csr(const double[::1] data, const intp_t[::1] indices,
+		const intp_t[::1] indptr, const node_t[::1] children_left,
+		const node_t[::1] children_right, const feature_t[::1] feature,
+		const float[::1] threshold, const float[:, ::1] value,
+		const intp_t[::1] roots, const intp_t[::1] output_offsets, double[:, ::1] out,
+		const node_t[::1] category_split=None,
+		const word_t[:, ::1] categories=None,
+		const intp_t[::1] category_roots=None):
+	"""``predict_sum_dense`` on the rows of a CSR matrix with sorted indices."""
+	cdef Py_ssize_t i, t, k
+	cdef Py_ssize_t width = value.shape[1]
+	cdef intp_t node, offset
+	cdef bint categorical = category_split is not None
+	with nogil:
+		for i in range(indptr.shape[0] - 1):
+			for t in range(roots.shape[0]):
+				if categorical:
+					node = _leaf_csr_categorical(data, indices, indptr[i],
+						indptr[i + 1], children_left, children_right, feature,
+						threshold, category_split, categories, roots[t],
+						category_roots[t])
+				else:
+					node = _leaf_csr(data, indices, indptr[i], indptr[i + 1],
+						children_left, children_right, feature, threshold, roots[t])
+				offset = output_offsets[t]
+				for k in range(width):
+					out[i, offset + k] += value[node, k]
+
+
+cdef inline bint _holds(double x, float lower, float upper) nogil:
+	"""Whether ``lower < x <= upper``, the right side of a split being what is
+	not ``<=`` its threshold."""
+	return not (x <= lower) and x <= upper
+
+
+cdef inline bint _in_set(double x, const word_t[:, ::1] categories,
+		intp_t row) nogil:
+	"""Whether the category code ``x`` is in the set ``categories[row]``,
+	codes past the bitset when its last word is set."""
+	cdef intp_t code
+	cdef Py_ssize_t last = categories.shape[1] - 1
+	if not (x >= 0 and x < last * 32):
+		return categories[row, last] != 0
+	code = <intp_t>x
+	return (categories[row, code >> 5] >> (code & 31)) & 1
+
+
+cdef inline bint _element_holds(double x, Py_ssize_t e, const float[::1] lower,
+		const float[::1] upper, bint categorical, const int[::1] category_set,
+		const word_t[:, ::1] categories) nogil:
+	if categorical and category_set[e] >= 0:
+		return _in_set(x, categories, category_set[e])
+	return _holds(x, lower[e], upper[e])
+
+
+cdef inline void _extend(double* weights, const double* one, const double* zero,
+		Py_ssize_t length) noexcept nogil:
+	"""EXTEND of TreeSHAP: weights of the subsets of every size of the
+	``length`` elements."""
+	cdef Py_ssize_t depth, i
+	weights[0] = 1.
+	for depth in range(1, length + 1):
+		weights[depth] = 0.
+		for i in range(depth - 1, -1, -1):
+			weights[i + 1] += one[depth - 1] * weights[i] * (i + 1) / (depth + 1)
+			weights[i] = zero[depth - 1] * weights[i] * (depth - i) / (depth + 1)
+
+
+cdef inline double _unwound_sum(const double* weights, double one, double zero,
+		Py_ssize_t length) nogil:
+	"""UNWOUND sum of TreeSHAP: the total weight of the subsets without an
+	element of one fraction ``one`` and zero fraction ``zero``."""
+	cdef double total = 0., next_one = weights[length], tmp
+	cdef Py_ssize_t j
+	if one != 0:
+		for j in range(length - 1, -1, -1):
+			tmp = next_one * (length + 1) / ((j + 1) * one)
+			total += tmp
+			next_one = weights[j] - tmp * zero * (length - j) / (length + 1)
+	elif zero != 0:
+		for j in range(length - 1, -1, -1):
+			total += weights[j] * (length + 1) / ((length - j) * zero)
+	return total
+
+
+cdef Py_ssize_t _max_length(const int[::1] path_start):
+	cdef Py_ssize_t p, longest = 0
+	for p in range(path_start.shape[0] - 1):
+		if path_start[p + 1] - path_start[p] > longest:
+			longest = path_start[p + 1] - path_start[p]
+	return longest
+
+
+def shap_path_dependent(const double[:, ::1] X, const int[::1] path_start,
+		const int[::1] feature, const float[::1] lower, const float[::1] upper,
+		const double[::1] zero_fraction, const double[:, ::1] value,
+		const int[::1] column, Py_ssize_t n_outputs, double[:, ::1] out,
+		const int[::1] category_set=None, const word_t[:, ::1] categories=None):
+	"""Add the TreeSHAP contribution of every path to ``out[i, feature *
+	n_outputs + column + k]``."""
+	cdef Py_ssize_t i, p, e, k, start, length, base
+	cdef Py_ssize_t width = value.shape[1]
+	cdef Py_ssize_t longest = _max_length(path_start)
+	cdef bint categorical = category_set is not None
+	cdef double w
+	cdef double* weights = <double*>malloc((longest + 1) * sizeof(double))
+	cdef double* one = <double*>malloc((longest + 1) * sizeof(double))
+	if weights == NULL or one == NULL:
+		free(weights)
+		free(one)
+		raise MemoryError()
+	with nogil:
+		for i in range(X.shape[0]):
+			for p in range(path_start.shape[0] - 1):
+				start = path_start[p]
+				length = path_start[p + 1] - start
+				if length == 0:
+					continue
+				for e in range(length):
+					one[e] = _element_holds(X[i, feature[start + e]], start + e,
+						lower, upper, categorical, category_set, categories)
+				_extend(weights, one, &zero_fraction[start], length)
+				for e in range(length):
+					w = _unwound_sum(weights, one[e], zero_fraction[start + e], length)
+					w *= one[e] - zero_fraction[start + e]
+					base = feature[start + e] * n_outputs + column[p]
+					for k in range(width):
+						out[i, base + k] += w * value[p, k]
+	free(weights)
+	free(one)
+
+
+def shap_interventional(const double[:, ::1] X, const unsigned char[:, ::1] in_background,
+		const int[::1] path_start, const int[::1] feature, const float[::1] lower,
+		const float[::1] upper, const double[:, ::1] value, const int[::1] column,
+		Py_ssize_t n_outputs, const double[:, ::1] weights, double[:, ::1] out,
+		const int[::1] category_set=None, const word_t[:, ::1] categories=None):
+	"""Add the interventional SHAP contribution of every path to ``out``,
+	averaged over the background rows. ``in_background[b, e]`` tells whether
+	element ``e`` holds background row ``b``, ``weights[a, b]`` is the
+	Shapley weight of the features only ``x`` satisfies."""
+	cdef Py_ssize_t i, p, e, k, b, start, length, base, only_x, only_z
+	cdef Py_ssize_t width = value.shape[1]
+	cdef Py_ssize_t n_background = in_background.shape[0]
+	cdef Py_ssize_t longest = _max_length(path_start)
+	cdef bint categorical = category_set is not None
+	cdef bint reached
+	cdef double positive, negative
+	cdef unsigned char* in_x = <unsigned char*>malloc(longest + 1)
+	cdef double* phi = <double*>malloc((longest + 1) * sizeof(double))
+	if in_x == NULL or phi == NULL:
+		free(in_x)
+		free(phi)
+		raise MemoryError()
+	with nogil:
+		for i in range(X.shape[0]):
+			for p in range(path_start.shape[0] - 1):
+				start = path_start[p]
+				length = path_start[p + 1] - start
+				if length == 0:
+					continue
+				for e in range(length):
+					in_x[e] = _element_holds(X[i, feature[start + e]], start + e,
+						lower, upper, categorical, category_set, categories)
+					phi[e] = 0.
+				for b in range(n_background):
+					only_x = only_z = 0
+					reached = True
+					for e in range(length):
+						if in_x[e] and not in_background[b, start + e]:
+							only_x += 1
+						elif in_background[b, start + e] and not in_x[e]:
+							only_z += 1
+						elif not in_x[e]:
+							reached = False
+							break
+					if not reached or only_x + only_z == 0:
+						continue
+					positive = weights[only_x, only_z]
+					negative = weights[only_z, only_x]
+					for e in range(length):
+						if in_x[e] and not in_background[b, start + e]:
+							phi[e] += positive
+						elif in_background[b, start + e] and not in_x[e]:
+							phi[e] -= negative
+				for e in range(length):
+					if phi[e] == 0.:
+						continue
+					base = feature[start + e] * n_outputs + column[p]
+					for k in range(width):
+						out[i, base + k] += phi[e] / n_background * value[p, k]
+	free(in_x)
+	free(phi)
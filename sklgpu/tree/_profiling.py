@@ -0,0 +1,177 @@
+"""Per stage and per kernel timings of fit and predict.
+
+The builders, the grower and the predictors wrap their work in
+``record(stage)``; while a ``Profiler`` is active the wall clock time of
+every stage is accumulated, otherwise ``record`` hands back a shared no-op
+context manager. The CUDA histogram builder, reductions and ensemble
+predictor also report the CUDA event timings of their kernels and
+transfers.
+
+Stages:
+
+- ``'binning'``: finding the bin thresholds and binning the data
+- ``'presort'``: sorting the feature columns for exact splits
+- ``'transfer'``: host to device and device to host copies
+- ``'histogram'``: building histograms (kernel time on the GPU)
+- ``'split'``: best split search over the histograms
+- ``'partition'``: sending the node samples to the children
+- ``'predict'``: routing rows to their leaves
+- ``'explain'``: SHAP values
+- ``'allreduce'``: summing histograms over the processes of a distributed
+  fit
+
+Work done in other processes (forests fitted with ``n_jobs > 1``) is not
+collected.
+"""
+import time
+
+from ._backend import cuda_available, load_extension
+
+__all__ = ["Profiler", "profile", "device_properties"]
+
+STAGES = ('binning', 'presort', 'transfer', 'histogram', 'split',
+          'partition', 'predict', 'explain', 'allreduce')
+
+_active = []
+
+
+class _NullContext(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class _StageTimer(object):
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_time(self.stage, time.perf_counter() - self._start)
+        return False
+
+
+def is_active():
+    """Whether a profiler is collecting timings."""
+    return bool(_active)
+
+
+def record(stage):
+    """Context manager adding its duration to ``stage``."""
+    if not _active:
+        return _NULL_CONTEXT
+    return _StageTimer(stage)
+
+
+def record_time(stage, seconds):
+    for profiler in _active:
+        profiler.add_stage(stage, seconds)
+
+
+def record_kernel(name, seconds):
+    for profiler in _active:
+        profiler.add_kernel(name, seconds)
+
+
+def device_properties(device=0):
+    """Properties of a CUDA device as a dict, None without a device."""
+    if not cuda_available():
+        return None
+    _tree_gpu = load_extension()
+    try:
+        if device >= _tree_gpu.device_count():
+            return None
+        return _tree_gpu.device_properties(device)
+    except RuntimeError:
+        return None
+
+
+class Profiler(object):
+    """Collects stage and kernel timings while used as a context manager.
+
+    Parameters
+    ----------
+    callback : callable or None
+        Called as ``callback(kind, name, seconds)`` for every timing as it
+        is recorded, ``kind`` being ``'stage'`` or ``'kernel'``.
+
+    Attributes
+    ----------
+    stages : dict
+        ``{stage: {'time': seconds, 'calls': count}}``.
+
+    kernels : dict
+        Same for the CUDA event timings, keyed by kernel or copy name.
+
+    device : dict or None
+        Properties of the CUDA device, None without one.
+
+    wall_time : float
+        Seconds spent inside the ``with`` block.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stages = {}
+        self.kernels = {}
+        self.device = None
+        self.wall_time = 0.
+
+    def __enter__(self):
+        if self.device is None:
+            self.device = device_properties()
+        _active.append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_time += time.perf_counter() - self._start
+        _active.remove(self)
+        return False
+
+    def _add(self, timings, kind, name, seconds):
+        entry = timings.get(name)
+        if entry is None:
+            entry = timings[name] = {'time': 0., 'calls': 0}
+        entry['time'] += seconds
+        entry['calls'] += 1
+        if self.callback is not None:
+            self.callback(kind, name, seconds)
+
+    def add_stage(self, stage, seconds):
+        self._add(self.stages, 'stage', stage, seconds)
+
+    def add_kernel(self, name, seconds):
+        self._add(self.kernels, 'kernel', name, seconds)
+
+    def summary(self):
+        """All the timings as one JSON serializable dict."""
+        return {'wall_time': self.wall_time,
+                'stages': {name: dict(entry)
+                           for name, entry in self.stages.items()},
+                'kernels': {name: dict(entry)
+                            for name, entry in self.kernels.items()},
+                'device': self.device}
+
+
+def profile(callback=None):
+    """Profile the fits and predictions run inside a ``with`` block.
+
+    Examples
+    --------
+    >>> from sklgpu.tree import DecisionTreeRegressor, profile
+    >>> with profile() as prof:
+    ...     DecisionTreeRegressor().fit(X, y)
+    >>> prof.stages['histogram']['time']
+    """
+    return Profiler(callback)
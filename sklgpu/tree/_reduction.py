@@ -0,0 +1,139 @@
+"""Sum, min, max and argmax reductions.
+
+Host implementations of the ``_tree_gpu`` reduction kernels. The block
+wise sums replay the pairing order of each kernel variant with vectorized
+NumPy operations over all blocks at once, so a float32 or float64 GPU sum
+can be checked bit for bit; min, max and argmax do not depend on the order
+and use the plain NumPy reductions.
+
+The ``backend`` argument runs the same reduction through the CUDA kernels.
+"""
+import numpy as np
+
+from ._backend import require_extension
+from ._profiling import is_active, record_kernel
+
+__all__ = ["reduce", "argmax"]
+
+OPS = {'sum': 0, 'min': 1, 'max': 2}
+VARIANTS = {'neighbored': 0, 'neighbored_plus': 1, 'interleaved': 2,
+            'unrolled': 3}
+DEFAULT_BLOCK_SIZE = 512
+
+_UFUNCS = {'sum': np.add, 'min': np.fmin, 'max': np.fmax}
+
+
+def _check_input(x):
+    x = np.ascontiguousarray(x).ravel()
+    if x.dtype not in (np.float32, np.float64):
+        raise ValueError("reductions support float32 and float64 arrays, "
+                         "got %s" % x.dtype)
+    return x
+
+
+def _identity(op, dtype):
+    return dtype.type({'sum': 0., 'min': np.inf, 'max': -np.inf}[op])
+
+
+def _block_partials(x, op, variant, block_size):
+    """Per block results, in the pairing order of the kernel variant."""
+    ufunc = _UFUNCS[op]
+    per_block = 2 * block_size if variant == 'unrolled' else block_size
+    n_blocks = max(1, -(-x.shape[0] // per_block))
+    blocks = np.full(n_blocks * per_block, _identity(op, x.dtype),
+                     dtype=x.dtype)
+    blocks[:x.shape[0]] = x
+    blocks = blocks.reshape(n_blocks, per_block)
+    if variant == 'unrolled':
+        # each thread folds its element with the one a block further
+        blocks = ufunc(blocks[:, :block_size], blocks[:, block_size:])
+
+    if variant in ('neighbored', 'neighbored_plus'):
+        stride = 1
+        while stride < block_size:
+            blocks[:, ::2 * stride] = ufunc(blocks[:, ::2 * stride],
+                                            blocks[:, stride::2 * stride])
+            stride *= 2
+    else:
+        stride = block_size // 2
+        while stride > 0:
+            blocks[:, :stride] = ufunc(blocks[:, :stride],
+                                       blocks[:, stride:2 * stride])
+            stride //= 2
+    return blocks[:, 0]
+
+
+def reduce(x, op='sum', variant='unrolled', block_size=DEFAULT_BLOCK_SIZE,
+           backend='cpu'):
+    """Reduce a float32 or float64 array.
+
+    Parameters
+    ----------
+    x : array-like
+        Values, flattened.
+
+    op : {'sum', 'min', 'max'}
+
+    variant : {'neighbored', 'neighbored_plus', 'interleaved', 'unrolled'}
+        Kernel whose summation order is followed.
+
+    block_size : int
+        Threads per block, a power of 2 (at least 64 for 'unrolled').
+
+    backend : {'cpu', 'cuda'}
+
+    Returns
+    -------
+    result : scalar of the input dtype
+    """
+    x = _check_input(x)
+    if op not in OPS:
+        raise ValueError("op should be one of %s, got %r"
+                         % (sorted(OPS), op))
+    if variant not in VARIANTS:
+        raise ValueError("variant should be one of %s, got %r"
+                         % (sorted(VARIANTS), variant))
+    if block_size < 1 or block_size & (block_size - 1):
+        raise ValueError("block_size should be a power of 2")
+    if variant == 'unrolled' and block_size < 64:
+        raise ValueError("the unrolled variant needs block_size >= 64")
+    if backend == 'cuda':
+        _tree_gpu = require_extension("the 'cuda' backend")
+        timings = {} if is_active() else None
+        result = _tree_gpu.reduce(x, OPS[op], VARIANTS[variant], block_size,
+                                  timings)
+        if timings is not None:
+            record_kernel('reduce_' + variant, timings['kernel_ms'] * 1e-3)
+        return result
+    if op != 'sum':
+        # order independent
+        return _UFUNCS[op].reduce(np.concatenate(
+            [[_identity(op, x.dtype)], x]))
+    partials = _block_partials(x, op, variant, block_size)
+    # the host folds the partials one after the other, like cumsum does
+    return np.cumsum(partials, dtype=x.dtype)[-1]
+
+
+def argmax(x, block_size=DEFAULT_BLOCK_SIZE, backend='cpu'):
+    """Maximum of ``x`` and the first index holding it, ignoring NaN.
+
+    Returns ``(-inf, -1)`` when ``x`` is empty or only holds NaN.
+    """
+    x = _check_input(x)
+    if backend == 'cuda':
+        _tree_gpu = require_extension("the 'cuda' backend")
+        timings = {} if is_active() else None
+        result = _tree_gpu.argmax(x, block_size, timings)
+        if timings is not None:
+            record_kernel('argmax', timings['kernel_ms'] * 1e-3)
+        return result
+    if x.shape[0] == 0:
+        return x.dtype.type(-np.inf), -1
+    index = int(np.argmax(x))
+    if np.isnan(x[index]):
+        # np.argmax stops at the first NaN
+        valid = np.flatnonzero(~np.isnan(x))
+        if valid.shape[0] == 0:
+            return x.dtype.type(-np.inf), -1
+        index = int(valid[np.argmax(x[valid])])
+    return x[index], index
@@ -0,0 +1,213 @@
+"""Micro-batched prediction for asyncio servers.
+
+Online traffic comes one row at a time, and predicting rows one by one
+pays the Python and launch overheads of a batch for every row. A
+``Predictor`` gathers the rows of concurrent requests into batches and
+runs the batch ``predict`` of the model on a thread pool: the traversal
+(the Cython, CUDA and compiled paths) releases the GIL, so the event loop
+keeps accepting requests while a batch runs.
+
+A batch starts when ``max_batch_size`` rows are waiting, or when the
+oldest waiting row has waited ``max_wait`` seconds, whichever comes first,
+and a worker is free. While every worker is busy the rows keep gathering,
+so batches grow with the load and the latency stays bounded by about
+``max_wait`` plus the time of two batches.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+__all__ = ["Predictor"]
+
+
+def _n_features(model):
+    for name in ('n_features_', 'n_features'):
+        n_features = getattr(model, name, None)
+        if n_features is not None:
+            return int(n_features)
+    return None
+
+
+class Predictor(object):
+    """Asyncio front end of a fitted estimator, batching concurrent
+    single row requests.
+
+    Parameters
+    ----------
+    model : fitted estimator
+        A tree, forest or gradient boosting model of sklgpu, or the
+        ``CompiledModel`` of one; anything with the ``method``.
+
+    method : str, optional (default='predict')
+        The batch method called, e.g. 'predict_proba' or
+        'decision_function'.
+
+    max_batch_size : int, optional (default=256)
+        Rows per batch at most.
+
+    max_wait : float, optional (default=0.001)
+        Seconds a row waits for others before its batch starts anyway.
+
+    n_workers : int, optional (default=1)
+        Threads running batches, the batches running at once.
+
+    Attributes
+    ----------
+    n_requests : int
+        Rows predicted.
+
+    n_batches : int
+        Batches run, ``n_requests / n_batches`` is the mean batch size.
+
+    Examples
+    --------
+    >>> async def handle(predictor, row):
+    ...     return await predictor.predict(row)
+    >>> async def main(model, rows):
+    ...     async with Predictor(model, 'predict_proba') as predictor:
+    ...         return await asyncio.gather(*[handle(predictor, row)
+    ...                                       for row in rows])
+    """
+
+    def __init__(self, model, method='predict', max_batch_size=256,
+                 max_wait=0.001, n_workers=1):
+        if not callable(getattr(model, method, None)):
+            raise ValueError("%s has no method %r"
+                             % (type(model).__name__, method))
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size should be at least 1, got %r"
+                             % max_batch_size)
+        if max_wait < 0:
+            raise ValueError("max_wait should be non negative, got %r"
+                             % max_wait)
+        if n_workers < 1:
+            raise ValueError("n_workers should be at least 1, got %r"
+                             % n_workers)
+        self.model = model
+        self.method = method
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.n_workers = n_workers
+        self.n_requests = 0
+        self.n_batches = 0
+        self._function = getattr(model, method)
+        self._n_features = _n_features(model)
+        self._executor = ThreadPoolExecutor(
+            n_workers, thread_name_prefix='sklgpu-predictor')
+        self._loop = None
+        # (row, future) of the rows waiting for a batch, oldest first
+        self._pending = []
+        # fires max_wait after the oldest pending row arrived; None with
+        # pending rows means they are due and wait for a worker
+        self._timer = None
+        self._running = set()
+        self._closed = False
+
+    def _check_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop = loop
+        elif loop is not self._loop:
+            raise RuntimeError("a Predictor serves the event loop it was "
+                               "first used in")
+        return loop
+
+    def _check_row(self, x):
+        row = np.asarray(x, dtype=np.float64)
+        if row.ndim == 2 and row.shape[0] == 1:
+            row = row[0]
+        if row.ndim != 1:
+            raise ValueError("expected one row, got shape %r" % (row.shape,))
+        if self._n_features is None:
+            self._n_features = row.shape[0]
+        elif row.shape[0] != self._n_features:
+            raise ValueError("expected %d features, got %d"
+                             % (self._n_features, row.shape[0]))
+        return row
+
+    async def predict(self, x):
+        """The output of ``method`` for one row.
+
+        Parameters
+        ----------
+        x : array-like, shape (n_features,) or (1, n_features)
+
+        Returns
+        -------
+        y : scalar or ndarray
+            The row of the batch output, e.g. a class or target for
+            'predict', the class probabilities for 'predict_proba'.
+        """
+        if self._closed:
+            raise RuntimeError("the Predictor is closed")
+        loop = self._check_loop()
+        row = self._check_row(x)
+        future = loop.create_future()
+        self._pending.append((row, future))
+        self.n_requests += 1
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif len(self._pending) == 1:
+            self._timer = loop.call_later(self.max_wait, self._on_timer)
+        return await future
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        """Start batches while workers are free and rows are due: a full
+        batch, or rows that waited ``max_wait``."""
+        while (self._pending and len(self._running) < self.n_workers
+               and (self._timer is None
+                    or len(self._pending) >= self.max_batch_size)):
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            self.n_batches += 1
+            done = self._loop.run_in_executor(
+                self._executor, self._predict_batch,
+                [row for row, _ in batch])
+            self._running.add(done)
+            done.add_done_callback(functools.partial(self._finish, batch))
+        if not self._pending and self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _predict_batch(self, rows):
+        return self._function(np.stack(rows))
+
+    def _finish(self, batch, done):
+        self._running.discard(done)
+        error = done.exception()
+        if error is None:
+            out = done.result()
+        for i, (_, future) in enumerate(batch):
+            # callers that gave up cancelled their future
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(out[i])
+        self._dispatch()
+
+    async def aclose(self):
+        """Run the pending rows, wait for the batches and stop the
+        workers. Later ``predict`` calls raise RuntimeError."""
+        self._closed = True
+        if self._loop is not None:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._dispatch()
+            while self._running:
+                await asyncio.wait(list(self._running))
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
@@ -0,0 +1,555 @@
+"""SHAP values of tree models over their flat node arrays.
+
+Every tree is decomposed once into its root to leaf paths, the conditions
+of a feature repeated along a path merged into one interval ``lower < x <=
+upper`` and the fractions of the training cover following its edges into
+one ``zero_fraction``. The TreeSHAP contributions of a leaf to a row only
+depend on which of the path's intervals hold the row (the row's "one
+fractions"), so a row is explained by running the leaf step of TreeSHAP,
+the EXTEND of the path weights followed by one UNWOUND sum per feature, on
+every path: ``O(n_leaves * depth ** 2)`` per tree like the recursive
+algorithm, but independent over rows and paths.
+
+- ``'tree_path_dependent'`` SHAP (exact TreeSHAP, Lundberg et al. 2020)
+  takes the expectations over the training cover recorded in
+  ``weighted_n_node_samples`` (the hessians for boosting).
+- ``'interventional'`` SHAP takes them over a background set: a path
+  contributes to the pair ``(x, z)`` when every interval holds ``x`` or
+  ``z``, with a closed form weight in the number of intervals that hold
+  only ``x`` and only ``z``.
+
+The contributions are computed by the ``_predictor`` extension when it is
+built (row chunks on threads, without the GIL), by NumPy vectorized over
+rows and paths otherwise, and with ``backend='cuda'`` by the ``_tree_gpu``
+kernels, one thread per row.
+
+The condition of a split on a categorical feature is a set of categories
+rather than an interval: the elements on such a feature hold the
+intersection of the sets of their edges, a uint32 bitset over the codes
+like those of the traversal, and the rows of codes in it.
+"""
+import os
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.special import gammaln
+
+from ._backend import cuda_available, require_extension
+from ._profiling import record
+from ._tree import CATEGORY_DTYPE, TREE_LEAF, _map_chunks
+
+try:
+    from . import _predictor
+except ImportError:
+    _predictor = None
+
+__all__ = ["TreePaths", "shap_values"]
+
+# entries of the (rows, paths, length) temporaries of the NumPy path
+NUMPY_BLOCK = 1 << 22
+# rows per task of the compiled path, a row costs a pass over every path
+CHUNK_SIZE = 1024
+# longest path the CUDA kernels hold in registers and local memory
+CUDA_MAX_LENGTH = 64
+
+
+class TreePaths(object):
+    """Root to leaf paths of an ensemble of trees, one per leaf.
+
+    Parameters
+    ----------
+    children_left, children_right, feature, threshold, value, \
+            weighted_n_node_samples :
+        Node arrays in the layout of ``TreeEnsemble``.
+
+    roots : array of intp, shape (n_trees,)
+        First node of every tree, child ids are relative to it.
+
+    output_offsets : array of int or None
+        First output column of every tree, all 0 when None.
+
+    n_outputs : int or None
+        Width of the prediction, enough for every tree when None.
+
+    category_split, categories, category_roots : ndarray or None
+        The bitsets of the categorical splits in the layout of
+        ``TreeEnsemble``, None without categorical split.
+
+    Attributes
+    ----------
+    path_start : ndarray of int32, shape (n_paths + 1,)
+        Elements of path ``p`` are ``path_start[p]:path_start[p + 1]``.
+
+    feature : ndarray of int32, shape (n_elements,)
+        The feature of every element, distinct along a path.
+
+    lower, upper : ndarray of float32, shape (n_elements,)
+        The interval ``lower < x <= upper`` the element holds rows in.
+
+    category_set : ndarray of int32, shape (n_elements,) or None
+        Row of ``categories`` of the elements on a categorical feature, -1
+        for the intervals; None without categorical split.
+
+    categories : ndarray of uint32, shape (n_sets, n_words + 1) or None
+        Bitsets of the category codes the elements hold, the last word set
+        when they hold the codes past the bitsets as well, which only go
+        right.
+
+    zero_fraction : ndarray of float64, shape (n_elements,)
+        Fraction of the cover reaching the leaf through the element.
+
+    value : ndarray of float64, shape (n_paths, width)
+        Leaf values.
+
+    column : ndarray of int32, shape (n_paths,)
+        First output column of the leaf values.
+
+    expected_value : ndarray of float64, shape (n_outputs,)
+        Sum of the expected values of the trees over their covers.
+
+    max_length : int
+        Elements of the longest path.
+    """
+
+    def __init__(self, children_left, children_right, feature, threshold,
+                 value, weighted_n_node_samples, roots, output_offsets=None,
+                 n_outputs=None, category_split=None, categories=None,
+                 category_roots=None):
+        n_nodes = children_left.shape[0]
+        roots = np.asarray(roots, dtype=np.intp)
+        sizes = np.diff(np.append(roots, n_nodes))
+        if output_offsets is None:
+            output_offsets = np.zeros(roots.shape[0], dtype=np.intp)
+        output_offsets = np.asarray(output_offsets, dtype=np.intp)
+        width = value.shape[1]
+        if n_outputs is None:
+            n_outputs = int(output_offsets.max()) + width
+        self.n_outputs = n_outputs
+        self.category_set = self.categories = None
+
+        # parent and side of every node, in global ids
+        root_of = np.repeat(roots, sizes)
+        internal = np.flatnonzero(children_left != TREE_LEAF)
+        parent = np.full(n_nodes, -1, dtype=np.intp)
+        goes_left = np.zeros(n_nodes, dtype=bool)
+        left = root_of[internal] + children_left[internal]
+        parent[left] = internal
+        goes_left[left] = True
+        parent[root_of[internal] + children_right[internal]] = internal
+        cover = weighted_n_node_samples.astype(np.float64)
+        node_set = None
+        if category_split is not None:
+            # the bitset rows of the nodes, and a last word for the codes
+            # past them: left edges hold none, right edges all
+            node_set = np.where(category_split >= 0, np.repeat(
+                category_roots, sizes) + category_split, -1)
+            n_words = categories.shape[1]
+            categories = np.column_stack([
+                categories, np.zeros(categories.shape[0], CATEGORY_DTYPE)])
+            unrestricted = np.full(n_words + 1, ~CATEGORY_DTYPE(0))
+
+        # the edges of every leaf, walked up all at once
+        leaves = np.flatnonzero(children_left == TREE_LEAF)
+        edge_path, edge_feature, edge_lower, edge_upper, edge_zero = \
+            [], [], [], [], []
+        edge_categorical, edge_bits = [], []
+        path = np.arange(leaves.shape[0])
+        node = leaves
+        while node.shape[0]:
+            up = parent[node]
+            climbing = up >= 0
+            path, node, up = path[climbing], node[climbing], up[climbing]
+            if not path.shape[0]:
+                break
+            left_edge = goes_left[node]
+            split = threshold[up]
+            if node_set is not None:
+                categorical = node_set[up] >= 0
+                bits = np.where(categorical[:, np.newaxis],
+                                categories[node_set[up]], unrestricted)
+                bits[categorical & ~left_edge] ^= unrestricted
+                edge_categorical.append(categorical)
+                edge_bits.append(bits)
+                # the interval of a categorical edge holds every row
+                left_edge = left_edge | categorical
+                split = np.where(categorical, np.inf, split)
+            edge_path.append(path)
+            edge_feature.append(feature[up].astype(np.intp))
+            edge_lower.append(np.where(left_edge, -np.inf, split))
+            edge_upper.append(np.where(left_edge, split, np.inf))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                edge_zero.append(np.where(cover[up] > 0,
+                                          cover[node] / cover[up], 0.))
+            node = up
+
+        self.value = value[leaves].astype(np.float64)
+        tree_of = np.searchsorted(roots, leaves, side='right') - 1
+        self.column = output_offsets[tree_of].astype(np.int32)
+        n_paths = leaves.shape[0]
+        if edge_path:
+            edge_path = np.concatenate(edge_path)
+            edge_feature = np.concatenate(edge_feature)
+            # one element per (path, feature), in path order
+            order = np.lexsort((edge_feature, edge_path))
+            edge_path, edge_feature = edge_path[order], edge_feature[order]
+            starts = np.flatnonzero(np.concatenate(
+                [[True], (np.diff(edge_path) != 0)
+                 | (np.diff(edge_feature) != 0)]))
+            element_path = edge_path[starts]
+            self.feature = edge_feature[starts].astype(np.int32)
+            self.lower = np.maximum.reduceat(
+                np.concatenate(edge_lower)[order], starts).astype(np.float32)
+            self.upper = np.minimum.reduceat(
+                np.concatenate(edge_upper)[order], starts).astype(np.float32)
+            self.zero_fraction = np.multiply.reduceat(
+                np.concatenate(edge_zero)[order], starts)
+            if edge_bits:
+                categorical = np.logical_or.reduceat(
+                    np.concatenate(edge_categorical)[order], starts)
+                bits = np.bitwise_and.reduceat(
+                    np.concatenate(edge_bits)[order], starts)
+                self.category_set = np.where(
+                    categorical, np.cumsum(categorical) - 1, -1).astype(
+                    np.int32)
+                self.categories = np.ascontiguousarray(bits[categorical])
+        else:
+            element_path = np.zeros(0, dtype=np.intp)
+            self.feature = np.zeros(0, dtype=np.int32)
+            self.lower = np.zeros(0, dtype=np.float32)
+            self.upper = np.zeros(0, dtype=np.float32)
+            self.zero_fraction = np.zeros(0)
+        lengths = np.bincount(element_path, minlength=n_paths)
+        self.path_start = np.concatenate([[0], np.cumsum(lengths)]).astype(
+            np.int32)
+        self.max_length = int(lengths.max()) if n_paths else 0
+
+        # the bias of TreeSHAP: leaf values weighted by the product of the
+        # zero fractions of their path
+        reach = np.ones(n_paths)
+        np.multiply.at(reach, element_path, self.zero_fraction)
+        self.expected_value = self._leaf_sum(reach)
+
+    @classmethod
+    def from_ensemble(cls, ensemble):
+        """Paths of a ``TreeEnsemble``."""
+        return cls(ensemble.children_left, ensemble.children_right,
+                   ensemble.feature, ensemble.threshold, ensemble.value,
+                   ensemble.weighted_n_node_samples, ensemble.roots,
+                   ensemble.output_offsets, ensemble.n_outputs,
+                   ensemble.category_split, ensemble.categories,
+                   ensemble.category_roots)
+
+    @classmethod
+    def from_tree(cls, tree):
+        """Paths of a single ``Tree``."""
+        return cls(tree.children_left, tree.children_right, tree.feature,
+                   tree.threshold, tree.value, tree.weighted_n_node_samples,
+                   [0], category_split=tree.category_split,
+                   categories=tree.categories, category_roots=[0])
+
+    @property
+    def n_paths(self):
+        return self.value.shape[0]
+
+    def _leaf_sum(self, reach):
+        """Leaf values weighted by ``reach``, summed into the outputs."""
+        total = np.zeros(self.n_outputs)
+        for k in range(self.value.shape[1]):
+            np.add.at(total, self.column + k, reach * self.value[:, k])
+        return total
+
+    def mean_value(self, X):
+        """Mean prediction of the dense rows ``X``, the expected value of
+        interventional SHAP."""
+        reach = np.ones(self.n_paths)
+        for length, group in self._groups():
+            elements = self._elements(group, length)
+            reach[group] = np.all(_holds(
+                X[:, self.feature[elements]], *self._conditions(elements)),
+                axis=2).mean(axis=0)
+        return self._leaf_sum(reach)
+
+    def _conditions(self, elements):
+        """The arguments of ``_holds`` after the values, for the
+        ``elements``."""
+        sets = (None if self.category_set is None
+                else self.category_set[elements])
+        return (self.lower[elements], self.upper[elements], sets,
+                self.categories)
+
+    def _groups(self):
+        """``(length, paths)`` of the paths of every length."""
+        lengths = np.diff(self.path_start)
+        return [(m, np.flatnonzero(lengths == m))
+                for m in np.unique(lengths) if m > 0]
+
+    def _elements(self, paths, length):
+        """Element ids of ``paths`` (all ``length`` long), shape
+        (len(paths), length)."""
+        return self.path_start[paths][:, np.newaxis] + np.arange(length)
+
+    def _scatter(self, paths, elements, n_features):
+        """Sparse matrix adding the (path, element) contributions times the
+        leaf values to the flat (feature, output) columns."""
+        n_paths, length = elements.shape
+        width = self.value.shape[1]
+        columns = (self.feature[elements][:, :, np.newaxis] * self.n_outputs
+                   + self.column[paths][:, np.newaxis, np.newaxis]
+                   + np.arange(width))
+        data = np.broadcast_to(self.value[paths][:, np.newaxis, :],
+                               columns.shape)
+        rows = np.broadcast_to(
+            np.arange(n_paths * length).reshape(n_paths, length, 1),
+            columns.shape)
+        return sp.csr_matrix((data.ravel(), (rows.ravel(), columns.ravel())),
+                             shape=(n_paths * length,
+                                    n_features * self.n_outputs))
+
+
+def _holds(x, lower, upper, sets=None, categories=None):
+    """Whether the elements hold the values ``x``: the right child of a
+    split takes what is not ``<=`` its threshold, or not in its set of
+    categories, like the traversal. ``sets`` are the rows of
+    ``categories`` of the elements, -1 for the intervals."""
+    holds = ~(x <= lower) & (x <= upper)
+    if sets is not None:
+        sets = np.broadcast_to(sets, holds.shape)
+        categorical = sets >= 0
+        if categorical.any():
+            holds[categorical] = _in_set(
+                np.broadcast_to(x, holds.shape)[categorical], categories,
+                sets[categorical])
+    return holds
+
+
+def _in_set(x, categories, rows):
+    """Whether code ``x[i]`` is in the set ``categories[rows[i]]``, codes
+    past the bitset when its last word is set."""
+    n_codes = (categories.shape[1] - 1) * 32
+    known = (x >= 0) & (x < n_codes)
+    codes = np.where(known, x, 0).astype(np.intp)
+    words = categories[rows, codes >> 5]
+    return np.where(
+        known, ((words >> (codes & 31).astype(CATEGORY_DTYPE)) & 1) > 0,
+        categories[rows, -1] > 0)
+
+
+def _path_weights(one, zero, length):
+    """EXTEND of TreeSHAP over the elements of paths of ``length`` elements:
+    the weights of the subsets of every size, shape (length + 1, rows,
+    paths), from the one fractions (rows, paths, length) and the zero
+    fractions (paths, length)."""
+    weights = np.zeros((length + 1,) + one.shape[:2])
+    weights[0] = 1.
+    for depth in range(1, length + 1):
+        o, z = one[:, :, depth - 1], zero[:, depth - 1]
+        for i in range(depth - 1, -1, -1):
+            weights[i + 1] += o * weights[i] * ((i + 1.) / (depth + 1))
+            weights[i] *= z * ((depth - i) / (depth + 1.))
+    return weights
+
+
+def _unwound_sums(weights, one, zero, length):
+    """UNWOUND sum of every element, the weight of the subsets without it,
+    shape (rows, paths, length). One fractions are 0 or 1."""
+    total = np.zeros(one.shape)
+    for e in range(length):
+        o, z = one[:, :, e], zero[:, e]
+        # one fraction 1: the recursion of the extension run backwards
+        next_one = weights[length].copy()
+        hot = np.zeros(o.shape)
+        for j in range(length - 1, -1, -1):
+            tmp = next_one * ((length + 1.) / (j + 1))
+            hot += tmp
+            next_one = weights[j] - tmp * z * ((length - j) / (length + 1.))
+        # one fraction 0: the zero fraction divided out of every weight
+        cold = np.zeros(o.shape)
+        safe = np.where(z > 0, z, 1.)
+        for j in range(length - 1, -1, -1):
+            cold += weights[j] * ((length + 1.) / ((length - j) * safe))
+        total[:, :, e] = np.where(o > 0, hot, cold)
+    return total
+
+
+def _dense_rows(X, rows):
+    if sp.issparse(X):
+        return X[rows].toarray()
+    return X[rows]
+
+
+def _path_dependent_numpy(paths, X, out, n_features):
+    flat = out.reshape(out.shape[0], -1)
+    for length, group in paths._groups():
+        elements = paths._elements(group, length)
+        scatter = paths._scatter(group, elements, n_features)
+        feature = paths.feature[elements]
+        conditions = paths._conditions(elements)
+        zero = paths.zero_fraction[elements]
+        step = max(1, NUMPY_BLOCK // (group.shape[0] * (length + 1)))
+        for start in range(0, X.shape[0], step):
+            rows = slice(start, min(start + step, X.shape[0]))
+            x = _dense_rows(X, rows)[:, feature]
+            one = _holds(x, *conditions).astype(np.float64)
+            weights = _path_weights(one, zero, length)
+            phi = _unwound_sums(weights, one, zero, length) * (one - zero)
+            flat[rows, :n_features * paths.n_outputs] += (
+                phi.reshape(phi.shape[0], -1) @ scatter)
+
+
+def _coalition_weights(max_length):
+    """``weights[a, b] = (a - 1)! b! / (a + b)!``: the Shapley weight of a
+    feature among the ``a`` that only ``x`` satisfies when ``b`` features
+    are only satisfied by ``z``."""
+    a = np.arange(max_length + 1)[:, np.newaxis]
+    b = np.arange(max_length + 1)[np.newaxis, :]
+    with np.errstate(invalid='ignore'):
+        weights = np.exp(gammaln(np.maximum(a, 1)) + gammaln(b + 1)
+                         - gammaln(a + b + 1))
+    weights[0] = 0.
+    return weights
+
+
+def _interventional_numpy(paths, X, background, out, n_features):
+    flat = out.reshape(out.shape[0], -1)
+    weights = _coalition_weights(paths.max_length)
+    for length, group in paths._groups():
+        elements = paths._elements(group, length)
+        scatter = paths._scatter(group, elements, n_features)
+        feature = paths.feature[elements]
+        conditions = paths._conditions(elements)
+        in_background = _holds(background[:, feature], *conditions)
+        step = max(1, NUMPY_BLOCK // (group.shape[0] * length))
+        for start in range(0, X.shape[0], step):
+            rows = slice(start, min(start + step, X.shape[0]))
+            in_x = _holds(_dense_rows(X, rows)[:, feature], *conditions)
+            phi = np.zeros(in_x.shape)
+            for in_z in in_background:
+                only_x = in_x & ~in_z
+                only_z = in_z & ~in_x
+                reached = np.all(in_x | in_z, axis=2)
+                a = only_x.sum(axis=2)
+                b = only_z.sum(axis=2)
+                phi += reached[:, :, np.newaxis] * (
+                    only_x * weights[a, b][:, :, np.newaxis]
+                    - only_z * weights[b, a][:, :, np.newaxis])
+            phi /= background.shape[0]
+            flat[rows, :n_features * paths.n_outputs] += (
+                phi.reshape(phi.shape[0], -1) @ scatter)
+
+
+def _in_background(paths, background):
+    """Whether every path element holds every background row, as uint8 of
+    shape (n_background, n_elements); found once for all the rows."""
+    return np.ascontiguousarray(_holds(
+        background[:, paths.feature],
+        *paths._conditions(slice(None)))).view(np.uint8)
+
+
+def _compiled(paths, X, background, out, n_features, chunk_size, n_threads):
+    flat = out.reshape(out.shape[0], -1)
+    sparse = sp.issparse(X)
+    if background is not None:
+        in_background = _in_background(paths, background)
+        weights = _coalition_weights(paths.max_length)
+
+    def explain_chunk(chunk):
+        x = _dense_rows(X, chunk) if sparse else X[chunk]
+        if background is None:
+            _predictor.shap_path_dependent(
+                x, paths.path_start, paths.feature, paths.lower, paths.upper,
+                paths.zero_fraction, paths.value, paths.column,
+                paths.n_outputs, flat[chunk], paths.category_set,
+                paths.categories)
+        else:
+            _predictor.shap_interventional(
+                x, in_background, paths.path_start, paths.feature,
+                paths.lower, paths.upper, paths.value, paths.column,
+                paths.n_outputs, weights, flat[chunk], paths.category_set,
+                paths.categories)
+
+    _map_chunks(explain_chunk, X.shape[0], chunk_size, n_threads)
+
+
+def _cuda(paths, X, background, out, n_features):
+    _tree_gpu = require_extension("SHAP values on the 'cuda' backend")
+    in_background = weights = None
+    if background is not None:
+        in_background = _in_background(paths, background)
+        weights = _coalition_weights(paths.max_length)
+    explainer = _tree_gpu.ShapExplainer(
+        paths.path_start, paths.feature, paths.lower, paths.upper,
+        paths.zero_fraction, paths.value, paths.column, paths.n_outputs,
+        n_features, in_background, weights,
+        category_set=paths.category_set, categories=paths.categories)
+    explainer.shap_values(X, out.reshape(out.shape[0], -1))
+
+
+def _n_threads(n_jobs):
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(os.cpu_count() + 1 + n_jobs, 1)
+    if n_jobs == 0:
+        raise ValueError("n_jobs == 0 has no meaning")
+    return n_jobs
+
+
+def shap_values(paths, X, n_features, background=None, n_jobs=None,
+                backend='cpu', chunk_size=CHUNK_SIZE):
+    """SHAP values of the rows of ``X``.
+
+    Parameters
+    ----------
+    paths : TreePaths
+
+    X : ndarray or sparse matrix, shape (n_samples, n_features)
+        Sparse rows are densified a chunk at a time.
+
+    n_features : int
+
+    background : array, shape (n_background, n_features) or None
+        Interventional SHAP over these rows, tree path dependent SHAP over
+        the training cover when None.
+
+    n_jobs : int or None
+        Threads over the row chunks of the compiled path, all the cores
+        with -1.
+
+    backend : {'cpu', 'cuda'}
+        'cuda' runs the kernels on the GPU, when a device is there and the
+        paths are at most ``CUDA_MAX_LENGTH`` features long.
+
+    Returns
+    -------
+    values : ndarray, shape (n_samples, n_features + 1, n_outputs)
+        The contribution of every feature, and in the last column the
+        expected value; a row sums to the prediction.
+    """
+    if background is not None:
+        if sp.issparse(background):
+            background = background.toarray()
+        background = np.ascontiguousarray(background, dtype=np.float64)
+        if background.ndim != 2 or background.shape[1] != n_features:
+            raise ValueError("background should have shape (n_background, "
+                             "%d), got %r" % (n_features, background.shape))
+        if background.shape[0] == 0:
+            raise ValueError("background has no row")
+    if not sp.issparse(X):
+        X = np.ascontiguousarray(X, dtype=np.float64)
+    else:
+        X = sp.csr_matrix(X, dtype=np.float64)
+    out = np.zeros((X.shape[0], n_features + 1, paths.n_outputs))
+    with record('explain'):
+        if (backend == 'cuda' and not sp.issparse(X) and cuda_available()
+                and paths.max_length <= CUDA_MAX_LENGTH and X.shape[0]):
+            _cuda(paths, X, background, out, n_features)
+        elif _predictor is not None:
+            _compiled(paths, X, background, out, n_features, chunk_size,
+                      _n_threads(n_jobs))
+        elif background is None:
+            _path_dependent_numpy(paths, X, out, n_features)
+        else:
+            _interventional_numpy(paths, X, background, out, n_features)
+    out[:, n_features] = (paths.expected_value if background is None
+                          else paths.mean_value(background))
+    return out
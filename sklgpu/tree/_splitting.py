@@ -0,0 +1,325 @@
+"""Split criteria and best split search over feature histograms.
+
+Every criterion works on the same statistics layout: column 0 holds the
+number of samples, column 1 the sample weight (the hessian for gradient
+boosting) and the remaining columns are criterion specific. Summing the
+statistics of a set of samples gives everything needed to compute its
+value and impurity, so histograms are simply per-bin sums of them.
+
+The bins of a categorical feature are categories in no meaningful order.
+Its splits send a subset of them left: the categories of the node are
+sorted by ``Criterion.category_key`` and the subsets tried are the
+prefixes of that order, which holds the best partition for the mean
+squared error and for two classes (Fisher, Breiman) and is the ordering of
+LightGBM for the boosting gain. Like LightGBM, the keys are smoothed
+towards the node and categories with fewer than ``MIN_CATEGORY_SUPPORT``
+samples in the node go right, as do those the fit never saw: their keys
+are noise, and sorting on them overfits high cardinality features.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from ._reduction import argmax
+from ._tree import _round_up
+
+COUNT = 0
+WEIGHT = 1
+
+# samples a category needs in a node to be sorted, and pseudo samples of
+# the node added to every category for its key
+MIN_CATEGORY_SUPPORT = 10
+CATEGORY_SMOOTHING = 10.
+
+
+class Criterion(object):
+    """Base class of the histogram split criteria.
+
+    Subclasses implement ``sample_stats``, ``node_value`` and
+    ``weighted_impurity``; the impurity decrease of a split is
+    ``weighted_impurity(parent) - weighted_impurity(left) -
+    weighted_impurity(right)``.
+    """
+
+    n_stats = 2
+
+    def weighted_impurity(self, stats):
+        """Impurity times node weight, vectorized over leading axes."""
+        raise NotImplementedError
+
+    def node_value(self, stats):
+        raise NotImplementedError
+
+    def impurity(self, stats):
+        weight = stats[..., WEIGHT]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(weight > 0,
+                            self.weighted_impurity(stats) / weight, 0.)
+
+    def category_key(self, stats, parent_stats):
+        """Sort key of the categories of a node with statistics ``stats``
+        (leading axes are vectorized over): the node value, of one output.
+        """
+        return self.node_value(stats)[..., 0]
+
+
+class ClassificationCriterion(Criterion):
+
+    def __init__(self, n_classes):
+        self.n_classes = n_classes
+        self.n_stats = 2 + n_classes
+
+    def sample_stats(self, y, sample_weight):
+        """y holds encoded class indices."""
+        stats = np.zeros((y.shape[0], self.n_stats))
+        stats[:, COUNT] = sample_weight > 0
+        stats[:, WEIGHT] = sample_weight
+        stats[np.arange(y.shape[0]), 2 + y] = sample_weight
+        return stats
+
+    def node_value(self, stats):
+        counts = stats[..., 2:]
+        total = counts.sum(axis=-1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(total > 0, counts / total, 0.)
+
+    def category_key(self, stats, parent_stats):
+        """The frequency of the majority class of the parent node."""
+        majority = np.argmax(parent_stats[2:])
+        return self.node_value(stats)[..., majority]
+
+
+class Gini(ClassificationCriterion):
+
+    def weighted_impurity(self, stats):
+        weight = stats[..., WEIGHT]
+        sq = np.square(stats[..., 2:]).sum(axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(weight > 0, weight - sq / weight, 0.)
+
+
+class Entropy(ClassificationCriterion):
+
+    def weighted_impurity(self, stats):
+        counts = stats[..., 2:]
+        weight = stats[..., WEIGHT][..., np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = np.where(counts > 0, counts * np.log2(counts / weight), 0.)
+        return -terms.sum(axis=-1)
+
+
+class MSE(Criterion):
+    """Mean squared error, statistics are ``[count, w, w * y, w * y ** 2]``."""
+
+    n_stats = 4
+
+    def sample_stats(self, y, sample_weight):
+        stats = np.empty((y.shape[0], self.n_stats))
+        stats[:, COUNT] = sample_weight > 0
+        stats[:, WEIGHT] = sample_weight
+        stats[:, 2] = sample_weight * y
+        stats[:, 3] = stats[:, 2] * y
+        return stats
+
+    def node_value(self, stats):
+        weight = stats[..., WEIGHT]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(weight > 0, stats[..., 2] / weight, 0.)
+        return mean[..., np.newaxis]
+
+    def weighted_impurity(self, stats):
+        weight = stats[..., WEIGHT]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(weight > 0,
+                            stats[..., 3] - np.square(stats[..., 2]) / weight,
+                            0.)
+
+
+class GradientCriterion(Criterion):
+    """Second order boosting gain, statistics are ``[count, h, g]``.
+
+    The weighted impurity is ``-G ** 2 / (H + l2_regularization)`` so that
+    the impurity decrease is the usual XGBoost/LightGBM split gain (without
+    the constant factor 1/2).
+    """
+
+    n_stats = 3
+
+    def __init__(self, l2_regularization=0.):
+        self.l2_regularization = l2_regularization
+
+    def sample_stats(self, gradients, hessians, sample_weight=None):
+        stats = np.empty((gradients.shape[0], self.n_stats))
+        if sample_weight is None:
+            stats[:, COUNT] = 1.
+            stats[:, WEIGHT] = hessians
+            stats[:, 2] = gradients
+        else:
+            stats[:, COUNT] = sample_weight > 0
+            stats[:, WEIGHT] = hessians * sample_weight
+            stats[:, 2] = gradients * sample_weight
+        return stats
+
+    def node_value(self, stats):
+        value = -stats[..., 2] / (stats[..., WEIGHT] + self.l2_regularization)
+        return value[..., np.newaxis]
+
+    def weighted_impurity(self, stats):
+        denominator = stats[..., WEIGHT] + self.l2_regularization
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(denominator > 0,
+                            -np.square(stats[..., 2]) / denominator, 0.)
+
+    def impurity(self, stats):
+        return self.weighted_impurity(stats)
+
+
+CRITERIA_CLF = {'gini': Gini, 'entropy': Entropy}
+CRITERIA_REG = {'mse': MSE}
+
+
+# left_bins: sorted bins of the categories going left for a split on a
+# categorical feature, None for a split ``bin <= b``
+SplitInfo = namedtuple('SplitInfo', ['gain', 'feature', 'bin',
+                                     'left_stats', 'right_stats',
+                                     'left_bins'], defaults=[None])
+
+
+def _split_gains(left, criterion, parent_stats, min_samples_leaf,
+                 min_weight_leaf):
+    """Impurity decrease of every candidate with ``left`` child statistics,
+    -inf where a child breaks the constraints; and the right statistics."""
+    right = parent_stats - left
+    gain = (criterion.weighted_impurity(parent_stats)
+            - criterion.weighted_impurity(left)
+            - criterion.weighted_impurity(right))
+    invalid = ((left[..., COUNT] < min_samples_leaf)
+               | (right[..., COUNT] < min_samples_leaf))
+    if min_weight_leaf > 0:
+        invalid |= ((left[..., WEIGHT] < min_weight_leaf)
+                    | (right[..., WEIGHT] < min_weight_leaf))
+    gain[invalid] = -np.inf
+    return gain, right
+
+
+def _best_split(gain, left, right, parent_stats, features, orders=None):
+    if gain.size == 0:
+        return None
+    _, best = argmax(gain)
+    if best < 0:
+        return None
+    f, b = np.unravel_index(best, gain.shape)
+    # guard against gains that are float noise on a pure node
+    if not gain[f, b] > 1e-12 * max(1., abs(parent_stats[WEIGHT])):
+        return None
+    feature = f if features is None else features[f]
+    left_bins = None
+    if orders is not None and orders[f] is not None:
+        left_bins = np.sort(orders[f][:b + 1])
+    return SplitInfo(gain[f, b], int(feature), int(b),
+                     left[f, b].copy(), right[f, b].copy(), left_bins)
+
+
+def _sorted_categories(hist, criterion, parent_stats):
+    """Histograms of categorical features with their bins sorted by
+    ``criterion.category_key``, the categories of too few samples last,
+    and that order."""
+    # the statistics of CATEGORY_SMOOTHING average samples of the node
+    # pull the keys of the small categories towards the node's
+    prior = parent_stats * (CATEGORY_SMOOTHING
+                            / max(parent_stats[COUNT], 1.))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        key = criterion.category_key(hist + prior, parent_stats)
+    key = np.where(hist[..., COUNT] >= MIN_CATEGORY_SUPPORT, key, np.inf)
+    order = np.argsort(key, axis=1, kind='stable')
+    return np.take_along_axis(hist, order[..., np.newaxis], axis=1), order
+
+
+def find_best_split(hist, criterion, parent_stats, min_samples_leaf=1,
+                    min_weight_leaf=0., features=None, categorical=None):
+    """Best ``bin <= b`` split of a node given its histogram, or best
+    subset of the categories of a categorical feature.
+
+    Parameters
+    ----------
+    hist : ndarray, shape (n_features, n_bins, n_stats)
+
+    criterion : Criterion
+
+    parent_stats : ndarray, shape (n_stats,)
+        Statistics of the whole node (the sum of any feature histogram).
+
+    min_samples_leaf : int
+        Minimum number of samples in each child.
+
+    min_weight_leaf : float
+        Minimum weight (hessian for boosting) in each child.
+
+    features : array of int or None
+        Candidate features, all of them when None.
+
+    categorical : array of bool or None
+        Whether every feature is categorical, none of them when None.
+
+    Returns
+    -------
+    split : SplitInfo or None
+        None when no split satisfies the constraints with a positive gain.
+    """
+    if features is not None:
+        hist = hist[features]
+        if categorical is not None:
+            categorical = categorical[features]
+    # left child of the split after bin b holds bins [0, b]
+    left = np.cumsum(hist[:, :-1, :], axis=1)
+    orders = None
+    if categorical is not None and categorical.any():
+        # the same prefix sums, over the sorted categories
+        rows = np.flatnonzero(categorical)
+        sorted_hist, order = _sorted_categories(hist[rows], criterion,
+                                                parent_stats)
+        left[rows] = np.cumsum(sorted_hist[:, :-1, :], axis=1)
+        orders = [None] * hist.shape[0]
+        for row, row_order in zip(rows, order):
+            orders[row] = row_order
+        # the prefixes stop at the last category of enough samples
+        n_supported = np.count_nonzero(
+            hist[rows, :, COUNT] >= MIN_CATEGORY_SUPPORT, axis=1)
+    gain, right = _split_gains(left, criterion, parent_stats,
+                               min_samples_leaf, min_weight_leaf)
+    if orders is not None:
+        gain[rows] = np.where(
+            np.arange(gain.shape[1]) < n_supported[:, np.newaxis],
+            gain[rows], -np.inf)
+    return _best_split(gain, left, right, parent_stats, features, orders)
+
+
+def find_best_exact_split(values, stats, criterion, parent_stats,
+                          min_samples_leaf=1, min_weight_leaf=0.,
+                          features=None):
+    """Best split of a node between two consecutive distinct values.
+
+    Parameters
+    ----------
+    values : ndarray, shape (n_features, n_node_samples)
+        Feature values of the node samples, every row sorted.
+
+    stats : ndarray, shape (n_features, n_node_samples, n_stats)
+        Statistics of the samples in the order of ``values``.
+
+    criterion, parent_stats, min_samples_leaf, min_weight_leaf, features :
+        As in ``find_best_split``, ``features`` naming the rows.
+
+    Returns
+    -------
+    split : SplitInfo or None
+        ``bin`` is the position of the last sample going left.
+    """
+    # left child of the split after position p holds samples [0, p]
+    left = np.cumsum(stats[:, :-1, :], axis=1)
+    gain, right = _split_gains(left, criterion, parent_stats,
+                               min_samples_leaf, min_weight_leaf)
+    # no float32 threshold separates equal values, nor values closer than
+    # float32 resolves
+    gain[_round_up(values[:, :-1]) >= values[:, 1:]] = -np.inf
+    return _best_split(gain, left, right, parent_stats, features)
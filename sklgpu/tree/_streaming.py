@@ -0,0 +1,137 @@
+"""Training sets larger than memory.
+
+The estimators only keep the binned matrix (uint8 or uint16, 8 or 4 times
+smaller than float64) in memory. The float input is read one chunk of
+rows at a time, so it can be:
+
+- an ``np.memmap``, read in place by ``BinMapper`` without being copied
+  or converted as a whole;
+- an iterator of row chunks, each chunk an array ``X_chunk`` or a tuple
+  ``(X_chunk, y_chunk)`` or ``(X_chunk, y_chunk, sample_weight_chunk)``.
+  The chunks are written to an anonymous temporary file mapped back as an
+  ``np.memmap``, since binning reads the data twice (quantiles, then
+  bins).
+"""
+import tempfile
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.utils import check_array
+
+__all__ = ["is_chunk_iterator", "check_large_array", "spool_chunks",
+           "check_training_data"]
+
+# rows of float input read at a time
+DEFAULT_CHUNK_ROWS = 1 << 16
+
+
+def is_chunk_iterator(X):
+    """Whether ``X`` is an iterator of row chunks rather than a matrix."""
+    return hasattr(X, '__next__')
+
+
+def row_chunks(n_rows, chunk_rows=DEFAULT_CHUNK_ROWS):
+    return [slice(start, min(start + chunk_rows, n_rows))
+            for start in range(0, n_rows, chunk_rows)]
+
+
+def check_large_array(X):
+    """``check_array(X, dtype=np.float64)`` except for memory mapped arrays,
+    which are returned as they are; their chunks are validated and
+    converted when read. CSR and CSC matrices are kept sparse."""
+    if sp.issparse(X):
+        return check_array(X, accept_sparse=['csr', 'csc'], dtype=np.float64)
+    if not isinstance(X, np.memmap):
+        return check_array(X, dtype=np.float64)
+    if X.ndim != 2:
+        raise ValueError("Expected a 2D memory mapped array, got %dD"
+                         % X.ndim)
+    if X.dtype.kind not in 'biuf':
+        raise ValueError("memory mapped arrays should be numeric, got %s"
+                         % X.dtype)
+    if X.shape[0] < 1 or X.shape[1] < 1:
+        raise ValueError("Found array with shape %r, at least one sample "
+                         "and one feature are required" % (X.shape,))
+    return X
+
+
+def read_rows(X, rows):
+    """Rows of ``X`` as a validated float64 array, a view when possible."""
+    return check_array(X[rows], dtype=np.float64)
+
+
+def read_column(X, feature):
+    """Column ``feature`` of ``X`` as a validated float64 array."""
+    return check_array(X[:, [feature]], dtype=np.float64)[:, 0]
+
+
+def spool_chunks(chunks, y=None, sample_weight=None):
+    """Write an iterator of row chunks to a temporary file.
+
+    Parameters
+    ----------
+    chunks : iterator
+        Of arrays, ``(X, y)`` or ``(X, y, sample_weight)`` tuples.
+
+    y, sample_weight : array-like or None
+        For the whole dataset, when the chunks do not carry them.
+
+    Returns
+    -------
+    X : np.memmap of float64, shape (n_samples, n_features)
+
+    y, sample_weight : ndarray or None
+    """
+    y_chunks, weight_chunks = [], []
+    n_chunks = n_rows = n_features = 0
+    # unlinked on creation on POSIX, the mapping keeps the data alive
+    spool = tempfile.TemporaryFile(prefix='sklgpu_')
+    for chunk in chunks:
+        if isinstance(chunk, tuple):
+            if not 2 <= len(chunk) <= 3:
+                raise ValueError("chunks should be arrays or (X, y[, "
+                                 "sample_weight]) tuples, got a tuple of %d"
+                                 % len(chunk))
+            if y is not None:
+                raise ValueError("y is given both as a parameter and in the "
+                                 "chunks")
+            y_chunks.append(np.ravel(chunk[1]))
+            if len(chunk) == 3:
+                weight_chunks.append(np.ravel(chunk[2]))
+            chunk = chunk[0]
+        chunk = check_array(chunk, dtype=np.float64, order='C')
+        if n_rows and chunk.shape[1] != n_features:
+            raise ValueError("chunk has %d features, the previous ones had "
+                             "%d" % (chunk.shape[1], n_features))
+        n_features = chunk.shape[1]
+        n_rows += chunk.shape[0]
+        n_chunks += 1
+        spool.write(memoryview(chunk).cast('B'))
+    if n_rows == 0:
+        raise ValueError("the iterator did not yield any chunk")
+    if y_chunks and len(y_chunks) != n_chunks:
+        raise ValueError("either all the chunks or none carry y")
+    if weight_chunks and len(weight_chunks) != n_chunks:
+        raise ValueError("either all the chunks or none carry sample_weight")
+    if weight_chunks:
+        if sample_weight is not None:
+            raise ValueError("sample_weight is given both as a parameter and "
+                             "in the chunks")
+        sample_weight = np.concatenate(weight_chunks)
+    if y_chunks:
+        y = np.concatenate(y_chunks)
+    if y is None:
+        raise ValueError("y is required, as a parameter or in the chunks")
+    spool.flush()
+    X = np.memmap(spool, dtype=np.float64, mode='r',
+                  shape=(n_rows, n_features))
+    spool.close()
+    return X, y, sample_weight
+
+
+def check_training_data(X, y, sample_weight=None):
+    """Training data of the ``fit`` methods: ``X`` as validated by
+    ``check_large_array``, iterators of chunks spooled to a memmap first."""
+    if is_chunk_iterator(X):
+        return spool_chunks(X, y, sample_weight)
+    return check_large_array(X), y, sample_weight
@@ -0,0 +1,715 @@
+"""Fitted trees as flat node arrays.
+
+Growing works on ``TreeNode`` objects; once a tree is grown it is stored
+as parallel arrays indexed by node id (preorder, the root is node 0), the
+layout of scikit-learn's ``Tree`` with compact types: int32 child ids,
+uint16 feature ids (int32 past 65535 features), float32 thresholds,
+values and node statistics, 26 bytes plus 4 per output per node against
+56 plus 8 in float64 / intp. Thresholds are rounded down to float32, which
+sends every float32 value the same way as the float64 threshold found
+while growing; float64 input is still compared in float64. Prediction
+walks every row of a chunk at once down these arrays, in the
+``_predictor`` Cython extension without the GIL when it is built and with
+vectorized NumPy otherwise.
+
+``TreeEnsemble`` concatenates the arrays of many trees so that a forest
+or a boosting model is predicted in one pass over the rows, on the GPU
+when asked to and a device is there; the device gets the same compact
+arrays. Child ids stay relative to the root of their tree, so the arrays
+of the trees are views of the concatenated ones rather than copies.
+
+Sparse input is predicted as CSR, without densifying: missing entries
+read as 0.
+
+Splits on categorical features send the rows whose category code is in a
+set left. The sets are bitsets over the codes, rows of a uint32
+``categories`` array, and the ``category_split`` node array gives the row
+of every such split (-1 elsewhere, the threshold of those nodes is NaN).
+Trees without categorical split have neither array, their nodes and
+traversal are unchanged. Codes that are not integers of the bitsets,
+negative, NaN or past the largest code of the split, go right; the
+estimators reject NaN before their input reaches the traversal.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+
+from ._backend import cuda_available, require_extension
+from ._profiling import is_active, record, record_kernel
+
+try:
+    from . import _predictor
+except ImportError:
+    _predictor = None
+
+__all__ = ["Tree", "TreeEnsemble", "TREE_LEAF", "TREE_UNDEFINED", "nbytes"]
+
+TREE_LEAF = -1
+TREE_UNDEFINED = -2
+
+NODE_DTYPE = np.int32
+FEATURE_DTYPE = np.uint16
+# features ids of trees split on features past 65535
+WIDE_FEATURE_DTYPE = np.int32
+THRESHOLD_DTYPE = np.float32
+VALUE_DTYPE = np.float32
+# words of the category bitsets
+CATEGORY_DTYPE = np.uint32
+
+_NODE_ARRAYS = ('children_left', 'children_right', 'feature', 'threshold',
+                'value', 'impurity', 'n_node_samples',
+                'weighted_n_node_samples')
+# of the trees with categorical splits, None for the others
+_CATEGORY_ARRAYS = ('category_split', 'categories')
+# rows per prediction pass, bounds the temporaries of the NumPy path
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+
+class _SparseRows(object):
+    """CSR matrix indexed like the dense input of the traversal: ``X[rows,
+    columns]`` (same length arrays) looks the entries up, ``X[chunk]`` (a
+    slice) takes rows."""
+
+    def __init__(self, X):
+        X = sp.csr_matrix(X, dtype=np.float64)
+        X.sort_indices()
+        self.shape = X.shape
+        self.data = X.data
+        self.indices = X.indices.astype(np.intp, copy=False)
+        self.indptr = X.indptr.astype(np.intp, copy=False)
+        self._keys = None
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, _ = key.indices(self.shape[0])
+            return _SparseRows(sp.csr_matrix(
+                (self.data, self.indices, self.indptr),
+                shape=self.shape)[start:stop])
+        rows, columns = key
+        if self._keys is None:
+            # stored entries in row major order, sorted as row * width + col
+            row_of = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+            self._keys = row_of * self.shape[1] + self.indices
+        wanted = np.asarray(rows) * self.shape[1] + np.asarray(columns)
+        values = np.zeros(wanted.shape[0])
+        if self._keys.shape[0]:
+            pos = np.minimum(np.searchsorted(self._keys, wanted),
+                             self._keys.shape[0] - 1)
+            found = self._keys[pos] == wanted
+            values[found] = self.data[pos[found]]
+        return values
+
+
+def _as_predict_input(X):
+    if sp.issparse(X):
+        return _SparseRows(X)
+    return np.ascontiguousarray(X, dtype=np.float64)
+
+
+def _apply_compiled(X, children_left, children_right, feature, threshold,
+                    roots, out, categorical=None):
+    """``categorical`` is ``(category_split, categories, category_roots)``
+    of trees with categorical splits, None otherwise."""
+    categorical = categorical or ()
+    if isinstance(X, _SparseRows):
+        _predictor.apply_csr(X.data, X.indices, X.indptr, children_left,
+                             children_right, feature, threshold, roots, out,
+                             *categorical)
+    else:
+        _predictor.apply_dense(X, children_left, children_right, feature,
+                               threshold, roots, out, *categorical)
+
+
+def _predict_sum_compiled(X, children_left, children_right, feature,
+                          threshold, value, roots, output_offsets, out,
+                          categorical=None):
+    categorical = categorical or ()
+    if isinstance(X, _SparseRows):
+        _predictor.predict_sum_csr(X.data, X.indices, X.indptr,
+                                   children_left, children_right, feature,
+                                   threshold, value, roots, output_offsets,
+                                   out, *categorical)
+    else:
+        _predictor.predict_sum_dense(X, children_left, children_right,
+                                     feature, threshold, value, roots,
+                                     output_offsets, out, *categorical)
+
+
+def _in_categories(x, categories, rows):
+    """Whether code ``x[i]`` is in the bitset ``categories[rows[i]]``."""
+    known = (x >= 0) & (x < categories.shape[1] * 32)
+    codes = np.where(known, x, 0).astype(np.intp)
+    words = categories[rows, codes >> 5]
+    return known & (((words >> (codes & 31).astype(CATEGORY_DTYPE)) & 1) > 0)
+
+
+def _category_bitsets(sets):
+    """uint32 bitsets of the category code arrays ``sets``, one row each,
+    as wide as the largest code needs."""
+    n_words = max(int(np.max(codes)) // 32 + 1 for codes in sets)
+    categories = np.zeros((len(sets), n_words), dtype=CATEGORY_DTYPE)
+    for row, codes in zip(categories, sets):
+        codes = np.asarray(codes, dtype=np.intp)
+        np.bitwise_or.at(row, codes >> 5, np.left_shift(
+            CATEGORY_DTYPE(1), (codes & 31).astype(CATEGORY_DTYPE)))
+    return categories
+
+
+def _apply_numpy(X, children_left, children_right, feature, threshold,
+                 root, category_split=None, categories=None, category_root=0):
+    """Node reached by every row, all rows advancing one level per step.
+
+    Child ids are relative to ``root``, the returned ids are not; the
+    ``category_split`` rows are relative to ``category_root``.
+    """
+    node = np.full(X.shape[0], root, dtype=np.intp)
+    if children_left[root] == TREE_LEAF:
+        return node
+    active = np.arange(X.shape[0])
+    while active.shape[0]:
+        current = node[active]
+        x = X[active, feature[current]]
+        # the float32 thresholds promote to float64
+        goes_left = x <= threshold[current]
+        if category_split is not None:
+            split = category_split[current]
+            categorical = split >= 0
+            if categorical.any():
+                goes_left[categorical] = _in_categories(
+                    x[categorical], categories,
+                    category_root + split[categorical])
+        current = root + np.where(goes_left, children_left[current],
+                                  children_right[current])
+        node[active] = current
+        active = active[children_left[current] != TREE_LEAF]
+    return node
+
+
+def _round_down(threshold):
+    """Largest float32 not above every float64 ``threshold``.
+
+    A float32 ``x`` below or at ``threshold`` is then below or at the
+    rounded value too, and one above it stays above: float32 data is split
+    exactly as during the fit.
+    """
+    rounded = threshold.astype(THRESHOLD_DTYPE)
+    above = rounded > threshold
+    rounded[above] = np.nextafter(rounded[above], THRESHOLD_DTYPE(-np.inf))
+    return rounded
+
+
+def _round_up(values):
+    """Smallest float32 not below every float64 of ``values``.
+
+    No float32 threshold separates ``low < high`` when
+    ``_round_up(low) >= high``.
+    """
+    with np.errstate(over='ignore'):
+        rounded = values.astype(THRESHOLD_DTYPE)
+    below = rounded < values
+    rounded[below] = np.nextafter(rounded[below], THRESHOLD_DTYPE(np.inf))
+    return rounded
+
+
+def _byte_bounds(array):
+    """First and past the last address of the bytes ``array`` views."""
+    low = high = array.__array_interface__['data'][0]
+    for extent, stride in zip(array.shape, array.strides):
+        if stride < 0:
+            low += stride * (extent - 1)
+        else:
+            high += stride * (extent - 1)
+    return low, high + array.itemsize
+
+
+def nbytes(arrays):
+    """Bytes viewed by ``arrays``, bytes viewed by several of them counted
+    once.
+
+    Only the views count, not the whole buffers behind them: the arrays of
+    a model loaded by ``load_model`` all view one memory mapped file.
+    """
+    total = 0
+    end = None
+    for low, high in sorted(_byte_bounds(array) for array in arrays
+                            if array.size):
+        if end is not None:
+            low = max(low, end)
+        if high > low:
+            total += high - low
+            end = high
+    return total
+
+
+def _memory_usage(trees, ensemble=None, bin_thresholds=()):
+    """``memory_usage`` of a fitted estimator: the ``'nodes'`` of its trees
+    and of their ensemble (views of it counted once), the ``'device'``
+    copy of the ensemble, the ``'binning'`` thresholds, the host
+    ``'total'`` and ``'n_nodes'``."""
+    arrays = [getattr(tree, name) for tree in trees
+              for name in _NODE_ARRAYS + _CATEGORY_ARRAYS
+              if getattr(tree, name) is not None]
+    device = 0
+    if ensemble is not None:
+        arrays.extend(getattr(ensemble, name)
+                      for name in _NODE_ARRAYS + _CATEGORY_ARRAYS
+                      if getattr(ensemble, name) is not None)
+        device = ensemble.memory_usage()['device']
+    usage = {'nodes': nbytes(arrays), 'device': device,
+             'binning': nbytes(bin_thresholds)}
+    usage['total'] = usage['nodes'] + usage['binning']
+    usage['n_nodes'] = sum(tree.node_count for tree in trees)
+    return usage
+
+
+def _chunks(n_rows, chunk_size):
+    return [slice(start, min(start + chunk_size, n_rows))
+            for start in range(0, n_rows, chunk_size)]
+
+
+def _map_chunks(func, n_rows, chunk_size, n_threads):
+    """Run ``func(chunk)`` over row chunks, on threads when asked to (the
+    Cython path releases the GIL)."""
+    chunks = _chunks(n_rows, chunk_size)
+    if n_threads <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            func(chunk)
+        return
+    with ThreadPoolExecutor(min(n_threads, len(chunks))) as executor:
+        list(executor.map(func, chunks))
+
+
+def _feature_dtype(max_feature):
+    if max_feature > np.iinfo(FEATURE_DTYPE).max:
+        return WIDE_FEATURE_DTYPE
+    return FEATURE_DTYPE
+
+
+class Tree(object):
+    """Array representation of a fitted tree.
+
+    Internal node ``i`` sends the rows with ``X[:, feature[i]] <=
+    threshold[i]`` to ``children_left[i]``, the others to
+    ``children_right[i]``. Leaves have ``children_left == TREE_LEAF``,
+    ``feature == 0`` (there is no room for ``TREE_UNDEFINED`` in uint16)
+    and ``threshold == TREE_UNDEFINED``.
+
+    Attributes
+    ----------
+    children_left, children_right : ndarray of int32, shape (node_count,)
+
+    feature : ndarray of uint16 or int32, shape (node_count,)
+        int32 when the tree splits on features past 65535.
+
+    threshold : ndarray of float32, shape (node_count,)
+
+    value : ndarray of float32, shape (node_count, n_outputs)
+        Class probabilities, mean target or leaf value of the node.
+
+    impurity : ndarray of float32, shape (node_count,)
+
+    n_node_samples : ndarray of int32, shape (node_count,)
+
+    weighted_n_node_samples : ndarray of float32, shape (node_count,)
+
+    max_depth : int
+
+    category_split : ndarray of int32, shape (node_count,) or None
+        Row of ``categories`` of the splits on a categorical feature, -1
+        for the other nodes. None when the tree has no such split.
+
+    categories : ndarray of uint32, shape (n_category_splits, n_words) \
+            or None
+        Bitsets of the category codes going left, code ``c`` is bit
+        ``c % 32`` of word ``c // 32``.
+    """
+
+    def __init__(self, children_left, children_right, feature, threshold,
+                 value, impurity, n_node_samples, weighted_n_node_samples,
+                 max_depth, category_split=None, categories=None):
+        self.children_left = children_left
+        self.children_right = children_right
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.impurity = impurity
+        self.n_node_samples = n_node_samples
+        self.weighted_n_node_samples = weighted_n_node_samples
+        self.max_depth = max_depth
+        self.category_split = category_split
+        self.categories = categories
+
+    def __setstate__(self, state):
+        # pickled before the categorical splits
+        state.setdefault('category_split', None)
+        state.setdefault('categories', None)
+        self.__dict__.update(state)
+
+    @classmethod
+    def from_root(cls, root):
+        """Flatten a grown ``TreeNode`` tree, numbering nodes in preorder."""
+        nodes = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            if not node.is_leaf:
+                stack.append(node.right)
+                stack.append(node.left)
+        index = {id(node): i for i, node in enumerate(nodes)}
+
+        n_nodes = len(nodes)
+        children_left = np.full(n_nodes, TREE_LEAF, dtype=NODE_DTYPE)
+        children_right = np.full(n_nodes, TREE_LEAF, dtype=NODE_DTYPE)
+        feature = np.zeros(n_nodes, dtype=np.intp)
+        threshold = np.full(n_nodes, TREE_UNDEFINED, dtype=np.float64)
+        category_split = np.full(n_nodes, -1, dtype=NODE_DTYPE)
+        category_sets = []
+        for i, node in enumerate(nodes):
+            if not node.is_leaf:
+                children_left[i] = index[id(node.left)]
+                children_right[i] = index[id(node.right)]
+                feature[i] = node.feature
+                threshold[i] = node.threshold
+                if node.categories is not None:
+                    category_split[i] = len(category_sets)
+                    category_sets.append(node.categories)
+        categories = None
+        if category_sets:
+            categories = _category_bitsets(category_sets)
+        else:
+            category_split = None
+        value = np.array([np.ravel(node.value) for node in nodes],
+                         dtype=VALUE_DTYPE)
+        return cls(children_left, children_right,
+                   feature.astype(_feature_dtype(feature.max())),
+                   _round_down(threshold), value,
+                   np.array([node.impurity for node in nodes],
+                            dtype=np.float32),
+                   np.array([node.n_samples for node in nodes],
+                            dtype=np.int32),
+                   np.array([node.weighted_n_samples for node in nodes],
+                            dtype=np.float32),
+                   max(node.depth for node in nodes), category_split,
+                   categories)
+
+    @property
+    def node_count(self):
+        return self.children_left.shape[0]
+
+    @property
+    def n_leaves(self):
+        return int(np.count_nonzero(self.children_left == TREE_LEAF))
+
+    @property
+    def n_outputs(self):
+        return self.value.shape[1]
+
+    def memory_usage(self):
+        """Bytes of every node array (and category array) and their
+        ``'total'``."""
+        usage = {name: getattr(self, name).nbytes
+                 for name in _NODE_ARRAYS + _CATEGORY_ARRAYS
+                 if getattr(self, name) is not None}
+        usage['total'] = sum(usage.values())
+        return usage
+
+    def apply(self, X, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Index of the leaf reached by every row of ``X``."""
+        X = _as_predict_input(X)
+        out = np.empty(X.shape[0], dtype=np.intp)
+
+        def apply_chunk(chunk):
+            out[chunk] = _apply_numpy(X[chunk], self.children_left,
+                                      self.children_right, self.feature,
+                                      self.threshold, 0, self.category_split,
+                                      self.categories)
+
+        with record('predict'):
+            if _predictor is not None:
+                categorical = None
+                if self.category_split is not None:
+                    categorical = (self.category_split, self.categories,
+                                   np.zeros(1, dtype=np.intp))
+                _apply_compiled(
+                    X, self.children_left, self.children_right, self.feature,
+                    self.threshold, np.zeros(1, dtype=np.intp),
+                    out.reshape(-1, 1), categorical)
+            else:
+                _map_chunks(apply_chunk, X.shape[0], chunk_size, 1)
+        return out
+
+    def predict(self, X, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Value of the leaf reached by every row, (n_samples, n_outputs)."""
+        return self.value.take(self.apply(X, chunk_size),
+                               axis=0).astype(np.float64)
+
+
+class TreeEnsemble(object):
+    """Node arrays of several trees concatenated for batch prediction.
+
+    ``predict`` sums the leaf values of all trees: the value of tree ``t``
+    (``n_outputs`` wide) is added at columns ``output_offsets[t]`` onwards,
+    which gives the sum behind a forest average (all offsets 0) or the raw
+    predictions of a boosting model (offset ``k`` for the trees of class
+    ``k``).
+
+    Parameters
+    ----------
+    trees : list of Tree
+        All with the same number of outputs.
+
+    output_offsets : array of int or None
+        First output column of every tree, all 0 when None.
+
+    n_outputs : int or None
+        Width of the prediction, enough for every tree when None.
+
+    Attributes
+    ----------
+    children_left, children_right, feature, threshold, value, impurity, \
+            n_node_samples, weighted_n_node_samples :
+        The node arrays of the trees, one after the other; the child ids
+        of the nodes of tree ``t`` are relative to ``roots[t]``. The
+        arrays of the trees are replaced by views of these, so the nodes
+        are held once.
+
+    roots : ndarray of intp, shape (n_trees,)
+        First node of every tree.
+
+    category_split, categories : ndarray or None
+        The category arrays of the trees, None when no tree has a
+        categorical split. The ``category_split`` rows of tree ``t`` are
+        relative to ``category_roots[t]``, the bitsets are padded to the
+        widest.
+
+    category_roots : ndarray of intp, shape (n_trees,) or None
+        First bitset of every tree.
+    """
+
+    # rows per chunk and streams of the CUDA prediction pipeline
+    cuda_chunk_rows = 1 << 16
+    cuda_streams = 2
+
+    def __init__(self, trees, output_offsets=None, n_outputs=None):
+        if not trees:
+            raise ValueError("TreeEnsemble needs at least one tree")
+        width = trees[0].n_outputs
+        if any(tree.n_outputs != width for tree in trees):
+            raise ValueError("all the trees should have the same number of "
+                             "outputs")
+        self.n_trees = len(trees)
+        sizes = np.array([tree.node_count for tree in trees], dtype=np.intp)
+        ends = np.cumsum(sizes)
+        self.roots = np.concatenate([[0], ends[:-1]]).astype(np.intp)
+        for name in _NODE_ARRAYS:
+            # uint16 features promote to int32 next to a wide tree
+            array = np.concatenate([getattr(t, name) for t in trees])
+            setattr(self, name, array)
+            for tree, start, end in zip(trees, self.roots, ends):
+                setattr(tree, name, array[start:end])
+        if output_offsets is None:
+            output_offsets = np.zeros(self.n_trees, dtype=np.intp)
+        self.output_offsets = np.asarray(output_offsets, dtype=np.intp)
+        if n_outputs is None:
+            n_outputs = int(self.output_offsets.max()) + width
+        self.n_outputs = n_outputs
+        self._concatenate_categories(trees, ends)
+
+    def _concatenate_categories(self, trees, ends):
+        self.category_split = self.categories = self.category_roots = None
+        categorical = [tree for tree in trees
+                       if tree.category_split is not None]
+        if not categorical:
+            return
+        n_words = max(tree.categories.shape[1] for tree in categorical)
+        rows = np.array([0 if tree.category_split is None
+                         else tree.categories.shape[0] for tree in trees],
+                        dtype=np.intp)
+        self.category_roots = np.concatenate([[0], np.cumsum(rows)[:-1]])
+        self.category_split = np.full(self.node_count, -1, dtype=NODE_DTYPE)
+        self.categories = np.zeros((rows.sum(), n_words),
+                                   dtype=CATEGORY_DTYPE)
+        for tree, start, end, first, n_rows in zip(
+                trees, self.roots, ends, self.category_roots, rows):
+            if tree.category_split is None:
+                continue
+            self.category_split[start:end] = tree.category_split
+            bitsets = self.categories[first:first + n_rows]
+            bitsets[:, :tree.categories.shape[1]] = tree.categories
+            tree.category_split = self.category_split[start:end]
+            tree.categories = bitsets
+
+    def _categorical(self):
+        """The category arguments of the compiled traversal, or None."""
+        if self.category_split is None:
+            return None
+        return self.category_split, self.categories, self.category_roots
+
+    @classmethod
+    def from_arrays(cls, arrays, roots, output_offsets, n_outputs,
+                    category_roots=None):
+        """An ensemble around node arrays concatenated already, e.g. memory
+        mapped from a model file, without copying them.
+
+        ``arrays`` maps every node array name, and the category array
+        names when ``category_roots`` is given, to its concatenation over
+        the trees; ``roots`` gives the first node of every tree.
+        """
+        ensemble = cls.__new__(cls)
+        for name in _NODE_ARRAYS:
+            setattr(ensemble, name, arrays[name])
+        ensemble.roots = np.asarray(roots, dtype=np.intp)
+        ensemble.n_trees = ensemble.roots.shape[0]
+        ensemble.output_offsets = np.asarray(output_offsets, dtype=np.intp)
+        ensemble.n_outputs = n_outputs
+        ensemble.category_split = ensemble.categories = None
+        ensemble.category_roots = None
+        if category_roots is not None:
+            ensemble.category_split = arrays['category_split']
+            ensemble.categories = arrays['categories']
+            ensemble.category_roots = np.asarray(category_roots,
+                                                 dtype=np.intp)
+        return ensemble
+
+    def trees(self, max_depths):
+        """The trees as ``Tree`` objects whose arrays are views of the
+        concatenated ones."""
+        ends = np.append(self.roots[1:], self.node_count)
+        trees = []
+        for t, (start, end, max_depth) in enumerate(zip(self.roots, ends,
+                                                        max_depths)):
+            tree = Tree(*([getattr(self, name)[start:end]
+                           for name in _NODE_ARRAYS] + [int(max_depth)]))
+            if self.category_split is not None:
+                first = self.category_roots[t]
+                last = (self.category_roots[t + 1] if t + 1 < self.n_trees
+                        else self.categories.shape[0])
+                if last > first:
+                    tree.category_split = self.category_split[start:end]
+                    tree.categories = self.categories[first:last]
+            trees.append(tree)
+        return trees
+
+    @property
+    def node_count(self):
+        return self.children_left.shape[0]
+
+    def memory_usage(self):
+        """Bytes of every node array (and category array), their
+        ``'total'`` and the ``'device'`` bytes of the copy made for GPU
+        prediction."""
+        usage = {name: getattr(self, name).nbytes
+                 for name in _NODE_ARRAYS + _CATEGORY_ARRAYS
+                 if getattr(self, name) is not None}
+        usage['total'] = sum(usage.values())
+        usage['device'] = 0
+        if getattr(self, '_cuda_predictor', None) is not None:
+            # the arrays read by the traversal and the int32 roots and
+            # output offsets, the node statistics stay on the host
+            usage['device'] = (sum(usage[name] for name in _NODE_ARRAYS[:5])
+                               + self.n_trees * 8)
+            if self.category_split is not None:
+                usage['device'] += (usage['category_split']
+                                    + usage['categories'] + self.n_trees * 4)
+        return usage
+
+    def apply(self, X, chunk_size=DEFAULT_CHUNK_SIZE, n_threads=1):
+        """Leaf of every row in every tree, numbered within each tree,
+        shape (n_samples, n_trees)."""
+        X = _as_predict_input(X)
+        out = np.empty((X.shape[0], self.n_trees), dtype=np.intp)
+
+        def apply_chunk(chunk):
+            if _predictor is not None:
+                _apply_compiled(
+                    X[chunk], self.children_left, self.children_right,
+                    self.feature, self.threshold, self.roots, out[chunk],
+                    self._categorical())
+                return
+            for t, root in enumerate(self.roots):
+                out[chunk, t] = _apply_numpy(
+                    X[chunk], self.children_left, self.children_right,
+                    self.feature, self.threshold, root,
+                    *self._tree_categories(t))
+
+        with record('predict'):
+            _map_chunks(apply_chunk, X.shape[0], chunk_size, n_threads)
+        out -= self.roots
+        return out
+
+    def predict(self, X, chunk_size=DEFAULT_CHUNK_SIZE, n_threads=1,
+                backend='cpu'):
+        """Sum of the leaf values of the trees, (n_samples, n_outputs).
+
+        With ``backend='cuda'`` dense rows go to the ``_tree_gpu`` kernel,
+        ``cuda_chunk_rows`` at a time through pinned double buffers so the
+        uploads overlap the traversal; the sums are the same. Sparse rows,
+        or no device, take the host path.
+        """
+        X = _as_predict_input(X)
+        if (backend == 'cuda' and not isinstance(X, _SparseRows)
+                and cuda_available()):
+            return self._predict_cuda(X)
+        out = np.zeros((X.shape[0], self.n_outputs))
+        width = self.value.shape[1]
+
+        def predict_chunk(chunk):
+            if _predictor is not None:
+                _predict_sum_compiled(
+                    X[chunk], self.children_left, self.children_right,
+                    self.feature, self.threshold, self.value, self.roots,
+                    self.output_offsets, out[chunk], self._categorical())
+                return
+            for t, (root, offset) in enumerate(zip(self.roots,
+                                                   self.output_offsets)):
+                leaves = _apply_numpy(X[chunk], self.children_left,
+                                      self.children_right, self.feature,
+                                      self.threshold, root,
+                                      *self._tree_categories(t))
+                out[chunk, offset:offset + width] += self.value.take(
+                    leaves, axis=0)
+
+        with record('predict'):
+            _map_chunks(predict_chunk, X.shape[0], chunk_size, n_threads)
+        return out
+
+    def _tree_categories(self, t):
+        """The category arguments of ``_apply_numpy`` for tree ``t``."""
+        if self.category_split is None:
+            return ()
+        return (self.category_split, self.categories,
+                self.category_roots[t])
+
+    def _predict_cuda(self, X):
+        if getattr(self, '_cuda_predictor', None) is None:
+            _tree_gpu = require_extension("the 'cuda' backend")
+            # the node arrays are uploaded once
+            self._cuda_predictor = _tree_gpu.EnsemblePredictor(
+                self.children_left, self.children_right, self.feature,
+                self.threshold, self.value, self.roots, self.output_offsets,
+                self.n_outputs, self.cuda_chunk_rows, self.cuda_streams,
+                *(self._categorical() or ()))
+        predictor = self._cuda_predictor
+        predictor.profile = is_active()
+        with record('predict'):
+            out = predictor.predict(X)
+        if predictor.profile:
+            timings = predictor.timings
+            record_kernel('predict_upload', timings['upload_ms'] * 1e-3)
+            record_kernel('predict', timings['kernel_ms'] * 1e-3)
+            record_kernel('predict_download', timings['download_ms'] * 1e-3)
+        return out
+
+    def __getstate__(self):
+        # device buffers do not pickle, they are uploaded again on use
+        state = self.__dict__.copy()
+        state.pop('_cuda_predictor', None)
+        return state
+
+    def __setstate__(self, state):
+        # pickled before the categorical splits
+        for name in _CATEGORY_ARRAYS + ('category_roots',):
+            state.setdefault(name, None)
+        self.__dict__.update(state)
@@ -0,0 +1,595 @@
+# coding: utf-8
+# cython: language_level=3
+import numpy as np
+cimport numpy as np
+from libc.math cimport cosf
+
+np.import_array()
+
+cdef extern from "cudalib.h":
+	ctypedef struct DeviceProperties:
+		char name[256]
+		int major
+		int minor
+		int driver_version
+		int runtime_version
+		size_t total_global_mem
+		size_t shared_mem_per_block
+		int multiprocessor_count
+		int clock_rate_khz
+		int memory_clock_rate_khz
+		int memory_bus_width
+		int warp_size
+		int max_threads_per_multiprocessor
+		int max_threads_per_block
+		int max_threads_dim[3]
+		int max_grid_size[3]
+	int cuDeviceProperties(int device, DeviceProperties* props) nogil
+	int cuCheck()
+
+cdef extern from "histogram.h":
+	ctypedef struct HistContext:
+		int profile
+		float upload_ms
+		float kernel_ms
+		float download_ms
+	int cuDeviceCount(int* count) nogil
+	const char* cuErrorString(int code) nogil
+	int cuMemGetInfo(size_t* free_bytes, size_t* total_bytes) nogil
+	int cuHistCreate(HistContext** ctx, const void* X, unsigned int bin_bytes,
+		unsigned int n_rows, unsigned int n_features, unsigned int n_bins, unsigned int n_stats,
+		unsigned int chunk_rows, unsigned int n_streams) nogil
+	int cuHistSetStats(HistContext* ctx, const double* stats) nogil
+	int cuHistBuild(HistContext* ctx, const unsigned int* indices, unsigned int n_idx,
+		double* out) nogil
+	void cuHistFree(HistContext* ctx) nogil
+
+cdef extern from "pipeline.h":
+	int PIPELINE_MAX_STREAMS
+
+cdef extern from "predict.h":
+	ctypedef struct PredictContext:
+		int profile
+		float upload_ms
+		float kernel_ms
+		float download_ms
+	int cuPredictCreate(PredictContext** ctx, const int* children_left, const int* children_right,
+		const void* feature, unsigned int feature_bytes, const float* threshold, const float* value,
+		unsigned int n_nodes, unsigned int width, const int* roots, const int* output_offsets,
+		unsigned int n_trees, unsigned int n_outputs, unsigned int chunk_rows,
+		unsigned int n_streams, const int* category_split, const unsigned int* categories,
+		const int* category_roots, unsigned int n_category_rows, unsigned int n_words) nogil
+	int cuPredictSum(PredictContext* ctx, const double* X, unsigned int n_rows,
+		unsigned int n_features, double* out) nogil
+	void cuPredictFree(PredictContext* ctx) nogil
+
+cdef extern from "shap.h":
+	int SHAP_MAX_LENGTH
+	ctypedef struct ShapContext:
+		int profile
+		float upload_ms
+		float kernel_ms
+		float download_ms
+	int cuShapCreate(ShapContext** ctx, const int* path_start, const int* feature,
+		const float* lower, const float* upper, const double* zero_fraction, const double* value,
+		const int* column, unsigned int n_paths, unsigned int width, unsigned int n_outputs,
+		unsigned int n_features, const unsigned char* in_background, unsigned int n_background,
+		const double* weights, unsigned int max_length, unsigned int chunk_rows,
+		unsigned int n_streams, const int* category_set, const unsigned int* categories,
+		unsigned int n_sets, unsigned int n_words) nogil
+	int cuShapValues(ShapContext* ctx, const double* X, unsigned int n_rows, double* out) nogil
+	void cuShapFree(ShapContext* ctx) nogil
+
+cdef extern from "reduction.h":
+	int cuReduceFloat(const float* x, unsigned int n, int op, int variant,
+		unsigned int block_size, float* out, float* kernel_ms) nogil
+	int cuReduceDouble(const double* x, unsigned int n, int op, int variant,
+		unsigned int block_size, double* out, float* kernel_ms) nogil
+	int cuArgmaxFloat(const float* x, unsigned int n, unsigned int block_size,
+		float* value, long long* index, float* kernel_ms) nogil
+	int cuArgmaxDouble(const double* x, unsigned int n, unsigned int block_size,
+		double* value, long long* index, float* kernel_ms) nogil
+
+cdef extern from "memory_pool.h":
+	ctypedef struct PoolStats:
+		unsigned long long bytes_in_use
+		unsigned long long bytes_cached
+		unsigned long long peak_bytes_in_use
+		unsigned long long max_cached_bytes
+		unsigned long long hits
+		unsigned long long misses
+	int POOL_DEVICE
+	int POOL_PINNED
+	void cuPoolStats(int kind, PoolStats* stats) nogil
+	void cuPoolSetLimit(int kind, size_t max_cached_bytes) nogil
+	int cuPoolRelease(int kind) nogil
+
+ctypedef fused floating:
+	float
+	double
+
+
+cdef int _check(int code) except -1:
+	if code != 0:
+		raise RuntimeError("CUDA error %d: %s" % (code, cuErrorString(code).decode("utf-8")))
+	return 0
+
+
+cpdef int device_count() except -1:
+	cdef int count = 0
+	_check(cuDeviceCount(&count))
+	return count
+
+
+cpdef void gpu_check() except *:
+	cuCheck()
+
+
+# smoke checks of the extension build, see tests/test.py
+
+cpdef float add_a_b(float a, float b) except *:
+	return a + b
+
+
+cpdef float cos(float theta) except *:
+	return cosf(theta)
+
+
+cpdef float square(float a) except *:
+	return a * a
+
+
+cpdef float npsum(np.ndarray[np.float64_t, ndim=1] arr) except *:
+	return np.sum(arr)
+
+
+def device_properties(int device=0):
+	"""Properties of a CUDA device as a dict."""
+	cdef DeviceProperties props
+	_check(cuDeviceProperties(device, &props))
+	return {
+		'name': props.name.decode("utf-8", "replace"),
+		'compute_capability': (props.major, props.minor),
+		'driver_version': props.driver_version,
+		'runtime_version': props.runtime_version,
+		'total_global_mem': props.total_global_mem,
+		'shared_mem_per_block': props.shared_mem_per_block,
+		'multiprocessor_count': props.multiprocessor_count,
+		'clock_rate_khz': props.clock_rate_khz,
+		'memory_clock_rate_khz': props.memory_clock_rate_khz,
+		'memory_bus_width': props.memory_bus_width,
+		'warp_size': props.warp_size,
+		'max_threads_per_multiprocessor': props.max_threads_per_multiprocessor,
+		'max_threads_per_block': props.max_threads_per_block,
+		'max_threads_dim': tuple(props.max_threads_dim[i] for i in range(3)),
+		'max_grid_size': tuple(props.max_grid_size[i] for i in range(3)),
+	}
+
+
+POOL_KINDS = {'device': POOL_DEVICE, 'pinned': POOL_PINNED}
+
+
+def pool_stats(int kind):
+	"""Counters of a caching allocator, ``kind`` is a ``POOL_KINDS`` value."""
+	cdef PoolStats stats
+	cuPoolStats(kind, &stats)
+	return {
+		'bytes_in_use': stats.bytes_in_use,
+		'bytes_cached': stats.bytes_cached,
+		'peak_bytes_in_use': stats.peak_bytes_in_use,
+		'max_cached_bytes': stats.max_cached_bytes,
+		'hits': stats.hits,
+		'misses': stats.misses,
+	}
+
+
+def pool_set_limit(int kind, size_t max_cached_bytes):
+	"""Cap the bytes kept cached, freed blocks beyond it go to the driver."""
+	cuPoolSetLimit(kind, max_cached_bytes)
+
+
+def pool_release(int kind):
+	"""Give every cached block back to the driver."""
+	_check(cuPoolRelease(kind))
+
+
+def reduce(const floating[::1] x, int op, int variant, unsigned int block_size,
+		dict timings=None):
+	"""Sum (op 0), min (1) or max (2) of a float32 or float64 array with the
+	given kernel variant, see ``sklgpu.tree._reduction``.
+
+	When ``timings`` is a dict, the kernel time in milliseconds is stored
+	under ``'kernel_ms'``."""
+	cdef int code
+	cdef floating out = 0
+	cdef float kernel_ms = 0
+	cdef float* timing = &kernel_ms if timings is not None else NULL
+	cdef unsigned int n = x.shape[0]
+	cdef const floating* data = &x[0] if n > 0 else NULL
+	with nogil:
+		if floating is float:
+			code = cuReduceFloat(data, n, op, variant, block_size, &out, timing)
+		else:
+			code = cuReduceDouble(data, n, op, variant, block_size, &out, timing)
+	_check(code)
+	if timings is not None:
+		timings['kernel_ms'] = kernel_ms
+	return np.float32(out) if floating is float else np.float64(out)
+
+
+def argmax(const floating[::1] x, unsigned int block_size, dict timings=None):
+	"""``(value, index)`` of the maximum, first index on ties, NaN ignored."""
+	cdef int code
+	cdef floating value = 0
+	cdef long long index = -1
+	cdef float kernel_ms = 0
+	cdef float* timing = &kernel_ms if timings is not None else NULL
+	cdef unsigned int n = x.shape[0]
+	cdef const floating* data = &x[0] if n > 0 else NULL
+	with nogil:
+		if floating is float:
+			code = cuArgmaxFloat(data, n, block_size, &value, &index, timing)
+		else:
+			code = cuArgmaxDouble(data, n, block_size, &value, &index, timing)
+	_check(code)
+	if timings is not None:
+		timings['kernel_ms'] = kernel_ms
+	return (np.float32(value) if floating is float else np.float64(value)), index
+
+
+cdef class HistogramBuilder:
+	"""Feature histograms on the GPU.
+
+	The binned matrix (uint8 or uint16, uploaded column major) is copied to
+	the device once, ``set_stats`` uploads the per-sample statistics and
+	``build`` only copies the node sample indices before running the kernel.
+
+	With ``chunk_rows`` smaller than the number of rows, the matrix and the
+	statistics stay in host memory and every ``build`` streams the chunks of
+	``chunk_rows`` rows holding node samples through the device. -1 picks
+	the largest chunks for which the buffers of all the streams fit in half
+	of the free device memory, which is the whole matrix when it fits.
+
+	Uploads go through pinned staging buffers on ``n_streams`` streams, the
+	copy of a chunk (or of a batch of indices) overlapping the kernel of the
+	previous one.
+
+	With ``profile`` set, ``timings`` holds the CUDA event timings of the
+	last ``set_stats`` or ``build`` call.
+	"""
+	cdef HistContext* ctx
+	cdef np.ndarray _X
+	cdef object _stats
+	cdef readonly unsigned int n_rows
+	cdef readonly unsigned int n_features
+	cdef readonly unsigned int n_bins
+	cdef readonly unsigned int n_stats
+	cdef readonly unsigned int chunk_rows
+	cdef readonly unsigned int n_streams
+	cdef long long _requested_chunk_rows
+	cdef public bint profile
+
+	def __cinit__(self, X_binned, unsigned int n_bins, long long chunk_rows=0,
+			unsigned int n_streams=2):
+		X_binned = np.asfortranarray(X_binned)
+		if X_binned.ndim != 2 or X_binned.dtype not in (np.uint8, np.uint16):
+			raise ValueError("X_binned should be a 2d uint8 or uint16 array")
+		if not 1 <= n_streams <= PIPELINE_MAX_STREAMS:
+			raise ValueError("n_streams should be between 1 and %d, got %d"
+				% (PIPELINE_MAX_STREAMS, n_streams))
+		self.ctx = NULL
+		self._X = X_binned
+		self.n_rows = X_binned.shape[0]
+		self.n_features = X_binned.shape[1]
+		self.n_bins = n_bins
+		self.n_stats = 0
+		self.chunk_rows = 0
+		self.n_streams = n_streams
+		self._requested_chunk_rows = chunk_rows
+		self._stats = None
+		self.profile = False
+
+	def __dealloc__(self):
+		if self.ctx != NULL:
+			cuHistFree(self.ctx)
+			self.ctx = NULL
+
+	def set_stats(self, stats_array):
+		"""Set the ``(n_rows, n_stats)`` per-sample statistics."""
+		cdef const double[:, ::1] stats = stats_array
+		cdef int code
+		cdef const void* X = np.PyArray_DATA(self._X)
+		cdef unsigned int bin_bytes = self._X.dtype.itemsize
+		if stats.shape[0] != self.n_rows:
+			raise ValueError("stats has %d rows, expected %d" % (stats.shape[0], self.n_rows))
+		if self.ctx == NULL or stats.shape[1] != self.n_stats:
+			# the device buffers are sized on the number of statistics
+			if self.ctx != NULL:
+				cuHistFree(self.ctx)
+				self.ctx = NULL
+			self.n_stats = stats.shape[1]
+			self.chunk_rows = self._chunk_rows(bin_bytes)
+			with nogil:
+				code = cuHistCreate(&self.ctx, X, bin_bytes, self.n_rows,
+					self.n_features, self.n_bins, self.n_stats, self.chunk_rows,
+					self.n_streams)
+			_check(code)
+		# streamed chunks are read from the host array until the next call
+		self._stats = stats_array
+		self.ctx.profile = self.profile
+		with nogil:
+			code = cuHistSetStats(self.ctx, &stats[0, 0])
+		_check(code)
+
+	def build(self, const unsigned int[::1] sample_indices, hist=None):
+		"""Histogram of shape ``(n_features, n_bins, n_stats)`` of the samples,
+		written to ``hist`` when given."""
+		cdef int code
+		cdef unsigned int n_idx = sample_indices.shape[0]
+		if self.ctx == NULL:
+			raise RuntimeError("set_stats must be called before build")
+		if hist is None:
+			hist = np.empty((self.n_features, self.n_bins, self.n_stats), dtype=np.float64)
+		elif hist.shape != (self.n_features, self.n_bins, self.n_stats):
+			raise ValueError("hist should have shape %r" % ((self.n_features, self.n_bins, self.n_stats),))
+		cdef double[:, :, ::1] out = hist
+		cdef const unsigned int* indices = &sample_indices[0] if n_idx > 0 else NULL
+		self.ctx.profile = self.profile
+		with nogil:
+			code = cuHistBuild(self.ctx, indices, n_idx, &out[0, 0, 0])
+		_check(code)
+		return hist
+
+	cdef unsigned int _chunk_rows(self, unsigned int bin_bytes) except? 0:
+		"""0 (device resident) or the rows per streamed chunk."""
+		cdef size_t free_bytes = 0, total_bytes = 0, row_bytes
+		if self._requested_chunk_rows >= 0:
+			if self._requested_chunk_rows >= self.n_rows:
+				return 0
+			return max(<unsigned int>self._requested_chunk_rows, 1)
+		_check(cuMemGetInfo(&free_bytes, &total_bytes))
+		# binned row, statistics and sample index
+		row_bytes = self.n_features * bin_bytes + self.n_stats * sizeof(double) + sizeof(unsigned int)
+		if <size_t>self.n_rows * row_bytes <= free_bytes // 2:
+			return 0
+		# every stream has its own chunk buffer
+		return max(<unsigned int>((free_bytes // 2) // (row_bytes * self.n_streams)), 1)
+
+	@property
+	def timings(self):
+		"""``{'upload_ms', 'kernel_ms', 'download_ms'}`` of the last call."""
+		if self.ctx == NULL:
+			return {'upload_ms': 0., 'kernel_ms': 0., 'download_ms': 0.}
+		return {'upload_ms': self.ctx.upload_ms, 'kernel_ms': self.ctx.kernel_ms,
+			'download_ms': self.ctx.download_ms}
+
+
+cdef class EnsemblePredictor:
+	"""Sum of the leaf values of a ``TreeEnsemble`` computed on the GPU.
+
+	The node arrays are uploaded once, in the compact layout of the
+	ensemble (uint16 or int32 features, float32 thresholds and values,
+	children relative to the roots). ``predict`` feeds the rows through
+	the device ``chunk_rows`` at a time on ``n_streams`` streams with pinned
+	staging buffers: the upload of a chunk and the download of the previous
+	results overlap the kernel of the current one. The ``category_split``,
+	``categories`` and ``category_roots`` of an ensemble with categorical
+	splits are uploaded with the nodes.
+	"""
+	cdef PredictContext* ctx
+	cdef readonly unsigned int n_outputs
+	cdef readonly unsigned int chunk_rows
+	cdef readonly unsigned int n_streams
+	cdef public bint profile
+
+	def __cinit__(self, children_left, children_right, feature, threshold, value, roots,
+			output_offsets, unsigned int n_outputs, unsigned int chunk_rows=65536,
+			unsigned int n_streams=2, category_split=None, categories=None,
+			category_roots=None):
+		cdef const int[::1] left = np.ascontiguousarray(children_left, dtype=np.int32)
+		cdef const int[::1] right = np.ascontiguousarray(children_right, dtype=np.int32)
+		feature = np.ascontiguousarray(feature)
+		if feature.dtype != np.uint16:
+			feature = feature.astype(np.int32, copy=False)
+		cdef const unsigned char[::1] feature_ = feature.view(np.uint8)
+		cdef unsigned int feature_bytes = feature.itemsize
+		cdef const float[::1] threshold_ = np.ascontiguousarray(threshold, dtype=np.float32)
+		cdef const float[:, ::1] value_ = np.ascontiguousarray(value, dtype=np.float32)
+		cdef const int[::1] roots_ = np.ascontiguousarray(roots, dtype=np.int32)
+		cdef const int[::1] offsets = np.ascontiguousarray(output_offsets, dtype=np.int32)
+		cdef const int[::1] split
+		cdef const unsigned int[:, ::1] bitsets
+		cdef const int[::1] category_roots_
+		cdef const int* split_ptr = NULL
+		cdef const unsigned int* bitsets_ptr = NULL
+		cdef const int* category_roots_ptr = NULL
+		cdef unsigned int n_category_rows = 0
+		cdef unsigned int n_words = 0
+		cdef int code
+		self.ctx = NULL
+		self.profile = False
+		if chunk_rows == 0:
+			raise ValueError("chunk_rows should be positive")
+		if not 1 <= n_streams <= PIPELINE_MAX_STREAMS:
+			raise ValueError("n_streams should be between 1 and %d, got %d"
+				% (PIPELINE_MAX_STREAMS, n_streams))
+		if left.shape[0] == 0 or roots_.shape[0] == 0:
+			raise ValueError("the ensemble has no node")
+		if category_split is not None:
+			split = np.ascontiguousarray(category_split, dtype=np.int32)
+			bitsets = np.ascontiguousarray(categories, dtype=np.uint32)
+			category_roots_ = np.ascontiguousarray(category_roots, dtype=np.int32)
+			if split.shape[0] != left.shape[0] or category_roots_.shape[0] != roots_.shape[0]:
+				raise ValueError("category_split should have a row per node and "
+					"category_roots one per tree")
+			if bitsets.shape[0] == 0 or bitsets.shape[1] == 0:
+				raise ValueError("categories has no bitset")
+			split_ptr = &split[0]
+			bitsets_ptr = &bitsets[0, 0]
+			category_roots_ptr = &category_roots_[0]
+			n_category_rows = bitsets.shape[0]
+			n_words = bitsets.shape[1]
+		self.n_outputs = n_outputs
+		self.chunk_rows = chunk_rows
+		self.n_streams = n_streams
+		with nogil:
+			code = cuPredictCreate(&self.ctx, &left[0], &right[0], &feature_[0], feature_bytes,
+				&threshold_[0], &value_[0, 0], left.shape[0], value_.shape[1], &roots_[0], &offsets[0],
+				roots_.shape[0], n_outputs, chunk_rows, n_streams, split_ptr, bitsets_ptr,
+				category_roots_ptr, n_category_rows, n_words)
+		_check(code)
+
+	def __dealloc__(self):
+		if self.ctx != NULL:
+			cuPredictFree(self.ctx)
+			self.ctx = NULL
+
+	def predict(self, const double[:, ::1] X, out=None):
+		"""Sums of shape ``(n_samples, n_outputs)``, written to ``out`` when
+		given."""
+		cdef int code
+		cdef unsigned int n_rows = X.shape[0]
+		if out is None:
+			out = np.empty((n_rows, self.n_outputs), dtype=np.float64)
+		elif out.shape != (n_rows, self.n_outputs):
+			raise ValueError("out should have shape %r" % ((n_rows, self.n_outputs),))
+		cdef double[:, ::1] out_ = out
+		if n_rows == 0:
+			return out
+		self.ctx.profile = self.profile
+		with nogil:
+			code = cuPredictSum(self.ctx, &X[0, 0], n_rows, X.shape[1], &out_[0, 0])
+		_check(code)
+		return out
+
+	@property
+	def timings(self):
+		"""``{'upload_ms', 'kernel_ms', 'download_ms'}`` of the last call,
+		summed over the chunks."""
+		return {'upload_ms': self.ctx.upload_ms, 'kernel_ms': self.ctx.kernel_ms,
+			'download_ms': self.ctx.download_ms}
+
+
+cdef class ShapExplainer:
+	"""SHAP values of the root to leaf paths of a ``TreePaths`` computed on
+	the GPU, one thread per row.
+
+	The paths are uploaded once. ``in_background`` (``(n_background,
+	n_elements)`` uint8, whether every path element holds every background
+	row) and the coalition ``weights`` select interventional SHAP, None tree
+	path dependent SHAP. The ``category_set`` and ``categories`` of paths
+	through categorical splits are uploaded with them. ``shap_values`` feeds
+	the rows through the device ``chunk_rows`` at a time on ``n_streams``
+	streams, like ``EnsemblePredictor``.
+	"""
+	cdef ShapContext* ctx
+	cdef readonly unsigned int n_features
+	cdef readonly unsigned int n_outputs
+	cdef readonly unsigned int chunk_rows
+	cdef readonly unsigned int n_streams
+	cdef public bint profile
+
+	def __cinit__(self, path_start, feature, lower, upper, zero_fraction, value, column,
+			unsigned int n_outputs, unsigned int n_features, in_background=None, weights=None,
+			unsigned int chunk_rows=4096, unsigned int n_streams=2, category_set=None,
+			categories=None):
+		cdef const int[::1] start = np.ascontiguousarray(path_start, dtype=np.int32)
+		cdef const int[::1] feature_ = np.ascontiguousarray(feature, dtype=np.int32)
+		cdef const float[::1] lower_ = np.ascontiguousarray(lower, dtype=np.float32)
+		cdef const float[::1] upper_ = np.ascontiguousarray(upper, dtype=np.float32)
+		cdef const double[::1] zero = np.ascontiguousarray(zero_fraction, dtype=np.float64)
+		cdef const double[:, ::1] value_ = np.ascontiguousarray(value, dtype=np.float64)
+		cdef const int[::1] column_ = np.ascontiguousarray(column, dtype=np.int32)
+		cdef const unsigned char[:, ::1] background
+		cdef const double[:, ::1] weights_
+		cdef const unsigned char* background_ptr = NULL
+		cdef const double* weights_ptr = NULL
+		cdef const int[::1] sets
+		cdef const unsigned int[:, ::1] bitsets
+		cdef const int* sets_ptr = NULL
+		cdef const unsigned int* bitsets_ptr = NULL
+		cdef unsigned int n_sets = 0
+		cdef unsigned int n_words = 0
+		cdef unsigned int n_background = 0
+		cdef unsigned int max_length = 0
+		cdef Py_ssize_t n_paths = start.shape[0] - 1
+		cdef int code
+		self.ctx = NULL
+		self.profile = False
+		if chunk_rows == 0:
+			raise ValueError("chunk_rows should be positive")
+		if not 1 <= n_streams <= PIPELINE_MAX_STREAMS:
+			raise ValueError("n_streams should be between 1 and %d, got %d"
+				% (PIPELINE_MAX_STREAMS, n_streams))
+		if n_paths < 1 or feature_.shape[0] == 0:
+			raise ValueError("the ensemble has no path")
+		max_length = np.diff(start).max()
+		if max_length > SHAP_MAX_LENGTH:
+			raise ValueError("paths of %d features are longer than the %d the kernels "
+				"hold" % (max_length, SHAP_MAX_LENGTH))
+		if in_background is not None:
+			background = np.ascontiguousarray(in_background, dtype=np.uint8)
+			weights_ = np.ascontiguousarray(weights, dtype=np.float64)
+			if background.shape[0] == 0:
+				raise ValueError("in_background has no row")
+			if weights_.shape[0] <= max_length:
+				raise ValueError("weights should cover paths of %d features" % max_length)
+			background_ptr = &background[0, 0]
+			weights_ptr = &weights_[0, 0]
+			n_background = background.shape[0]
+			max_length = weights_.shape[0] - 1
+		if category_set is not None:
+			sets = np.ascontiguousarray(category_set, dtype=np.int32)
+			bitsets = np.ascontiguousarray(categories, dtype=np.uint32)
+			if sets.shape[0] != feature_.shape[0]:
+				raise ValueError("category_set should have a row per path element")
+			if bitsets.shape[0] == 0 or bitsets.shape[1] < 2:
+				raise ValueError("categories has no bitset")
+			sets_ptr = &sets[0]
+			bitsets_ptr = &bitsets[0, 0]
+			n_sets = bitsets.shape[0]
+			n_words = bitsets.shape[1]
+		self.n_features = n_features
+		self.n_outputs = n_outputs
+		self.chunk_rows = chunk_rows
+		self.n_streams = n_streams
+		with nogil:
+			code = cuShapCreate(&self.ctx, &start[0], &feature_[0], &lower_[0], &upper_[0],
+				&zero[0], &value_[0, 0], &column_[0], n_paths, value_.shape[1], n_outputs,
+				n_features, background_ptr, n_background, weights_ptr, max_length, chunk_rows,
+				n_streams, sets_ptr, bitsets_ptr, n_sets, n_words)
+		_check(code)
+
+	def __dealloc__(self):
+		if self.ctx != NULL:
+			cuShapFree(self.ctx)
+			self.ctx = NULL
+
+	def shap_values(self, const double[:, ::1] X, out=None):
+		"""SHAP values of shape ``(n_samples, (n_features + 1) * n_outputs)``,
+		feature major, written to ``out`` when given. The expected value
+		columns are left to 0."""
+		cdef int code
+		cdef unsigned int n_rows = X.shape[0]
+		cdef tuple shape = (n_rows, (self.n_features + 1) * self.n_outputs)
+		if X.shape[1] != self.n_features:
+			raise ValueError("X has %d features, expected %d" % (X.shape[1], self.n_features))
+		if out is None:
+			out = np.empty(shape, dtype=np.float64)
+		elif out.shape != shape:
+			raise ValueError("out should have shape %r" % (shape,))
+		cdef double[:, ::1] out_ = out
+		if n_rows == 0:
+			return out
+		self.ctx.profile = self.profile
+		with nogil:
+			code = cuShapValues(self.ctx, &X[0, 0], n_rows, &out_[0, 0])
+		_check(code)
+		return out
+
+	@property
+	def timings(self):
+		"""``{'upload_ms', 'kernel_ms', 'download_ms'}`` of the last call,
+		summed over the chunks."""
+		return {'upload_ms': self.ctx.upload_ms, 'kernel_ms': self.ctx.kernel_ms,
+			'download_ms': self.ctx.download_ms}
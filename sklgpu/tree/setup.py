@@ -7,15 +7,28 @@ from _build_utils import CUDA
 def configuration(parent_package="", top_path=None):
     config = Configuration("tree", parent_package, top_path)
 
-    config.add_extension("_tree_gpu", ["tests/cmodule01.pyx", "tests/funclib.cpp", "tests/cudalib.cu"], 
-        library_dirs = [CUDA['lib64']], 
-        libraries = ['cudart', 'cuda'], 
-        # runtime_library_dirs = [CUDA['lib64']],
-        extra_compile_args = {'cc': [], 'nvcc': ['-arch=sm_30', '-c', '-Xcompiler', '/MD', '-O3']},
-        include_dirs = [CUDA['include'], numpy.get_include()],
-        language = "c++"
+    config.add_extension("_predictor", ["_predictor.pyx"],
+        include_dirs = [numpy.get_include()]
     )
 
+    # without a CUDA toolkit only the CPU extensions are built and the estimators
+    # use the 'cpu' backend
+    if CUDA is not None:
+        if os.name == 'nt':
+            nvcc_args = ['-arch=sm_30', '-c', '-Xcompiler', '/MD', '-O3']
+        else:
+            nvcc_args = ['-arch=sm_30', '-c', '-Xcompiler', '-fPIC', '-O3']
+        config.add_extension("_tree_gpu", ["_tree_gpu.pyx", "src/memory_pool.cu", "src/pipeline.cu",
+                                           "src/histogram.cu", "src/reduction.cu", "src/predict.cu",
+                                           "src/shap.cu", "src/cudalib.cu"], 
+            library_dirs = [CUDA['lib64']], 
+            libraries = ['cudart', 'cuda'], 
+            # runtime_library_dirs = [CUDA['lib64']],
+            extra_compile_args = {'cc': [], 'nvcc': nvcc_args},
+            include_dirs = ["src", CUDA['include'], numpy.get_include()],
+            language = "c++"
+        )
+
     config.add_subpackage("tests")
 
     return config
@@ -0,0 +1,166 @@
+#include "cudalib.h"
+#include "reduction.h"
+#include <cuda_runtime.h>
+#include <stdio.h>
+#include <string.h>
+#include <time.h>
+#ifdef _WIN32
+	#include <windows.h>
+#else
+	#include <sys/time.h>
+#endif
+#ifdef WIN32
+	int gettimeofday(struct timeval* tp, void* tzp) {
+		time_t clock;
+		struct tm tm;
+		SYSTEMTIME wtm;
+		GetLocalTime(&wtm);
+		tm.tm_year = wtm.wYear - 1900;
+		tm.tm_mon = wtm.wMonth - 1;
+		tm.tm_mday = wtm.wDay;
+		tm.tm_hour = wtm.wHour;
+		tm.tm_min = wtm.wMinute;
+		tm.tm_sec = wtm.wSecond;
+		tm.tm_isdst = -1;
+		clock = mktime(&tm);
+		tp->tv_sec = clock;
+		tp->tv_usec = wtm.wMilliseconds * 1000;
+		return 0;
+	}
+#endif
+
+#define CHECK(call)															\
+{																			\
+	const cudaError_t error = call;											\
+	if (error != cudaSuccess) {												\
+		printf("Error: %s:%d, ", __FILE__, __LINE__);						\
+		printf("code:%d, reason: %s\n", error, cudaGetErrorString(error));	\
+		exit(EXIT_FAILURE);													\
+	}																		\
+}
+
+double cpuSeconds() {
+	struct timeval tp;
+	gettimeofday(&tp, NULL);
+	return ((double)tp.tv_sec + (double)tp.tv_usec * 1.e-6);
+}
+
+__global__ void _checkIndex() {
+	printf("threadIdx:(%d, %d, %d) blockIdx:(%d, %d, %d) blockDim:(%d, %d, %d) gridDim:(%d, %d, %d)\n",
+		threadIdx.x, threadIdx.y, threadIdx.z, blockIdx.x, blockIdx.y, blockIdx.z, blockDim.x, blockDim.y, blockDim.z,
+		gridDim.x, gridDim.y, gridDim.z);
+}
+
+void checkIndex() {
+	printf("GPU Side Invocation Check.\n");
+	dim3 block(3);
+	dim3 grid((6 + block.x - 1) / block.x);
+	double iStart = cpuSeconds();
+	_checkIndex<<<grid, block>>>();
+	cudaDeviceSynchronize();
+	double iEnd = cpuSeconds();
+	printf("checkIndex<<<grid, block>>> time elapsed %f.", iEnd - iStart);
+}
+
+int cuDeviceProperties(int device, DeviceProperties* props) {
+	cudaDeviceProp deviceProp;
+	cudaError_t error = cudaGetDeviceProperties(&deviceProp, device);
+	if (error != cudaSuccess) return (int)error;
+	strncpy(props->name, deviceProp.name, sizeof(props->name) - 1);
+	props->name[sizeof(props->name) - 1] = '\0';
+	props->major = deviceProp.major;
+	props->minor = deviceProp.minor;
+	props->driver_version = 0;
+	props->runtime_version = 0;
+	cudaDriverGetVersion(&props->driver_version);
+	cudaRuntimeGetVersion(&props->runtime_version);
+	props->total_global_mem = deviceProp.totalGlobalMem;
+	props->shared_mem_per_block = deviceProp.sharedMemPerBlock;
+	props->multiprocessor_count = deviceProp.multiProcessorCount;
+	props->clock_rate_khz = deviceProp.clockRate;
+	props->memory_clock_rate_khz = deviceProp.memoryClockRate;
+	props->memory_bus_width = deviceProp.memoryBusWidth;
+	props->warp_size = deviceProp.warpSize;
+	props->max_threads_per_multiprocessor = deviceProp.maxThreadsPerMultiProcessor;
+	props->max_threads_per_block = deviceProp.maxThreadsPerBlock;
+	for (int i = 0; i < 3; i++) {
+		props->max_threads_dim[i] = deviceProp.maxThreadsDim[i];
+		props->max_grid_size[i] = deviceProp.maxGridSize[i];
+	}
+	return (int)cudaSuccess;
+}
+
+void printDeviceProp() {
+	int deviceCount = 0;
+	CHECK(cudaGetDeviceCount(&deviceCount));
+	if (deviceCount == 0) {
+		printf("There are no available devices that support CUDA\n");
+	} else {
+		printf("Detected %d CUDA Capable device(s)\n", deviceCount);
+	}
+	int dev = 0;
+	cudaSetDevice(dev);
+	DeviceProperties props;
+	CHECK((cudaError_t)cuDeviceProperties(dev, &props));
+	printf("Device: %d, \"%s\"\n", dev, props.name);
+	printf("	CUDA Driver Version / RuntimeVersion 	%d.%d / %d.%d\n", props.driver_version / 1000,
+		(props.driver_version % 100) / 10, props.runtime_version / 1000, (props.runtime_version % 100) / 10);
+	printf("	Total amount of global memory:	%.2f GB (%llu bytes)\n", (float)props.total_global_mem / (pow(1024.0, 3)),
+		(unsigned long long) props.total_global_mem);
+	printf("	Multiprocessor Count: %d\n", props.multiprocessor_count);
+	printf("	GPU Clock rate:	%.0f MHz(%.2f GHz)\n", props.clock_rate_khz * 1e-3f, props.clock_rate_khz * 1e-6f);
+	printf("	Memory Clock rate:	%.0f MHz\n", props.memory_clock_rate_khz * 1e-3f);
+	printf("	Memory Bus Width:	%d-bit\n", props.memory_bus_width);
+	printf("	Warp size:	%d\n", props.warp_size);
+	printf("	Maximum number of threads per multiprocessor: %d\n", props.max_threads_per_multiprocessor);
+	printf("	Maximum number of threads per block: %d\n", props.max_threads_per_block);
+	printf("	Maximum size of each dimension of a block: %d x %d x %d\n", props.max_threads_dim[0],
+		props.max_threads_dim[1], props.max_threads_dim[2]);
+	printf("	Maximum size of each dimension of a grid: %d x %d x %d\n", props.max_grid_size[0],
+		props.max_grid_size[1], props.max_grid_size[2]);
+}
+
+void __reduceCheck(int blockSize = 512) {
+	unsigned int size = 1 << 24;
+	size_t bytes = size * sizeof(double);
+	double* h_idata = NULL;
+	/* no cudaDeviceReset at the end: it would drop the pooled blocks (and
+	 * every other allocation) of the interpreter that called the check */
+	int code = cuPoolMalloc(POOL_PINNED, (void**)&h_idata, bytes);
+	if (code != 0) {
+		printf("host allocation failed: %s\n", cudaGetErrorString((cudaError_t)code));
+		return;
+	}
+	double cpu_sum = 0;
+	for (unsigned int i = 0; i < size; i++) {
+		h_idata[i] = (double)(rand() & 0xff);
+		cpu_sum += h_idata[i];
+	}
+	const char* names[] = {"Neighbored", "Neighbored Plus", "Interleaved", "Unrolled Warps"};
+	int variants[] = {REDUCE_NEIGHBORED, REDUCE_NEIGHBORED_PLUS, REDUCE_INTERLEAVED, REDUCE_UNROLLED};
+	printf("cpu sum: %.0f\n", cpu_sum);
+	/* the reductions copy the input to the device chunk by chunk, a few MB
+	 * at a time instead of the whole buffer, on two streams so the copies
+	 * overlap the kernels; the input is pinned, the copies read it in place */
+	for (int v = 0; v < 4; v++) {
+		double gpu_sum = 0;
+		float kernel_ms = 0;
+		double iStart = cpuSeconds();
+		code = cuReduceDouble(h_idata, size, REDUCE_SUM, variants[v], blockSize, &gpu_sum, &kernel_ms);
+		double iEnd = cpuSeconds();
+		if (code != 0) {
+			printf("gpu %s Reduce failed: %s\n", names[v], cudaGetErrorString((cudaError_t)code));
+			continue;
+		}
+		printf("gpu %s Reduce elapsed %.4f s (kernel %.4f ms) gpu_sum: %.0f <<<block %d>>>\n", names[v],
+			iEnd - iStart, kernel_ms, gpu_sum, blockSize);
+	}
+	cuPoolFree(POOL_PINNED, h_idata);
+}
+
+int cuCheck() {
+	printDeviceProp();
+	printf("Reduce Check\n");
+	__reduceCheck();
+	return 0;
+}
\ No newline at end of file
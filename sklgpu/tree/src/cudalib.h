@@ -0,0 +1,26 @@
+#ifndef CUDALIB
+#define CUDALIB
+	#include <stddef.h>
+
+	typedef struct DeviceProperties {
+		char name[256];
+		int major;
+		int minor;
+		int driver_version;
+		int runtime_version;
+		size_t total_global_mem;
+		size_t shared_mem_per_block;
+		int multiprocessor_count;
+		int clock_rate_khz;
+		int memory_clock_rate_khz;
+		int memory_bus_width;
+		int warp_size;
+		int max_threads_per_multiprocessor;
+		int max_threads_per_block;
+		int max_threads_dim[3];
+		int max_grid_size[3];
+	} DeviceProperties;
+
+	int cuDeviceProperties(int device, DeviceProperties* props);
+	int cuCheck();
+#endif
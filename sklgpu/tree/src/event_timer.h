@@ -0,0 +1,41 @@
+#ifndef EVENT_TIMER
+#define EVENT_TIMER
+	#include <cuda_runtime.h>
+
+	/* Elapsed time of a stretch of work on the default stream, measured with
+	 * a pair of CUDA events. A timer with a NULL target does nothing, so the
+	 * unprofiled path does not pay for the events or the synchronization. */
+	struct EventTimer {
+		cudaEvent_t start_event;
+		cudaEvent_t stop_event;
+		float* target;
+
+		explicit EventTimer(float* target_ms) : start_event(NULL), stop_event(NULL), target(target_ms) {
+			if (target == NULL) return;
+			if (cudaEventCreate(&start_event) != cudaSuccess || cudaEventCreate(&stop_event) != cudaSuccess) {
+				cudaGetLastError();
+				target = NULL;
+			}
+		}
+
+		~EventTimer() {
+			if (start_event != NULL) cudaEventDestroy(start_event);
+			if (stop_event != NULL) cudaEventDestroy(stop_event);
+		}
+
+		void start() {
+			if (target != NULL) cudaEventRecord(start_event, 0);
+		}
+
+		/* adds the time since start() to the target */
+		int stop() {
+			if (target == NULL) return (int)cudaSuccess;
+			float ms = 0;
+			cudaError_t error = cudaEventRecord(stop_event, 0);
+			if (error == cudaSuccess) error = cudaEventSynchronize(stop_event);
+			if (error == cudaSuccess) error = cudaEventElapsedTime(&ms, start_event, stop_event);
+			if (error == cudaSuccess) *target += ms;
+			return (int)error;
+		}
+	};
+#endif
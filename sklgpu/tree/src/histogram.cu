@@ -0,0 +1,366 @@
+#include "histogram.h"
+#include "memory_pool.h"
+#include "event_timer.h"
+#include <cuda_runtime.h>
+#include <stdlib.h>
+#include <string.h>
+
+#define HIST_BLOCK 256
+#define HIST_MAX_GRID_X 64
+/* sample indices per pipeline item of a device resident build */
+#define HIST_INDEX_BATCH (1u << 20)
+/* alignment of the sections of the streamed slot buffers */
+#define HIST_ALIGN 256
+
+/* return the error code to the caller instead of exiting the interpreter */
+#define CUDA_TRY(call)															\
+{																				\
+	const cudaError_t error = call;												\
+	if (error != cudaSuccess) return (int)error;								\
+}
+
+__device__ inline double atomicAddDouble(double* address, double val) {
+#if __CUDA_ARCH__ >= 600
+	return atomicAdd(address, val);
+#else
+	unsigned long long int* address_as_ull = (unsigned long long int*)address;
+	unsigned long long int old = *address_as_ull, assumed;
+	do {
+		assumed = old;
+		old = atomicCAS(address_as_ull, assumed,
+			__double_as_longlong(val + __longlong_as_double(assumed)));
+	} while (assumed != old);
+	return __longlong_as_double(old);
+#endif
+}
+
+/* One grid row (blockIdx.y) per feature. Every block accumulates a private
+ * histogram of its feature in shared memory, then flushes it with one
+ * global atomic per non empty cell. */
+template <typename BinT>
+__global__ void _histogramShared(const BinT* X, unsigned int n_rows,
+		const unsigned int* indices, unsigned int n_idx, const double* stats,
+		unsigned int n_stats, unsigned int n_bins, double* hist) {
+	extern __shared__ double s_hist[];
+	unsigned int feature = blockIdx.y;
+	unsigned int size = n_bins * n_stats;
+	const BinT* column = X + (size_t)feature * n_rows;
+	for (unsigned int i = threadIdx.x; i < size; i += blockDim.x) s_hist[i] = 0.0;
+	__syncthreads();
+	for (unsigned int i = blockIdx.x * blockDim.x + threadIdx.x; i < n_idx; i += blockDim.x * gridDim.x) {
+		unsigned int row = indices[i];
+		double* cell = s_hist + column[row] * n_stats;
+		const double* s = stats + (size_t)row * n_stats;
+		for (unsigned int k = 0; k < n_stats; k++) atomicAddDouble(cell + k, s[k]);
+	}
+	__syncthreads();
+	double* out = hist + (size_t)feature * size;
+	for (unsigned int i = threadIdx.x; i < size; i += blockDim.x) {
+		if (s_hist[i] != 0.0) atomicAddDouble(out + i, s_hist[i]);
+	}
+}
+
+/* Fallback when a feature histogram does not fit in shared memory (many
+ * classes): accumulate straight into global memory. */
+template <typename BinT>
+__global__ void _histogramGlobal(const BinT* X, unsigned int n_rows,
+		const unsigned int* indices, unsigned int n_idx, const double* stats,
+		unsigned int n_stats, unsigned int n_bins, double* hist) {
+	unsigned int feature = blockIdx.y;
+	const BinT* column = X + (size_t)feature * n_rows;
+	double* out = hist + (size_t)feature * n_bins * n_stats;
+	for (unsigned int i = blockIdx.x * blockDim.x + threadIdx.x; i < n_idx; i += blockDim.x * gridDim.x) {
+		unsigned int row = indices[i];
+		double* cell = out + column[row] * n_stats;
+		const double* s = stats + (size_t)row * n_stats;
+		for (unsigned int k = 0; k < n_stats; k++) atomicAddDouble(cell + k, s[k]);
+	}
+}
+
+/* pitch: rows of every device column, n_rows or chunk_rows when streaming */
+template <typename BinT>
+void _launchHistogram(const HistContext* ctx, const void* X, const double* stats,
+		const unsigned int* indices, unsigned int n_idx, unsigned int pitch, dim3 grid, dim3 block,
+		size_t shared, bool use_shared, cudaStream_t stream) {
+	if (use_shared) {
+		_histogramShared<BinT><<<grid, block, shared, stream>>>((const BinT*)X, pitch, indices, n_idx,
+			stats, ctx->n_stats, ctx->n_bins, ctx->hist);
+	} else {
+		_histogramGlobal<BinT><<<grid, block, 0, stream>>>((const BinT*)X, pitch, indices, n_idx,
+			stats, ctx->n_stats, ctx->n_bins, ctx->hist);
+	}
+}
+
+static bool _streamed(const HistContext* ctx) {
+	return ctx->chunk_rows > 0 && ctx->chunk_rows < ctx->n_rows;
+}
+
+/* Histogram kernel over n_idx indices already on the device. The kernels
+ * of the pipeline slots accumulate into the same histogram with atomics. */
+static int _runHistogram(const HistContext* ctx, const void* X, const double* stats,
+		const unsigned int* indices, unsigned int n_idx, unsigned int pitch, cudaStream_t stream) {
+	unsigned int blocks = (n_idx + HIST_BLOCK - 1) / HIST_BLOCK;
+	dim3 block(HIST_BLOCK);
+	dim3 grid(blocks < HIST_MAX_GRID_X ? blocks : HIST_MAX_GRID_X, ctx->n_features);
+	size_t shared = (size_t)ctx->n_bins * ctx->n_stats * sizeof(double);
+	int device = 0, max_shared = 0;
+	CUDA_TRY(cudaGetDevice(&device));
+	CUDA_TRY(cudaDeviceGetAttribute(&max_shared, cudaDevAttrMaxSharedMemoryPerBlock, device));
+	if (ctx->bin_bytes == 1) {
+		_launchHistogram<unsigned char>(ctx, X, stats, indices, n_idx, pitch, grid, block, shared,
+			shared <= (size_t)max_shared, stream);
+	} else {
+		_launchHistogram<unsigned short>(ctx, X, stats, indices, n_idx, pitch, grid, block, shared,
+			shared <= (size_t)max_shared, stream);
+	}
+	return (int)cudaGetLastError();
+}
+
+static size_t _align(size_t bytes) {
+	return (bytes + HIST_ALIGN - 1) / HIST_ALIGN * HIST_ALIGN;
+}
+
+/* Slot buffers of the streamed mode: the chunk columns (pitch chunk_rows),
+ * the chunk statistics, then the chunk local sample indices. */
+static size_t _statsOffset(const HistContext* ctx) {
+	return _align((size_t)ctx->chunk_rows * ctx->n_features * ctx->bin_bytes);
+}
+
+static size_t _indicesOffset(const HistContext* ctx) {
+	return _statsOffset(ctx) + _align((size_t)ctx->chunk_rows * ctx->n_stats * sizeof(double));
+}
+
+/* Queue the copy of n indices to the slot device buffer at offset. */
+static int _uploadIndices(PipelineSlot* slot, size_t offset, const unsigned int* indices, unsigned int n) {
+	size_t bytes = (size_t)n * sizeof(unsigned int);
+	memcpy((char*)slot->h_in + offset, indices, bytes);
+	return (int)cudaMemcpyAsync((char*)slot->d_in + offset, (char*)slot->h_in + offset, bytes,
+		cudaMemcpyHostToDevice, slot->stream);
+}
+
+/* Device resident matrix: the node indices go through the pipeline in
+ * batches, the upload of a batch overlaps the kernel of the previous one. */
+struct ResidentStage {
+	HistContext* ctx;
+	const unsigned int* indices;
+	unsigned int n_idx;
+
+	unsigned int count(unsigned int item) const {
+		unsigned int first = item * HIST_INDEX_BATCH;
+		return n_idx - first < HIST_INDEX_BATCH ? n_idx - first : HIST_INDEX_BATCH;
+	}
+
+	int upload(unsigned int item, PipelineSlot* slot) {
+		return _uploadIndices(slot, 0, indices + (size_t)item * HIST_INDEX_BATCH, count(item));
+	}
+
+	int launch(unsigned int item, PipelineSlot* slot) {
+		/* the histogram was cleared on the default stream */
+		CUDA_TRY(cudaStreamWaitEvent(slot->stream, ctx->cleared, 0));
+		return _runHistogram(ctx, ctx->X, ctx->stats, (const unsigned int*)slot->d_in, count(item),
+			ctx->n_rows, slot->stream);
+	}
+
+	int download(unsigned int item, PipelineSlot* slot) {
+		return (int)cudaSuccess;
+	}
+
+	int retire(unsigned int item, PipelineSlot* slot) {
+		return (int)cudaSuccess;
+	}
+};
+
+/* Streamed matrix: one item per chunk holding node samples. The host packs
+ * the chunk columns and statistics in the slot staging buffer, skipped when
+ * the slot still holds the chunk from an earlier build. */
+struct StreamedStage {
+	HistContext* ctx;
+	/* non empty chunks, and the group of each in grouped (counting sort) */
+	const unsigned int* chunks;
+	const unsigned int* starts;
+	const unsigned int* grouped;
+
+	int upload(unsigned int item, PipelineSlot* slot) {
+		unsigned int c = chunks[item];
+		if (slot->tag != (long long)c) {
+			slot->tag = -1;
+			size_t first = (size_t)c * ctx->chunk_rows;
+			size_t rows = ctx->n_rows - first < ctx->chunk_rows ? ctx->n_rows - first : ctx->chunk_rows;
+			const char* host_X = (const char*)ctx->host_X;
+			char* h_in = (char*)slot->h_in;
+			for (unsigned int f = 0; f < ctx->n_features; f++) {
+				memcpy(h_in + (size_t)f * ctx->chunk_rows * ctx->bin_bytes,
+					host_X + ((size_t)f * ctx->n_rows + first) * ctx->bin_bytes, rows * ctx->bin_bytes);
+			}
+			memcpy(h_in + _statsOffset(ctx), ctx->host_stats + first * ctx->n_stats,
+				rows * ctx->n_stats * sizeof(double));
+			CUDA_TRY(cudaMemcpyAsync(slot->d_in, slot->h_in,
+				_statsOffset(ctx) + rows * ctx->n_stats * sizeof(double), cudaMemcpyHostToDevice,
+				slot->stream));
+			slot->tag = c;
+		}
+		return _uploadIndices(slot, _indicesOffset(ctx), grouped + starts[c], starts[c + 1] - starts[c]);
+	}
+
+	int launch(unsigned int item, PipelineSlot* slot) {
+		unsigned int c = chunks[item];
+		const char* d_in = (const char*)slot->d_in;
+		CUDA_TRY(cudaStreamWaitEvent(slot->stream, ctx->cleared, 0));
+		return _runHistogram(ctx, d_in, (const double*)(d_in + _statsOffset(ctx)),
+			(const unsigned int*)(d_in + _indicesOffset(ctx)), starts[c + 1] - starts[c],
+			ctx->chunk_rows, slot->stream);
+	}
+
+	int download(unsigned int item, PipelineSlot* slot) {
+		return (int)cudaSuccess;
+	}
+
+	int retire(unsigned int item, PipelineSlot* slot) {
+		return (int)cudaSuccess;
+	}
+};
+
+/* Group the node samples by chunk (counting sort, chunk local row ids),
+ * then run the chunks holding at least one sample through the pipeline. */
+static int _buildStreamed(HistContext* ctx, const unsigned int* indices, unsigned int n_idx,
+		PipelineTimings* timings) {
+	unsigned int n_chunks = (ctx->n_rows + ctx->chunk_rows - 1) / ctx->chunk_rows;
+	unsigned int* starts = (unsigned int*)calloc((size_t)n_chunks + 1, sizeof(unsigned int));
+	unsigned int* fill = (unsigned int*)malloc((size_t)n_chunks * sizeof(unsigned int));
+	unsigned int* chunks = (unsigned int*)malloc((size_t)n_chunks * sizeof(unsigned int));
+	unsigned int* grouped = (unsigned int*)malloc((size_t)n_idx * sizeof(unsigned int));
+	int code = (int)cudaErrorMemoryAllocation;
+	if (starts != NULL && fill != NULL && chunks != NULL && grouped != NULL) {
+		unsigned int n_items = 0;
+		for (unsigned int i = 0; i < n_idx; i++) starts[indices[i] / ctx->chunk_rows + 1]++;
+		for (unsigned int c = 0; c < n_chunks; c++) {
+			if (starts[c + 1] > 0) chunks[n_items++] = c;
+			starts[c + 1] += starts[c];
+			fill[c] = starts[c];
+		}
+		for (unsigned int i = 0; i < n_idx; i++) {
+			unsigned int c = indices[i] / ctx->chunk_rows;
+			grouped[fill[c]++] = indices[i] - c * ctx->chunk_rows;
+		}
+		StreamedStage stage = {ctx, chunks, starts, grouped};
+		code = runPipeline(&ctx->pipeline, n_items, stage, timings);
+	}
+	free(starts);
+	free(fill);
+	free(chunks);
+	free(grouped);
+	return code;
+}
+
+int cuDeviceCount(int* count) {
+	*count = 0;
+	cudaError_t error = cudaGetDeviceCount(count);
+	if (error == cudaErrorNoDevice || error == cudaErrorInsufficientDriver) {
+		*count = 0;
+		return (int)cudaSuccess;
+	}
+	return (int)error;
+}
+
+const char* cuErrorString(int code) {
+	return cudaGetErrorString((cudaError_t)code);
+}
+
+int cuMemGetInfo(size_t* free_bytes, size_t* total_bytes) {
+	return (int)cudaMemGetInfo(free_bytes, total_bytes);
+}
+
+int cuHistCreate(HistContext** ctx, const void* X, unsigned int bin_bytes,
+		unsigned int n_rows, unsigned int n_features, unsigned int n_bins, unsigned int n_stats,
+		unsigned int chunk_rows, unsigned int n_streams) {
+	HistContext* c = (HistContext*)calloc(1, sizeof(HistContext));
+	if (c == NULL) return (int)cudaErrorMemoryAllocation;
+	c->bin_bytes = bin_bytes;
+	c->n_rows = n_rows;
+	c->n_features = n_features;
+	c->n_bins = n_bins;
+	c->n_stats = n_stats;
+	c->chunk_rows = chunk_rows;
+	c->host_X = X;
+	*ctx = c;
+	size_t hist_bytes = (size_t)n_features * n_bins * n_stats * sizeof(double);
+	CUDA_TRY(cudaEventCreateWithFlags(&c->cleared, cudaEventDisableTiming));
+	CUDA_TRY((cudaError_t)cuPoolMalloc(POOL_DEVICE, (void**)&c->hist, hist_bytes));
+	if (_streamed(c)) {
+		/* the chunks live in the slot buffers */
+		return cuPipelineCreate(&c->pipeline, n_streams,
+			_indicesOffset(c) + (size_t)chunk_rows * sizeof(unsigned int), 0, 0);
+	}
+	size_t x_bytes = (size_t)n_rows * n_features * bin_bytes;
+	unsigned int batch = n_rows < HIST_INDEX_BATCH ? n_rows : HIST_INDEX_BATCH;
+	CUDA_TRY((cudaError_t)cuPoolMalloc(POOL_DEVICE, (void**)&c->X, x_bytes));
+	CUDA_TRY((cudaError_t)cuPoolMalloc(POOL_DEVICE, (void**)&c->stats, (size_t)n_rows * n_stats * sizeof(double)));
+	CUDA_TRY((cudaError_t)cuPipelineCreate(&c->pipeline, n_streams, (size_t)batch * sizeof(unsigned int), 0, 0));
+	CUDA_TRY(cudaMemcpy(c->X, X, x_bytes, cudaMemcpyHostToDevice));
+	/* a pageable copy may return before the DMA is over, and the pipeline
+	 * streams do not synchronize with the default one */
+	CUDA_TRY(cudaStreamSynchronize(0));
+	return (int)cudaSuccess;
+}
+
+int cuHistSetStats(HistContext* ctx, const double* stats) {
+	ctx->upload_ms = ctx->kernel_ms = ctx->download_ms = 0;
+	if (_streamed(ctx)) {
+		/* read chunk by chunk by the builds, the chunks the slots hold are
+		 * stale */
+		ctx->host_stats = stats;
+		for (unsigned int s = 0; s < ctx->pipeline.n_slots; s++) ctx->pipeline.slots[s].tag = -1;
+		return (int)cudaSuccess;
+	}
+	EventTimer upload(ctx->profile ? &ctx->upload_ms : NULL);
+	upload.start();
+	CUDA_TRY(cudaMemcpy(ctx->stats, stats, (size_t)ctx->n_rows * ctx->n_stats * sizeof(double),
+		cudaMemcpyHostToDevice));
+	CUDA_TRY((cudaError_t)upload.stop());
+	CUDA_TRY(cudaStreamSynchronize(0));
+	return (int)cudaSuccess;
+}
+
+int cuHistBuild(HistContext* ctx, const unsigned int* indices, unsigned int n_idx, double* out) {
+	size_t hist_bytes = (size_t)ctx->n_features * ctx->n_bins * ctx->n_stats * sizeof(double);
+	ctx->upload_ms = ctx->kernel_ms = ctx->download_ms = 0;
+	EventTimer clear(ctx->profile ? &ctx->kernel_ms : NULL);
+	EventTimer download(ctx->profile ? &ctx->download_ms : NULL);
+	clear.start();
+	CUDA_TRY(cudaMemset(ctx->hist, 0, hist_bytes));
+	CUDA_TRY(cudaEventRecord(ctx->cleared, 0));
+	CUDA_TRY((cudaError_t)clear.stop());
+	if (n_idx > 0) {
+		PipelineTimings timings;
+		int code;
+		ctx->pipeline.profile = ctx->profile;
+		if (_streamed(ctx)) {
+			code = _buildStreamed(ctx, indices, n_idx, &timings);
+		} else {
+			ResidentStage stage = {ctx, indices, n_idx};
+			code = runPipeline(&ctx->pipeline, (n_idx + HIST_INDEX_BATCH - 1) / HIST_INDEX_BATCH, stage,
+				&timings);
+		}
+		CUDA_TRY((cudaError_t)code);
+		if (ctx->profile) {
+			ctx->upload_ms += timings.upload_ms;
+			ctx->kernel_ms += timings.kernel_ms;
+		}
+	}
+	/* the pipeline waited for its kernels */
+	download.start();
+	CUDA_TRY(cudaMemcpy(out, ctx->hist, hist_bytes, cudaMemcpyDeviceToHost));
+	CUDA_TRY((cudaError_t)download.stop());
+	return (int)cudaSuccess;
+}
+
+void cuHistFree(HistContext* ctx) {
+	if (ctx == NULL) return;
+	cuPipelineDestroy(&ctx->pipeline);
+	/* back to the pool, the next tree of a forest or boosting round reuses them */
+	cuPoolFree(POOL_DEVICE, ctx->X);
+	cuPoolFree(POOL_DEVICE, ctx->stats);
+	cuPoolFree(POOL_DEVICE, ctx->hist);
+	if (ctx->cleared != NULL) cudaEventDestroy(ctx->cleared);
+	free(ctx);
+}
@@ -0,0 +1,57 @@
+#ifndef HISTOGRAM
+#define HISTOGRAM
+	#include "pipeline.h"
+
+	/* Device resident binned matrix (column major, uint8 or uint16 bins)
+	 * plus the per-sample statistics and scratch buffers of the histogram
+	 * kernels.
+	 *
+	 * Builds feed the kernels through a pipeline of n_streams slots (see
+	 * pipeline.h): the node sample indices go to the device in batches,
+	 * the copy of a batch overlapping the kernel of the previous one.
+	 *
+	 * With chunk_rows set (and smaller than n_rows) the matrix and the
+	 * statistics stay in host memory and X / stats are not allocated:
+	 * every build streams the chunks holding node samples through the
+	 * slot buffers, each chunk packed in pinned memory and uploaded while
+	 * the previous chunk is accumulated. A slot keeps its chunk until the
+	 * next cuHistSetStats, builds reusing it only upload indices. The host
+	 * arrays must outlive the context. */
+	typedef struct HistContext {
+		void* X;
+		unsigned int bin_bytes;
+		unsigned int n_rows;
+		unsigned int n_features;
+		unsigned int n_bins;
+		unsigned int n_stats;
+		double* stats;
+		double* hist;
+		/* recorded once hist is cleared, the slot streams wait on it */
+		cudaEvent_t cleared;
+		Pipeline pipeline;
+		unsigned int chunk_rows;
+		const void* host_X;
+		const double* host_stats;
+		/* when profile is set, every cuHistSetStats / cuHistBuild call
+		 * stores the event timings of its transfers and kernel, summed
+		 * over the pipeline items */
+		int profile;
+		float upload_ms;
+		float kernel_ms;
+		float download_ms;
+	} HistContext;
+
+	int cuDeviceCount(int* count);
+	const char* cuErrorString(int code);
+
+	int cuMemGetInfo(size_t* free_bytes, size_t* total_bytes);
+
+	/* chunk_rows = 0 uploads the whole matrix, n_streams is 1 to
+	 * PIPELINE_MAX_STREAMS */
+	int cuHistCreate(HistContext** ctx, const void* X, unsigned int bin_bytes,
+		unsigned int n_rows, unsigned int n_features, unsigned int n_bins, unsigned int n_stats,
+		unsigned int chunk_rows, unsigned int n_streams);
+	int cuHistSetStats(HistContext* ctx, const double* stats);
+	int cuHistBuild(HistContext* ctx, const unsigned int* indices, unsigned int n_idx, double* out);
+	void cuHistFree(HistContext* ctx);
+#endif
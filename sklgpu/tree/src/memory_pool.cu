@@ -0,0 +1,140 @@
+#include "memory_pool.h"
+#include <cuda_runtime.h>
+#include <map>
+#include <mutex>
+#include <unordered_map>
+#include <vector>
+
+#define MIN_BLOCK (size_t)512
+#define LARGE_BLOCK ((size_t)1 << 20)
+#define DEFAULT_MAX_CACHED ((size_t)1 << 30)
+
+/* powers of 2 below 1 MiB, multiples of 1 MiB above */
+size_t cuPoolSizeClass(size_t bytes) {
+	if (bytes >= LARGE_BLOCK) return (bytes + LARGE_BLOCK - 1) / LARGE_BLOCK * LARGE_BLOCK;
+	size_t size = MIN_BLOCK;
+	while (size < bytes) size <<= 1;
+	return size;
+}
+
+class CachingAllocator {
+public:
+	explicit CachingAllocator(int kind) : kind_(kind), max_cached_(DEFAULT_MAX_CACHED) {
+		stats_.bytes_in_use = stats_.bytes_cached = stats_.peak_bytes_in_use = 0;
+		stats_.hits = stats_.misses = 0;
+	}
+
+	int malloc(void** ptr, size_t bytes) {
+		std::lock_guard<std::mutex> lock(mutex_);
+		size_t size = cuPoolSizeClass(bytes > 0 ? bytes : 1);
+		std::vector<void*>& bucket = free_[size];
+		if (!bucket.empty()) {
+			*ptr = bucket.back();
+			bucket.pop_back();
+			stats_.bytes_cached -= size;
+			stats_.hits++;
+		} else {
+			stats_.misses++;
+			cudaError_t error = raw_malloc(ptr, size);
+			if (error == cudaErrorMemoryAllocation) {
+				/* give the cached blocks back and retry once */
+				cudaGetLastError();
+				release_locked();
+				error = raw_malloc(ptr, size);
+			}
+			if (error != cudaSuccess) return (int)error;
+		}
+		in_use_[*ptr] = size;
+		stats_.bytes_in_use += size;
+		if (stats_.bytes_in_use > stats_.peak_bytes_in_use) stats_.peak_bytes_in_use = stats_.bytes_in_use;
+		return (int)cudaSuccess;
+	}
+
+	int free(void* ptr) {
+		if (ptr == NULL) return (int)cudaSuccess;
+		std::lock_guard<std::mutex> lock(mutex_);
+		std::unordered_map<void*, size_t>::iterator it = in_use_.find(ptr);
+		if (it == in_use_.end()) return (int)cudaErrorInvalidValue;
+		size_t size = it->second;
+		in_use_.erase(it);
+		stats_.bytes_in_use -= size;
+		if (stats_.bytes_cached + size > max_cached_) return (int)raw_free(ptr);
+		free_[size].push_back(ptr);
+		stats_.bytes_cached += size;
+		return (int)cudaSuccess;
+	}
+
+	void stats(PoolStats* out) {
+		std::lock_guard<std::mutex> lock(mutex_);
+		*out = stats_;
+		out->max_cached_bytes = max_cached_;
+	}
+
+	void set_limit(size_t max_cached) {
+		std::lock_guard<std::mutex> lock(mutex_);
+		max_cached_ = max_cached;
+		if (stats_.bytes_cached > max_cached_) release_locked();
+	}
+
+	int release() {
+		std::lock_guard<std::mutex> lock(mutex_);
+		return release_locked();
+	}
+
+private:
+	cudaError_t raw_malloc(void** ptr, size_t size) {
+		return kind_ == POOL_PINNED ? cudaMallocHost(ptr, size) : cudaMalloc(ptr, size);
+	}
+
+	cudaError_t raw_free(void* ptr) {
+		return kind_ == POOL_PINNED ? cudaFreeHost(ptr) : cudaFree(ptr);
+	}
+
+	int release_locked() {
+		cudaError_t result = cudaSuccess;
+		for (std::map<size_t, std::vector<void*> >::iterator it = free_.begin(); it != free_.end(); ++it) {
+			for (size_t i = 0; i < it->second.size(); i++) {
+				cudaError_t error = raw_free(it->second[i]);
+				if (error != cudaSuccess) result = error;
+			}
+			it->second.clear();
+		}
+		stats_.bytes_cached = 0;
+		return (int)result;
+	}
+
+	int kind_;
+	size_t max_cached_;
+	PoolStats stats_;
+	std::mutex mutex_;
+	std::map<size_t, std::vector<void*> > free_;
+	std::unordered_map<void*, size_t> in_use_;
+};
+
+/* never destroyed: releasing device memory during static destruction races
+ * with the CUDA runtime teardown */
+static CachingAllocator* pool(int kind) {
+	static CachingAllocator* device = new CachingAllocator(POOL_DEVICE);
+	static CachingAllocator* pinned = new CachingAllocator(POOL_PINNED);
+	return kind == POOL_PINNED ? pinned : device;
+}
+
+int cuPoolMalloc(int kind, void** ptr, size_t bytes) {
+	return pool(kind)->malloc(ptr, bytes);
+}
+
+int cuPoolFree(int kind, void* ptr) {
+	return pool(kind)->free(ptr);
+}
+
+void cuPoolStats(int kind, PoolStats* stats) {
+	pool(kind)->stats(stats);
+}
+
+void cuPoolSetLimit(int kind, size_t max_cached_bytes) {
+	pool(kind)->set_limit(max_cached_bytes);
+}
+
+int cuPoolRelease(int kind) {
+	return pool(kind)->release();
+}
@@ -0,0 +1,29 @@
+#ifndef MEMORY_POOL
+#define MEMORY_POOL
+	#include <stddef.h>
+
+	/* pool kinds */
+	#define POOL_DEVICE 0
+	#define POOL_PINNED 1
+
+	typedef struct PoolStats {
+		unsigned long long bytes_in_use;
+		unsigned long long bytes_cached;
+		unsigned long long peak_bytes_in_use;
+		unsigned long long max_cached_bytes;
+		unsigned long long hits;
+		unsigned long long misses;
+	} PoolStats;
+
+	/* Caching allocators over cudaMalloc (POOL_DEVICE) and cudaMallocHost
+	 * (POOL_PINNED). Requests are rounded up to a size class, freed blocks are
+	 * kept per class and handed out again; at most max_cached_bytes stay
+	 * cached, beyond that freed blocks go back to the driver. */
+	int cuPoolMalloc(int kind, void** ptr, size_t bytes);
+	int cuPoolFree(int kind, void* ptr);
+	void cuPoolStats(int kind, PoolStats* stats);
+	void cuPoolSetLimit(int kind, size_t max_cached_bytes);
+	/* free every cached (unused) block */
+	int cuPoolRelease(int kind);
+	size_t cuPoolSizeClass(size_t bytes);
+#endif
@@ -0,0 +1,57 @@
+#include "pipeline.h"
+#include "memory_pool.h"
+#include <cuda_runtime.h>
+#include <string.h>
+
+#define CUDA_TRY(call)															\
+{																				\
+	const cudaError_t error = call;												\
+	if (error != cudaSuccess) return (int)error;								\
+}
+
+int cuPipelineCreate(Pipeline* p, unsigned int n_streams, size_t in_bytes, size_t out_bytes,
+		int profile) {
+	memset(p, 0, sizeof(Pipeline));
+	if (n_streams < 1 || n_streams > PIPELINE_MAX_STREAMS) return (int)cudaErrorInvalidValue;
+	p->in_bytes = in_bytes;
+	p->out_bytes = out_bytes;
+	p->profile = profile;
+	for (unsigned int s = 0; s < n_streams; s++) {
+		PipelineSlot* slot = &p->slots[s];
+		slot->tag = -1;
+		/* counted before the allocations, a failure halfway is cleaned up by
+		 * cuPipelineDestroy */
+		p->n_slots = s + 1;
+		/* non blocking: the legacy default stream does not serialize them */
+		CUDA_TRY(cudaStreamCreateWithFlags(&slot->stream, cudaStreamNonBlocking));
+		/* timing events either way, profile can be switched between runs */
+		CUDA_TRY(cudaEventCreate(&slot->done));
+		for (int m = 0; m < 3; m++) CUDA_TRY(cudaEventCreate(&slot->marks[m]));
+		if (in_bytes > 0) {
+			CUDA_TRY((cudaError_t)cuPoolMalloc(POOL_PINNED, &slot->h_in, in_bytes));
+			CUDA_TRY((cudaError_t)cuPoolMalloc(POOL_DEVICE, &slot->d_in, in_bytes));
+		}
+		if (out_bytes > 0) {
+			CUDA_TRY((cudaError_t)cuPoolMalloc(POOL_PINNED, &slot->h_out, out_bytes));
+			CUDA_TRY((cudaError_t)cuPoolMalloc(POOL_DEVICE, &slot->d_out, out_bytes));
+		}
+	}
+	return (int)cudaSuccess;
+}
+
+void cuPipelineDestroy(Pipeline* p) {
+	for (unsigned int s = 0; s < p->n_slots; s++) {
+		PipelineSlot* slot = &p->slots[s];
+		if (slot->stream != NULL) cudaStreamSynchronize(slot->stream);
+		cuPoolFree(POOL_PINNED, slot->h_in);
+		cuPoolFree(POOL_DEVICE, slot->d_in);
+		cuPoolFree(POOL_PINNED, slot->h_out);
+		cuPoolFree(POOL_DEVICE, slot->d_out);
+		for (int m = 0; m < 3; m++) {
+			if (slot->marks[m] != NULL) cudaEventDestroy(slot->marks[m]);
+		}
+		if (slot->done != NULL) cudaEventDestroy(slot->done);
+		if (slot->stream != NULL) cudaStreamDestroy(slot->stream);
+	}
+	memset(p, 0, sizeof(Pipeline));
+}
@@ -0,0 +1,117 @@
+#ifndef PIPELINE
+#define PIPELINE
+	#include <cuda_runtime.h>
+	#include <stddef.h>
+
+	#define PIPELINE_MAX_STREAMS 8
+	#define PIPELINE_DEFAULT_STREAMS 2
+
+	/* One buffer set of the pipeline: a non blocking stream, pinned staging
+	 * buffers the host packs inputs into and unpacks outputs from, and their
+	 * device counterparts. done is recorded after the last operation of an
+	 * item, the slot is free again once it completed. */
+	typedef struct PipelineSlot {
+		cudaStream_t stream;
+		cudaEvent_t done;
+		/* marks of the profiled runs: before the upload, after the upload,
+		 * after the kernels */
+		cudaEvent_t marks[3];
+		void* h_in;
+		void* d_in;
+		void* h_out;
+		void* d_out;
+		/* free for the stage, e.g. the chunk the slot buffers hold */
+		long long tag;
+	} PipelineSlot;
+
+	typedef struct Pipeline {
+		unsigned int n_slots;
+		size_t in_bytes;
+		size_t out_bytes;
+		int profile;
+		PipelineSlot slots[PIPELINE_MAX_STREAMS];
+	} Pipeline;
+
+	typedef struct PipelineTimings {
+		float upload_ms;
+		float kernel_ms;
+		float download_ms;
+	} PipelineTimings;
+
+	/* n_streams slots (1 to PIPELINE_MAX_STREAMS) with in_bytes and out_bytes
+	 * staging and device buffers each, from the memory pools. While profile
+	 * is set the runs time their stages with events. */
+	int cuPipelineCreate(Pipeline* p, unsigned int n_streams, size_t in_bytes, size_t out_bytes,
+		int profile);
+	/* waits for the work in flight, then releases the buffers */
+	void cuPipelineDestroy(Pipeline* p);
+
+	/* whether ptr is page locked host memory, which async copies can read
+	 * without going through a staging buffer */
+	inline bool hostIsPinned(const void* ptr) {
+		cudaPointerAttributes attributes;
+		if (ptr == NULL || cudaPointerGetAttributes(&attributes, ptr) != cudaSuccess) {
+			/* older runtimes fail on pageable memory */
+			cudaGetLastError();
+			return false;
+		}
+		return attributes.type == cudaMemoryTypeHost;
+	}
+
+	/* Run n_items items through the slots, item i on slot i % n_slots:
+	 *
+	 *   stage.upload(i, slot)    packs the input in slot->h_in and queues the
+	 *                            host to device copies on slot->stream
+	 *   stage.launch(i, slot)    queues the kernels
+	 *   stage.download(i, slot)  queues the device to host copies to
+	 *                            slot->h_out
+	 *   stage.retire(i, slot)    consumes slot->h_out once the item is done
+	 *
+	 * Items are retired in order. Before a slot is reused its previous item
+	 * is waited for and retired, so the host packs item i + 1 and the copy
+	 * engine moves it while the kernels of item i run: with two slots this
+	 * is double buffering. The calls return cuda error codes. On error the
+	 * items in flight are still waited for, never retired, and the first
+	 * error is returned. timings (may be NULL) receives the summed stage
+	 * times of a profiled pipeline; they overlap, their sum exceeds the
+	 * wall time when the pipeline does its job. */
+	template <typename Stage>
+	int runPipeline(Pipeline* p, unsigned int n_items, Stage& stage, PipelineTimings* timings) {
+		int code = (int)cudaSuccess;
+		unsigned int issued = 0, retired = 0;
+		if (timings != NULL) timings->upload_ms = timings->kernel_ms = timings->download_ms = 0;
+		while (retired < issued || (code == cudaSuccess && issued < n_items)) {
+			bool issue = code == cudaSuccess && issued < n_items;
+			/* retire the oldest item when its slot is needed or at the end */
+			if (retired < issued && (!issue || issued - retired == p->n_slots)) {
+				PipelineSlot* slot = &p->slots[retired % p->n_slots];
+				int status = (int)cudaEventSynchronize(slot->done);
+				if (status == cudaSuccess && code == cudaSuccess && timings != NULL && p->profile) {
+					float ms = 0;
+					cudaEventElapsedTime(&ms, slot->marks[0], slot->marks[1]);
+					timings->upload_ms += ms;
+					cudaEventElapsedTime(&ms, slot->marks[1], slot->marks[2]);
+					timings->kernel_ms += ms;
+					cudaEventElapsedTime(&ms, slot->marks[2], slot->done);
+					timings->download_ms += ms;
+				}
+				if (status == cudaSuccess && code == cudaSuccess) status = stage.retire(retired, slot);
+				if (code == cudaSuccess) code = status;
+				retired++;
+				continue;
+			}
+			PipelineSlot* slot = &p->slots[issued % p->n_slots];
+			if (p->profile) code = (int)cudaEventRecord(slot->marks[0], slot->stream);
+			if (code == cudaSuccess) code = stage.upload(issued, slot);
+			if (code == cudaSuccess && p->profile) code = (int)cudaEventRecord(slot->marks[1], slot->stream);
+			if (code == cudaSuccess) code = stage.launch(issued, slot);
+			if (code == cudaSuccess && p->profile) code = (int)cudaEventRecord(slot->marks[2], slot->stream);
+			if (code == cudaSuccess) code = stage.download(issued, slot);
+			/* recorded even after an error, the retire loop waits on it */
+			int status = (int)cudaEventRecord(slot->done, slot->stream);
+			if (code == cudaSuccess) code = status;
+			issued++;
+		}
+		return code;
+	}
+#endif
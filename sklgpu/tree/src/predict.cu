@@ -0,0 +1,199 @@
+#include "predict.h"
+#include "memory_pool.h"
+#include <cuda_runtime.h>
+#include <stdlib.h>
+#include <string.h>
+
+#define PREDICT_BLOCK 128
+#define TREE_LEAF -1
+
+#define CUDA_TRY(call)															\
+{																				\
+	const cudaError_t error = call;												\
+	if (error != cudaSuccess) return (int)error;								\
+}
+
+/* Whether category code x is in the bitset of n_words words, codes out of
+ * its range (and NaN) never are. */
+__device__ inline bool _inCategories(double x, const unsigned int* bitset, unsigned int n_words) {
+	if (!(x >= 0 && x < 32.0 * n_words)) return false;
+	unsigned int code = (unsigned int)x;
+	return (bitset[code >> 5] >> (code & 31)) & 1;
+}
+
+/* One thread per row, the trees in order, so the sums are those of the
+ * host traversal. NaN compare false and go right like on the host. The
+ * float thresholds are compared and the float values summed in double,
+ * child ids are relative to the root of their tree. Without categorical
+ * split category_split is NULL. */
+template <typename F>
+__global__ void _predictSum(const double* X, unsigned int n_rows, unsigned int n_features,
+		const int* children_left, const int* children_right, const F* feature,
+		const float* threshold, const float* value, unsigned int width, const int* roots,
+		const int* output_offsets, unsigned int n_trees, unsigned int n_outputs,
+		const int* category_split, const unsigned int* categories, const int* category_roots,
+		unsigned int n_words, double* out) {
+	unsigned int row = blockIdx.x * blockDim.x + threadIdx.x;
+	if (row >= n_rows) return;
+	const double* x = X + (size_t)row * n_features;
+	double* o = out + (size_t)row * n_outputs;
+	for (unsigned int k = 0; k < n_outputs; k++) o[k] = 0.0;
+	for (unsigned int t = 0; t < n_trees; t++) {
+		int root = roots[t];
+		int node = root;
+		while (children_left[node] != TREE_LEAF) {
+			double v = x[feature[node]];
+			int split = category_split != NULL ? category_split[node] : -1;
+			bool left = split >= 0
+				? _inCategories(v, categories + (size_t)(category_roots[t] + split) * n_words, n_words)
+				: v <= (double)threshold[node];
+			node = root + (left ? children_left[node] : children_right[node]);
+		}
+		const float* v = value + (size_t)node * width;
+		double* target = o + output_offsets[t];
+		for (unsigned int k = 0; k < width; k++) target[k] += (double)v[k];
+	}
+}
+
+struct PredictStage {
+	PredictContext* ctx;
+	const double* X;
+	unsigned int n_rows;
+	unsigned int n_features;
+	double* out;
+	bool pinned;
+
+	unsigned int count(unsigned int item) const {
+		unsigned int first = item * ctx->chunk_rows;
+		return n_rows - first < ctx->chunk_rows ? n_rows - first : ctx->chunk_rows;
+	}
+
+	int upload(unsigned int item, PipelineSlot* slot) {
+		size_t bytes = (size_t)count(item) * n_features * sizeof(double);
+		const double* src = X + (size_t)item * ctx->chunk_rows * n_features;
+		if (!pinned) {
+			memcpy(slot->h_in, src, bytes);
+			src = (const double*)slot->h_in;
+		}
+		return (int)cudaMemcpyAsync(slot->d_in, src, bytes, cudaMemcpyHostToDevice, slot->stream);
+	}
+
+	int launch(unsigned int item, PipelineSlot* slot) {
+		unsigned int rows = count(item);
+		dim3 block(PREDICT_BLOCK);
+		dim3 grid((rows + PREDICT_BLOCK - 1) / PREDICT_BLOCK);
+		if (ctx->feature_bytes == sizeof(unsigned short)) {
+			_predictSum<unsigned short><<<grid, block, 0, slot->stream>>>((const double*)slot->d_in,
+				rows, n_features, ctx->children_left, ctx->children_right,
+				(const unsigned short*)ctx->feature, ctx->threshold, ctx->value, ctx->width,
+				ctx->roots, ctx->output_offsets, ctx->n_trees, ctx->n_outputs,
+				ctx->category_split, ctx->categories, ctx->category_roots, ctx->n_words,
+				(double*)slot->d_out);
+		} else {
+			_predictSum<int><<<grid, block, 0, slot->stream>>>((const double*)slot->d_in, rows,
+				n_features, ctx->children_left, ctx->children_right, (const int*)ctx->feature,
+				ctx->threshold, ctx->value, ctx->width, ctx->roots, ctx->output_offsets,
+				ctx->n_trees, ctx->n_outputs, ctx->category_split, ctx->categories,
+				ctx->category_roots, ctx->n_words, (double*)slot->d_out);
+		}
+		return (int)cudaGetLastError();
+	}
+
+	int download(unsigned int item, PipelineSlot* slot) {
+		return (int)cudaMemcpyAsync(slot->h_out, slot->d_out,
+			(size_t)count(item) * ctx->n_outputs * sizeof(double), cudaMemcpyDeviceToHost, slot->stream);
+	}
+
+	int retire(unsigned int item, PipelineSlot* slot) {
+		memcpy(out + (size_t)item * ctx->chunk_rows * ctx->n_outputs, slot->h_out,
+			(size_t)count(item) * ctx->n_outputs * sizeof(double));
+		return (int)cudaSuccess;
+	}
+};
+
+template <typename T>
+static int _upload(T** device, const T* host, size_t n) {
+	CUDA_TRY((cudaError_t)cuPoolMalloc(POOL_DEVICE, (void**)device, (n > 0 ? n : 1) * sizeof(T)));
+	return (int)cudaMemcpy(*device, host, n * sizeof(T), cudaMemcpyHostToDevice);
+}
+
+int cuPredictCreate(PredictContext** ctx, const int* children_left, const int* children_right,
+		const void* feature, unsigned int feature_bytes, const float* threshold, const float* value,
+		unsigned int n_nodes, unsigned int width, const int* roots, const int* output_offsets,
+		unsigned int n_trees, unsigned int n_outputs, unsigned int chunk_rows, unsigned int n_streams,
+		const int* category_split, const unsigned int* categories, const int* category_roots,
+		unsigned int n_category_rows, unsigned int n_words) {
+	if (chunk_rows == 0 || n_streams < 1 || n_streams > PIPELINE_MAX_STREAMS) return (int)cudaErrorInvalidValue;
+	if (feature_bytes != sizeof(unsigned short) && feature_bytes != sizeof(int)) return (int)cudaErrorInvalidValue;
+	PredictContext* c = (PredictContext*)calloc(1, sizeof(PredictContext));
+	if (c == NULL) return (int)cudaErrorMemoryAllocation;
+	c->n_nodes = n_nodes;
+	c->feature_bytes = feature_bytes;
+	c->width = width;
+	c->n_trees = n_trees;
+	c->n_outputs = n_outputs;
+	c->chunk_rows = chunk_rows;
+	c->n_streams = n_streams;
+	c->n_words = n_words;
+	c->n_category_rows = n_category_rows;
+	*ctx = c;
+	CUDA_TRY((cudaError_t)_upload(&c->children_left, children_left, n_nodes));
+	CUDA_TRY((cudaError_t)_upload(&c->children_right, children_right, n_nodes));
+	CUDA_TRY((cudaError_t)_upload((char**)&c->feature, (const char*)feature,
+		(size_t)n_nodes * feature_bytes));
+	CUDA_TRY((cudaError_t)_upload(&c->threshold, threshold, n_nodes));
+	CUDA_TRY((cudaError_t)_upload(&c->value, value, (size_t)n_nodes * width));
+	CUDA_TRY((cudaError_t)_upload(&c->roots, roots, n_trees));
+	CUDA_TRY((cudaError_t)_upload(&c->output_offsets, output_offsets, n_trees));
+	if (category_split != NULL) {
+		CUDA_TRY((cudaError_t)_upload(&c->category_split, category_split, n_nodes));
+		CUDA_TRY((cudaError_t)_upload(&c->categories, categories,
+			(size_t)n_category_rows * n_words));
+		CUDA_TRY((cudaError_t)_upload(&c->category_roots, category_roots, n_trees));
+	}
+	/* the pipeline streams do not synchronize with the default one */
+	CUDA_TRY(cudaStreamSynchronize(0));
+	return (int)cudaSuccess;
+}
+
+int cuPredictSum(PredictContext* ctx, const double* X, unsigned int n_rows, unsigned int n_features,
+		double* out) {
+	ctx->upload_ms = ctx->kernel_ms = ctx->download_ms = 0;
+	if (n_rows == 0) return (int)cudaSuccess;
+	if (n_features != ctx->n_features) {
+		/* slot buffers sized for the rows of this width */
+		cuPipelineDestroy(&ctx->pipeline);
+		ctx->n_features = 0;
+		CUDA_TRY((cudaError_t)cuPipelineCreate(&ctx->pipeline, ctx->n_streams,
+			(size_t)ctx->chunk_rows * n_features * sizeof(double),
+			(size_t)ctx->chunk_rows * ctx->n_outputs * sizeof(double), ctx->profile));
+		ctx->n_features = n_features;
+	}
+	ctx->pipeline.profile = ctx->profile;
+	PredictStage stage = {ctx, X, n_rows, n_features, out, hostIsPinned(X)};
+	PipelineTimings timings;
+	CUDA_TRY((cudaError_t)runPipeline(&ctx->pipeline, (n_rows + ctx->chunk_rows - 1) / ctx->chunk_rows,
+		stage, &timings));
+	if (ctx->profile) {
+		ctx->upload_ms = timings.upload_ms;
+		ctx->kernel_ms = timings.kernel_ms;
+		ctx->download_ms = timings.download_ms;
+	}
+	return (int)cudaSuccess;
+}
+
+void cuPredictFree(PredictContext* ctx) {
+	if (ctx == NULL) return;
+	cuPipelineDestroy(&ctx->pipeline);
+	cuPoolFree(POOL_DEVICE, ctx->children_left);
+	cuPoolFree(POOL_DEVICE, ctx->children_right);
+	cuPoolFree(POOL_DEVICE, ctx->feature);
+	cuPoolFree(POOL_DEVICE, ctx->threshold);
+	cuPoolFree(POOL_DEVICE, ctx->value);
+	cuPoolFree(POOL_DEVICE, ctx->roots);
+	cuPoolFree(POOL_DEVICE, ctx->output_offsets);
+	cuPoolFree(POOL_DEVICE, ctx->category_split);
+	cuPoolFree(POOL_DEVICE, ctx->categories);
+	cuPoolFree(POOL_DEVICE, ctx->category_roots);
+	free(ctx);
+}
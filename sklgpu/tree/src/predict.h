@@ -0,0 +1,64 @@
+#ifndef PREDICT
+#define PREDICT
+	#include "pipeline.h"
+
+	/* Node arrays of a tree ensemble on the device, in the compact layout of
+	 * sklgpu.tree._tree.TreeEnsemble: int child ids relative to the root of
+	 * their tree, unsigned short or int feature ids, float thresholds and
+	 * values, and the category bitsets of the categorical splits if any.
+	 * And the pipeline that feeds it row chunks. */
+	typedef struct PredictContext {
+		int* children_left;
+		int* children_right;
+		void* feature;
+		/* sizeof(unsigned short) or sizeof(int) */
+		unsigned int feature_bytes;
+		float* threshold;
+		float* value;
+		int* roots;
+		int* output_offsets;
+		/* row of categories of every node splitting on a categorical
+		 * feature, relative to category_roots[t], -1 elsewhere; all three
+		 * NULL without categorical split */
+		int* category_split;
+		unsigned int* categories;
+		int* category_roots;
+		/* uint32 words of a bitset, a row of categories */
+		unsigned int n_words;
+		unsigned int n_category_rows;
+		unsigned int n_nodes;
+		unsigned int width;
+		unsigned int n_trees;
+		unsigned int n_outputs;
+		unsigned int chunk_rows;
+		unsigned int n_streams;
+		/* features of the rows the slot buffers are sized for, 0 before the
+		 * first call */
+		unsigned int n_features;
+		Pipeline pipeline;
+		/* when profile is set, cuPredictSum stores the event timings of its
+		 * transfers and kernels, summed over the chunks */
+		int profile;
+		float upload_ms;
+		float kernel_ms;
+		float download_ms;
+	} PredictContext;
+
+	/* value is (n_nodes, width) row major, tree t adds its leaf value to the
+	 * outputs output_offsets[t] onwards. categories is (n_category_rows,
+	 * n_words) row major; category_split, categories and category_roots are
+	 * NULL for ensembles without categorical split. */
+	int cuPredictCreate(PredictContext** ctx, const int* children_left, const int* children_right,
+		const void* feature, unsigned int feature_bytes, const float* threshold, const float* value,
+		unsigned int n_nodes, unsigned int width, const int* roots, const int* output_offsets,
+		unsigned int n_trees, unsigned int n_outputs, unsigned int chunk_rows, unsigned int n_streams,
+		const int* category_split, const unsigned int* categories, const int* category_roots,
+		unsigned int n_category_rows, unsigned int n_words);
+	/* Sum of the leaf values of the trees for the n_rows rows of X (row major,
+	 * n_features columns) into out (n_rows, n_outputs). The rows go through
+	 * the device chunk_rows at a time: while the kernel of a chunk runs the
+	 * next one is uploaded and the previous one downloaded. */
+	int cuPredictSum(PredictContext* ctx, const double* X, unsigned int n_rows, unsigned int n_features,
+		double* out);
+	void cuPredictFree(PredictContext* ctx);
+#endif
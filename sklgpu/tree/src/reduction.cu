@@ -0,0 +1,392 @@
+#include "reduction.h"
+#include "pipeline.h"
+#include <cuda_runtime.h>
+#include <math_constants.h>
+#include <stdlib.h>
+#include <string.h>
+
+#define FULL_MASK 0xffffffff
+#define NO_INDEX 0xffffffffu
+/* elements copied to the device per pipeline item, 8 MB of doubles */
+#define REDUCE_CHUNK (1u << 20)
+
+#define CUDA_TRY(call)															\
+{																				\
+	const cudaError_t error = call;												\
+	if (error != cudaSuccess) return (int)error;								\
+}
+
+/* Dynamic shared memory cannot be declared once per template type, alias it
+ * through a raw buffer. */
+template <typename T>
+__device__ inline T* sharedBuffer() {
+	extern __shared__ unsigned char s_raw[];
+	return reinterpret_cast<T*>(s_raw);
+}
+
+template <typename T> __device__ inline T positiveInfinity();
+template <> __device__ inline float positiveInfinity<float>() { return CUDART_INF_F; }
+template <> __device__ inline double positiveInfinity<double>() { return CUDART_INF; }
+
+template <typename T> struct SumOp {
+	__device__ static inline T identity() { return (T)0; }
+	__device__ static inline T apply(T a, T b) { return a + b; }
+};
+
+template <typename T> struct MinOp {
+	__device__ static inline T identity() { return positiveInfinity<T>(); }
+	__device__ static inline T apply(T a, T b) { return b < a ? b : a; }
+};
+
+template <typename T> struct MaxOp {
+	__device__ static inline T identity() { return -positiveInfinity<T>(); }
+	__device__ static inline T apply(T a, T b) { return b > a ? b : a; }
+};
+
+/* Neighbored pairs, thread tid folds tid + stride when tid % (2 * stride) == 0.
+ * Unlike the original int demo kernel the block is staged in shared memory,
+ * so the input is left untouched, and out of range threads load the identity
+ * instead of returning before __syncthreads. */
+template <typename T, typename Op>
+__global__ void reduceNeighbor(const T* g_idata, T* g_odata, unsigned int n) {
+	T* sdata = sharedBuffer<T>();
+	unsigned int tid = threadIdx.x;
+	size_t idx = (size_t)blockIdx.x * blockDim.x + threadIdx.x;
+	sdata[tid] = idx < n ? g_idata[idx] : Op::identity();
+	__syncthreads();
+	for (unsigned int stride = 1; stride < blockDim.x; stride *= 2) {
+		if ((tid % (2 * stride)) == 0) {
+			sdata[tid] = Op::apply(sdata[tid], sdata[tid + stride]);
+		}
+		__syncthreads();
+	}
+	if (tid == 0) g_odata[blockIdx.x] = sdata[0];
+}
+
+/* Same pairs as reduceNeighbor, remapped so the active threads are the
+ * first ones of the block and whole warps retire together. */
+template <typename T, typename Op>
+__global__ void reduceNeighborPlus(const T* g_idata, T* g_odata, unsigned int n) {
+	T* sdata = sharedBuffer<T>();
+	unsigned int tid = threadIdx.x;
+	size_t idx = (size_t)blockIdx.x * blockDim.x + threadIdx.x;
+	sdata[tid] = idx < n ? g_idata[idx] : Op::identity();
+	__syncthreads();
+	for (unsigned int stride = 1; stride < blockDim.x; stride *= 2) {
+		unsigned int index = 2 * stride * tid;
+		if (index < blockDim.x) {
+			sdata[index] = Op::apply(sdata[index], sdata[index + stride]);
+		}
+		__syncthreads();
+	}
+	if (tid == 0) g_odata[blockIdx.x] = sdata[0];
+}
+
+/* Interleaved pairs: stride halves from blockDim.x / 2, conflict free
+ * shared memory accesses. */
+template <typename T, typename Op>
+__global__ void reduceInterleaved(const T* g_idata, T* g_odata, unsigned int n) {
+	T* sdata = sharedBuffer<T>();
+	unsigned int tid = threadIdx.x;
+	size_t idx = (size_t)blockIdx.x * blockDim.x + threadIdx.x;
+	sdata[tid] = idx < n ? g_idata[idx] : Op::identity();
+	__syncthreads();
+	for (unsigned int stride = blockDim.x / 2; stride > 0; stride >>= 1) {
+		if (tid < stride) {
+			sdata[tid] = Op::apply(sdata[tid], sdata[tid + stride]);
+		}
+		__syncthreads();
+	}
+	if (tid == 0) g_odata[blockIdx.x] = sdata[0];
+}
+
+/* Every block covers 2 * blockDim.x elements (each thread folds two of them
+ * while loading), interleaved folding down to one warp, then the last 32
+ * partials are folded with warp shuffles. The order of the operations is
+ * the interleaved one, so results match REDUCE_INTERLEAVED on the pairwise
+ * pre-folded input. */
+template <typename T, typename Op>
+__global__ void reduceUnrollWarps(const T* g_idata, T* g_odata, unsigned int n) {
+	T* sdata = sharedBuffer<T>();
+	unsigned int tid = threadIdx.x;
+	size_t idx = (size_t)blockIdx.x * blockDim.x * 2 + threadIdx.x;
+	T a = idx < n ? g_idata[idx] : Op::identity();
+	T b = idx + blockDim.x < n ? g_idata[idx + blockDim.x] : Op::identity();
+	sdata[tid] = Op::apply(a, b);
+	__syncthreads();
+	for (unsigned int stride = blockDim.x / 2; stride > 32; stride >>= 1) {
+		if (tid < stride) {
+			sdata[tid] = Op::apply(sdata[tid], sdata[tid + stride]);
+		}
+		__syncthreads();
+	}
+	if (tid < 32) {
+		T value = Op::apply(sdata[tid], sdata[tid + 32]);
+		for (int offset = 16; offset > 0; offset >>= 1) {
+			value = Op::apply(value, __shfl_down_sync(FULL_MASK, value, offset));
+		}
+		if (tid == 0) g_odata[blockIdx.x] = value;
+	}
+}
+
+template <typename T>
+__device__ inline bool argmaxTakes(T value, unsigned int index, T best, unsigned int best_index) {
+	return value > best || (value == best && index < best_index);
+}
+
+/* Interleaved argmax carrying (value, index) pairs, ties go to the smallest
+ * index and NaN never win. */
+template <typename T>
+__global__ void reduceArgmax(const T* g_idata, T* g_ovalue, unsigned int* g_oindex, unsigned int n) {
+	T* svalue = sharedBuffer<T>();
+	unsigned int* sindex = (unsigned int*)(svalue + blockDim.x);
+	unsigned int tid = threadIdx.x;
+	size_t idx = (size_t)blockIdx.x * blockDim.x + threadIdx.x;
+	T value = -positiveInfinity<T>();
+	unsigned int index = NO_INDEX;
+	if (idx < n && g_idata[idx] == g_idata[idx]) {
+		value = g_idata[idx];
+		index = (unsigned int)idx;
+	}
+	svalue[tid] = value;
+	sindex[tid] = index;
+	__syncthreads();
+	for (unsigned int stride = blockDim.x / 2; stride > 0; stride >>= 1) {
+		if (tid < stride && argmaxTakes(svalue[tid + stride], sindex[tid + stride], svalue[tid], sindex[tid])) {
+			svalue[tid] = svalue[tid + stride];
+			sindex[tid] = sindex[tid + stride];
+		}
+		__syncthreads();
+	}
+	if (tid == 0) {
+		g_ovalue[blockIdx.x] = svalue[0];
+		g_oindex[blockIdx.x] = sindex[0];
+	}
+}
+
+template <typename T, typename Op>
+int _reduceLaunch(const T* d_in, T* d_out, unsigned int n, int variant, dim3 grid, dim3 block,
+		cudaStream_t stream) {
+	size_t shared = block.x * sizeof(T);
+	switch (variant) {
+	case REDUCE_NEIGHBORED:
+		reduceNeighbor<T, Op><<<grid, block, shared, stream>>>(d_in, d_out, n);
+		break;
+	case REDUCE_NEIGHBORED_PLUS:
+		reduceNeighborPlus<T, Op><<<grid, block, shared, stream>>>(d_in, d_out, n);
+		break;
+	case REDUCE_INTERLEAVED:
+		reduceInterleaved<T, Op><<<grid, block, shared, stream>>>(d_in, d_out, n);
+		break;
+	case REDUCE_UNROLLED:
+		reduceUnrollWarps<T, Op><<<grid, block, shared, stream>>>(d_in, d_out, n);
+		break;
+	default:
+		return (int)cudaErrorInvalidValue;
+	}
+	return (int)cudaGetLastError();
+}
+
+/* Input chunks of the reductions: chunk elements per pipeline item, the
+ * last one shorter. An empty input is one item of 0 elements, the kernel
+ * then writes the identity. */
+template <typename T>
+struct ReduceChunks {
+	const T* x;
+	unsigned int n;
+	unsigned int chunk;
+	unsigned int per_block;
+	bool pinned;
+
+	ReduceChunks(const T* x_, unsigned int n_, unsigned int per_block_)
+		: x(x_), n(n_), chunk(n_ < REDUCE_CHUNK ? n_ : REDUCE_CHUNK), per_block(per_block_),
+		pinned(hostIsPinned(x_)) {}
+
+	unsigned int items() const {
+		return n > 0 ? (n + chunk - 1) / chunk : 1;
+	}
+
+	unsigned int count(unsigned int item) const {
+		size_t first = (size_t)item * chunk;
+		return n - first < chunk ? (unsigned int)(n - first) : chunk;
+	}
+
+	unsigned int blocks(unsigned int item) const {
+		unsigned int c = count(item);
+		return c > 0 ? (c + per_block - 1) / per_block : 1;
+	}
+
+	/* through the pinned staging buffer unless the input is pinned already */
+	int upload(unsigned int item, PipelineSlot* slot) const {
+		size_t bytes = (size_t)count(item) * sizeof(T);
+		if (bytes == 0) return (int)cudaSuccess;
+		const T* src = x + (size_t)item * chunk;
+		if (!pinned) {
+			memcpy(slot->h_in, src, bytes);
+			src = (const T*)slot->h_in;
+		}
+		return (int)cudaMemcpyAsync(slot->d_in, src, bytes, cudaMemcpyHostToDevice, slot->stream);
+	}
+};
+
+template <typename T>
+struct ReduceStage {
+	ReduceChunks<T> chunks;
+	int op;
+	int variant;
+	dim3 block;
+	T result;
+
+	ReduceStage(const T* x, unsigned int n, int op_, int variant_, unsigned int block_size)
+		: chunks(x, n, variant_ == REDUCE_UNROLLED ? 2 * block_size : block_size), op(op_),
+		variant(variant_), block(block_size), result((T)0) {}
+
+	int upload(unsigned int item, PipelineSlot* slot) {
+		return chunks.upload(item, slot);
+	}
+
+	int launch(unsigned int item, PipelineSlot* slot) {
+		const T* d_in = (const T*)slot->d_in;
+		T* d_out = (T*)slot->d_out;
+		unsigned int count = chunks.count(item);
+		dim3 grid(chunks.blocks(item));
+		switch (op) {
+		case REDUCE_SUM: return _reduceLaunch<T, SumOp<T> >(d_in, d_out, count, variant, grid, block, slot->stream);
+		case REDUCE_MIN: return _reduceLaunch<T, MinOp<T> >(d_in, d_out, count, variant, grid, block, slot->stream);
+		default: return _reduceLaunch<T, MaxOp<T> >(d_in, d_out, count, variant, grid, block, slot->stream);
+		}
+	}
+
+	int download(unsigned int item, PipelineSlot* slot) {
+		return (int)cudaMemcpyAsync(slot->h_out, slot->d_out, chunks.blocks(item) * sizeof(T),
+			cudaMemcpyDeviceToHost, slot->stream);
+	}
+
+	/* items retire in order, the partials are folded in block order */
+	int retire(unsigned int item, PipelineSlot* slot) {
+		const T* h_out = (const T*)slot->h_out;
+		for (unsigned int i = 0; i < chunks.blocks(item); i++) {
+			if (item == 0 && i == 0) result = h_out[0];
+			else if (op == REDUCE_SUM) result = result + h_out[i];
+			else if (op == REDUCE_MIN) result = h_out[i] < result ? h_out[i] : result;
+			else result = h_out[i] > result ? h_out[i] : result;
+		}
+		return (int)cudaSuccess;
+	}
+};
+
+template <typename T>
+struct ArgmaxStage {
+	ReduceChunks<T> chunks;
+	dim3 block;
+	T best;
+	long long best_index;
+
+	ArgmaxStage(const T* x, unsigned int n, unsigned int block_size)
+		: chunks(x, n, block_size), block(block_size), best((T)0), best_index(-1) {}
+
+	/* the block indices follow the values in d_out / h_out */
+	size_t indexOffset() const {
+		return (size_t)chunks.blocks(0) * sizeof(T);
+	}
+
+	int upload(unsigned int item, PipelineSlot* slot) {
+		return chunks.upload(item, slot);
+	}
+
+	int launch(unsigned int item, PipelineSlot* slot) {
+		size_t shared = block.x * (sizeof(T) + sizeof(unsigned int));
+		dim3 grid(chunks.blocks(item));
+		reduceArgmax<T><<<grid, block, shared, slot->stream>>>((const T*)slot->d_in, (T*)slot->d_out,
+			(unsigned int*)((char*)slot->d_out + indexOffset()), chunks.count(item));
+		return (int)cudaGetLastError();
+	}
+
+	int download(unsigned int item, PipelineSlot* slot) {
+		return (int)cudaMemcpyAsync(slot->h_out, slot->d_out,
+			indexOffset() + chunks.blocks(0) * sizeof(unsigned int), cudaMemcpyDeviceToHost, slot->stream);
+	}
+
+	/* block indices are local to their chunk; later chunks have larger
+	 * indices, a tie keeps the earlier one */
+	int retire(unsigned int item, PipelineSlot* slot) {
+		const T* h_value = (const T*)slot->h_out;
+		const unsigned int* h_index = (const unsigned int*)((char*)slot->h_out + indexOffset());
+		long long first = (long long)item * chunks.chunk;
+		for (unsigned int i = 0; i < chunks.blocks(item); i++) {
+			long long index = h_index[i] == NO_INDEX ? -1 : first + h_index[i];
+			if ((item == 0 && i == 0) || h_value[i] > best) {
+				best = h_value[i];
+				best_index = index;
+			} else if (h_value[i] == best && index >= 0 && (best_index < 0 || index < best_index)) {
+				best_index = index;
+			}
+		}
+		return (int)cudaSuccess;
+	}
+};
+
+template <typename T>
+int _reduce(const T* x, unsigned int n, int op, int variant, unsigned int block_size, T* out,
+		float* kernel_ms) {
+	if (block_size == 0 || (block_size & (block_size - 1)) != 0) return (int)cudaErrorInvalidValue;
+	if (variant == REDUCE_UNROLLED && block_size < 64) return (int)cudaErrorInvalidValue;
+	if (op != REDUCE_SUM && op != REDUCE_MIN && op != REDUCE_MAX) return (int)cudaErrorInvalidValue;
+	/* the input goes through the device REDUCE_CHUNK elements at a time, a
+	 * multiple of the elements per block so the blocks and the order of the
+	 * partials are those of a single pass; the copy of a chunk overlaps the
+	 * kernel of the previous one */
+	ReduceStage<T> stage(x, n, op, variant, block_size);
+	size_t chunk_bytes = (size_t)(stage.chunks.chunk > 0 ? stage.chunks.chunk : 1) * sizeof(T);
+	Pipeline pipeline;
+	PipelineTimings timings;
+	/* pooled buffers: repeated reductions of similar sizes allocate nothing */
+	int code = cuPipelineCreate(&pipeline, PIPELINE_DEFAULT_STREAMS, chunk_bytes,
+		stage.chunks.blocks(0) * sizeof(T), kernel_ms != NULL);
+	if (code == cudaSuccess) code = runPipeline(&pipeline, stage.chunks.items(), stage, &timings);
+	cuPipelineDestroy(&pipeline);
+	if (kernel_ms != NULL) *kernel_ms = code == cudaSuccess ? timings.kernel_ms : 0;
+	if (code == cudaSuccess) *out = stage.result;
+	return code;
+}
+
+template <typename T>
+int _argmax(const T* x, unsigned int n, unsigned int block_size, T* value, long long* index,
+		float* kernel_ms) {
+	if (block_size == 0 || (block_size & (block_size - 1)) != 0) return (int)cudaErrorInvalidValue;
+	/* chunked and pipelined like _reduce */
+	ArgmaxStage<T> stage(x, n, block_size);
+	size_t chunk_bytes = (size_t)(stage.chunks.chunk > 0 ? stage.chunks.chunk : 1) * sizeof(T);
+	Pipeline pipeline;
+	PipelineTimings timings;
+	int code = cuPipelineCreate(&pipeline, PIPELINE_DEFAULT_STREAMS, chunk_bytes,
+		stage.indexOffset() + stage.chunks.blocks(0) * sizeof(unsigned int), kernel_ms != NULL);
+	if (code == cudaSuccess) code = runPipeline(&pipeline, stage.chunks.items(), stage, &timings);
+	cuPipelineDestroy(&pipeline);
+	if (kernel_ms != NULL) *kernel_ms = code == cudaSuccess ? timings.kernel_ms : 0;
+	if (code == cudaSuccess) {
+		*value = stage.best;
+		*index = stage.best_index;
+	}
+	return code;
+}
+
+int cuReduceFloat(const float* x, unsigned int n, int op, int variant, unsigned int block_size, float* out,
+		float* kernel_ms) {
+	return _reduce<float>(x, n, op, variant, block_size, out, kernel_ms);
+}
+
+int cuReduceDouble(const double* x, unsigned int n, int op, int variant, unsigned int block_size, double* out,
+		float* kernel_ms) {
+	return _reduce<double>(x, n, op, variant, block_size, out, kernel_ms);
+}
+
+int cuArgmaxFloat(const float* x, unsigned int n, unsigned int block_size, float* value, long long* index,
+		float* kernel_ms) {
+	return _argmax<float>(x, n, block_size, value, index, kernel_ms);
+}
+
+int cuArgmaxDouble(const double* x, unsigned int n, unsigned int block_size, double* value, long long* index,
+		float* kernel_ms) {
+	return _argmax<double>(x, n, block_size, value, index, kernel_ms);
+}
@@ -0,0 +1,32 @@
+#ifndef REDUCTION
+#define REDUCTION
+	/* reduction operators */
+	#define REDUCE_SUM 0
+	#define REDUCE_MIN 1
+	#define REDUCE_MAX 2
+
+	/* kernel variants, see reduction.cu */
+	#define REDUCE_NEIGHBORED 0
+	#define REDUCE_NEIGHBORED_PLUS 1
+	#define REDUCE_INTERLEAVED 2
+	#define REDUCE_UNROLLED 3
+
+	/* Reduce host arrays. The input is copied to the device and reduced in
+	 * chunks of a bounded size, through the double buffered pipeline of
+	 * pipeline.h: the copy of a chunk overlaps the kernel of the previous
+	 * one. Every block writes one partial result, partials are folded on
+	 * the host in block order. block_size must be a power of 2
+	 * (at least 64 for REDUCE_UNROLLED). When kernel_ms is not NULL it
+	 * receives the kernel time measured with CUDA events. */
+	int cuReduceFloat(const float* x, unsigned int n, int op, int variant,
+		unsigned int block_size, float* out, float* kernel_ms);
+	int cuReduceDouble(const double* x, unsigned int n, int op, int variant,
+		unsigned int block_size, double* out, float* kernel_ms);
+
+	/* Maximum and the smallest index holding it, NaN are ignored. An empty or
+	 * all NaN input gives -inf and index -1. */
+	int cuArgmaxFloat(const float* x, unsigned int n, unsigned int block_size,
+		float* value, long long* index, float* kernel_ms);
+	int cuArgmaxDouble(const double* x, unsigned int n, unsigned int block_size,
+		double* value, long long* index, float* kernel_ms);
+#endif
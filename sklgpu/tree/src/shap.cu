@@ -0,0 +1,293 @@
+#include "shap.h"
+#include "memory_pool.h"
+#include <cuda_runtime.h>
+#include <stdlib.h>
+#include <string.h>
+
+#define SHAP_BLOCK 64
+
+#define CUDA_TRY(call)															\
+{																				\
+	const cudaError_t error = call;												\
+	if (error != cudaSuccess) return (int)error;								\
+}
+
+/* the right child of a split takes what is not <= its threshold, NaN
+ * included, like the traversal */
+__device__ inline bool _holds(double x, float lower, float upper) {
+	return !(x <= (double)lower) && x <= (double)upper;
+}
+
+/* Whether category code x is in the set of n_words words, the codes past
+ * its bitset (and NaN) when the last word is set. */
+__device__ inline bool _inSet(double x, const unsigned int* set, unsigned int n_words) {
+	if (!(x >= 0 && x < 32.0 * (n_words - 1))) return set[n_words - 1] != 0;
+	unsigned int code = (unsigned int)x;
+	return (set[code >> 5] >> (code & 31)) & 1;
+}
+
+__device__ inline bool _elementHolds(double x, int e, const float* lower, const float* upper,
+		const int* category_set, const unsigned int* categories, unsigned int n_words) {
+	if (category_set != NULL && category_set[e] >= 0) {
+		return _inSet(x, categories + (size_t)category_set[e] * n_words, n_words);
+	}
+	return _holds(x, lower[e], upper[e]);
+}
+
+/* EXTEND of TreeSHAP: weights of the subsets of every size of the length
+ * elements of a path */
+__device__ inline void _extend(double* weights, const double* one, const double* zero, int length) {
+	weights[0] = 1.0;
+	for (int depth = 1; depth <= length; depth++) {
+		weights[depth] = 0.0;
+		for (int i = depth - 1; i >= 0; i--) {
+			weights[i + 1] += one[depth - 1] * weights[i] * (i + 1) / (depth + 1);
+			weights[i] = zero[depth - 1] * weights[i] * (depth - i) / (depth + 1);
+		}
+	}
+}
+
+/* UNWOUND sum of TreeSHAP: total weight of the subsets without an element */
+__device__ inline double _unwoundSum(const double* weights, double one, double zero, int length) {
+	double total = 0.0;
+	if (one != 0) {
+		double next_one = weights[length];
+		for (int j = length - 1; j >= 0; j--) {
+			double tmp = next_one * (length + 1) / ((j + 1) * one);
+			total += tmp;
+			next_one = weights[j] - tmp * zero * (length - j) / (length + 1);
+		}
+	} else if (zero != 0) {
+		for (int j = length - 1; j >= 0; j--) {
+			total += weights[j] * (length + 1) / ((length - j) * zero);
+		}
+	}
+	return total;
+}
+
+/* One thread per row, the paths in order as on the host. */
+__global__ void _shapPathDependent(const double* X, unsigned int n_rows, unsigned int n_features,
+		const int* path_start, const int* feature, const float* lower, const float* upper,
+		const double* zero_fraction, const double* value, const int* column, unsigned int n_paths,
+		unsigned int width, unsigned int n_outputs, const int* category_set,
+		const unsigned int* categories, unsigned int n_words, double* out) {
+	unsigned int row = blockIdx.x * blockDim.x + threadIdx.x;
+	if (row >= n_rows) return;
+	const double* x = X + (size_t)row * n_features;
+	double* o = out + (size_t)row * (n_features + 1) * n_outputs;
+	for (size_t k = 0; k < (size_t)(n_features + 1) * n_outputs; k++) o[k] = 0.0;
+	double weights[SHAP_MAX_LENGTH + 1];
+	double one[SHAP_MAX_LENGTH];
+	for (unsigned int p = 0; p < n_paths; p++) {
+		int start = path_start[p];
+		int length = path_start[p + 1] - start;
+		if (length == 0) continue;
+		for (int e = 0; e < length; e++) {
+			one[e] = _elementHolds(x[feature[start + e]], start + e, lower, upper, category_set,
+				categories, n_words) ? 1.0 : 0.0;
+		}
+		_extend(weights, one, zero_fraction + start, length);
+		for (int e = 0; e < length; e++) {
+			double zero = zero_fraction[start + e];
+			double w = _unwoundSum(weights, one[e], zero, length) * (one[e] - zero);
+			double* target = o + (size_t)feature[start + e] * n_outputs + column[p];
+			for (unsigned int k = 0; k < width; k++) target[k] += w * value[(size_t)p * width + k];
+		}
+	}
+}
+
+/* One thread per row, averaging the paths' contributions over the background
+ * rows: a path counts for (x, z) when each of its elements holds x or z,
+ * with the weight of the coalitions of the elements holding only x. */
+__global__ void _shapInterventional(const double* X, unsigned int n_rows, unsigned int n_features,
+		const int* path_start, const int* feature, const float* lower, const float* upper,
+		const double* value, const int* column, unsigned int n_paths, unsigned int width,
+		unsigned int n_outputs, const unsigned char* in_background, unsigned int n_background,
+		unsigned int n_elements, const double* weights, unsigned int max_length,
+		const int* category_set, const unsigned int* categories, unsigned int n_words, double* out) {
+	unsigned int row = blockIdx.x * blockDim.x + threadIdx.x;
+	if (row >= n_rows) return;
+	const double* x = X + (size_t)row * n_features;
+	double* o = out + (size_t)row * (n_features + 1) * n_outputs;
+	for (size_t k = 0; k < (size_t)(n_features + 1) * n_outputs; k++) o[k] = 0.0;
+	bool in_x[SHAP_MAX_LENGTH];
+	double phi[SHAP_MAX_LENGTH];
+	for (unsigned int p = 0; p < n_paths; p++) {
+		int start = path_start[p];
+		int length = path_start[p + 1] - start;
+		if (length == 0) continue;
+		for (int e = 0; e < length; e++) {
+			in_x[e] = _elementHolds(x[feature[start + e]], start + e, lower, upper, category_set,
+				categories, n_words);
+			phi[e] = 0.0;
+		}
+		for (unsigned int b = 0; b < n_background; b++) {
+			const unsigned char* in_z = in_background + (size_t)b * n_elements + start;
+			int only_x = 0, only_z = 0;
+			bool reached = true;
+			for (int e = 0; e < length; e++) {
+				if (in_x[e] && !in_z[e]) only_x++;
+				else if (in_z[e] && !in_x[e]) only_z++;
+				else if (!in_x[e]) { reached = false; break; }
+			}
+			if (!reached || only_x + only_z == 0) continue;
+			double positive = weights[only_x * (max_length + 1) + only_z];
+			double negative = weights[only_z * (max_length + 1) + only_x];
+			for (int e = 0; e < length; e++) {
+				if (in_x[e] && !in_z[e]) phi[e] += positive;
+				else if (in_z[e] && !in_x[e]) phi[e] -= negative;
+			}
+		}
+		for (int e = 0; e < length; e++) {
+			if (phi[e] == 0.0) continue;
+			double* target = o + (size_t)feature[start + e] * n_outputs + column[p];
+			for (unsigned int k = 0; k < width; k++) {
+				target[k] += phi[e] / n_background * value[(size_t)p * width + k];
+			}
+		}
+	}
+}
+
+struct ShapStage {
+	ShapContext* ctx;
+	const double* X;
+	unsigned int n_rows;
+	double* out;
+	bool pinned;
+
+	unsigned int count(unsigned int item) const {
+		unsigned int first = item * ctx->chunk_rows;
+		return n_rows - first < ctx->chunk_rows ? n_rows - first : ctx->chunk_rows;
+	}
+
+	size_t rowOutputs() const {
+		return (size_t)(ctx->n_features + 1) * ctx->n_outputs;
+	}
+
+	int upload(unsigned int item, PipelineSlot* slot) {
+		size_t bytes = (size_t)count(item) * ctx->n_features * sizeof(double);
+		const double* src = X + (size_t)item * ctx->chunk_rows * ctx->n_features;
+		if (!pinned) {
+			memcpy(slot->h_in, src, bytes);
+			src = (const double*)slot->h_in;
+		}
+		return (int)cudaMemcpyAsync(slot->d_in, src, bytes, cudaMemcpyHostToDevice, slot->stream);
+	}
+
+	int launch(unsigned int item, PipelineSlot* slot) {
+		unsigned int rows = count(item);
+		dim3 block(SHAP_BLOCK);
+		dim3 grid((rows + SHAP_BLOCK - 1) / SHAP_BLOCK);
+		if (ctx->in_background == NULL) {
+			_shapPathDependent<<<grid, block, 0, slot->stream>>>((const double*)slot->d_in, rows,
+				ctx->n_features, ctx->path_start, ctx->feature, ctx->lower, ctx->upper,
+				ctx->zero_fraction, ctx->value, ctx->column, ctx->n_paths, ctx->width,
+				ctx->n_outputs, ctx->category_set, ctx->categories, ctx->n_words,
+				(double*)slot->d_out);
+		} else {
+			_shapInterventional<<<grid, block, 0, slot->stream>>>((const double*)slot->d_in, rows,
+				ctx->n_features, ctx->path_start, ctx->feature, ctx->lower, ctx->upper, ctx->value,
+				ctx->column, ctx->n_paths, ctx->width, ctx->n_outputs, ctx->in_background,
+				ctx->n_background, ctx->n_elements, ctx->weights, ctx->max_length,
+				ctx->category_set, ctx->categories, ctx->n_words, (double*)slot->d_out);
+		}
+		return (int)cudaGetLastError();
+	}
+
+	int download(unsigned int item, PipelineSlot* slot) {
+		return (int)cudaMemcpyAsync(slot->h_out, slot->d_out,
+			(size_t)count(item) * rowOutputs() * sizeof(double), cudaMemcpyDeviceToHost, slot->stream);
+	}
+
+	int retire(unsigned int item, PipelineSlot* slot) {
+		memcpy(out + (size_t)item * ctx->chunk_rows * rowOutputs(), slot->h_out,
+			(size_t)count(item) * rowOutputs() * sizeof(double));
+		return (int)cudaSuccess;
+	}
+};
+
+template <typename T>
+static int _upload(T** device, const T* host, size_t n) {
+	CUDA_TRY((cudaError_t)cuPoolMalloc(POOL_DEVICE, (void**)device, (n > 0 ? n : 1) * sizeof(T)));
+	return (int)cudaMemcpy(*device, host, n * sizeof(T), cudaMemcpyHostToDevice);
+}
+
+int cuShapCreate(ShapContext** ctx, const int* path_start, const int* feature,
+		const float* lower, const float* upper, const double* zero_fraction, const double* value,
+		const int* column, unsigned int n_paths, unsigned int width, unsigned int n_outputs,
+		unsigned int n_features, const unsigned char* in_background, unsigned int n_background,
+		const double* weights, unsigned int max_length, unsigned int chunk_rows,
+		unsigned int n_streams, const int* category_set, const unsigned int* categories,
+		unsigned int n_sets, unsigned int n_words) {
+	if (chunk_rows == 0 || n_streams < 1 || n_streams > PIPELINE_MAX_STREAMS) return (int)cudaErrorInvalidValue;
+	if (max_length > SHAP_MAX_LENGTH) return (int)cudaErrorInvalidValue;
+	ShapContext* c = (ShapContext*)calloc(1, sizeof(ShapContext));
+	if (c == NULL) return (int)cudaErrorMemoryAllocation;
+	c->n_paths = n_paths;
+	c->n_elements = path_start[n_paths];
+	c->width = width;
+	c->n_outputs = n_outputs;
+	c->n_features = n_features;
+	c->n_background = n_background;
+	c->max_length = max_length;
+	c->chunk_rows = chunk_rows;
+	c->n_streams = n_streams;
+	c->n_words = n_words;
+	*ctx = c;
+	CUDA_TRY((cudaError_t)_upload(&c->path_start, path_start, n_paths + 1));
+	CUDA_TRY((cudaError_t)_upload(&c->feature, feature, c->n_elements));
+	CUDA_TRY((cudaError_t)_upload(&c->lower, lower, c->n_elements));
+	CUDA_TRY((cudaError_t)_upload(&c->upper, upper, c->n_elements));
+	CUDA_TRY((cudaError_t)_upload(&c->zero_fraction, zero_fraction, c->n_elements));
+	CUDA_TRY((cudaError_t)_upload(&c->value, value, (size_t)n_paths * width));
+	CUDA_TRY((cudaError_t)_upload(&c->column, column, n_paths));
+	if (category_set != NULL) {
+		CUDA_TRY((cudaError_t)_upload(&c->category_set, category_set, c->n_elements));
+		CUDA_TRY((cudaError_t)_upload(&c->categories, categories, (size_t)n_sets * n_words));
+	}
+	if (n_background > 0) {
+		CUDA_TRY((cudaError_t)_upload(&c->in_background, in_background,
+			(size_t)n_background * c->n_elements));
+		CUDA_TRY((cudaError_t)_upload(&c->weights, weights,
+			(size_t)(max_length + 1) * (max_length + 1)));
+	}
+	CUDA_TRY((cudaError_t)cuPipelineCreate(&c->pipeline, n_streams,
+		(size_t)chunk_rows * n_features * sizeof(double),
+		(size_t)chunk_rows * (n_features + 1) * n_outputs * sizeof(double), 0));
+	/* the pipeline streams do not synchronize with the default one */
+	CUDA_TRY(cudaStreamSynchronize(0));
+	return (int)cudaSuccess;
+}
+
+int cuShapValues(ShapContext* ctx, const double* X, unsigned int n_rows, double* out) {
+	ctx->upload_ms = ctx->kernel_ms = ctx->download_ms = 0;
+	if (n_rows == 0) return (int)cudaSuccess;
+	ctx->pipeline.profile = ctx->profile;
+	ShapStage stage = {ctx, X, n_rows, out, hostIsPinned(X)};
+	PipelineTimings timings;
+	CUDA_TRY((cudaError_t)runPipeline(&ctx->pipeline, (n_rows + ctx->chunk_rows - 1) / ctx->chunk_rows,
+		stage, &timings));
+	if (ctx->profile) {
+		ctx->upload_ms = timings.upload_ms;
+		ctx->kernel_ms = timings.kernel_ms;
+		ctx->download_ms = timings.download_ms;
+	}
+	return (int)cudaSuccess;
+}
+
+void cuShapFree(ShapContext* ctx) {
+	if (ctx == NULL) return;
+	cuPipelineDestroy(&ctx->pipeline);
+	cuPoolFree(POOL_DEVICE, ctx->path_start);
+	cuPoolFree(POOL_DEVICE, ctx->feature);
+	cuPoolFree(POOL_DEVICE, ctx->lower);
+	cuPoolFree(POOL_DEVICE, ctx->upper);
+	cuPoolFree(POOL_DEVICE, ctx->zero_fraction);
+	cuPoolFree(POOL_DEVICE, ctx->value);
+	cuPoolFree(POOL_DEVICE, ctx->column);
+	cuPoolFree(POOL_DEVICE, ctx->category_set);
+	cuPoolFree(POOL_DEVICE, ctx->categories);
+	cuPoolFree(POOL_DEVICE, ctx->in_background);
+	cuPoolFree(POOL_DEVICE, ctx->weights);
+	free(ctx);
+}
@@ -0,0 +1,68 @@
+#ifndef SHAP
+#define SHAP
+	#include "pipeline.h"
+
+	/* longest path, in distinct features, the kernels hold in local memory */
+	#define SHAP_MAX_LENGTH 64
+
+	/* Root to leaf paths of a tree ensemble on the device, in the layout of
+	 * sklgpu.tree._shap.TreePaths: the elements of path p are
+	 * path_start[p] to path_start[p + 1], each an interval lower < x <= upper
+	 * or a set of categories on a feature with the fraction of the cover
+	 * going through it. And the pipeline that feeds them row chunks. */
+	typedef struct ShapContext {
+		int* path_start;
+		int* feature;
+		float* lower;
+		float* upper;
+		double* zero_fraction;
+		double* value;
+		int* column;
+		/* row of categories of the elements on a categorical feature, -1
+		 * for the intervals; both NULL without categorical split. A row is
+		 * a bitset of n_words - 1 words over the codes, and a last word set
+		 * when the codes past them are in the set too */
+		int* category_set;
+		unsigned int* categories;
+		unsigned int n_words;
+		/* interventional SHAP, NULL otherwise: whether element e holds
+		 * background row b at in_background[b * n_elements + e], and the
+		 * Shapley weights weights[a * (max_length + 1) + b] */
+		unsigned char* in_background;
+		double* weights;
+		unsigned int n_paths;
+		unsigned int n_elements;
+		unsigned int width;
+		unsigned int n_outputs;
+		unsigned int n_features;
+		unsigned int n_background;
+		unsigned int max_length;
+		unsigned int chunk_rows;
+		unsigned int n_streams;
+		Pipeline pipeline;
+		/* when profile is set, cuShapValues stores the event timings of its
+		 * transfers and kernels, summed over the chunks */
+		int profile;
+		float upload_ms;
+		float kernel_ms;
+		float download_ms;
+	} ShapContext;
+
+	/* value is (n_paths, width) row major, the values of path p go to the
+	 * outputs column[p] onwards. n_background is 0 for tree path dependent
+	 * SHAP. Paths are at most SHAP_MAX_LENGTH elements long. category_set is
+	 * NULL without categorical split, categories is (n_sets, n_words). */
+	int cuShapCreate(ShapContext** ctx, const int* path_start, const int* feature,
+		const float* lower, const float* upper, const double* zero_fraction, const double* value,
+		const int* column, unsigned int n_paths, unsigned int width, unsigned int n_outputs,
+		unsigned int n_features, const unsigned char* in_background, unsigned int n_background,
+		const double* weights, unsigned int max_length, unsigned int chunk_rows,
+		unsigned int n_streams, const int* category_set, const unsigned int* categories,
+		unsigned int n_sets, unsigned int n_words);
+	/* SHAP values of the n_rows rows of X (row major, n_features columns)
+	 * into out (n_rows, n_features + 1, n_outputs); the last column, the
+	 * expected value, is left to 0. The rows go through the device
+	 * chunk_rows at a time, the transfers overlapping the kernels. */
+	int cuShapValues(ShapContext* ctx, const double* X, unsigned int n_rows, double* out);
+	void cuShapFree(ShapContext* ctx);
+#endif
@@ -0,0 +1,54 @@
+"""Estimators shared by the tests of the ways fitted trees are used.
+
+The tests of compiled code, sparse and memory mapped input, SHAP values
+and model files parametrize over ``MODELS``, one maker of each kind of
+estimator, and fit them with ``fit_model``.
+"""
+import numpy as np
+
+from sklgpu.ensemble import (HistGradientBoostingClassifier,
+                             HistGradientBoostingRegressor,
+                             RandomForestClassifier, RandomForestRegressor)
+from sklgpu.tree import DecisionTreeClassifier, DecisionTreeRegressor
+
+MODELS = [
+    lambda: DecisionTreeRegressor(max_depth=6),
+    lambda: DecisionTreeClassifier(max_depth=6),
+    lambda: RandomForestRegressor(n_estimators=4, max_depth=5,
+                                  random_state=0),
+    lambda: RandomForestClassifier(n_estimators=4, max_depth=5,
+                                   random_state=0),
+    lambda: HistGradientBoostingRegressor(max_iter=10),
+    lambda: HistGradientBoostingClassifier(max_iter=10),
+]
+
+# splits on the codes of the last feature of ``model_data``
+CATEGORICAL_MODELS = [
+    lambda: DecisionTreeClassifier(max_depth=6, categorical_features=[4]),
+    lambda: HistGradientBoostingRegressor(max_iter=10,
+                                          categorical_features=[4]),
+]
+
+
+def model_data(n_samples=300, seed=0):
+    """``(X, y)`` of 5 features, the last one codes in 0..7, the target
+    depending on all of them but the fourth."""
+    rng = np.random.RandomState(seed)
+    X = rng.normal(size=(n_samples, 5))
+    X[:, 4] = rng.randint(0, 8, size=n_samples)
+    y = (X[:, 0] + X[:, 1] * X[:, 2] + X[:, 4] % 3
+         + rng.normal(scale=.1, size=n_samples))
+    return X, y
+
+
+def fit_model(make_model, X=None, y=None, n_classes=3, **params):
+    """``(model, X)``, ``make_model()`` with ``params`` fitted on the CPU
+    backend to ``(X, y)``, ``model_data()`` by default; classifiers to
+    ``y`` cut into ``n_classes`` classes of about the same size."""
+    if X is None:
+        X, y = model_data()
+    model = make_model().set_params(backend='cpu', **params)
+    if hasattr(model, 'predict_proba'):
+        y = np.digitize(y, np.percentile(y, np.linspace(
+            0, 100, n_classes + 1)[1:-1]))
+    return model.fit(X, y), X
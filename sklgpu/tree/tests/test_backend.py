@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import sklgpu
+from sklgpu.tree import _backend
+from sklgpu.tree._backend import (available_backends, cuda_available,
+                                  require_extension, resolve_backend)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(sklgpu.__file__)))
+
+
+def _run(code, **environ):
+    env = dict(os.environ, PYTHONPATH=ROOT, **environ)
+    return subprocess.run([sys.executable, '-c', code], env=env, cwd=ROOT,
+                          capture_output=True, text=True, check=True).stdout
+
+
+def test_import_does_not_load_the_extension():
+    code = ("import pickle, sys\n"
+            "import numpy as np\n"
+            "import sklgpu, sklgpu.ensemble, sklgpu.tree\n"
+            "from sklgpu.tree import DecisionTreeRegressor\n"
+            "X = np.arange(40.).reshape(20, 2)\n"
+            "tree = DecisionTreeRegressor(backend='cpu').fit(X, X[:, 0])\n"
+            "pickle.loads(pickle.dumps(tree)).predict(X)\n"
+            "print('sklgpu.tree._tree_gpu' in sys.modules)\n")
+    assert _run(code).strip() == 'False'
+
+
+def test_disable_cuda():
+    code = ("from sklgpu.tree import _backend\n"
+            "print(_backend.load_extension() is None,"
+            " _backend.cuda_available(), _backend.available_backends())\n")
+    out = _run(code, SKLGPU_DISABLE_CUDA='1')
+    assert out.strip() == "True False ['cpu']"
+
+
+def test_require_extension_names_the_cause(monkeypatch):
+    monkeypatch.setattr(_backend, '_extension', None)
+    monkeypatch.setattr(_backend, '_extension_loaded', True)
+    monkeypatch.setattr(_backend, '_extension_error',
+                        "disabled by SKLGPU_DISABLE_CUDA")
+    with pytest.raises(RuntimeError, match="SKLGPU_DISABLE_CUDA.*"
+                                           "the 'cuda' backend"):
+        require_extension("the 'cuda' backend")
+
+
+def test_resolve_backend():
+    expected = 'cuda' if cuda_available() else 'cpu'
+    assert available_backends()[0] == expected
+    assert resolve_backend('auto') == expected
+    assert resolve_backend('cpu') == 'cpu'
+    with pytest.raises(ValueError, match="backend should be one of"):
+        resolve_backend('opencl')
+
+
+@pytest.mark.skipif(cuda_available(), reason="needs a host without a device")
+def test_cuda_falls_back_to_cpu():
+    with pytest.warns(RuntimeWarning, match="unavailable here"):
+        assert resolve_backend('cuda') == 'cpu'
+
+
+@pytest.mark.skipif(cuda_available(), reason="needs a host without a device")
+def test_estimator_falls_back_to_cpu():
+    from sklgpu.tree import DecisionTreeRegressor
+    X = np.arange(40.).reshape(20, 2)
+    tree = DecisionTreeRegressor(backend='cpu').fit(X, X[:, 0])
+    with pytest.warns(RuntimeWarning, match="unavailable here"):
+        fallback = DecisionTreeRegressor(backend='cuda').fit(X, X[:, 0])
+    np.testing.assert_array_equal(fallback.predict(X), tree.predict(X))
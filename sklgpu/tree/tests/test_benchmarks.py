@@ -0,0 +1,32 @@
+import importlib.util
+import json
+import os
+
+import pytest
+
+BENCH_TREES = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                           os.pardir, 'benchmarks', 'bench_trees.py')
+
+
+@pytest.mark.skipif(not os.path.exists(BENCH_TREES),
+                    reason="benchmarks are not installed")
+def test_benchmark_report(tmp_path):
+    spec = importlib.util.spec_from_file_location('bench_trees', BENCH_TREES)
+    bench_trees = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench_trees)
+    output = str(tmp_path / 'bench.json')
+    bench_trees.main([
+        '--rows', '300', '--features', '3', '--depth', '2', '3',
+        '--n-estimators', '2', '--warmup', '0', '--repeat', '2',
+        '--percentiles', '50', '--output', output])
+    with open(output) as f:
+        report = json.load(f)
+    assert report['parameters']['rows'] == [300]
+    results = report['results']
+    # one result per benchmark and depth
+    assert len(results) == (len(bench_trees.BENCHMARKS)
+                            + len(bench_trees.DEPTH_BENCHMARKS))
+    for result in results:
+        assert result['backend'] == 'cpu'
+        assert len(result['times']) == 2
+        assert result['min'] <= result['p50'] <= max(result['times'])
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from sklgpu.tree import BinMapper
+from sklgpu.tree._binning import get_bin_cache
+
+
+def test_bins_follow_thresholds():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(5000, 3))
+    bin_mapper = BinMapper(max_bins=64, random_state=0)
+    X_binned = bin_mapper.fit_transform(X)
+    assert X_binned.dtype == np.uint8
+    assert bin_mapper.n_bins_ == 64
+    for f, thresholds in enumerate(bin_mapper.bin_thresholds_):
+        # bin b holds thresholds[b - 1] < x <= thresholds[b]
+        expected = np.searchsorted(thresholds, X[:, f], side='left')
+        np.testing.assert_array_equal(X_binned[:, f], expected)
+        # roughly equal quantiles
+        counts = np.bincount(X_binned[:, f])
+        assert counts.max() < 2 * counts.min()
+
+
+def test_few_distinct_values_get_a_bin_each():
+    X = np.repeat([[0.], [1.5], [2.], [10.]], 5, axis=0)
+    bin_mapper = BinMapper().fit(X)
+    np.testing.assert_array_equal(bin_mapper.bin_thresholds_[0],
+                                  [.75, 1.75, 6.])
+    np.testing.assert_array_equal(bin_mapper.transform(X)[:, 0],
+                                  np.repeat([0, 1, 2, 3], 5))
+
+
+@pytest.mark.parametrize('order', ['C', 'F'])
+def test_layout_and_wide_bins(order):
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(3000, 4))
+    X_binned = BinMapper(max_bins=1000, order=order,
+                         random_state=0).fit_transform(X)
+    assert X_binned.dtype == np.uint16
+    assert X_binned.max() >= 256
+    assert X_binned.flags['%s_CONTIGUOUS' % order]
+
+
+def test_cache_reuses_binned_matrix():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(1000, 4))
+    cache = get_bin_cache()
+    hits = cache.hits
+    first = BinMapper(cache=True, random_state=0).fit_transform(X)
+    second = BinMapper(cache=True, random_state=0).fit_transform(X.copy())
+    assert second is first
+    assert cache.hits == hits + 1
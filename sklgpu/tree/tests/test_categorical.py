@@ -0,0 +1,130 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from sklgpu.ensemble import (HistGradientBoostingRegressor,
+                             RandomForestClassifier)
+from sklgpu.ensemble.distributed import run_local
+from sklgpu.tree import BinMapper, DecisionTreeRegressor
+from sklgpu.tree import _tree
+
+
+def _data(n_samples=2000, n_categories=40, seed=0):
+    # the target depends on a set of categories, not on their order
+    rng = np.random.RandomState(seed)
+    codes = rng.randint(0, n_categories, size=n_samples)
+    X = np.column_stack([rng.normal(size=n_samples), codes * 2])
+    effect = rng.permutation(n_categories) % 2
+    y = 5. * effect[codes] + .1 * X[:, 0] + rng.normal(scale=.1,
+                                                       size=n_samples)
+    return X, y
+
+
+def test_one_split_separates_a_set_of_categories():
+    X, y = _data()
+    stump = DecisionTreeRegressor(max_depth=1, categorical_features=[1],
+                                  backend='cpu').fit(X, y)
+    assert stump.tree_.category_split[0] == 0
+    # more than 32 codes, the bitsets span several words
+    assert stump.tree_.categories.shape[1] > 1
+    assert stump.score(X, y) > .95
+    ordinal = DecisionTreeRegressor(max_depth=1, backend='cpu').fit(X, y)
+    assert ordinal.score(X, y) < .5
+
+    mask = np.array([False, True])
+    masked = DecisionTreeRegressor(max_depth=1, categorical_features=mask,
+                                   backend='cpu').fit(X, y)
+    np.testing.assert_array_equal(masked.predict(X), stump.predict(X))
+
+
+def test_unseen_codes_go_right():
+    X, y = _data()
+    tree = DecisionTreeRegressor(max_depth=1, categorical_features=[1],
+                                 backend='cpu').fit(X, y)
+    right = tree.tree_.children_right[0]
+    unseen = np.array([[0., 1.], [0., 81.], [0., 65535.]])
+    np.testing.assert_array_equal(tree.tree_.apply(unseen), right)
+
+
+def test_binning_gives_every_category_a_bin():
+    X, _ = _data(n_samples=20000, n_categories=100)
+    # a category of a single row, outside of the binning subsample
+    X[-1, 1] = 1001.
+    mapper = BinMapper(subsample=1000, categorical_features=[1],
+                       random_state=0).fit(X)
+    categories = np.unique(X[:, 1])
+    np.testing.assert_array_equal(mapper.categories_[1], categories)
+    assert mapper.categories_[0] is None
+    binned = mapper.transform(X)
+    np.testing.assert_array_equal(binned[:, 1],
+                                  np.searchsorted(categories, X[:, 1]))
+
+
+@pytest.mark.parametrize('codes', [[-1.], [1.5], [np.nan], [70000.]])
+def test_invalid_codes(codes):
+    X, y = _data(100)
+    X[0, 1] = codes[0]
+    with pytest.raises(ValueError):
+        DecisionTreeRegressor(categorical_features=[1],
+                              backend='cpu').fit(X, y)
+
+
+def test_invalid_parameters():
+    X, y = _data(100)
+    with pytest.raises(ValueError, match="splitter='hist'"):
+        DecisionTreeRegressor(categorical_features=[1],
+                              splitter='exact').fit(X, y)
+    with pytest.raises(ValueError, match="more than max_bins"):
+        DecisionTreeRegressor(categorical_features=[1], max_bins=16,
+                              backend='cpu').fit(X, y)
+    with pytest.raises(ValueError, match="categorical_features"):
+        DecisionTreeRegressor(categorical_features=[2],
+                              backend='cpu').fit(X, y)
+
+
+def test_models_and_traversals():
+    X, y = _data(2500)
+    X, X_test, y, y_test = X[:2000], X[2000:], y[:2000], y[2000:]
+    boosting = HistGradientBoostingRegressor(
+        max_iter=20, categorical_features=[1], backend='cpu').fit(X, y)
+    assert boosting.score(X_test, y_test) > .95
+    forest = RandomForestClassifier(
+        n_estimators=5, max_depth=4, categorical_features=[1],
+        random_state=0, backend='cpu').fit(X, y > 2.5)
+    assert forest.score(X_test, y_test > 2.5) > .95
+
+    for model in (boosting, forest):
+        loaded = pickle.loads(pickle.dumps(model))
+        np.testing.assert_array_equal(loaded.predict(X_test),
+                                      model.predict(X_test))
+
+
+@pytest.mark.skipif(_tree._predictor is None,
+                    reason="needs the _predictor extension")
+def test_compiled_matches_numpy(monkeypatch):
+    X, y = _data()
+    X_test = np.vstack([X, [[0., 3.], [0., 1000.]]])
+    model = HistGradientBoostingRegressor(
+        max_iter=10, categorical_features=[1], backend='cpu').fit(X, y)
+    compiled = model.predict(X_test)
+    model._ensemble = None
+    monkeypatch.setattr(_tree, '_predictor', None)
+    np.testing.assert_array_equal(model.predict(X_test), compiled)
+
+
+def test_distributed_categories_are_the_union_of_the_shards():
+    X, y = _data(900, n_categories=12)
+    # every shard misses some of the categories
+    order = np.argsort(X[:, 1], kind='stable')
+    X, y = X[order], y[order]
+    shards = [(X[:300], y[:300]), (X[300:600], y[300:600]),
+              (X[600:], y[600:])]
+    estimator = HistGradientBoostingRegressor(
+        max_iter=5, categorical_features=[1], backend='cpu')
+    single = estimator.fit(X, y)
+    model = run_local(estimator, shards, timeout=120)
+    np.testing.assert_array_equal(model.bin_mapper_.categories_[1],
+                                  single.bin_mapper_.categories_[1])
+    np.testing.assert_allclose(model.predict(X), single.predict(X),
+                               rtol=1e-6)
@@ -0,0 +1,78 @@
+import pickle
+import shutil
+import sysconfig
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from sklgpu.tree import compile_model, export_c
+from sklgpu.tree.tests._models import CATEGORICAL_MODELS, MODELS, fit_model
+
+_CC = (sysconfig.get_config_var('CC') or 'cc').split()[0]
+pytestmark = pytest.mark.skipif(shutil.which(_CC) is None,
+                                reason="needs a C compiler")
+
+
+@pytest.mark.parametrize('style', ['branches', 'arrays'])
+@pytest.mark.parametrize('make_model', MODELS + CATEGORICAL_MODELS)
+def test_compiled_matches_estimator(make_model, style, tmp_path):
+    model, X = fit_model(make_model)
+    compiled = compile_model(model, style=style, compiler='cc',
+                             build_dir=str(tmp_path))
+    assert compiled.compiler == 'cc'
+    assert compiled.n_features == X.shape[1]
+    np.testing.assert_array_equal(compiled.predict(X), model.predict(X))
+    if hasattr(model, 'predict_proba'):
+        np.testing.assert_array_equal(compiled.predict_proba(X),
+                                      model.predict_proba(X))
+    np.testing.assert_array_equal(compiled.predict(X, n_threads=3),
+                                  compiled.predict(X))
+    np.testing.assert_array_equal(compiled.predict(sp.csr_matrix(X)),
+                                  compiled.predict(X))
+
+
+def test_source_names_the_entry_points():
+    model, _ = fit_model(MODELS[0])
+    source = export_c(model, name='my_tree')
+    for function in ('my_tree_predict', 'my_tree_n_features',
+                     'my_tree_n_outputs'):
+        assert function in source
+    with pytest.raises(ValueError):
+        export_c(model, style='table')
+
+
+def test_library_is_reused_and_rebuilt(tmp_path):
+    model, X = fit_model(MODELS[5])
+    compiled = compile_model(model, compiler='cc', build_dir=str(tmp_path))
+    again = compile_model(model, compiler='cc', build_dir=str(tmp_path))
+    assert again.library_path == compiled.library_path
+
+    # pickles keep the source, the library is built again when missing
+    loaded = pickle.loads(pickle.dumps(compiled))
+    shutil.rmtree(str(tmp_path))
+    np.testing.assert_array_equal(loaded.predict_proba(X),
+                                  model.predict_proba(X))
+
+
+def test_checks_the_input(tmp_path):
+    model, X = fit_model(MODELS[0])
+    compiled = compile_model(model, compiler='cc', build_dir=str(tmp_path))
+    with pytest.raises(ValueError, match="5 features"):
+        compiled.predict(X[:, :3])
+    with pytest.raises(AttributeError, match="classifiers"):
+        compiled.predict_proba(X)
+    with pytest.raises(ValueError, match="compiler should be one of"):
+        compile_model(model, compiler='icc', build_dir=str(tmp_path))
+
+
+@pytest.mark.skipif(shutil.which('false') is None,
+                    reason="needs a POSIX shell environment")
+def test_compiler_errors(tmp_path, monkeypatch):
+    model, _ = fit_model(MODELS[0])
+    monkeypatch.setenv('CC', 'false')
+    with pytest.raises(RuntimeError, match="failed to build"):
+        compile_model(model, compiler='cc', build_dir=str(tmp_path))
+    monkeypatch.setenv('CC', str(tmp_path / 'missing-cc'))
+    with pytest.raises(RuntimeError, match="could not be run"):
+        compile_model(model, compiler='cc', build_dir=str(tmp_path))
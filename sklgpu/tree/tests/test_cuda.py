@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from sklgpu.tree import DecisionTreeRegressor
+from sklgpu.tree._backend import cuda_available, load_extension
+from sklgpu.tree._histogram import CPUHistogramBuilder
+
+pytestmark = pytest.mark.skipif(not cuda_available(),
+                                reason="needs the CUDA extension and a device")
+
+
+def test_histograms_match_cpu():
+    _tree_gpu = load_extension()
+    rng = np.random.RandomState(0)
+    X_binned = np.asfortranarray(
+        rng.randint(0, 256, size=(10000, 8)).astype(np.uint8))
+    stats = rng.rand(10000, 3)
+    indices = np.flatnonzero(rng.rand(10000) < 0.3).astype(np.uint32)
+    gpu = _tree_gpu.HistogramBuilder(X_binned, 256)
+    gpu.set_stats(stats)
+    cpu = CPUHistogramBuilder(X_binned, 256)
+    cpu.set_stats(stats)
+    np.testing.assert_allclose(gpu.build(indices), cpu.build(indices),
+                               rtol=1e-5, atol=1e-8)
+
+
+def test_tree_matches_cpu():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(2000, 8))
+    y = X[:, 0] - 2 * X[:, 1] + rng.normal(size=2000)
+    gpu = DecisionTreeRegressor(max_depth=6, backend='cuda').fit(X, y)
+    cpu = DecisionTreeRegressor(max_depth=6, backend='cpu').fit(X, y)
+    np.testing.assert_allclose(gpu.predict(X), cpu.predict(X), rtol=1e-5)
@@ -0,0 +1,40 @@
+import numpy as np
+
+from sklgpu.tree._binning import BinMapper
+from sklgpu.tree._grower import TreeGrower
+from sklgpu.tree._histogram import CPUHistogramBuilder
+from sklgpu.tree._splitting import GradientCriterion
+
+
+class RecordingBuilder(CPUHistogramBuilder):
+
+    def build(self, sample_indices):
+        self.built.append(len(sample_indices))
+        return super(RecordingBuilder, self).build(sample_indices)
+
+
+def test_sibling_histograms_by_subtraction():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(2000, 5))
+    gradients = X[:, 0] - X[:, 1] ** 2 + rng.normal(scale=.1, size=2000)
+    bin_mapper = BinMapper(random_state=0)
+    X_binned = bin_mapper.fit_transform(X)
+    criterion = GradientCriterion()
+    stats = criterion.sample_stats(gradients, np.ones(2000))
+    builder = RecordingBuilder(X_binned, bin_mapper.n_bins_)
+    builder.built = []
+    builder.set_stats(stats)
+    grower = TreeGrower(X_binned, bin_mapper.bin_thresholds_, builder,
+                        criterion, max_depth=5)
+    grower.grow(np.arange(2000, dtype=np.uint32))
+
+    # the root, then only the smaller child of every split
+    n_splits = len(grower.leaves) - 1
+    assert len(builder.built) == n_splits + 1
+    assert builder.built[0] == 2000
+    assert all(n <= 1000 for n in builder.built[1:])
+    # the subtracted histograms hold the statistics of their samples
+    for leaf in grower.leaves:
+        np.testing.assert_allclose(leaf.stats,
+                                   stats[leaf.sample_indices].sum(axis=0),
+                                   rtol=1e-6, atol=1e-6)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from sklgpu.tree._backend import cuda_available
+from sklgpu.tree._memory import HostMemoryPool, get_memory_pool, size_class
+
+
+def test_size_classes():
+    assert size_class(1) == 512
+    assert size_class(513) == 1024
+    assert size_class((1 << 20) + 1) == 2 << 20
+
+
+def test_freed_blocks_are_reused():
+    pool = HostMemoryPool()
+    first = pool.empty((10, 20))
+    assert first.shape == (10, 20) and first.flags.c_contiguous
+    address = first.__array_interface__['data'][0]
+    pool.free(first)
+    second = pool.zeros((20, 10), dtype=np.float64)
+    assert second.__array_interface__['data'][0] == address
+    assert not second.any()
+    stats = pool.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1
+    assert stats['bytes_in_use'] == size_class(second.nbytes)
+    with pytest.raises(ValueError):
+        pool.free(first)
+
+
+def test_cache_limit():
+    pool = HostMemoryPool(max_cached_bytes=2048)
+    arrays = [pool.empty(256) for _ in range(3)]
+    for array in arrays:
+        pool.free(array)
+    assert pool.stats()['bytes_cached'] == 2048
+    pool.set_limit(0)
+    assert pool.stats()['bytes_cached'] == 0
+
+
+def test_dropped_arrays_are_forgotten():
+    pool = HostMemoryPool()
+    pool.empty(100)
+    assert pool.stats()['bytes_in_use'] == 0
+
+
+@pytest.mark.skipif(not cuda_available(),
+                    reason="needs the CUDA extension and a device")
+def test_device_pools_have_host_statistics():
+    for kind in ('device', 'pinned'):
+        assert set(get_memory_pool(kind).stats()) == set(
+            get_memory_pool('host').stats())
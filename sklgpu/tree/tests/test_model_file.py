@@ -0,0 +1,134 @@
+import io
+import struct
+
+import numpy as np
+import pytest
+
+from sklgpu.ensemble import (HistGradientBoostingClassifier,
+                             HistGradientBoostingRegressor)
+from sklgpu.tree import DecisionTreeRegressor, load_model, save_model
+from sklgpu.tree.tests._models import (CATEGORICAL_MODELS, MODELS, fit_model,
+                                       model_data)
+
+
+def _outputs(model, X):
+    outputs = [model.predict(X)]
+    if hasattr(model, 'predict_proba'):
+        outputs.append(model.predict_proba(X))
+    return outputs
+
+
+@pytest.mark.parametrize('mmap_mode', ['r', 'c', None])
+@pytest.mark.parametrize('make_model', MODELS + CATEGORICAL_MODELS)
+def test_round_trip(make_model, mmap_mode, tmp_path):
+    model, X = fit_model(make_model)
+    path = str(tmp_path / 'model.skg')
+    save_model(model, path)
+    loaded = load_model(path, mmap_mode=mmap_mode)
+    assert type(loaded) is type(model)
+    assert loaded.get_params() == model.get_params()
+    for a, b in zip(_outputs(loaded, X), _outputs(model, X)):
+        np.testing.assert_array_equal(a, b)
+    np.testing.assert_array_equal(loaded.feature_importances_,
+                                  model.feature_importances_)
+
+
+def test_buffers_and_file_objects():
+    model, X = fit_model(MODELS[5])
+    f = io.BytesIO()
+    save_model(model, f)
+    loaded = load_model(f.getvalue())
+    np.testing.assert_array_equal(loaded.predict_proba(X),
+                                  model.predict_proba(X))
+    np.testing.assert_array_equal(loaded.shap_values(X),
+                                  model.shap_values(X))
+
+
+def test_loaded_arrays_view_the_file(tmp_path):
+    model, X = fit_model(MODELS[3])
+    path = str(tmp_path / 'model.skg')
+    save_model(model, path)
+    # written to a temporary file, then renamed
+    assert [p.name for p in tmp_path.iterdir()] == ['model.skg']
+    loaded = load_model(path)
+    for estimator in loaded.estimators_:
+        assert isinstance(estimator.tree_.value.base, np.memmap)
+        assert not estimator.tree_.value.flags.writeable
+
+
+def test_warm_start_of_a_loaded_model(tmp_path):
+    X, y = model_data()
+    ref = HistGradientBoostingRegressor(max_iter=20, backend='cpu').fit(X, y)
+    model = HistGradientBoostingRegressor(max_iter=10, warm_start=True,
+                                          backend='cpu').fit(X, y)
+    path = str(tmp_path / 'model.skg')
+    save_model(model, path)
+    loaded = load_model(path, mmap_mode='c')
+    loaded.set_params(max_iter=20).fit(X, y)
+    np.testing.assert_array_equal(loaded.predict(X), ref.predict(X))
+
+
+@pytest.mark.parametrize('make_model', MODELS)
+def test_random_state_instance(make_model, tmp_path):
+    model, X = fit_model(make_model, random_state=np.random.RandomState(0))
+    path = str(tmp_path / 'model.skg')
+    save_model(model, path)
+    loaded = load_model(path)
+    assert isinstance(loaded.random_state, np.random.RandomState)
+    assert loaded.random_state is not model.random_state
+    for a, b in zip(loaded.random_state.get_state(),
+                    model.random_state.get_state()):
+        np.testing.assert_array_equal(a, b)
+    np.testing.assert_array_equal(loaded.predict(X), model.predict(X))
+    # the loaded state draws what the saved one does
+    np.testing.assert_array_equal(loaded.random_state.rand(5),
+                                  model.random_state.rand(5))
+
+
+def test_callable_scoring(tmp_path):
+    model, X = fit_model(
+        MODELS[5], n_iter_no_change=3,
+        scoring=lambda estimator, X, y: estimator.score(X, y))
+    path = str(tmp_path / 'model.skg')
+    save_model(model, path)
+    loaded = load_model(path)
+    # callables are not saved: the loaded model has None in their place
+    assert loaded.scoring is None
+    params = model.get_params()
+    params['scoring'] = None
+    assert loaded.get_params() == params
+    np.testing.assert_array_equal(loaded.validation_score_,
+                                  model.validation_score_)
+    np.testing.assert_array_equal(loaded.predict_proba(X),
+                                  model.predict_proba(X))
+
+
+def test_memory_usage_of_loaded_model(tmp_path):
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(500, 5))
+    est = HistGradientBoostingClassifier(max_iter=20, random_state=0)
+    est.fit(X, X[:, 0] > 0)
+    save_model(est, str(tmp_path / 'model.skg'))
+    loaded = load_model(str(tmp_path / 'model.skg'))
+    # the arrays all view one memory mapped file, each counts its own bytes
+    assert loaded.memory_usage() == est.memory_usage()
+
+
+def test_invalid_files(tmp_path):
+    model, _ = fit_model(MODELS[0])
+    f = io.BytesIO()
+    save_model(model, f)
+    content = f.getvalue()
+    with pytest.raises(ValueError, match="too short"):
+        load_model(content[:10])
+    with pytest.raises(ValueError, match="not a sklgpu model file"):
+        load_model(b'X' + content[1:])
+    with pytest.raises(ValueError, match="truncated"):
+        load_model(content[:-100])
+    newer = content[:8] + struct.pack('<I', 99) + content[12:]
+    with pytest.raises(ValueError, match="format 99 is newer"):
+        load_model(newer)
+    with pytest.raises(ValueError, match="mmap_mode"):
+        load_model(str(tmp_path / 'model.skg'), mmap_mode='w+')
+    with pytest.raises(TypeError, match="fitted"):
+        save_model(DecisionTreeRegressor(), io.BytesIO())
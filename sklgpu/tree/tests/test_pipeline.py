@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from sklgpu.tree import DecisionTreeRegressor
+from sklgpu.tree._pipeline import (HostPipeline, PredictStage, ReduceStage,
+                                   emulate_predict, emulate_reduce)
+from sklgpu.tree._reduction import reduce
+from sklgpu.tree._tree import TreeEnsemble
+
+
+def _ensemble(n_trees=3):
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(500, 4))
+    y = X[:, 0] + X[:, 1] * X[:, 2]
+    trees = [DecisionTreeRegressor(max_depth=5, max_features=2,
+                                   random_state=i, backend='cpu').fit(X, y)
+             for i in range(n_trees)]
+    return TreeEnsemble([tree.tree_ for tree in trees]), X
+
+
+@pytest.mark.parametrize('n_streams', [1, 2, 3])
+@pytest.mark.parametrize('chunk_rows', [64, 500, 1000])
+def test_emulate_predict(chunk_rows, n_streams):
+    ensemble, X = _ensemble()
+    np.testing.assert_array_equal(
+        emulate_predict(ensemble, X, chunk_rows, n_streams),
+        ensemble.predict(X))
+
+
+@pytest.mark.parametrize('op', ['sum', 'min', 'max'])
+@pytest.mark.parametrize('variant', ['interleaved', 'unrolled'])
+def test_emulate_reduce(op, variant):
+    x = np.random.RandomState(0).rand(10000).astype(np.float32)
+    # several chunks, the last one partial
+    result = emulate_reduce(x, op, variant, block_size=64, chunk=1024)
+    assert result == reduce(x, op, variant, block_size=64)
+
+
+def test_reduce_chunk_covers_whole_blocks():
+    with pytest.raises(ValueError, match="multiple"):
+        ReduceStage(np.ones(10), block_size=64, chunk=100)
+
+
+def test_timeline():
+    ensemble, X = _ensemble()
+    with HostPipeline(2) as pipeline:
+        emulate_predict(ensemble, X, chunk_rows=100, pipeline=pipeline)
+    kinds = {}
+    for kind, item, stream, start, end in pipeline.timeline:
+        assert stream == 'stream%d' % (item % 2)
+        assert start <= end
+        kinds.setdefault(item, []).append(kind)
+    assert kinds == {item: ['upload', 'kernel', 'download']
+                     for item in range(5)}
+    assert pipeline.overlap() >= 0
+
+
+class FailingStage(PredictStage):
+
+    def _kernel(self, rows, out):
+        raise RuntimeError("kernel failed")
+
+
+def test_errors_are_raised_once_in_flight_items_are_done():
+    ensemble, X = _ensemble()
+    out = np.zeros((X.shape[0], 1))
+    with HostPipeline(2) as pipeline:
+        with pytest.raises(RuntimeError, match="kernel failed"):
+            pipeline.run(5, FailingStage(ensemble, X, out, 100))
+        np.testing.assert_array_equal(out, 0)
+        # the streams work again after the run
+        np.testing.assert_array_equal(
+            emulate_predict(ensemble, X, 100, pipeline=pipeline),
+            ensemble.predict(X))
+
+
+def test_n_streams():
+    with pytest.raises(ValueError, match="between 1 and 8"):
+        HostPipeline(0)
+    with pytest.raises(ValueError, match="between 1 and 8"):
+        HostPipeline(9)
@@ -0,0 +1,43 @@
+import json
+
+import numpy as np
+import pytest
+
+from sklgpu.tree import DecisionTreeRegressor, profile
+from sklgpu.tree._backend import cuda_available
+from sklgpu.tree._binning import get_bin_cache
+from sklgpu.tree._profiling import is_active
+
+
+def _data():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(2000, 8))
+    return X, X[:, 0] + rng.normal(size=2000)
+
+
+def test_stage_timings():
+    X, y = _data()
+    # A cache hit on data binned by an earlier test skips the binning stage
+    get_bin_cache().clear()
+    calls = []
+    with profile(lambda *timing: calls.append(timing)) as prof:
+        assert is_active()
+        est = DecisionTreeRegressor(max_depth=6, backend='cpu').fit(X, y)
+        est.predict(X)
+    assert not is_active()
+    for stage in ('binning', 'histogram', 'split', 'partition', 'predict'):
+        assert prof.stages[stage]['calls'] > 0
+    assert sum(entry['calls'] for entry in prof.stages.values()) == len(
+        calls)
+    assert prof.wall_time >= prof.stages['histogram']['time']
+    json.dumps(prof.summary())
+
+
+@pytest.mark.skipif(not cuda_available(),
+                    reason="needs the CUDA extension and a device")
+def test_kernel_timings():
+    X, y = _data()
+    with profile() as prof:
+        DecisionTreeRegressor(max_depth=6, backend='cuda').fit(X, y)
+    assert prof.kernels
+    assert prof.device is not None
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from sklgpu.tree import _reduction
+from sklgpu.tree._backend import cuda_available
+
+VARIANTS = sorted(_reduction.VARIANTS)
+
+
+@pytest.mark.parametrize('variant', VARIANTS)
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_reductions_match_numpy(variant, dtype):
+    rng = np.random.RandomState(0)
+    x = rng.rand(100003).astype(dtype)
+    np.testing.assert_allclose(_reduction.reduce(x, 'sum', variant),
+                               x.sum(dtype=np.float64), rtol=1e-5)
+    assert _reduction.reduce(x, 'min', variant) == x.min()
+    assert _reduction.reduce(x, 'max', variant) == x.max()
+
+
+def test_argmax_ignores_nan():
+    x = np.array([np.nan, 1., 3., np.nan, 3.])
+    assert _reduction.argmax(x) == (3., 2)
+    assert _reduction.argmax(np.full(3, np.nan)) == (-np.inf, -1)
+    assert _reduction.argmax(np.empty(0)) == (-np.inf, -1)
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        _reduction.reduce(np.arange(4), 'sum')
+    with pytest.raises(ValueError):
+        _reduction.reduce(np.ones(4), 'mean')
+    with pytest.raises(ValueError):
+        _reduction.reduce(np.ones(4), block_size=48)
+
+
+@pytest.mark.skipif(not cuda_available(),
+                    reason="needs the CUDA extension and a device")
+@pytest.mark.parametrize('variant', VARIANTS)
+def test_kernels_match_host_order(variant):
+    # the host replays the pairing order of the kernels, bit for bit
+    rng = np.random.RandomState(0)
+    x = rng.rand(1000003).astype(np.float32)
+    assert (_reduction.reduce(x, 'sum', variant, backend='cuda')
+            == _reduction.reduce(x, 'sum', variant))
+    assert (_reduction.argmax(x, backend='cuda') == _reduction.argmax(x))
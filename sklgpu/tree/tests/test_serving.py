@@ -0,0 +1,108 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from sklgpu.ensemble import HistGradientBoostingClassifier
+from sklgpu.tree import DecisionTreeRegressor, Predictor
+
+
+def _model():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(500, 4))
+    y = np.digitize(X[:, 0] + X[:, 1], [-.5, .5])
+    return HistGradientBoostingClassifier(max_iter=5, backend='cpu').fit(
+        X, y), X
+
+
+async def _gather(predictor, X):
+    return await asyncio.gather(*[predictor.predict(x) for x in X])
+
+
+@pytest.mark.parametrize('method', ['predict', 'predict_proba',
+                                    'decision_function'])
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_results_match_batch_method(method, n_workers):
+    model, X = _model()
+
+    async def main():
+        async with Predictor(model, method, max_batch_size=64,
+                             n_workers=n_workers) as predictor:
+            results = await _gather(predictor, X)
+        return results, predictor
+
+    results, predictor = asyncio.run(main())
+    np.testing.assert_array_equal(np.array(results),
+                                  getattr(model, method)(X))
+    assert predictor.n_requests == X.shape[0]
+    # concurrent rows share batches
+    assert X.shape[0] / 64 <= predictor.n_batches < X.shape[0]
+
+
+def test_a_lone_row_waits_max_wait_at_most():
+    model, X = _model()
+
+    async def main():
+        async with Predictor(model, max_wait=0.01) as predictor:
+            first = await predictor.predict(X[0])
+            second = await predictor.predict(X[1:2])
+        return first, second, predictor
+
+    first, second, predictor = asyncio.run(main())
+    assert first == model.predict(X[:1])[0]
+    assert second == model.predict(X[1:2])[0]
+    assert predictor.n_batches == 2
+
+
+def test_single_row_batches():
+    model, X = _model()
+
+    async def main():
+        async with Predictor(model, max_batch_size=1) as predictor:
+            await _gather(predictor, X[:10])
+        return predictor
+
+    assert asyncio.run(main()).n_batches == 10
+
+
+class FailingModel(object):
+    n_features_ = 2
+
+    def predict(self, X):
+        raise RuntimeError("no prediction")
+
+
+def test_batch_errors_reach_every_row():
+    async def main():
+        async with Predictor(FailingModel()) as predictor:
+            return await asyncio.gather(
+                *[predictor.predict([0., 1.]) for _ in range(3)],
+                return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert len(errors) == 3
+    assert all(isinstance(e, RuntimeError) for e in errors)
+
+
+def test_invalid_rows_and_arguments():
+    model, X = _model()
+
+    async def main():
+        predictor = Predictor(model)
+        with pytest.raises(ValueError, match="expected 4 features"):
+            await predictor.predict(X[0, :3])
+        with pytest.raises(ValueError, match="expected one row"):
+            await predictor.predict(X[:2])
+        await predictor.aclose()
+        with pytest.raises(RuntimeError, match="closed"):
+            await predictor.predict(X[0])
+
+    asyncio.run(main())
+    with pytest.raises(ValueError, match="no method 'predict_proba'"):
+        Predictor(DecisionTreeRegressor(), 'predict_proba')
+    with pytest.raises(ValueError, match="max_batch_size"):
+        Predictor(model, max_batch_size=0)
+    with pytest.raises(ValueError, match="max_wait"):
+        Predictor(model, max_wait=-1)
+    with pytest.raises(ValueError, match="n_workers"):
+        Predictor(model, n_workers=0)
@@ -0,0 +1,167 @@
+import itertools
+from math import factorial
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from sklgpu.ensemble import (HistGradientBoostingRegressor,
+                             RandomForestRegressor)
+from sklgpu.tree import DecisionTreeRegressor
+from sklgpu.tree import _shap
+from sklgpu.tree._tree import TREE_LEAF, _in_categories
+from sklgpu.tree.tests._models import (CATEGORICAL_MODELS, MODELS, fit_model,
+                                       model_data)
+
+
+def _output(model, X):
+    """What the SHAP values of ``model`` add up to."""
+    if hasattr(model, 'decision_function'):
+        return model.decision_function(X)
+    if hasattr(model, 'predict_proba'):
+        return model.predict_proba(X)
+    return model.predict(X)
+
+
+@pytest.mark.parametrize('make_model', MODELS + CATEGORICAL_MODELS)
+def test_rows_sum_to_the_prediction(make_model):
+    model, X = fit_model(make_model)
+    # categories of no split, past the bitsets or not, go right
+    X[:3, 4] = [9, 40, 1000]
+    expected = _output(model, X)
+    values = model.shap_values(X)
+    assert values.shape[:2] == (X.shape[0], X.shape[1] + 1)
+    np.testing.assert_allclose(values.sum(axis=1), expected, rtol=1e-5,
+                               atol=1e-6)
+    # the expected value is the same for every row
+    np.testing.assert_allclose(values[:, -1], values[:1, -1].repeat(
+        X.shape[0], axis=0), rtol=1e-12)
+
+    background = X[:20]
+    values = model.shap_values(X, background=background)
+    np.testing.assert_allclose(values.sum(axis=1), expected, rtol=1e-5,
+                               atol=1e-6)
+    np.testing.assert_allclose(values[0, -1],
+                               _output(model, background).mean(axis=0),
+                               rtol=1e-5, atol=1e-6)
+
+
+def test_binary_classifier_explains_the_decision_function():
+    model, X = fit_model(MODELS[5], n_classes=2)
+    values = model.shap_values(X)
+    assert values.shape == (X.shape[0], X.shape[1] + 1)
+    np.testing.assert_allclose(values.sum(axis=1),
+                               model.decision_function(X), rtol=1e-5,
+                               atol=1e-6)
+
+
+def _shapley(value, n_features):
+    """Shapley values of the set function ``value`` of feature subsets."""
+    phi = np.zeros(n_features)
+    for i in range(n_features):
+        others = [j for j in range(n_features) if j != i]
+        for size in range(n_features):
+            weight = (factorial(size) * factorial(n_features - size - 1)
+                      / factorial(n_features))
+            for subset in itertools.combinations(others, size):
+                phi[i] += weight * (value(set(subset) | {i})
+                                    - value(set(subset)))
+    return phi
+
+
+def _expected_value(tree, x, subset, node=0):
+    """Prediction of ``tree`` knowing only the features of ``subset``, the
+    others averaged over the training cover of the nodes."""
+    left = tree.children_left[node]
+    if left == TREE_LEAF:
+        return float(tree.value[node, 0])
+    right = tree.children_right[node]
+    if tree.feature[node] in subset:
+        value = x[tree.feature[node]]
+        if tree.category_split is not None and tree.category_split[node] >= 0:
+            goes_left = _in_categories(np.array([value]), tree.categories,
+                                       tree.category_split[[node]])[0]
+        else:
+            goes_left = value <= tree.threshold[node]
+        child = left if goes_left else right
+        return _expected_value(tree, x, subset, child)
+    cover = tree.weighted_n_node_samples
+    return ((cover[left] * _expected_value(tree, x, subset, left)
+             + cover[right] * _expected_value(tree, x, subset, right))
+            / cover[node])
+
+
+@pytest.mark.parametrize('make_model',
+                         [MODELS[0], MODELS[4], CATEGORICAL_MODELS[1]])
+def test_path_dependent_values_are_the_shapley_values(make_model):
+    model, X = fit_model(make_model)
+    trees = ([model.tree_] if hasattr(model, 'tree_')
+             else [trees[0] for trees in model._predictors])
+    values = model.shap_values(X[:5])
+    for x, row in zip(X[:5], values):
+        def value(subset):
+            return sum(_expected_value(tree, x, subset) for tree in trees)
+        np.testing.assert_allclose(row[:-1], _shapley(value, X.shape[1]),
+                                   rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize('make_model',
+                         [MODELS[2], MODELS[4], CATEGORICAL_MODELS[1]])
+def test_interventional_values_are_the_shapley_values(make_model):
+    model, X = fit_model(make_model)
+    z = X[-1]
+    values = model.shap_values(X[:5], background=z[np.newaxis])
+    for x, row in zip(X[:5], values):
+        def value(subset):
+            hybrid = z.copy()
+            hybrid[list(subset)] = x[list(subset)]
+            return model.predict(hybrid[np.newaxis])[0]
+        np.testing.assert_allclose(row[:-1], _shapley(value, X.shape[1]),
+                                   rtol=1e-5, atol=1e-6)
+
+
+def test_sparse_rows_and_threads():
+    model, X = fit_model(MODELS[4])
+    X[np.abs(X) < .5] = 0
+    values = model.shap_values(X)
+    np.testing.assert_allclose(model.shap_values(sp.csr_matrix(X)), values,
+                               rtol=1e-12)
+    np.testing.assert_allclose(model.shap_values(X, n_jobs=2), values,
+                               rtol=1e-12)
+
+
+@pytest.mark.skipif(_shap._predictor is None,
+                    reason="needs the _predictor extension")
+@pytest.mark.parametrize('make_model', [MODELS[5], CATEGORICAL_MODELS[0]])
+def test_compiled_matches_numpy(make_model, monkeypatch):
+    model, X = fit_model(make_model)
+    X[:3, 4] = [9, 40, 1000]
+    background = X[:10]
+    compiled = [model.shap_values(X), model.shap_values(X, background)]
+    monkeypatch.setattr(_shap, '_predictor', None)
+    interpreted = [model.shap_values(X), model.shap_values(X, background)]
+    for a, b in zip(compiled, interpreted):
+        np.testing.assert_allclose(a, b, rtol=1e-10, atol=1e-12)
+
+
+def test_invalid_arguments():
+    model, X = fit_model(MODELS[4])
+    with pytest.raises(ValueError, match="2 features"):
+        model.shap_values(X, background=X[:, :2])
+    with pytest.raises(ValueError, match="0 sample"):
+        model.shap_values(X, background=X[:0])
+
+
+def test_feature_importances():
+    X, y = model_data(1000)
+    for model in (DecisionTreeRegressor(max_depth=5),
+                  RandomForestRegressor(n_estimators=5, max_depth=5,
+                                        random_state=0),
+                  HistGradientBoostingRegressor(max_iter=10)):
+        model.set_params(backend='cpu').fit(X, y)
+        importances = model.feature_importances_
+        assert importances.shape == (5,)
+        np.testing.assert_allclose(importances.sum(), 1)
+        # the noise feature matters least
+        assert np.argmin(importances) == 3
+        assert model.feature_split_counts_.sum() > 0
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from sklgpu.tree import BinMapper, DecisionTreeRegressor
+from sklgpu.tree._binning import SparseBinnedMatrix
+from sklgpu.tree.tests._models import MODELS, fit_model
+
+
+def _sparse_data(n_samples=600, n_features=8, density=0.2, seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.normal(size=(n_samples, n_features))
+    X[rng.rand(n_samples, n_features) > density] = 0
+    y = X[:, 0] - 2 * X[:, 1] + X[:, 2] * X[:, 3] + rng.normal(
+        scale=0.1, size=n_samples)
+    return X, y
+
+
+@pytest.mark.parametrize('format', ['csr', 'csc'])
+@pytest.mark.parametrize('make_model', MODELS)
+def test_sparse_fit_matches_dense(make_model, format):
+    X, y = _sparse_data()
+    # the zero bins of sparse histograms are the node totals minus the
+    # stored entries: the gains of features separating a node alike can
+    # differ by a rounding error and break their tie the other way, which
+    # the leaves of a few samples of bootstrapped forests run into
+    params = ({'min_samples_leaf': 10}
+              if hasattr(make_model(), 'n_estimators') else {})
+    dense, _ = fit_model(make_model, X, y, **params)
+    model, _ = fit_model(make_model, sp.csr_matrix(X).asformat(format), y,
+                         **params)
+    # the leaf values sum the same samples in another order
+    for X_test in (X, sp.csr_matrix(X)):
+        np.testing.assert_allclose(model.predict(X_test), dense.predict(X),
+                                   rtol=1e-12)
+        if hasattr(model, 'predict_proba'):
+            np.testing.assert_allclose(model.predict_proba(X_test),
+                                       dense.predict_proba(X), rtol=1e-12)
+
+
+def test_sparse_binning_matches_dense():
+    X, _ = _sparse_data()
+    expected = BinMapper(random_state=0).fit(X)
+    mapper = BinMapper(random_state=0).fit(sp.csc_matrix(X))
+    for a, b in zip(mapper.bin_thresholds_, expected.bin_thresholds_):
+        np.testing.assert_array_equal(a, b)
+    binned = mapper.transform(sp.csr_matrix(X))
+    assert isinstance(binned, SparseBinnedMatrix)
+    dense = expected.transform(X)
+    assert binned.dtype == dense.dtype
+    # the stored entries keep their bins, the implicit zeros have the bin
+    # of 0 of their feature
+    filled = np.tile(binned.zero_bins, (X.shape[0], 1))
+    stored = binned.csr.tocoo()
+    filled[stored.row, stored.col] = stored.data
+    np.testing.assert_array_equal(filled, dense)
+    np.testing.assert_array_equal(binned.csc.toarray(), binned.csr.toarray())
+
+
+def test_column_of_zeros():
+    X, y = _sparse_data()
+    X[:, 5] = 0
+    expected = DecisionTreeRegressor(backend='cpu').fit(X, y)
+    model = DecisionTreeRegressor(backend='cpu').fit(sp.csr_matrix(X), y)
+    np.testing.assert_allclose(model.predict(X), expected.predict(X),
+                               rtol=1e-12)
+    assert not np.any(model.tree_.feature[model.tree_.children_left >= 0]
+                      == 5)
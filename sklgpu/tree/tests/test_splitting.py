@@ -0,0 +1,19 @@
+import numpy as np
+
+from sklgpu.tree._splitting import (MIN_CATEGORY_SUPPORT, MSE,
+                                    find_best_split)
+
+
+def test_rare_categories_go_right():
+    # category 0 is the only one of enough samples; the rare categories
+    # 1 to 4 share its target and would join it in a longer prefix
+    n_rare = MIN_CATEGORY_SUPPORT - 1
+    codes = np.repeat(np.arange(9), [100] + [n_rare] * 8)
+    y = np.where(codes <= 4, 0., 10.)
+    criterion = MSE()
+    stats = criterion.sample_stats(y, np.ones_like(y))
+    hist = np.zeros((1, 9, criterion.n_stats))
+    np.add.at(hist[0], codes, stats)
+    split = find_best_split(hist, criterion, stats.sum(axis=0),
+                            categorical=np.array([True]))
+    np.testing.assert_array_equal(np.sort(split.left_bins), [0])
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from sklgpu.ensemble import HistGradientBoostingClassifier
+from sklgpu.tree import BinMapper, DecisionTreeRegressor
+from sklgpu.tree._streaming import check_large_array, spool_chunks
+from sklgpu.tree.tests._models import MODELS, fit_model, model_data
+
+
+def _memmap(X, path, dtype=np.float64):
+    X_map = np.memmap(str(path), dtype=dtype, mode='w+', shape=X.shape)
+    X_map[:] = X
+    X_map.flush()
+    return np.memmap(str(path), dtype=dtype, mode='r', shape=X.shape)
+
+
+@pytest.mark.parametrize('make_model', MODELS)
+def test_memmap_matches_in_memory(make_model, tmp_path):
+    X, y = model_data()
+    expected, _ = fit_model(make_model, X, y)
+    model, _ = fit_model(make_model, _memmap(X, tmp_path / 'X.dat'), y)
+    np.testing.assert_array_equal(model.predict(X), expected.predict(X))
+
+
+def test_float32_memmap_matches_float32_array(tmp_path):
+    X, y = model_data()
+    X = X.astype(np.float32)
+    X_map = _memmap(X, tmp_path / 'X.dat', np.float32)
+    expected = DecisionTreeRegressor(backend='cpu').fit(X, y).predict(X)
+    model = DecisionTreeRegressor(backend='cpu').fit(X_map, y)
+    np.testing.assert_array_equal(model.predict(X), expected)
+
+
+def test_chunk_iterator_matches_in_memory():
+    X, y = model_data(1000)
+    rng = np.random.RandomState(1)
+    sample_weight = rng.uniform(0.5, 2, size=y.shape[0])
+    y = (y > 0).astype(np.int64)
+    expected = HistGradientBoostingClassifier(
+        max_iter=10, backend='cpu').fit(X, y, sample_weight)
+    chunks = ((X[i:i + 300], y[i:i + 300], sample_weight[i:i + 300])
+              for i in range(0, X.shape[0], 300))
+    model = HistGradientBoostingClassifier(max_iter=10, backend='cpu').fit(
+        chunks, None)
+    np.testing.assert_array_equal(model.predict_proba(X),
+                                  expected.predict_proba(X))
+
+    # y given for the whole dataset
+    chunks = (X[i:i + 300] for i in range(0, X.shape[0], 300))
+    model = HistGradientBoostingClassifier(max_iter=10, backend='cpu').fit(
+        chunks, y, sample_weight)
+    np.testing.assert_array_equal(model.predict_proba(X),
+                                  expected.predict_proba(X))
+
+
+def test_binning_by_chunks(tmp_path):
+    X, _ = model_data(5000)
+    X_map = _memmap(X, tmp_path / 'X.dat')
+    expected = BinMapper(random_state=0).fit(X)
+    mapper = BinMapper(random_state=0)
+    mapper.chunk_rows = 333
+    mapper.fit(X_map)
+    for a, b in zip(mapper.bin_thresholds_, expected.bin_thresholds_):
+        np.testing.assert_array_equal(a, b)
+    np.testing.assert_array_equal(mapper.transform(X_map),
+                                  expected.transform(X))
+
+
+def test_spool_chunks():
+    X, y = model_data(10)
+    X_map, y_spooled, sample_weight = spool_chunks(
+        iter([(X[:4], y[:4]), (X[4:], y[4:])]))
+    assert isinstance(X_map, np.memmap)
+    np.testing.assert_array_equal(X_map, X)
+    np.testing.assert_array_equal(y_spooled, y)
+    assert sample_weight is None
+
+    with pytest.raises(ValueError, match="did not yield"):
+        spool_chunks(iter([]), y)
+    with pytest.raises(ValueError, match="y is required"):
+        spool_chunks(iter([X]))
+    with pytest.raises(ValueError, match="both as a parameter"):
+        spool_chunks(iter([(X, y)]), y)
+    with pytest.raises(ValueError, match="chunk has 2 features"):
+        spool_chunks(iter([X, X[:, :2]]), y)
+    with pytest.raises(ValueError, match="either all the chunks"):
+        spool_chunks(iter([(X[:4], y[:4]), X[4:]]))
+
+
+def test_check_large_array(tmp_path):
+    X, _ = model_data(10)
+    X_map = _memmap(X, tmp_path / 'X.dat')
+    # memory mapped arrays are not read as a whole
+    assert check_large_array(X_map) is X_map
+    with pytest.raises(ValueError, match="2D"):
+        check_large_array(X_map[:, 0])
@@ -0,0 +1,158 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from sklearn import tree as sklearn_tree
+
+from sklgpu.ensemble import RandomForestClassifier
+from sklgpu.tree import DecisionTreeClassifier, DecisionTreeRegressor
+from sklgpu.tree._presort import PresortedIndex, split_threshold
+from sklgpu.tree._tree import Tree, TreeEnsemble, _feature_dtype, nbytes
+
+
+def _integer_data(n_samples=500, n_features=4, seed=0):
+    # fewer distinct values than bins: the bin edges are all the midpoints
+    # and the histogram splits are the exact ones
+    rng = np.random.RandomState(seed)
+    X = rng.randint(0, 30, size=(n_samples, n_features)).astype(np.float64)
+    y = X[:, 0] - 2 * X[:, 1] + rng.normal(size=n_samples)
+    return X, y
+
+
+@pytest.mark.parametrize('splitter', ['hist', 'exact'])
+def test_regressor_matches_sklearn(splitter):
+    X, y = _integer_data()
+    est = DecisionTreeRegressor(max_depth=4, splitter=splitter,
+                                backend='cpu').fit(X, y)
+    ref = sklearn_tree.DecisionTreeRegressor(max_depth=4).fit(X, y)
+    np.testing.assert_allclose(est.predict(X), ref.predict(X), rtol=1e-6)
+
+
+def test_classifier_matches_sklearn():
+    X, y = _integer_data()
+    y = np.digitize(y, [-20, 0])
+    est = DecisionTreeClassifier(max_depth=4, backend='cpu').fit(X, y)
+    ref = sklearn_tree.DecisionTreeClassifier(max_depth=4).fit(X, y)
+    np.testing.assert_array_equal(est.predict(X), ref.predict(X))
+    np.testing.assert_allclose(est.predict_proba(X), ref.predict_proba(X),
+                               rtol=1e-6)
+
+
+def test_exact_splits_match_sklearn():
+    # more distinct values than bins, only the exact search finds the
+    # splits of scikit-learn
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(2000, 4))
+    y = X[:, 0] - 2 * X[:, 1] + rng.normal(size=2000)
+    est = DecisionTreeRegressor(max_depth=6, splitter='exact').fit(X, y)
+    ref = sklearn_tree.DecisionTreeRegressor(max_depth=6).fit(X, y)
+    np.testing.assert_allclose(est.predict(X), ref.predict(X), rtol=1e-6)
+    hist = DecisionTreeRegressor(max_depth=6, splitter='hist').fit(X, y)
+    assert np.any(hist.predict(X) != est.predict(X))
+
+
+def test_exact_splitter_arguments():
+    X, y = _integer_data()
+    with pytest.raises(ValueError, match="splitter must be"):
+        DecisionTreeRegressor(splitter='best').fit(X, y)
+    with pytest.raises(ValueError, match="dense X"):
+        DecisionTreeRegressor(splitter='exact').fit(sp.csr_matrix(X), y)
+
+
+def test_presorted_index():
+    rng = np.random.RandomState(0)
+    X = rng.randint(0, 5, size=(50, 3)).astype(np.float64)
+    index = PresortedIndex(X)
+    assert index.shape == X.shape
+    for f in range(3):
+        np.testing.assert_array_equal(index.order[f],
+                                      np.argsort(X[:, f], kind='stable'))
+        np.testing.assert_array_equal(index.values[f], np.sort(X[:, f]))
+    # the samples of a node keep their sorted order
+    rows = rng.choice(50, 20, replace=False)
+    order, values = index.restrict(rows)
+    for f in range(3):
+        assert set(order[f]) == set(rows)
+        np.testing.assert_array_equal(values[f], X[order[f], f])
+        assert np.all(np.diff(values[f]) >= 0)
+
+
+def test_split_threshold_separates_float32_values():
+    low = 1e4
+    high = np.nextafter(np.float32(low), np.float32(np.inf)).item()
+    threshold = split_threshold(low, high)
+    assert np.float32(low) <= np.float32(threshold) < np.float32(high)
+    threshold = split_threshold(1., 2.)
+    assert threshold == 1.5
+
+
+def test_fully_grown_tree_fits_training_set():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(300, 5))
+    y = rng.randint(0, 3, size=300)
+    est = DecisionTreeClassifier(backend='cpu').fit(X, y)
+    assert est.score(X, y) == 1.
+
+
+def test_node_arrays_are_compact():
+    X, y = _integer_data()
+    y = np.digitize(y, [-20, 0])
+    tree = DecisionTreeClassifier(max_depth=6, backend='cpu').fit(X, y)
+    usage = tree.memory_usage()
+    n_nodes = tree.tree_.node_count
+    assert usage['n_nodes'] == n_nodes
+    # int32 children, uint16 feature, float32 threshold, impurity, weight
+    # and values, int32 sample count
+    assert usage['nodes'] == n_nodes * (26 + 4 * 3)
+    assert usage['total'] == usage['nodes'] + usage['binning']
+    assert usage['device'] == 0
+
+    assert _feature_dtype(65535) == np.uint16
+    assert _feature_dtype(65536) == np.int32
+    arrays = [getattr(tree.tree_, name) for name in (
+        'children_left', 'children_right', 'feature', 'threshold', 'value',
+        'impurity', 'n_node_samples', 'weighted_n_node_samples',
+        'max_depth')]
+    arrays[2] = arrays[2].astype(np.int32)
+    wide = Tree(*arrays)
+    ensemble = TreeEnsemble([tree.tree_, wide])
+    assert ensemble.feature.dtype == np.int32
+    np.testing.assert_array_equal(ensemble.predict(X),
+                                  2 * tree.predict_proba(X))
+
+
+def test_forest_nodes_are_counted_once():
+    X, y = _integer_data()
+    y = np.digitize(y, [-20, 0])
+    forest = RandomForestClassifier(n_estimators=5, max_depth=5,
+                                    random_state=0, backend='cpu')
+    forest.fit(X, y)
+    before = forest.memory_usage()
+    # predicting concatenates the trees, which then view the ensemble
+    forest.predict(X)
+    assert forest.memory_usage()['nodes'] == before['nodes']
+    assert before['n_nodes'] == sum(est.tree_.node_count
+                                    for est in forest.estimators_)
+
+
+def test_nbytes_counts_overlaps_once():
+    a = np.zeros(100)
+    assert nbytes([a, a[10:20], a[50:]]) == a.nbytes
+    assert nbytes([a[:10], a[20:30]]) == 160
+    assert nbytes([a[::2]]) == 99 * 8
+    assert nbytes([a[:0], np.zeros(3, dtype=np.float32)]) == 12
+
+
+def test_float32_input_split_as_fitted():
+    # consecutive float32 values, their float64 midpoints round to either
+    rng = np.random.RandomState(0)
+    codes = rng.randint(0, 100, size=(1000, 2))
+    X = (1e4 + codes * np.spacing(np.float32(1e4))).astype(np.float32)
+    y = rng.normal(size=(100, 100))[codes[:, 0], codes[:, 1]]
+    tree = DecisionTreeRegressor(backend='cpu').fit(X, y)
+    assert tree.tree_.threshold.dtype == np.float32
+    fitted = tree.predict(X)
+    np.testing.assert_array_equal(tree.predict(X.astype(np.float64)),
+                                  fitted)
+    # every distinct row has its own leaf, of a float32 value
+    assert tree.tree_.n_leaves == np.unique(codes, axis=0).shape[0]
+    np.testing.assert_allclose(fitted, y, rtol=1e-6)
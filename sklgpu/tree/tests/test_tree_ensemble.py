@@ -0,0 +1,126 @@
+import pickle
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from sklgpu.tree import DecisionTreeClassifier, DecisionTreeRegressor
+from sklgpu.tree import _tree
+from sklgpu.tree._tree import TREE_LEAF, TreeEnsemble
+
+requires_predictor = pytest.mark.skipif(
+    _tree._predictor is None, reason="needs the _predictor extension")
+
+
+def _trees(n_trees=4, seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.normal(size=(400, 6))
+    X[rng.rand(*X.shape) < 0.5] = 0
+    y = X[:, 0] + X[:, 1] ** 2 + rng.normal(scale=0.1, size=400)
+    trees = [DecisionTreeRegressor(max_depth=6, max_features=3,
+                                   random_state=i, backend='cpu').fit(X, y)
+             for i in range(n_trees)]
+    return X, trees
+
+
+def test_tree_arrays():
+    X, (est,) = _trees(1)
+    tree = est.tree_
+    assert tree.children_left.dtype == np.int32
+    assert tree.feature.dtype == np.uint16
+    assert tree.threshold.dtype == np.float32
+    assert tree.value.dtype == np.float32
+    leaves = tree.children_left == TREE_LEAF
+    assert tree.n_leaves == np.count_nonzero(leaves)
+    # preorder: the left child of a node follows it
+    split = np.flatnonzero(~leaves)
+    np.testing.assert_array_equal(tree.children_left[split], split + 1)
+    assert np.all(tree.children_right[split] > split + 1)
+    np.testing.assert_array_equal(np.unique(tree.apply(X)),
+                                  np.flatnonzero(leaves))
+
+
+def test_predict_sums_the_trees():
+    X, estimators = _trees()
+    expected = sum(est.predict(X) for est in estimators)
+    leaves = np.column_stack([est.tree_.apply(X) for est in estimators])
+    ensemble = TreeEnsemble([est.tree_ for est in estimators])
+    np.testing.assert_allclose(ensemble.predict(X)[:, 0], expected,
+                               rtol=1e-12)
+    np.testing.assert_array_equal(ensemble.apply(X), leaves)
+    # the trees now view the concatenated arrays
+    assert all(np.shares_memory(est.tree_.value, ensemble.value)
+               for est in estimators)
+    np.testing.assert_allclose(sum(est.predict(X) for est in estimators),
+                               expected, rtol=1e-12)
+
+
+def test_output_offsets():
+    X, estimators = _trees(3)
+    ensemble = TreeEnsemble([est.tree_ for est in estimators],
+                            output_offsets=[0, 2, 0], n_outputs=3)
+    out = ensemble.predict(X)
+    np.testing.assert_allclose(
+        out[:, 0], estimators[0].predict(X) + estimators[2].predict(X),
+        rtol=1e-12)
+    np.testing.assert_array_equal(out[:, 1], 0)
+    np.testing.assert_allclose(out[:, 2], estimators[1].predict(X),
+                               rtol=1e-12)
+
+
+def test_ensemble_checks_the_outputs():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(50, 2))
+    classifier = DecisionTreeClassifier(max_depth=2, backend='cpu').fit(
+        X, rng.randint(0, 3, size=50))
+    regressor = DecisionTreeRegressor(max_depth=2, backend='cpu').fit(
+        X, X[:, 0])
+    with pytest.raises(ValueError, match="same number of outputs"):
+        TreeEnsemble([classifier.tree_, regressor.tree_])
+    with pytest.raises(ValueError, match="at least one tree"):
+        TreeEnsemble([])
+
+
+@pytest.mark.parametrize('chunk_size, n_threads', [(7, 1), (50, 3)])
+def test_chunks_and_threads(chunk_size, n_threads):
+    X, estimators = _trees()
+    ensemble = TreeEnsemble([est.tree_ for est in estimators])
+    np.testing.assert_array_equal(
+        ensemble.predict(X, chunk_size=chunk_size, n_threads=n_threads),
+        ensemble.predict(X))
+    np.testing.assert_array_equal(
+        ensemble.apply(X, chunk_size=chunk_size, n_threads=n_threads),
+        ensemble.apply(X))
+
+
+def test_sparse_rows():
+    X, estimators = _trees()
+    ensemble = TreeEnsemble([est.tree_ for est in estimators])
+    X_csr = sp.csr_matrix(X)
+    np.testing.assert_array_equal(ensemble.predict(X_csr),
+                                  ensemble.predict(X))
+    np.testing.assert_array_equal(ensemble.apply(X_csr), ensemble.apply(X))
+    np.testing.assert_array_equal(estimators[0].tree_.apply(X_csr),
+                                  estimators[0].tree_.apply(X))
+
+
+def test_pickle():
+    X, estimators = _trees()
+    ensemble = TreeEnsemble([est.tree_ for est in estimators])
+    loaded = pickle.loads(pickle.dumps(ensemble))
+    np.testing.assert_array_equal(loaded.predict(X), ensemble.predict(X))
+
+
+@requires_predictor
+def test_compiled_matches_numpy(monkeypatch):
+    X, estimators = _trees()
+    ensemble = TreeEnsemble([est.tree_ for est in estimators],
+                            output_offsets=[0, 1, 0, 1], n_outputs=2)
+    X_csr = sp.csr_matrix(X)
+    compiled = [ensemble.predict(X), ensemble.apply(X),
+                ensemble.predict(X_csr), estimators[0].tree_.apply(X)]
+    monkeypatch.setattr(_tree, '_predictor', None)
+    interpreted = [ensemble.predict(X), ensemble.apply(X),
+                   ensemble.predict(X_csr), estimators[0].tree_.apply(X)]
+    for a, b in zip(compiled, interpreted):
+        np.testing.assert_array_equal(a, b)
@@ -0,0 +1,551 @@
+"""Histogram based decision tree estimators.
+
+Features are quantile binned once per fit (at most ``max_bins`` bins per
+feature) and split candidates are the bin boundaries, which makes the cost
+of a node linear in its number of samples instead of requiring sorted
+feature values. ``splitter='exact'`` instead sorts the feature values once
+per fit and keeps every node's samples sorted, for exact splits.
+
+Categorical features are binned one bin per category and split into two
+subsets of categories, see :mod:`sklgpu.tree._splitting`.
+
+The gains and counts of the splits on every feature are summed while the
+tree grows, ``feature_importances_`` does not walk the tree. SHAP values
+are computed over the root to leaf paths of the fitted tree, see
+:mod:`sklgpu.tree._shap`.
+"""
+import numbers
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.base import BaseEstimator, ClassifierMixin, RegressorMixin
+from sklearn.utils import check_array, check_random_state
+from sklearn.utils.validation import check_is_fitted
+
+from ._binning import MAX_BINS, BinMapper, SparseBinnedMatrix
+from ._grower import TreeGrower
+from ._histogram import get_histogram_builder, resolve_backend
+from ._presort import ExactTreeGrower, PresortedIndex
+from ._shap import TreePaths, shap_values
+from ._splitting import CRITERIA_CLF, CRITERIA_REG
+from ._streaming import check_training_data
+from ._tree import Tree, _memory_usage
+
+__all__ = ["DecisionTreeClassifier", "DecisionTreeRegressor"]
+
+
+def _resolve_max_features(max_features, n_features):
+    if max_features is None:
+        return n_features
+    if isinstance(max_features, str):
+        if max_features in ('auto', 'sqrt'):
+            return max(1, int(np.sqrt(n_features)))
+        if max_features == 'log2':
+            return max(1, int(np.log2(n_features)))
+        raise ValueError("Invalid value for max_features: %r" % max_features)
+    if isinstance(max_features, numbers.Integral):
+        if not 0 < max_features <= n_features:
+            raise ValueError("max_features must be in (0, n_features]")
+        return int(max_features)
+    if not 0. < max_features <= 1.:
+        raise ValueError("max_features must be in (0, 1]")
+    return max(1, int(max_features * n_features))
+
+
+class BaseHistDecisionTree(BaseEstimator):
+    """Base class for the histogram decision trees.
+
+    Warning: This class should not be used directly. Use derived classes
+    instead.
+    """
+
+    def __init__(self, criterion, max_depth, min_samples_split,
+                 min_samples_leaf, max_features, max_leaf_nodes,
+                 min_impurity_decrease, max_bins, random_state, backend,
+                 splitter, categorical_features):
+        self.criterion = criterion
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.min_samples_leaf = min_samples_leaf
+        self.max_features = max_features
+        self.max_leaf_nodes = max_leaf_nodes
+        self.min_impurity_decrease = min_impurity_decrease
+        self.max_bins = max_bins
+        self.random_state = random_state
+        self.backend = backend
+        self.splitter = splitter
+        self.categorical_features = categorical_features
+
+    def _check_params(self):
+        if self.max_depth is not None and self.max_depth < 1:
+            raise ValueError("max_depth must be greater than zero.")
+        if self.min_samples_split < 2:
+            raise ValueError("min_samples_split must be at least 2.")
+        if self.min_samples_leaf < 1:
+            raise ValueError("min_samples_leaf must be at least 1.")
+        if self.max_leaf_nodes is not None and self.max_leaf_nodes < 2:
+            raise ValueError("max_leaf_nodes must be at least 2.")
+        if self.min_impurity_decrease < 0.:
+            raise ValueError("min_impurity_decrease must be non negative.")
+        if self.splitter not in ('hist', 'exact'):
+            raise ValueError("splitter must be 'hist' or 'exact', got %r."
+                             % self.splitter)
+        if self.splitter == 'exact' and self.categorical_features is not None:
+            raise ValueError("categorical_features needs splitter='hist'.")
+
+    def fit(self, X, y, sample_weight=None):
+        """Build a decision tree from the training set (X, y).
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+            The training input samples.
+            Also an ``np.memmap``, read by chunks of rows, or an iterator
+            of row chunks, arrays or ``(X, y[, sample_weight])`` tuples,
+            for training sets that do not fit in memory.
+            CSR and CSC matrices are binned without being densified.
+
+        y : array-like, shape (n_samples,)
+            The target values.
+
+        sample_weight : array-like, shape (n_samples,) or None
+            Sample weights, samples with zero weight are ignored.
+
+        Returns
+        -------
+        self : object
+        """
+        self._check_params()
+        X, y, sample_weight = check_training_data(X, y, sample_weight)
+        y = self._encode_y(np.ravel(y))
+        if X.shape[0] != y.shape[0]:
+            raise ValueError("Number of labels=%d does not match number of "
+                             "samples=%d" % (y.shape[0], X.shape[0]))
+        sample_weight = self._check_sample_weight(sample_weight, X.shape[0])
+
+        if self.splitter == 'exact':
+            return self._fit_presorted(PresortedIndex(X), y, sample_weight)
+        backend = resolve_backend(self.backend, sp.issparse(X))
+        bin_mapper = BinMapper(
+            self.max_bins,
+            order=get_histogram_builder(backend).preferred_order,
+            cache=True, random_state=self.random_state,
+            categorical_features=self.categorical_features)
+        X_binned = bin_mapper.fit_transform(X)
+        return self._fit_binned(X_binned, bin_mapper, y, sample_weight,
+                                backend)
+
+    def _check_sample_weight(self, sample_weight, n_samples):
+        if sample_weight is None:
+            return np.ones(n_samples, dtype=np.float64)
+        sample_weight = np.ascontiguousarray(sample_weight, dtype=np.float64)
+        if sample_weight.shape != (n_samples,):
+            raise ValueError("sample_weight has shape %r, expected (%d,)"
+                             % (sample_weight.shape, n_samples))
+        if np.any(sample_weight < 0):
+            raise ValueError("sample_weight cannot contain negative values")
+        return sample_weight
+
+    def _fit_binned(self, X_binned, bin_mapper, y, sample_weight,
+                    backend=None):
+        """Fit on already binned data and encoded targets.
+
+        Ensembles bin the training set once and call this for every tree.
+        ``backend`` is the already resolved backend, if any.
+        """
+        self.n_features_ = X_binned.shape[1]
+        self.backend_ = (resolve_backend(
+            self.backend, isinstance(X_binned, SparseBinnedMatrix))
+            if backend is None else backend)
+        self._bin_thresholds = bin_mapper.bin_thresholds_
+        random_state = check_random_state(self.random_state)
+
+        criterion = self._make_criterion()
+        builder = get_histogram_builder(self.backend_)(X_binned,
+                                                       bin_mapper.n_bins_)
+        builder.set_stats(criterion.sample_stats(y, sample_weight))
+
+        grower = TreeGrower(
+            X_binned, bin_mapper.bin_thresholds_, builder, criterion,
+            categories=bin_mapper.categories_,
+            **self._grower_params(random_state))
+        root = grower.grow(np.flatnonzero(sample_weight > 0))
+        self.tree_ = Tree.from_root(root)
+        self.node_count_ = self.tree_.node_count
+        self._set_importances(grower)
+        return self
+
+    def _fit_presorted(self, presorted, y, sample_weight):
+        """Fit with exact splits on a ``PresortedIndex``, which forests
+        share between their trees."""
+        self.n_features_ = presorted.shape[1]
+        self.backend_ = 'cpu'
+        self._bin_thresholds = []
+        random_state = check_random_state(self.random_state)
+        criterion = self._make_criterion()
+        grower = ExactTreeGrower(
+            presorted, criterion.sample_stats(y, sample_weight), criterion,
+            **self._grower_params(random_state))
+        root = grower.grow(np.flatnonzero(sample_weight > 0))
+        self.tree_ = Tree.from_root(root)
+        self.node_count_ = self.tree_.node_count
+        self._set_importances(grower)
+        return self
+
+    def _set_importances(self, grower):
+        # the features split on only, a forest keeps one per tree
+        features = np.flatnonzero(grower.split_counts)
+        self._split_importances = (features, grower.split_gains[features],
+                                   grower.split_counts[features])
+
+    def _split_totals(self):
+        check_is_fitted(self, 'tree_')
+        features, gains, counts = self._split_importances
+        total_gains = np.zeros(self.n_features_)
+        total_gains[features] = gains
+        total_counts = np.zeros(self.n_features_, dtype=np.intp)
+        total_counts[features] = counts
+        return total_gains, total_counts
+
+    @property
+    def feature_importances_(self):
+        """Impurity decrease of the splits on every feature, normalized to
+        sum to 1 (all zero for a tree without split).
+
+        Returns
+        -------
+        feature_importances_ : array, shape (n_features,)
+        """
+        gains = self._split_totals()[0]
+        total = gains.sum()
+        return gains / total if total > 0 else gains
+
+    @property
+    def feature_split_counts_(self):
+        """Number of splits on every feature, shape (n_features,)."""
+        return self._split_totals()[1]
+
+    def _grower_params(self, random_state):
+        return dict(max_depth=self.max_depth,
+                    min_samples_split=self.min_samples_split,
+                    min_samples_leaf=self.min_samples_leaf,
+                    min_impurity_decrease=self.min_impurity_decrease,
+                    max_features=_resolve_max_features(self.max_features,
+                                                       self.n_features_),
+                    max_leaf_nodes=self.max_leaf_nodes,
+                    random_state=random_state)
+
+    def _validate_X_predict(self, X):
+        check_is_fitted(self, 'tree_')
+        X = check_array(X, accept_sparse='csr', dtype=np.float64)
+        if X.shape[1] != self.n_features_:
+            raise ValueError("Number of features of the model must match the "
+                             "input. Model n_features is %d and input "
+                             "n_features is %d"
+                             % (self.n_features_, X.shape[1]))
+        return X
+
+    def _predict_value(self, X, check_input=True):
+        if check_input:
+            X = self._validate_X_predict(X)
+        return self.tree_.predict(X)
+
+    def _shap_values(self, X, background, n_jobs):
+        X = self._validate_X_predict(X)
+        if background is not None:
+            background = self._validate_X_predict(background)
+        return shap_values(TreePaths.from_tree(self.tree_), X,
+                           self.n_features_, background, n_jobs=n_jobs,
+                           backend=self.backend_)
+
+    def memory_usage(self):
+        """Bytes held by the fitted tree.
+
+        Returns
+        -------
+        usage : dict
+            ``'nodes'``: the node arrays, ``'binning'``: the bin thresholds
+            kept for prediction, ``'device'``: GPU copies (0 for a single
+            tree), ``'total'``: the host bytes, and ``'n_nodes'``.
+        """
+        check_is_fitted(self, 'tree_')
+        return _memory_usage([self.tree_],
+                             bin_thresholds=self._bin_thresholds)
+
+
+class DecisionTreeClassifier(ClassifierMixin, BaseHistDecisionTree):
+    """A histogram based decision tree classifier.
+
+    Parameters
+    ----------
+    criterion : string, optional (default="gini")
+        The function to measure the quality of a split, "gini" or
+        "entropy".
+
+    max_depth : int or None, optional (default=None)
+        The maximum depth of the tree.
+
+    min_samples_split : int, optional (default=2)
+        The minimum number of samples required to split an internal node.
+
+    min_samples_leaf : int, optional (default=1)
+        The minimum number of samples required to be at a leaf node.
+
+    max_features : int, float, string or None, optional (default=None)
+        The number of features to consider at each split: an int, a
+        fraction of ``n_features``, "sqrt", "log2" or None for all.
+
+    max_leaf_nodes : int or None, optional (default=None)
+        Grow the tree best first with at most ``max_leaf_nodes`` leaves.
+
+    min_impurity_decrease : float, optional (default=0.)
+        A node is split only if the weighted impurity decrease is at least
+        this value.
+
+    max_bins : int, optional (default=256)
+        Maximum number of histogram bins per feature, up to 65536 (the
+        binned data is uint16 beyond 256).
+
+    random_state : int, RandomState instance or None, optional
+        Controls the binning subsample and the feature sampling.
+
+    backend : string, optional (default="auto")
+        "cpu", "cuda", or "auto" to use the GPU when one is available.
+        "cuda" falls back to "cpu" with a warning when no device is
+        usable.
+
+    splitter : string, optional (default="hist")
+        "hist" splits at bin boundaries; "exact" between any two
+        consecutive feature values, from the feature columns sorted once
+        per fit. "exact" runs on the CPU, ignores ``max_bins`` and
+        ``backend`` and needs dense ``X``; it suits small and medium
+        training sets.
+
+    categorical_features : array-like of int or bool, or None, optional \
+            (default=None)
+        Indices or boolean mask of the categorical features, which hold
+        integer codes in [0, 65535], at most ``max_bins`` different ones
+        per feature. Their splits send a subset of the categories left,
+        without one-hot encoding; codes unseen during the fit, or of
+        fewer than 10 samples in the node, go right. Missing codes are
+        not supported: like every feature they must not be NaN, in fit
+        and predict.
+        Only with ``splitter="hist"``.
+
+    Attributes
+    ----------
+    classes_ : array of shape (n_classes,)
+        The classes labels.
+
+    n_classes_ : int
+        The number of classes.
+
+    n_features_ : int
+        The number of features when ``fit`` is performed.
+
+    backend_ : string
+        The backend the tree was built with.
+
+    tree_ : Tree
+        The fitted tree as flat node arrays.
+
+    feature_importances_ : array of shape (n_features,)
+        The normalized total impurity decrease of the splits on every
+        feature, summed during the fit.
+
+    feature_split_counts_ : array of shape (n_features,)
+        The number of splits on every feature.
+    """
+
+    def __init__(self, criterion="gini", max_depth=None, min_samples_split=2,
+                 min_samples_leaf=1, max_features=None, max_leaf_nodes=None,
+                 min_impurity_decrease=0., max_bins=MAX_BINS,
+                 random_state=None, backend="auto", splitter="hist",
+                 categorical_features=None):
+        super(DecisionTreeClassifier, self).__init__(
+            criterion=criterion, max_depth=max_depth,
+            min_samples_split=min_samples_split,
+            min_samples_leaf=min_samples_leaf, max_features=max_features,
+            max_leaf_nodes=max_leaf_nodes,
+            min_impurity_decrease=min_impurity_decrease, max_bins=max_bins,
+            random_state=random_state, backend=backend, splitter=splitter,
+            categorical_features=categorical_features)
+
+    def _encode_y(self, y):
+        self.classes_, y = np.unique(y, return_inverse=True)
+        self.n_classes_ = len(self.classes_)
+        return y
+
+    def _make_criterion(self):
+        if self.criterion not in CRITERIA_CLF:
+            raise ValueError("Unknown criterion %r" % self.criterion)
+        return CRITERIA_CLF[self.criterion](self.n_classes_)
+
+    def predict_proba(self, X):
+        """Class probabilities of the input samples X.
+
+        Returns
+        -------
+        p : array of shape (n_samples, n_classes)
+            The class probabilities, in the order of ``classes_``.
+        """
+        return self._predict_value(X)
+
+    def predict_log_proba(self, X):
+        with np.errstate(divide='ignore'):
+            return np.log(self.predict_proba(X))
+
+    def shap_values(self, X, background=None, n_jobs=None):
+        """SHAP values of the class probabilities of X.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+
+        background : array-like, shape (n_background, n_features) or None
+            Interventional SHAP values over these rows; None for the tree
+            path dependent values over the training samples of the nodes.
+
+        n_jobs : int or None, optional (default=None)
+            Threads over chunks of rows, all the cores with -1.
+
+        Returns
+        -------
+        values : array, shape (n_samples, n_features + 1, n_classes)
+            Contribution of every feature to the probability of every
+            class, then the expected probabilities: a row sums to
+            ``predict_proba``.
+        """
+        return self._shap_values(X, background, n_jobs)
+
+    def predict(self, X):
+        """Predict class for X."""
+        proba = self.predict_proba(X)
+        return self.classes_.take(np.argmax(proba, axis=1), axis=0)
+
+
+class DecisionTreeRegressor(RegressorMixin, BaseHistDecisionTree):
+    """A histogram based decision tree regressor.
+
+    Parameters
+    ----------
+    criterion : string, optional (default="mse")
+        The function to measure the quality of a split, only "mse" is
+        supported.
+
+    max_depth : int or None, optional (default=None)
+        The maximum depth of the tree.
+
+    min_samples_split : int, optional (default=2)
+        The minimum number of samples required to split an internal node.
+
+    min_samples_leaf : int, optional (default=1)
+        The minimum number of samples required to be at a leaf node.
+
+    max_features : int, float, string or None, optional (default=None)
+        The number of features to consider at each split: an int, a
+        fraction of ``n_features``, "sqrt", "log2" or None for all.
+
+    max_leaf_nodes : int or None, optional (default=None)
+        Grow the tree best first with at most ``max_leaf_nodes`` leaves.
+
+    min_impurity_decrease : float, optional (default=0.)
+        A node is split only if the weighted impurity decrease is at least
+        this value.
+
+    max_bins : int, optional (default=256)
+        Maximum number of histogram bins per feature, up to 65536 (the
+        binned data is uint16 beyond 256).
+
+    random_state : int, RandomState instance or None, optional
+        Controls the binning subsample and the feature sampling.
+
+    backend : string, optional (default="auto")
+        "cpu", "cuda", or "auto" to use the GPU when one is available.
+        "cuda" falls back to "cpu" with a warning when no device is
+        usable.
+
+    splitter : string, optional (default="hist")
+        "hist" splits at bin boundaries; "exact" between any two
+        consecutive feature values, from the feature columns sorted once
+        per fit. "exact" runs on the CPU, ignores ``max_bins`` and
+        ``backend`` and needs dense ``X``; it suits small and medium
+        training sets.
+
+    categorical_features : array-like of int or bool, or None, optional \
+            (default=None)
+        Indices or boolean mask of the categorical features, which hold
+        integer codes in [0, 65535], at most ``max_bins`` different ones
+        per feature. Their splits send a subset of the categories left,
+        without one-hot encoding; codes unseen during the fit, or of
+        fewer than 10 samples in the node, go right. Missing codes are
+        not supported: like every feature they must not be NaN, in fit
+        and predict.
+        Only with ``splitter="hist"``.
+
+    Attributes
+    ----------
+    n_features_ : int
+        The number of features when ``fit`` is performed.
+
+    backend_ : string
+        The backend the tree was built with.
+
+    tree_ : Tree
+        The fitted tree as flat node arrays.
+
+    feature_importances_ : array of shape (n_features,)
+        The normalized total impurity decrease of the splits on every
+        feature, summed during the fit.
+
+    feature_split_counts_ : array of shape (n_features,)
+        The number of splits on every feature.
+    """
+
+    def __init__(self, criterion="mse", max_depth=None, min_samples_split=2,
+                 min_samples_leaf=1, max_features=None, max_leaf_nodes=None,
+                 min_impurity_decrease=0., max_bins=MAX_BINS,
+                 random_state=None, backend="auto", splitter="hist",
+                 categorical_features=None):
+        super(DecisionTreeRegressor, self).__init__(
+            criterion=criterion, max_depth=max_depth,
+            min_samples_split=min_samples_split,
+            min_samples_leaf=min_samples_leaf, max_features=max_features,
+            max_leaf_nodes=max_leaf_nodes,
+            min_impurity_decrease=min_impurity_decrease, max_bins=max_bins,
+            random_state=random_state, backend=backend, splitter=splitter,
+            categorical_features=categorical_features)
+
+    def _encode_y(self, y):
+        return np.asarray(y, dtype=np.float64)
+
+    def _make_criterion(self):
+        if self.criterion not in CRITERIA_REG:
+            raise ValueError("Unknown criterion %r" % self.criterion)
+        return CRITERIA_REG[self.criterion]()
+
+    def predict(self, X):
+        """Predict regression target for X."""
+        return self._predict_value(X)[:, 0]
+
+    def shap_values(self, X, background=None, n_jobs=None):
+        """SHAP values of the predictions of X.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+
+        background : array-like, shape (n_background, n_features) or None
+            Interventional SHAP values over these rows; None for the tree
+            path dependent values over the training samples of the nodes.
+
+        n_jobs : int or None, optional (default=None)
+            Threads over chunks of rows, all the cores with -1.
+
+        Returns
+        -------
+        values : array, shape (n_samples, n_features + 1)
+            Contribution of every feature, then the expected value: a row
+            sums to the prediction.
+        """
+        return self._shap_values(X, background, n_jobs)[:, :, 0]